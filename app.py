@@ -3,13 +3,19 @@
 
 # === 1. ライブラリのインポート ===
 import streamlit as st
-import pandas as pd
-import gspread
-from google.oauth2.service_account import Credentials
 import datetime
-from collections import defaultdict
-import random
 import os
+import threading
+import contextlib
+import functools
+from collections import defaultdict
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+import instrumentation
+from instrumentation import traced, count_rows
+from sheets_ledger import ApiCallLedger, LedgeredClient
+import config
+from config import SPREADSHEET_ID, MEMBER_SHEET_NAME, ATTENDANCE_SHEET_NAME, WEEKLY_PLAN_SHEET_NAME, WEEKDAY_LABELS, PAIR_HISTORY_SHEET_NAME, LOOKUP_PAGE_SIZE
+# pandas・gspread・google-auth などの重いモジュールは、ログイン画面の表示を速くするため、ログイン後 (4.) に読み込む
 
 # === Streamlit のページ設定 (一番最初に呼び出す) ===
 st.set_page_config(page_title="バドミントン部 連絡システム", layout="centered", page_icon="shutlle.png") # アイコンを絵文字に修正
@@ -22,6 +28,21 @@ try:
 
     APP_CONFIG = st.secrets.get("app_config", {})
     DEBUG_MODE = APP_CONFIG.get("debug_mode", False)
+    config.DEBUG_MODE = DEBUG_MODE # 割り振り処理 (court_assignment.py) のデバッグ出力にも反映
+    # 計測スパンの書き出し先 (JSON Lines、未設定ならメモリ上にのみ保持)
+    instrumentation.configure(export_path=APP_CONFIG.get("trace_export_path"))
+    # 1操作あたりの Sheets API 呼び出し回数の上限 (超えると警告)
+    API_CALL_BUDGET = APP_CONFIG.get("api_call_budget", 30)
+    # 次の練習日のコート割り振りを事前計算する間隔 (分、既定の 0 で無効。有効にすると管理者が最初に開いたときに開始) と練習がある曜日 (0=月曜、未設定なら毎日)
+    PRECOMPUTE_INTERVAL_MINUTES = APP_CONFIG.get("precompute_interval_minutes", 0)
+    PRACTICE_WEEKDAYS = APP_CONFIG.get("practice_weekdays")
+    # 並行に実行する Sheets API 呼び出しの最大数
+    SHEETS_MAX_CONCURRENCY = APP_CONFIG.get("sheets_max_concurrency", 4)
+    # Sheets API の keep-alive 接続プールの大きさ (同時に動くセッション数 x 並行数 程度) とトークンを期限切れの何秒前に更新するか
+    HTTP_POOL_MAXSIZE = APP_CONFIG.get("http_pool_maxsize", 16)
+    TOKEN_REFRESH_MARGIN_SECONDS = APP_CONFIG.get("token_refresh_margin_seconds", 300)
+    # コート割り振りの計算に使うワーカープロセスの数 (0 ならジョブのスレッドで計算)
+    ASSIGNMENT_WORKER_PROCESSES = APP_CONFIG.get("assignment_worker_processes", 2)
 
     # 必須設定の確認
     if not GENERAL_PASSWORD_SECRET or not ADMIN_PASSWORD_SECRET:
@@ -32,44 +53,75 @@ except Exception as e:
     DEBUG_MODE = False # フォールバック
     st.stop()
 
-# --- サービスアカウント認証情報 (スプレッドシート操作用) ---
-SCOPES_GSPREAD = ['https://www.googleapis.com/auth/sheets', 'https://www.googleapis.com/auth/drive']
-
-# --- スプレッドシート情報 ---
-SPREADSHEET_ID = '1jCCxSeECR7NZpCEXwZCDmW_NjcoEzBPg8wqM-IGyIS8' # ★あなたのスプレッドシートID
-MEMBER_SHEET_NAME = '部員リスト'
-ATTENDANCE_SHEET_NAME = '遅刻欠席連絡'
-PARTICIPANT_LIST_SHEET_NAME = '参加者名簿'
-ABSENT_LIST_SHEET_NAME = '欠席者名簿'
-LATE_LIST_SHEET_NAME = '遅刻者名簿' # 新規追加: 遅刻者名簿シート名
-ASSIGNMENT_SHEET_NAME_8 = '割り振り結果_8チーム'
-ASSIGNMENT_SHEET_NAME_12 = '割り振り結果_12チーム'
-ASSIGNMENT_SHEET_NAME_10 = '割り振り結果_10チーム' # 10チーム割り振り結果シート名
-ASSIGNMENT_SHEET_NAME_3 = '割り振り結果_3チーム' # 新規追加: 3チーム割り振り結果シート名
-
-# --- 列名 (ヘッダー名) ---
-COL_MEMBER_ID = '学籍番号'; COL_MEMBER_NAME = '名前'; COL_MEMBER_GRADE = '学年';
-COL_MEMBER_LEVEL = 'レベル'; COL_MEMBER_GENDER = '性別'; COL_MEMBER_DEPARTMENT = '学科'; # 新規追加: 学科
-COL_ATTENDANCE_TIMESTAMP = '記録日時';
-COL_ATTENDANCE_TARGET_DATE = '対象練習日';
-COL_ATTENDANCE_STATUS = '状況';
-COL_ATTENDANCE_LATE_TIME = '遅刻開始時刻';
-COL_ATTENDANCE_REASON = '遅刻・欠席理由';
-OUTPUT_COLUMNS_ORDER = ['記録日時', '対象練習日', '学籍番号', '学年', '名前', '状況', '遅刻・欠席理由', '遅刻開始時刻', '学科'] # 学科を追加
-# 連絡確認フォームの表示用列 (学籍番号と遅刻・欠席理由を除外)
-LOOKUP_DISPLAY_COLUMNS = ['記録日時', '対象練習日', '学年', '名前', '状況', '遅刻開始時刻'] # 学科を削除
-
-# --- コート割り振り設定 ---
-DEFAULT_PRACTICE_TYPE = 'ノック';
-TEAMS_COUNT_MAP = {'ノック': 8, 'ハンドノック': 10, 'その他': 12}
+# --- スプレッドシート情報・コート割り振り設定 --- (config.py で定義)
+
 INACTIVITY_TIMEOUT_MINUTES = 10
+ASSIGNMENT_JOB_POLL_SECONDS = 1.0 # 割り振りジョブの進捗を表示し直す間隔
+
+# === 3. ログイン画面 (重いモジュールを読み込む前に表示する) ===
+st.title("🏸 バドミントン部 連絡システム")
+
+# ログイン状態を管理するセッション変数 (共通パスワード方式)
+if 'authentication_status' not in st.session_state:
+    st.session_state.authentication_status = None
+if 'user_name' not in st.session_state:
+    st.session_state.user_name = None
+if 'is_admin' not in st.session_state:
+    st.session_state.is_admin = False
+if 'last_interaction_time' not in st.session_state:
+    st.session_state.last_interaction_time = datetime.datetime.now()
+
+# --- 一般ログイン処理 ---
+def check_general_password():
+    """共通パスワードをチェックし、認証状態を更新します。"""
+    if st.session_state.general_password_input == GENERAL_PASSWORD_SECRET:
+        st.session_state.authentication_status = True
+        st.session_state.user_name = "部員"
+        st.session_state.last_interaction_time = datetime.datetime.now()
+    else:
+        st.error("共通パスワードが間違っています。")
+        st.session_state.authentication_status = False
 
-# === 3. 関数定義 ===
+# --- ログインフォームの表示 ---
+if st.session_state.authentication_status is not True:
+    st.subheader("アプリ利用のための共通パスワードを入力してください")
+    st.text_input("共通パスワード", type="password", key="general_password_input", on_change=check_general_password)
+    st.stop()
+
+# === 4. ログイン後に使うライブラリのインポート ===
+import pandas as pd
+from schema import (
+    COL_MEMBER_ID, COL_MEMBER_NAME, COL_MEMBER_GRADE, COL_ATTENDANCE_TIMESTAMP, COL_ATTENDANCE_TARGET_DATE,
+    MEMBER_SCHEMA, ATTENDANCE_SCHEMA, MEMBER_COLUMNS, ATTENDANCE_CHECK_COLUMNS, ATTENDANCE_ASSIGNMENT_COLUMNS,
+    LOOKUP_DISPLAY_COLUMNS, LOOKUP_ATTENDANCE_COLUMNS, ROLLUP_COLUMNS, ATTENDANCE_READ_COLUMNS, concat_frames, frame_memory_report,
+)
+from attendance_store import (
+    archive_sheet_name, is_attendance_sheet, archive_months_from_titles, months_for_target_date, months_for_target_dates,
+    practice_dates_in_range, recorded_member_dates, archive_past_attendance, attendance_records, attendance_rows, MemberHistoryIndex,
+)
+from court_assignment import load_assignment_inputs, run_weekly_assignment_pipeline, weekly_plan_grid, parse_team_requests
+from sheet_reader import read_frame
+from sheet_writer import write_grid, ensure_worksheet, sheet_size
+from sheets_async import run_concurrently
+from sheets_http import service_account_client, http_session
+from precompute import AssignmentScheduler, next_practice_date
+from pair_history import PairHistory
+from assignment_flow import compute_assignment, publish_assignment, read_pair_history
+from assignment_worker import AssignmentWorkerPool, JOB_DONE, JOB_FAILED, JOB_CANCELLED
+from roster import RosterStore, deep_sizeof
+from attendance_rollup import AttendanceRollups
+
+# --- 列名 (ヘッダー名) --- (列名と型、連絡ログに書き込む列・連絡確認で表示する列は schema.py で定義)
+MAX_BULK_TARGET_DATES = 31 # 複数の練習日をまとめて連絡する場合の最大日数
+
+# === 5. 関数定義 ===
 @st.cache_resource
+@traced("authenticate_gspread_service_account")
 def authenticate_gspread_service_account():
     """
     gspreadサービスアカウント認証を行います。
     Streamlit secretsまたはローカルのyour_credentials.jsonから認証情報を読み込みます。
+    クライアントは接続プールを持つ HTTP セッション (sheets_http.py) を使い、全セッションで共有されます。
     """
     if DEBUG_MODE: print("Attempting gspread Service Account Authentication...")
     try:
@@ -77,14 +129,14 @@ def authenticate_gspread_service_account():
             # Streamlit secretsから辞書として直接サービスアカウント情報を読み込む
             creds_info = st.secrets['google_credentials']
             if DEBUG_MODE: print("Attempting gspread Service Account Authentication (from Secrets dict)...")
-            client = gspread.service_account_from_dict(creds_info)
+            client = service_account_client(info=dict(creds_info), pool_maxsize=HTTP_POOL_MAXSIZE, refresh_margin_seconds=TOKEN_REFRESH_MARGIN_SECONDS)
             if DEBUG_MODE: print(f"DEBUG: gspread Client Type (from Secrets): {type(client)}") # Debug print
             if DEBUG_MODE: print("gspread Service Account Authentication successful (from Secrets dict).")
             return client
         elif os.path.exists('your_credentials.json'):
             st.warning("警告: ローカルファイルから認証情報を読み込んでいます。本番環境ではSecretsを使用してください。")
             if DEBUG_MODE: print("Attempting gspread Service Account Authentication (from File).")
-            client = gspread.service_account(filename='your_credentials.json')
+            client = service_account_client(filename='your_credentials.json', pool_maxsize=HTTP_POOL_MAXSIZE, refresh_margin_seconds=TOKEN_REFRESH_MARGIN_SECONDS)
             if DEBUG_MODE: print(f"DEBUG: gspread Client Type (from File): {type(client)}") # Debug print
             if DEBUG_MODE: print("gspread Service Account Authentication successful (from File).")
             return client
@@ -95,6 +147,7 @@ def authenticate_gspread_service_account():
     except Exception as e:
         st.error(f"認証エラー(SA): {e}"); print(f"ERROR: SA Authentication error: {e}"); return None
 
+@traced("get_worksheet_safe")
 def get_worksheet_safe(gspread_client, spreadsheet_id, sheet_name):
     """
     指定されたスプレッドシートからワークシートを安全に取得します。
@@ -103,8 +156,8 @@ def get_worksheet_safe(gspread_client, spreadsheet_id, sheet_name):
         st.error(f"内部エラー: Google Sheetsクライアントが初期化されていません。")
         return None
     
-    # gspread_clientがgspread.Clientインスタンスであることを明示的に確認
-    if not isinstance(gspread_client, gspread.Client):
+    # gspread_clientがクライアント (gspread.Client または呼び出し記録用のプロキシ) であることを確認
+    if not hasattr(gspread_client, 'open_by_key'):
         st.error(f"内部エラー: Google Sheetsクライアントが不正な型です ({type(gspread_client)})。認証が失敗した可能性があります。")
         print(f"ERROR: Invalid gspread_client type: {type(gspread_client)}")
         return None
@@ -117,619 +170,361 @@ def get_worksheet_safe(gspread_client, spreadsheet_id, sheet_name):
         return worksheet
     except Exception as e: st.error(f"ワークシート '{sheet_name}' 取得エラー: {e}"); print(f"Error getting worksheet '{sheet_name}': {e}"); return None
 
+@st.cache_resource
+def get_sheet_cache_stats():
+    """
+    シート読み込みキャッシュの利用状況 (シートごとの要求回数・実際の読み込み回数) を返します。
+    プロセス全体で共有されるため、全セッション分の回数が集計されます。
+    """
+    return {'lock': threading.Lock(), 'sheets': defaultdict(lambda: {'requests': 0, 'misses': 0})}
+
+def _count_sheet_cache_event(sheet_name, event):
+    stats = get_sheet_cache_stats()
+    with stats['lock']:
+        stats['sheets'][sheet_name][event] += 1
+
+# シートごとに読み込む列 (各用途で使う列の和集合)。シートは TTL ごとにこの列で1回だけ読み込み、用途ごとの列は読み込んだDataFrameから取り出す
+SHEET_READ_COLUMNS = {MEMBER_SHEET_NAME: MEMBER_COLUMNS, ATTENDANCE_SHEET_NAME: ATTENDANCE_READ_COLUMNS}
+
+def sheet_read_columns(sheet_name):
+    """シートから読み込む列 (SHEET_READ_COLUMNS、アーカイブシートはホットシートと同じ、登録がなければ None = 全列) を返します。"""
+    if is_attendance_sheet(sheet_name, ATTENDANCE_SHEET_NAME): return SHEET_READ_COLUMNS[ATTENDANCE_SHEET_NAME]
+    return SHEET_READ_COLUMNS.get(sheet_name)
+
 @st.cache_data(ttl=60)
-def load_data_to_dataframe(_gspread_client, spreadsheet_id, sheet_name, required_cols=None):
+def fetch_sheet_dataframe(_gspread_client, spreadsheet_id, sheet_name):
     """
-    スプレッドシートからデータをPandas DataFrameとして読み込みます。
-    必要な列のチェックとデータ型の変換を行います。
+    シートの列 (sheet_read_columns) を読み込み、型変換済みのDataFrameを返します。
+    列は batch_get で書式なしの値として取得し、列のリストから直接DataFrameを作成します (sheet_reader.py)。
+    キャッシュキーは (spreadsheet_id, sheet_name) のため、各シートは使う列が違う呼び出しがあっても TTL 内に1回だけ読み込まれます。
     """
+    _count_sheet_cache_event(sheet_name, 'misses') # この関数本体はキャッシュミス時のみ実行される
     if DEBUG_MODE: print(f"データを読み込みます: {sheet_name}")
     worksheet = get_worksheet_safe(_gspread_client, spreadsheet_id, sheet_name)
     if worksheet is None: return pd.DataFrame()
     try:
-        data = worksheet.get_all_records(); df = pd.DataFrame(data)
-        if DEBUG_MODE: print(f"-> {len(df)}件読み込み完了 ({sheet_name})")
-        
-        # 必須列のチェックを強化
-        if required_cols:
-            missing = [col for col in required_cols if col not in df.columns]
-            if missing: 
-                st.error(f"シート '{sheet_name}' に必要な列がありません: {missing}。スプレッドシートのヘッダーを確認してください。")
-                print(f"ERROR: Missing required columns in sheet '{sheet_name}': {missing}"); 
-                return pd.DataFrame()
-        
-        # データのクリーンアップと型変換
-        if COL_MEMBER_ID in df.columns: df[COL_MEMBER_ID] = df[COL_MEMBER_ID].astype(str).str.strip()
-        if COL_MEMBER_NAME in df.columns: df[COL_MEMBER_NAME] = df[COL_MEMBER_NAME].astype(str).str.strip()
-        if COL_MEMBER_GRADE in df.columns: df[COL_MEMBER_GRADE] = df[COL_MEMBER_GRADE].astype(str).str.strip()
-        # レベル列の数値変換、エラーはNaNとし、後で0で埋める
-        if COL_MEMBER_LEVEL in df.columns: df[COL_MEMBER_LEVEL] = pd.to_numeric(df[COL_MEMBER_LEVEL], errors='coerce')
-        if COL_MEMBER_GENDER in df.columns: df[COL_MEMBER_GENDER] = df[COL_MEMBER_GENDER].astype(str).str.strip()
-        if COL_MEMBER_DEPARTMENT in df.columns: df[COL_MEMBER_DEPARTMENT] = df[COL_MEMBER_DEPARTMENT].astype(str).str.strip() # 新規追加
-
-        if sheet_name == ATTENDANCE_SHEET_NAME:
-            # タイムスタンプと対象練習日のdatetime変換
-            if COL_ATTENDANCE_TIMESTAMP in df.columns: df['dt_timestamp'] = pd.to_datetime(df[COL_ATTENDANCE_TIMESTAMP], errors='coerce')
-            if COL_ATTENDANCE_TARGET_DATE in df.columns: df['dt_target_date'] = pd.to_datetime(df[COL_ATTENDANCE_TARGET_DATE], errors='coerce').dt.date
+        # データのクリーンアップと型変換 (記録日時・対象練習日は datetime64 に置き換え、文字列版は保持しない)
+        df = read_frame(worksheet, sheet_read_columns(sheet_name), ATTENDANCE_SCHEMA if is_attendance_sheet(sheet_name, ATTENDANCE_SHEET_NAME) else MEMBER_SCHEMA)
+        if DEBUG_MODE: print(f"-> {len(df)}件読み込み完了 ({sheet_name}, {len(df.columns)}列)")
         return df
     except Exception as e: st.error(f"データ読み込みエラー ({sheet_name}): {e}"); print(f"ERROR: Data loading error: {e}"); return pd.DataFrame()
 
-def record_attendance_streamlit(worksheet, data_dict):
+@traced("load_data_to_dataframe")
+def load_data_to_dataframe(gspread_client, spreadsheet_id, sheet_name, required_cols=None, columns=None):
     """
-    遅刻・欠席連絡をスプレッドシートに記録します。
+    スプレッドシートからデータをPandas DataFrameとして読み込みます。
+    columns を指定するとその列だけを返します (未指定ならシートから読み込んだ全ての列)。
+    読み込みはシート単位でキャッシュされ、列の取り出しと必要な列のチェックはキャッシュ済みのDataFrameに対して行います。
     """
-    if worksheet is None: st.error("記録用シートが見つかりません。"); return False
-    try:
-        row_data = [data_dict.get(col_name, "") for col_name in OUTPUT_COLUMNS_ORDER]
-        worksheet.append_row(row_data, value_input_option='USER_ENTERED')
-        if DEBUG_MODE: print(f"記録成功: {row_data}")
-        return True
-    except Exception as e: st.error(f"記録エラー: {e}"); print(f"ERROR: Error recording: {e}"); return False
+    _count_sheet_cache_event(sheet_name, 'requests')
+    df = fetch_sheet_dataframe(gspread_client, spreadsheet_id, sheet_name)
+    if columns: df = df[[col for col in columns if col in df.columns]]
+    count_rows(len(df))
+
+    # 必須列のチェックを強化
+    if required_cols:
+        missing = [col for col in required_cols if col not in df.columns]
+        if missing: 
+            st.error(f"シート '{sheet_name}' に必要な列がありません: {missing}。スプレッドシートのヘッダーを確認してください。")
+            print(f"ERROR: Missing required columns in sheet '{sheet_name}': {missing}"); 
+            return pd.DataFrame()
+    return df
 
-def calculate_imbalance_score(male_count, female_count):
+@st.cache_data(ttl=60)
+def list_attendance_archive_months(_gspread_client, spreadsheet_id):
     """
-    チームの男女比の偏りを数値で評価します。
-    男性または女性のみのチーム、または人数が少ないチームでも機能するように設計されています。
-    スコアが高いほど偏りが大きいことを示します。
+    遅刻欠席連絡のアーカイブ済みの月 ('YYYY-MM') を新しい順に返します。
     """
-    if male_count == 0 and female_count == 0:
-        return 0.0 # 空のチームは偏りなし
-    if male_count == 0: # 女性のみのチーム
-        return float(female_count) # 女性の数で偏りを評価
-    if female_count == 0: # 男性のみのチーム
-        return float(male_count) # 男性の数で偏りを評価
-    # どちらも0でない場合、大きい方を小さい方で割ることで偏りを数値化
-    # 割り算でゼロ除算を避けるためにminが0でないことを確認
-    if min(male_count, female_count) == 0: # 片方が0でもう片方は0でない場合
-        return max(male_count, female_count) * 1000.0 # 非常に高いペナルティ
-    return max(male_count, female_count) / min(male_count, female_count)
-
-def rebalance_teams_by_gender_and_level(teams, team_stats, late_member_ids, max_iterations=10): # Iterations increased for more attempts
+    try:
+        spreadsheet = _gspread_client.open_by_key(spreadsheet_id)
+        return archive_months_from_titles([ws.title for ws in spreadsheet.worksheets()], ATTENDANCE_SHEET_NAME)
+    except Exception as e: print(f"ERROR: Error listing archive sheets: {e}"); return []
+
+def run_sheet_calls_concurrently(funcs, return_exceptions=False):
     """
-    チーム間の男女比、レベル、遅刻者数の偏りを、同レベル・同性別の部員を交換することで再調整します。
-    チームの人数とレベル分布は維持されます。遅刻者は交換の対象外とします。
+    Sheets API を呼び出す関数 (引数なし) を並行に実行し、結果を同じ順序で返します (同時実行数は SHEETS_MAX_CONCURRENCY)。
+    各スレッドに現在のスクリプト文脈を引き継ぐため、関数内のキャッシュや st.error もそのまま使えます。
     """
-    if DEBUG_MODE: print("\n性別・レベル・遅刻者均等化のためのチーム再調整を開始...")
-
-    # For accurate statistics during rebalancing, re-calculate stats from current teams
-    def update_stats_from_teams(current_teams, current_team_stats):
-        for team_name in current_team_stats:
-            # Reset all counts for recalculation
-            for key in current_team_stats[team_name]:
-                current_team_stats[team_name][key] = 0
-            
-        for team_name, members in current_teams.items():
-            stats = current_team_stats[team_name]
-            stats['count'] = len(members)
-            for member in members:
-                if member.get(COL_MEMBER_ID) in late_member_ids:
-                    stats['late_count'] += 1
-                if member.get(COL_MEMBER_GENDER) == '男性':
-                    stats['male_count'] += 1
-                else:
-                    stats['female_count'] += 1
-                level = member.get(COL_MEMBER_LEVEL)
-                if pd.notna(level):
-                    level = int(level)
-                    if level == 6: stats['lv6_count'] += 1
-                    elif level == 5: stats['lv5_count'] += 1
-                    elif level == 4: stats['lv4_count'] += 1
-                    elif level == 1: stats['lv1_count'] += 1
-                    elif level in [2, 3]: stats['lv23_count'] += 1
-                    elif level == 0: stats['lv0_count'] += 1
-        return current_team_stats
-
-    # Make a copy of team_stats to update it consistently during rebalancing
-    current_team_stats = {k: v.copy() for k, v in team_stats.items()}
-
-    for iteration in range(max_iterations):
-        swapped_in_iteration = False
-        team_names = list(teams.keys())
-        random.shuffle(team_names)
-
-        # Recalculate stats for current iteration to reflect previous swaps
-        current_team_stats = update_stats_from_teams(teams, current_team_stats)
-        
-        # Determine average latecomers and standard deviation for robust imbalance check
-        late_counts = {name: stats['late_count'] for name, stats in current_team_stats.items()}
-        team_sizes = {name: stats['count'] for name, stats in current_team_stats.items()}
-        
-        if not late_counts: continue # No teams to rebalance
+    ctx = get_script_run_ctx()
+    return run_concurrently(funcs, max_concurrency=SHEETS_MAX_CONCURRENCY, return_exceptions=return_exceptions,
+                            thread_initializer=lambda: add_script_run_ctx(threading.current_thread(), ctx))
 
-        avg_late = sum(late_counts.values()) / len(late_counts)
-        
-        # --- 1. 遅刻者数の均等化を最優先で試みる ---
-        # Find teams with more latecomers than allowed max_diff (e.g., 1)
-        max_late_count = max(late_counts.values())
-        min_late_count = min(late_counts.values())
-
-        if max_late_count - min_late_count > 1: # Only try to balance if difference is > 1
-            high_late_teams = sorted([name for name, count in late_counts.items() if count == max_late_count], key=lambda k: late_counts[k], reverse=True)
-            low_late_teams = sorted([name for name, count in late_counts.items() if count == min_late_count], key=lambda k: late_counts[k])
-            
-            for team_a_name in high_late_teams:
-                for team_b_name in low_late_teams:
-                    if team_a_name == team_b_name: continue
-                    if team_sizes[team_a_name] < 1 or team_sizes[team_b_name] < 1: continue # Avoid empty teams
-
-                    # team_a から遅刻者を探す
-                    candidate_late_member = None
-                    members_in_team_a = teams[team_a_name].copy() # Copy to iterate and modify original list
-                    random.shuffle(members_in_team_a) 
-
-                    for m_late in members_in_team_a:
-                        if m_late.get(COL_MEMBER_ID) in late_member_ids: # team A から遅刻者
-                            # team_b から非遅刻者を探す（同レベル・同性別）
-                            candidate_non_late_member = None
-                            members_in_team_b = teams[team_b_name].copy() # Copy
-                            random.shuffle(members_in_team_b)
-
-                            for m_non_late in members_in_team_b:
-                                if m_non_late.get(COL_MEMBER_ID) not in late_member_ids and \
-                                   pd.notna(m_late.get(COL_MEMBER_LEVEL)) and \
-                                   pd.notna(m_non_late.get(COL_MEMBER_LEVEL)) and \
-                                   int(m_late.get(COL_MEMBER_LEVEL, -1)) == int(m_non_late.get(COL_MEMBER_LEVEL, -1)) and \
-                                   m_late.get(COL_MEMBER_GENDER) == m_non_late.get(COL_MEMBER_GENDER):
-                                    # Ensure this swap improves overall late count balance
-                                    # And doesn't drastically worsen other balances (gender, size)
-                                    temp_teams_after_swap = {k: v[:] for k,v in teams.items()} # Deep copy
-                                    temp_teams_after_swap[team_a_name].remove(m_late)
-                                    temp_teams_after_swap[team_a_name].append(m_non_late)
-                                    temp_teams_after_swap[team_b_name].remove(m_non_late)
-                                    temp_teams_after_swap[team_b_name].append(m_late)
-                                    
-                                    temp_stats_after_swap = update_stats_from_teams(temp_teams_after_swap, {k: v.copy() for k,v in team_stats.items()})
-                                    new_max_late = max(temp_stats_after_swap[n]['late_count'] for n in team_names)
-                                    new_min_late = min(temp_stats_after_swap[n]['late_count'] for n in team_names)
-
-                                    if new_max_late - new_min_late < (max_late_count - min_late_count):
-                                        candidate_late_member = m_late
-                                        candidate_non_late_member = m_non_late
-                                        break
-                            if candidate_late_member: break
-
-                    if candidate_late_member and candidate_non_late_member:
-                        # 実際に交換
-                        teams[team_a_name].remove(candidate_late_member)
-                        teams[team_a_name].append(candidate_non_late_member)
-                        teams[team_b_name].remove(candidate_non_late_member)
-                        teams[team_b_name].append(candidate_late_member)
-
-                        # 統計を更新
-                        current_team_stats = update_stats_from_teams(teams, current_team_stats)
-                        
-                        swapped_in_iteration = True
-                        if DEBUG_MODE:
-                            print(f"DEBUG: 遅刻者バランス調整 (Lv:{int(candidate_late_member.get(COL_MEMBER_LEVEL,-1))}, Gender:{candidate_late_member.get(COL_MEMBER_GENDER)}): {candidate_late_member.get(COL_MEMBER_NAME)} from {team_a_name} (late:{late_counts[team_a_name]}) swapped with {candidate_non_late_member.get(COL_MEMBER_NAME)} from {team_b_name} (late:{late_counts[team_b_name]}). New: {team_a_name} (late:{current_team_stats[team_a_name]['late_count']}), {team_b_name} (late:{current_team_stats[team_b_name]['late_count']}).")
-                        break # Go to next iteration to re-evaluate all balances
-                if swapped_in_iteration:
-                    break # Break from outer loop (team_a_name), re-start iteration loop
-        
-        # --- 2. 性別・レベルの均等化を試みる (遅刻者数の差が1以下の場合、または遅刻者調整ができなかった場合) ---
-        if not swapped_in_iteration: # Only proceed if no latecomer swaps were made in this iteration
-            for team_a_name in team_names:
-                team_a_stats = current_team_stats[team_a_name]
+def load_attendance_partitions(gspread_client, spreadsheet_id, months=(), required_cols=None, columns=None):
+    """
+    遅刻欠席連絡のホットシートと、指定された月のアーカイブシートだけを読み込んで結合します (columns で取り出す列を指定できます)。
+    存在しない月のアーカイブは読み込みません。各シートはシート単位でキャッシュされます。
+    ホットシートの読み込みとアーカイブ一覧の取得、各月のアーカイブの読み込みはそれぞれ並行して行います。
+    """
+    load_hot = functools.partial(load_data_to_dataframe, gspread_client, spreadsheet_id, ATTENDANCE_SHEET_NAME, required_cols=required_cols, columns=columns)
+    if not months: return concat_frames([load_hot()], ATTENDANCE_SCHEMA)
+    hot_df, archived_months = run_sheet_calls_concurrently([load_hot, functools.partial(list_attendance_archive_months, gspread_client, spreadsheet_id)])
+    archive_frames = run_sheet_calls_concurrently([
+        functools.partial(load_data_to_dataframe, gspread_client, spreadsheet_id, archive_sheet_name(ATTENDANCE_SHEET_NAME, month), columns=columns)
+        for month in months if month in set(archived_months)
+    ])
+    return concat_frames([hot_df] + archive_frames, ATTENDANCE_SCHEMA)
+
+@st.cache_resource(ttl=60)
+def get_member_history_index(_gspread_client, spreadsheet_id, months):
+    """
+    ホットシートと指定月のアーカイブから、学籍番号ごとの連絡履歴の索引を作成します。
+    索引はコピーせずにセッション間で共有するため cache_resource を使います (読み取り専用として扱うこと)。
+    """
+    return MemberHistoryIndex.build(load_attendance_partitions(_gspread_client, spreadsheet_id, list(months), columns=LOOKUP_ATTENDANCE_COLUMNS))
 
-                if team_a_stats['count'] < 2:
-                    continue
+def sheet_cache_stats_frame():
+    """
+    シート読み込みキャッシュのヒット/ミス回数を表形式で返します。
+    """
+    stats = get_sheet_cache_stats()
+    with stats['lock']:
+        rows = [{'シート': name, '要求回数': c['requests'], 'ヒット': c['requests'] - c['misses'], 'ミス (読み込み)': c['misses']}
+                for name, c in stats['sheets'].items()]
+    return pd.DataFrame(rows, columns=['シート', '要求回数', 'ヒット', 'ミス (読み込み)'])
 
-                current_imbalance_a = calculate_imbalance_score(team_a_stats['male_count'], team_a_stats['female_count'])
+@st.cache_resource
+def get_process_api_ledger():
+    """
+    プロセス全体の Sheets API 呼び出し台帳 (全セッション・全再実行の合計)。
+    """
+    return ApiCallLedger()
 
-                if current_imbalance_a < 1.5: # Only rebalance if gender is significantly imbalanced
-                    continue
+@st.cache_resource
+def get_roster_store():
+    """
+    全セッションで共有する部員名簿 (名簿の版 -> Roster)。
+    各セッションは名簿の版だけをセッション状態に保持し、部員リストと選択肢はここから参照します。
+    """
+    return RosterStore()
 
-                gender_to_swap_out_a = '男性' if team_a_stats['male_count'] > team_a_stats['female_count'] else '女性'
-                gender_to_swap_in_a = '女性' if gender_to_swap_out_a == '男性' else '男性'
+@st.cache_resource
+def get_session_footprints():
+    """
+    セッションごとのセッション状態のメモリ使用量 (セッションID -> 集計)。
+    プロセス全体で共有されるため、管理者画面で全セッション分を表示できます。
+    """
+    return {'lock': threading.Lock(), 'sessions': {}}
+
+def session_state_footprint():
+    """このセッションのセッション状態のキーごとのメモリ使用量 (バイト、大きい順) を返します。"""
+    sizes = {str(key): deep_sizeof(value) for key, value in st.session_state.to_dict().items()}
+    return dict(sorted(sizes.items(), key=lambda item: item[1], reverse=True))
+
+def record_session_footprint():
+    """このセッションのセッション状態のメモリ使用量を記録し、一定時間操作のないセッションの記録を削除します。"""
+    ctx = get_script_run_ctx()
+    if ctx is None: return
+    sizes = session_state_footprint()
+    now = datetime.datetime.now()
+    footprints = get_session_footprints()
+    with footprints['lock']:
+        footprints['sessions'][ctx.session_id] = {
+            'セッション': ctx.session_id[:8], 'ユーザー': st.session_state.get('user_name') or '', 'キー数': len(sizes),
+            'メモリ(KB)': round(sum(sizes.values()) / 1024, 1), '最大のキー': next(iter(sizes), ''), '名簿の版': st.session_state.get('roster_version') or '',
+            '最終更新': now.strftime('%H:%M:%S'), '_updated_at': now,
+        }
+        expired = [sid for sid, f in footprints['sessions'].items() if now - f['_updated_at'] > datetime.timedelta(minutes=INACTIVITY_TIMEOUT_MINUTES)]
+        for sid in expired: del footprints['sessions'][sid]
+
+def session_footprint_frame():
+    """全セッションのセッション状態のメモリ使用量を表形式で返します。"""
+    footprints = get_session_footprints()
+    with footprints['lock']:
+        rows = [{k: v for k, v in f.items() if not k.startswith('_')} for f in footprints['sessions'].values()]
+    return pd.DataFrame(rows, columns=['セッション', 'ユーザー', 'キー数', 'メモリ(KB)', '最大のキー', '名簿の版', '最終更新'])
 
-                member_a_candidate = None
-                members_of_gender_to_swap_out_a = [m for m in teams[team_a_name] if m.get(COL_MEMBER_GENDER) == gender_to_swap_out_a and m.get(COL_MEMBER_ID) not in late_member_ids]
-                if not members_of_gender_to_swap_out_a:
-                    continue
-                member_a_candidate = random.choice(members_of_gender_to_swap_out_a)
-                level_a = member_a_candidate.get(COL_MEMBER_LEVEL)
-                if pd.isna(level_a): continue
-                level_a = int(level_a)
+@st.cache_resource
+def get_pair_history(_gspread_client):
+    """
+    ペア履歴シートから、部員のペアが同じチームになった回数の履歴を読み込みます (プロセスで1つ)。
+    公開のたびにこのオブジェクトを更新してシートに書き戻すため、cache_resource で全セッションが同じものを使います。
+    シートがない場合は空の履歴から始めます。
+    """
+    history = read_pair_history(_gspread_client.open_by_key(SPREADSHEET_ID))
+    if history is None:
+        if DEBUG_MODE: print(f"シート '{PAIR_HISTORY_SHEET_NAME}' がないため、空のペア履歴から始めます。")
+        return PairHistory()
+    if DEBUG_MODE: print(f"ペア履歴を読み込みました: {len(history.ids)} 名 / {history.total_pairs} ペア")
+    return history
 
-                for team_b_name in team_names:
-                    if team_a_name == team_b_name: continue
-                    team_b_stats = current_team_stats[team_b_name]
+@st.cache_resource
+def get_attendance_rollups():
+    """
+    管理者向けの出欠の集計表 (プロセスで1つ)。
+    連絡ログ全体の読み込み (load_attendance_rollups) は管理者が最初に集計するときだけ行い、送信された連絡はその前後にかかわらず apply で反映します。
+    他のプロセスが追記した連絡は、表示のたびに catch_up_attendance_rollups でホットシートの末尾から反映します。
+    """
+    return AttendanceRollups()
 
-                    if team_b_stats['count'] < 2:
-                        continue
+def clear_attendance_cache(gspread_client, months=()):
+    """
+    連絡ログ (ホットシートと各月のアーカイブシート) の読み込みキャッシュとアーカイブの一覧だけを消します。
+    部員リストなど他のシートのキャッシュは残します。
+    アーカイブで書き込んだ月を months に渡すと、キャッシュしたアーカイブの一覧にまだない (新しく作成した) 月のシートも消します。
+    """
+    months = dict.fromkeys(list(list_attendance_archive_months(gspread_client, SPREADSHEET_ID)) + list(months))
+    for sheet_name in [ATTENDANCE_SHEET_NAME] + [archive_sheet_name(ATTENDANCE_SHEET_NAME, month) for month in months]:
+        fetch_sheet_dataframe.clear(gspread_client, SPREADSHEET_ID, sheet_name)
+    list_attendance_archive_months.clear()
 
-                    member_b_candidate = None
-                    members_of_gender_to_swap_in_a_from_b = [m for m in teams[team_b_name] if m.get(COL_MEMBER_GENDER) == gender_to_swap_in_a and int(m.get(COL_MEMBER_LEVEL, -1)) == level_a and m.get(COL_MEMBER_ID) not in late_member_ids]
-                    if members_of_gender_to_swap_in_a_from_b:
-                        member_b_candidate = random.choice(members_of_gender_to_swap_in_a_from_b)
-
-                    if member_b_candidate:
-                        # Simulate swap and check new imbalance scores
-                        new_male_a = team_a_stats['male_count'] - (1 if gender_to_swap_out_a == '男性' else 0) + (1 if gender_to_swap_in_a == '男性' else 0)
-                        new_female_a = team_a_stats['female_count'] - (1 if gender_to_swap_out_a == '女性' else 0) + (1 if gender_to_swap_in_a == '女性' else 0)
-                        new_imbalance_a = calculate_imbalance_score(new_male_a, new_female_a)
-
-                        new_male_b = team_b_stats['male_count'] - (1 if gender_to_swap_in_a == '男性' else 0) + (1 if gender_to_swap_out_a == '男性' else 0)
-                        new_female_b = team_b_stats['female_count'] - (1 if gender_to_swap_in_a == '女性' else 0) + (1 if gender_to_swap_out_a == '女性' else 0)
-                        new_imbalance_b = calculate_imbalance_score(new_male_b, new_female_b)
-                        
-                        # Only swap if it actually improves overall gender balance
-                        if (new_imbalance_a < current_imbalance_a and new_imbalance_b < 1.5 * calculate_imbalance_score(team_b_stats['male_count'], team_b_stats['female_count'])) or \
-                           (new_imbalance_a + new_imbalance_b < calculate_imbalance_score(team_a_stats['male_count'], team_a_stats['female_count']) + calculate_imbalance_score(team_b_stats['male_count'], team_b_stats['female_count'])):
-                            
-                            # Perform swap
-                            teams[team_a_name].remove(member_a_candidate)
-                            teams[team_a_name].append(member_b_candidate)
-                            teams[team_b_name].remove(member_b_candidate)
-                            teams[team_b_name].append(member_a_candidate)
-
-                            # Update stats
-                            current_team_stats = update_stats_from_teams(teams, current_team_stats)
-                            
-                            swapped_in_iteration = True
-                            if DEBUG_MODE:
-                                print(f"DEBUG: 性別/レベル調整: {member_a_candidate.get(COL_MEMBER_NAME)} (L{level_a}, {gender_to_swap_out_a}) を {team_a_name} から "
-                                      f"{member_b_candidate.get(COL_MEMBER_NAME)} (L{level_a}, {gender_to_swap_in_a}) を {team_b_name} と交換しました。")
-                                print(f"DEBUG: {team_a_name} の統計: {current_team_stats[team_a_name]['male_count']}M/{current_team_stats[team_a_name]['female_count']}F (新偏り: {new_imbalance_a:.2f})")
-                                print(f"DEBUG: {team_b_name} の統計: {current_team_stats[team_b_name]['male_count']}M/{current_team_stats[team_b_name]['female_count']}F (新偏り: {new_imbalance_b:.2f})")
-                            break # Break from inner loop (team_b_name), re-evaluate team_names in next outer loop
-                if swapped_in_iteration:
-                    break # Break from outer loop (team_a_name), re-start iteration loop
-        
-        if not swapped_in_iteration:
-            # If no swaps were made in this entire iteration (neither latecomer nor gender/level), stop rebalancing
-            if DEBUG_MODE: print(f"DEBUG: イテレーション {iteration+1} で交換が行われなかったため、再調整を停止します。")
-            break
+@traced("load_attendance_rollups")
+def load_attendance_rollups(gspread_client, rollups):
+    """
+    ホットシートと全ての月のアーカイブシートから集計に使う列だけを読み込み、集計表に反映します。
+    """
+    months = list_attendance_archive_months(gspread_client, SPREADSHEET_ID)
+    attendance_df = load_attendance_partitions(gspread_client, SPREADSHEET_ID, months, columns=ROLLUP_COLUMNS)
+    # ホットシートの行数 (以降の catch_up の起点)。上の読み込みとキャッシュを共有するため、API は呼び出さない
+    hot_df = load_data_to_dataframe(gspread_client, SPREADSHEET_ID, ATTENDANCE_SHEET_NAME, columns=ROLLUP_COLUMNS)
+    rollups.load(attendance_df, hot_rows=len(hot_df)); count_rows(len(attendance_df))
+    if DEBUG_MODE: print(f"連絡ログを集計しました: {len(attendance_df)}件 ({rollups.stats()})")
+
+@traced("catch_up_attendance_rollups")
+def catch_up_attendance_rollups(gspread_client, rollups):
+    """
+    ホットシートを読み込み、集計表にまだ反映していない末尾の行 (他のプロセスが追記した連絡) を反映します。反映した行数を返します。
+    読み込みは他の読み込みとキャッシュを共有するため、TTL (60秒) の間は API を呼び出しません。読み込めなかった場合は None を返します。
+    """
+    hot_df = load_data_to_dataframe(gspread_client, SPREADSHEET_ID, ATTENDANCE_SHEET_NAME, columns=ROLLUP_COLUMNS)
+    if hot_df.columns.empty: return None # 読み込みエラー (ヘッダーだけのシートなら列はある)
+    return rollups.catch_up(hot_df)
 
-    if DEBUG_MODE: print("性別・レベル・遅刻者均等化のためのチーム再調整が完了しました。")
-    return teams
+@st.cache_resource
+def get_assignment_workers():
+    """
+    コート割り振りの計算を行うワーカープロセスのプールとジョブの一覧 (プロセスで1つ、管理者画面から初めて使うときに作成)。
+    割り振りの計算中も他のセッションの操作が止まらないよう、計算は別プロセスで行います。
+    """
+    workers = AssignmentWorkerPool(ASSIGNMENT_WORKER_PROCESSES)
+    workers.warm_up()
+    return workers
 
-def assign_teams(members_pool_df, late_member_ids, num_teams, assignment_type="general"):
+@st.cache_resource
+def get_assignment_scheduler(_gspread_client):
     """
-    レベル、遅刻者、性別の均等性を考慮した改善版割り振り関数。
-    割り振り手順：
-    1. 全参加者を「通常参加者」と「遅刻者」に分ける。
-    2. 通常参加者をレベル順に、遅刻者をレベル順に割り振る。
-    3. 各部員を割り振る際、チームの現在の状態に基づいて最適なチームをスコアリングで決定する。
-    4. 最終的な性別・レベルの偏りを再調整する（遅刻者は動かさない）。
+    次の練習日のコート割り振りを事前計算するスケジューラー (プロセスで1つ、管理者画面から初めて使うときに作成)。
+    バックグラウンドスレッドからは Streamlit のキャッシュを使わず、court_assignment.py の読み込み処理で直接読み込みます。
+    事前計算 (PRECOMPUTE_INTERVAL_MINUTES > 0) は呼び出し側で start します。
     """
-    if DEBUG_MODE: print(f"\nコート割り振り開始 ({assignment_type} - {num_teams}チーム)... 参加者 {len(members_pool_df)} 名")
-    if members_pool_df.empty:
-        if DEBUG_MODE: print("参加者がいないため、割り振りできません。")
-        return {}
-
-    required_cols = [COL_MEMBER_ID, COL_MEMBER_NAME, COL_MEMBER_GRADE, COL_MEMBER_LEVEL, COL_MEMBER_GENDER]
-    missing_cols = [col for col in required_cols if col not in members_pool_df.columns]
-    if missing_cols:
-        st.error(f"エラー: 部員リストに必要な列が見つかりません: {missing_cols}")
-        print(f"ERROR: Missing required columns in member list: {missing_cols}")
-        return {}
-
-    total_members = len(members_pool_df)
-    actual_num_teams = min(num_teams, total_members)
-    if actual_num_teams <= 0:
-        if DEBUG_MODE: print("割り当て可能なチーム数が0です。"); return {}
-    if actual_num_teams != num_teams:
-        print(f"参加者数 ({total_members}名) に基づき、チーム数を {actual_num_teams} に調整。")
-        if actual_num_teams == 0: return {} # 調整の結果チーム数が0になった場合
-
-    # 参加者全体の男女比
-    total_male_present = len(members_pool_df[members_pool_df[COL_MEMBER_GENDER] == '男性'])
-    total_present_members = len(members_pool_df)
-    target_male_ratio_total = total_male_present / total_present_members if total_present_members > 0 else 0.5
-    if DEBUG_MODE: print(f"参加者全体の男性比率: {target_male_ratio_total:.2f}")
-
-    # 各レベルの総数を計算（偏りスコア計算用）
-    # NaNを-1として扱うことで、to_numericが失敗してもint()に変換できるようになる
-    members_pool_df[COL_MEMBER_LEVEL] = pd.to_numeric(members_pool_df[COL_MEMBER_LEVEL], errors='coerce').fillna(-1).astype(int)
-
-    total_lv6 = len(members_pool_df[members_pool_df[COL_MEMBER_LEVEL] == 6])
-    total_lv5 = len(members_pool_df[members_pool_df[COL_MEMBER_LEVEL] == 5])
-    total_lv4 = len(members_pool_df[members_pool_df[COL_MEMBER_LEVEL] == 4])
-    total_lv1 = len(members_pool_df[members_pool_df[COL_MEMBER_LEVEL] == 1])
-    total_lv23 = len(members_pool_df[members_pool_df[COL_MEMBER_LEVEL].isin([2, 3])])
-    total_lv0 = len(members_pool_df[members_pool_df[COL_MEMBER_LEVEL] == 0])
-    total_late = len(late_member_ids)
-
-    teams = defaultdict(list)
-    # team_statsを初期化
-    team_stats = {f"チーム {i+1}": {
-        'count': 0, 'lv6_count': 0, 'lv5_count': 0, 'lv4_count': 0,
-        'lv1_count': 0, 'lv23_count': 0, 'lv0_count': 0,
-        'male_count': 0, 'female_count': 0, 'late_count': 0
-    } for i in range(actual_num_teams)}
-
-    # Helper function to assign a member and update stats
-    def assign_single_member_to_team(member_dict, target_team_name, is_late_member=False):
-        teams[target_team_name].append(member_dict)
-        stats = team_stats[target_team_name]
-        stats['count'] += 1
-        level = member_dict.get(COL_MEMBER_LEVEL)
-        if pd.notna(level):
-            level = int(level)
-            if level == 6: stats['lv6_count'] += 1
-            elif level == 5: stats['lv5_count'] += 1
-            elif level == 4: stats['lv4_count'] += 1
-            elif level == 1: stats['lv1_count'] += 1
-            elif level in [2, 3]: stats['lv23_count'] += 1
-            elif level == 0: stats['lv0_count'] += 1
-        if member_dict.get(COL_MEMBER_GENDER) == '男性':
-            stats['male_count'] += 1
-        else:
-            stats['female_count'] += 1
-        if is_late_member:
-            stats['late_count'] += 1
-
-    all_members_data = members_pool_df.to_dict('records')
-
-    # Separate members by their status (late/regular)
-    late_members_categorized = [m for m in all_members_data if m.get(COL_MEMBER_ID) in late_member_ids]
-    regular_members_categorized = [m for m in all_members_data if m.get(COL_MEMBER_ID) not in late_member_ids]
-
-    # Define the order of levels to process for initial assignment
-    # Process higher impact levels first.
-    level_processing_order = [6, 5, 4, 1, 3, 2, 0] # Order of levels for assignment
-
-    # --- 割り振り実行 (レベル順に部員を処理し、最適なチームに割り振る) ---
-
-    # まず、通常参加者をレベル順に割り振る
-    for level_to_process in level_processing_order:
-        members_at_this_level = [m for m in regular_members_categorized if pd.notna(m.get(COL_MEMBER_LEVEL)) and int(m.get(COL_MEMBER_LEVEL)) == level_to_process]
-        random.shuffle(members_at_this_level) # Shuffle to add randomness and break ties for better distribution
-        for member_data in members_at_this_level:
-            is_male = (member_data.get(COL_MEMBER_GENDER) == '男性')
-            member_level = member_data.get(COL_MEMBER_LEVEL) 
-
-            team_candidate_scores = []
-            for team_name in team_stats.keys():
-                stats = team_stats[team_name]
-
-                # Scoring components (lower score is better)
-                score_current_size = stats['count'] # Smaller team size is preferred to balance counts
-                
-                # Gender balance (deviation from overall target ratio)
-                predicted_team_size = stats['count'] + 1
-                predicted_male_count = stats['male_count'] + (1 if is_male else 0)
-                predicted_female_count = stats['female_count'] + (1 if not is_male else 0)
-                score_gender_imbalance = calculate_imbalance_score(predicted_male_count, predicted_female_count)
-
-                # Combine scores into a tuple for prioritization. Lower values are better.
-                # Request 1: レベル6をまず各コートの人数ができるだけ均等になるように割り振る。
-                # Request 2: 各コートのレベル5の人数をレベル6の人数と合わせた人数ができるだけ均等になるように配置する。
-                # Request 3: レベル4同士がバラバラになるように配置する。配置先はチームの人数が少ないところから埋める。
-                # Request 4: レベル1も同様に配置する。
-                # Request 7: 最後に通常参加のレベル2、3をコートの人数差が1に収まるように割り振る。
-
-                if level_to_process == 6:
-                    combined_score = (
-                        stats['lv6_count'],             # Primary: Minimize Lv6 count in team (to ensure all teams get one first)
-                        score_current_size,             # Secondary: Balance overall team size
-                        score_gender_imbalance          # Tertiary: Balance gender
-                    )
-                elif level_to_process == 5:
-                    # Lv6とLv5の合計が均等になるように
-                    combined_lv6_lv5_in_team = stats['lv6_count'] + stats['lv5_count']
-                    # Aim to make combined Lv6+Lv5 count as even as possible across teams
-                    # Use a very high penalty if it would create an extreme imbalance
-                    combined_score = (
-                        combined_lv6_lv5_in_team,       # Primary: Minimize sum of Lv6+Lv5
-                        stats['lv5_count'],             # Secondary: Minimize Lv5 count specifically
-                        score_current_size,             # Tertiary: Balance overall team size
-                        score_gender_imbalance          # Quaternary: Balance gender
-                    )
-                elif level_to_process in [4, 1]:
-                    combined_score = (
-                        stats.get(f'lv{int(member_level)}_count', 0), # Primary: Minimize count of this specific level (to spread them out)
-                        score_current_size,             # Secondary: Balance overall team size
-                        score_gender_imbalance
-                    )
-                elif level_to_process in [3, 2, 0]: # 通常参加のLv2,3,0
-                    combined_score = (
-                        score_current_size,             # Primary: Balance overall team size (to ensure team count diff is 1)
-                        score_gender_imbalance,         # Secondary: Balance gender
-                        stats.get(f'lv{int(member_level)}_count', 0) # Tertiary: Balance this specific level
-                    )
-                else: # Fallback, should not happen with current level_processing_order
-                    combined_score = (score_current_size, score_gender_imbalance)
-
-                team_candidate_scores.append((combined_score, team_name))
-            
-            team_candidate_scores.sort() # Sort by the tuple score (Python sorts tuples element-wise)
-            target_team_name = team_candidate_scores[0][1] # Select the team with the lowest score
-            assign_single_member_to_team(member_data, target_team_name, is_late_member=False)
-            if DEBUG_MODE: print(f"-> 通常: {member_data.get(COL_MEMBER_NAME, '?')} (L{int(member_data.get(COL_MEMBER_LEVEL, 0)) if pd.notna(member_data.get(COL_MEMBER_LEVEL)) else '?'}, {member_data.get(COL_MEMBER_GENDER, '?')}) を {target_team_name} に割り振り。")
-
-
-    # 次に、遅刻者をレベル順に割り振る
-    for level_to_process in level_processing_order:
-        members_at_this_level = [m for m in late_members_categorized if pd.notna(m.get(COL_MEMBER_LEVEL)) and int(m.get(COL_MEMBER_LEVEL)) == level_to_process]
-        random.shuffle(members_at_this_level)
-        for member_data in members_at_this_level:
-            is_male = (member_data.get(COL_MEMBER_GENDER) == '男性')
-            member_level = member_data.get(COL_MEMBER_LEVEL)
-
-            team_candidate_scores = []
-            for team_name in team_stats.keys():
-                stats = team_stats[team_name]
-                
-                score_current_size = stats['count'] # チームの現在の人数
-                score_gender_imbalance = calculate_imbalance_score(
-                    stats['male_count'] + (1 if is_male else 0),
-                    stats['female_count'] + (1 if not is_male else 0)
-                )
-                score_late_count_imbalance = stats['late_count'] # 遅刻者全体の均等性
-
-                combined_score = (0, 0, 0, 0) # Default, will be overwritten
-
-                if level_to_process == 6: # 遅刻者のLv6
-                    # 最優先：当該Lv6の人数が少ないところに配置
-                    # 次点：遅刻者全体の均等性
-                    # 次点：チームの人数
-                    combined_score = (
-                        stats['lv6_count'],             # Primary: Minimize Lv6 count in team
-                        score_late_count_imbalance,     # Secondary: Balance overall latecomers
-                        score_current_size,
-                        score_gender_imbalance
-                    )
-                elif level_to_process == 5: # 遅刻者のLv5
-                    # 通常参加者と同様に、チーム全体のLv6とLv5の合計が均等になるように配置
-                    combined_lv6_lv5_in_team = stats['lv6_count'] + stats['lv5_count']
-                    combined_score = (
-                        combined_lv6_lv5_in_team,       # 1. チーム全体のLv6+Lv5の合計が少ない
-                        score_late_count_imbalance,     # 2. 遅刻者の人数が少ない
-                        stats['lv5_count'],             # 3. チーム全体のLv5の人数が少ない
-                        score_current_size,             # 4. 全体の人数が少ない
-                        score_gender_imbalance          # 5. 性別バランスが良い
-                    )
-                elif level_to_process in [4, 1]: # 遅刻者のLv4, Lv1
-                    # 最優先：当該レベルの人数が少ないところに
-                    # 次点：遅刻者全体の均等性
-                    # 次点：チームの人数
-                    combined_score = (
-                        stats.get(f'lv{int(member_level)}_count', 0), # Primary: Minimize count of this specific level
-                        score_late_count_imbalance,     # Secondary: Balance overall latecomers
-                        score_current_size,
-                        score_gender_imbalance
-                    )
-                elif level_to_process in [3, 2, 0]: # 遅刻者のLv2, Lv3, Lv0
-                    # 最優先：遅刻者が各コートで均等に割り振られるようにする
-                    # 次点：チームの人数も均等に
-                    # 次点：男女比の偏りが少ないチーム
-                    combined_score = (
-                        score_late_count_imbalance,    # Primary: Balance overall latecomers
-                        score_current_size,            # Secondary: Balance overall team size
-                        score_gender_imbalance
-                    )
-                else: # Fallback
-                    combined_score = (score_late_count_imbalance, score_current_size, score_gender_imbalance)
-
-                team_candidate_scores.append((combined_score, team_name))
-            
-            team_candidate_scores.sort()
-            target_team_name = team_candidate_scores[0][1]
-            assign_single_member_to_team(member_data, target_team_name, is_late_member=True)
-            if DEBUG_MODE: print(f"-> 遅刻: {member_data.get(COL_MEMBER_NAME, '?')} (L{int(member_data.get(COL_MEMBER_LEVEL, 0)) if pd.notna(member_data.get(COL_MEMBER_LEVEL)) else '?'}, {member_data.get(COL_MEMBER_GENDER, '?')}) を {target_team_name} に割り振り。")
-
-    if DEBUG_MODE: print("\n一次割り振りループ完了。")
-
-    # 最終的なバランス調整 (性別・レベルの偏りをさらに調整、遅刻者は動かさない)
-    # Request 8: 最後に男女比調整のために交換を実施する。
-    teams = rebalance_teams_by_gender_and_level(teams, team_stats, late_member_ids)
-
-    if DEBUG_MODE:
-        # 正確なデバッグ出力のために、最終的なチーム構成から統計を再計算する
-        print("\n最終的なチーム統計を再計算中...")
-        for team_name in team_stats:
-            for key in team_stats[team_name]:
-                team_stats[team_name][key] = 0 # Reset stats for recalculation
-        for team_name, members in teams.items():
-            stats = team_stats[team_name]
-            stats['count'] = len(members)
-            for member in members:
-                if member.get(COL_MEMBER_ID) in late_member_ids:
-                    stats['late_count'] += 1
-                if member.get(COL_MEMBER_GENDER) == '男性':
-                    stats['male_count'] += 1
-                else:
-                    stats['female_count'] += 1
-                level = member.get(COL_MEMBER_LEVEL)
-                if pd.notna(level):
-                    level = int(level)
-                    if level == 6: stats['lv6_count'] += 1
-                    elif level == 5: stats['lv5_count'] += 1
-                    elif level == 4: stats['lv4_count'] += 1
-                    elif level == 1: stats['lv1_count'] += 1
-                    elif level in [2, 3]: stats['lv23_count'] += 1
-                    elif level == 0: stats['lv0_count'] += 1
-
-        print(f"\n--- チーム割り振り最終結果 ({assignment_type} - {num_teams}チーム) ---")
-        total_assigned = 0
-        for team_name in sorted(teams.keys(), key=lambda name: int(name.split()[-1])):
-            members_in_team = teams[team_name]
-            total_assigned += len(members_in_team)
-            member_names = [f"{m.get(COL_MEMBER_NAME, '?')} (L{int(m.get(COL_MEMBER_LEVEL, 0)) if pd.notna(m.get(COL_MEMBER_LEVEL)) else '?'})" for m in members_in_team]
-            stats = team_stats[team_name]
-            num_lv6 = stats['lv6_count']
-            num_lv5 = stats['lv5_count']
-            num_lv4 = stats['lv4_count']
-            num_lv1 = stats['lv1_count']
-            num_male = stats['male_count']
-            num_female = stats['female_count']
-            num_late = stats['late_count']
-            num_lv23 = stats.get('lv23_count', 0)
-            num_lv0 = stats.get('lv0_count', 0)
-            print(f" {team_name} ({len(members_in_team)}名, Lv6:{num_lv6}, Lv5:{num_lv5}, Lv4:{num_lv4}, Lv1:{num_lv1}, Lv2/3:{num_lv23}, Lv0:{num_lv0}, 男:{num_male}, 女:{num_female}, 遅刻:{num_late}): {', '.join(member_names)}")
-        print("---------------------------------")
-        expected_count_for_debug = len(members_pool_df)
-        print(f"合計割り当て人数: {total_assigned} (期待値: {expected_count_for_debug})")
-        if total_assigned != expected_count_for_debug:
-            print(f"警告: 割り当て人数が期待値と異なります。")
-
-    return dict(teams)
-
-def format_assignment_results(assignments, practice_type_or_teams, target_date):
+    scheduler_client = LedgeredClient(_gspread_client, get_process_api_ledger())
+    def load_inputs(target_date):
+        return load_assignment_inputs(scheduler_client.open_by_key(SPREADSHEET_ID), target_date)
+    scheduler = AssignmentScheduler(load_inputs, PRECOMPUTE_INTERVAL_MINUTES * 60, practice_weekdays=PRACTICE_WEEKDAYS,
+                                     pair_history=get_pair_history(scheduler_client), runner=get_assignment_workers().run_tasks)
+    return scheduler
+
+@contextlib.contextmanager
+def api_action(name):
     """
-    割り振り結果をスプレッドシート書き込み用に整形します。
+    ユーザー操作1回分の Sheets API 呼び出しを集計します。
+    上限 (API_CALL_BUDGET) を超えた場合は警告を出力し、管理者・デバッグ時は画面にも表示します。
     """
-    if DEBUG_MODE: print(f"\n割り振り結果 ({practice_type_or_teams} - {target_date.strftime('%Y-%m-%d')}) を整形中...")
-    if not assignments: return [[f"割り振り結果なし ({practice_type_or_teams} - {target_date.strftime('%Y-%m-%d')})"]]
-    
-    output_rows = []
-    output_rows.append([f"コート割り振り結果 ({practice_type_or_teams} - {target_date.strftime('%Y-%m-%d')})"])
-    output_rows.append([]) # 空行
-    
-    # チーム名をソートしてヘッダーに追加
-    team_names = sorted(assignments.keys(), key=lambda name: int(name.split()[-1]))
-    output_rows.append(team_names)
-    
-    # 最大のチーム人数を取得し、行数を決定
-    max_len = max(len(m) for m in assignments.values()) if assignments else 0
-    
-    # 各行に部員名を追加
-    for i in range(max_len):
-        row = []
-        for team_name in team_names:
-            members = assignments.get(team_name, [])
-            cell_value = ""
-            if i < len(members):
-                member = members[i]
-                name = member.get(COL_MEMBER_NAME, '?')
-                level_val = member.get(COL_MEMBER_LEVEL, '?')
-                level_display = int(level_val) if pd.notna(level_val) else '?'
-                gender = member.get(COL_MEMBER_GENDER, '?')
-                cell_value = f"{name} (L{level_display}/{gender})"
-            else:
-                cell_value = "" # そのチームに部員がいなければ空文字列
-            row.append(cell_value)
-        if DEBUG_MODE and i < 2 : print(f"DEBUG: Completed Row {i+1} for format: {row}")
-        output_rows.append(row)
-    
-    if DEBUG_MODE: print("-> 整形完了")
-    return output_rows
+    ledger = st.session_state.api_ledger
+    record = None
+    try:
+        with ledger.action(name, budget=API_CALL_BUDGET) as record:
+            try:
+                yield record
+            finally:
+                history = st.session_state.setdefault('api_action_history', [])
+                history.append({'操作': name, '呼び出し回数': record['calls'], '上限': API_CALL_BUDGET,
+                                '概算転送量(KB)': round(record['bytes'] / 1024, 1), '内訳': ', '.join(f"{m}:{n}" for m, n in record['by_method'].most_common())})
+                del history[:-20] # 直近20件のみ保持
+    finally:
+        # 操作の途中で st.rerun() / st.stop() が呼ばれた (例外で抜けた) 場合も、上限の超過は記録する
+        if record is not None and record['over_budget']:
+            print(f"WARNING: {ledger.warnings[-1]}")
+            process_warnings = get_process_api_ledger().warnings
+            process_warnings.append(ledger.warnings[-1]); del process_warnings[:-50]
+            if DEBUG_MODE or st.session_state.get('is_admin'): st.warning(ledger.warnings[-1])
+
+def format_attendance_for_display(df):
+    """
+    表示用に日付列を文字列へ整形したコピーを返します (表示する行だけに適用します)。
+    """
+    display_df = df.copy()
+    if COL_ATTENDANCE_TIMESTAMP in display_df.columns: display_df[COL_ATTENDANCE_TIMESTAMP] = display_df[COL_ATTENDANCE_TIMESTAMP].dt.strftime('%Y-%m-%d %H:%M:%S')
+    if COL_ATTENDANCE_TARGET_DATE in display_df.columns: display_df[COL_ATTENDANCE_TARGET_DATE] = display_df[COL_ATTENDANCE_TARGET_DATE].dt.strftime('%Y/%m/%d')
+    return display_df
 
-def write_results_to_sheet(worksheet, result_data, data_name="データ"):
+@traced("record_attendance_streamlit")
+def record_attendance_streamlit(worksheet, data_dicts):
     """
-    整形された割り振り結果データをスプレッドシートに書き込みます。
-    既存の内容はクリアされます。
+    遅刻・欠席連絡 (複数件) を1回の append_rows でスプレッドシートに記録します。
     """
-    if worksheet is None: st.error(f"エラー: {data_name}の出力用シートが見つかりません。"); return False
-    if not result_data: st.warning(f"書き込む{data_name}がありません。"); return False
-    if DEBUG_MODE: print(f"{data_name}書き込み中: '{worksheet.title}' ...")
+    if worksheet is None: st.error("記録用シートが見つかりません。"); return False
     try:
-        worksheet.clear(); worksheet.update(range_name='A1', values=result_data, value_input_option='USER_ENTERED')
-        if DEBUG_MODE: print(f"-> {data_name}書き込み完了")
-        st.success(f"{data_name}をシート '{worksheet.title}' に書き込みました。")
+        rows_data = attendance_rows(data_dicts)
+        worksheet.append_rows(rows_data, value_input_option='USER_ENTERED'); count_rows(len(rows_data))
+        if DEBUG_MODE: print(f"記録成功: {len(rows_data)}件 {rows_data}")
         return True
-    except Exception as e: st.error(f"{data_name}のシートへの書き込み中にエラー: {e}"); print(f"ERROR: Error writing {data_name}: {e}"); return False
-
-# === 4. Streamlit アプリ本体の開始 ===
-st.title("🏸 バドミントン部 連絡システム")
+    except Exception as e: st.error(f"記録エラー: {e}"); print(f"ERROR: Error recording: {e}"); return False
 
+def publish_assignment_result(gspread_client, job_result, target_date, reassign_all, pair_history):
+    """
+    完了した割り振りジョブの結果 (事前計算の更新結果と追加のチーム数の結果) を名簿・割り振り結果シートに書き込み (assignment_flow.publish_assignment)、
+    書き込みの結果を表示します。書き込めた割り振りはペア履歴にも記録します。
+    """
+    precomputed = job_result['precomputed']
+    if precomputed.refresh_info['mode'] == 'delta':
+        repaired_count = sum(len(t) for t in precomputed.refresh_info['repaired_teams'].values())
+        st.info(f"事前計算済みの割り振りに {precomputed.refresh_info['changed_members']} 名の連絡の変化を反映しました (変更のあったチーム: {repaired_count})。")
+    elif precomputed.refresh_info['mode'] == 'unchanged':
+        st.info("事前計算以降に連絡の変化がないため、事前計算済みの割り振りをそのまま使用します (組み合わせを変える場合はシャッフルを選んで実行してください)。")
+    report = publish_assignment(gspread_client.open_by_key(SPREADSHEET_ID), job_result, target_date, force_full=reassign_all, pair_history=pair_history,
+                                run_calls=lambda funcs: run_sheet_calls_concurrently(funcs, return_exceptions=True))
+    if report['create_error'] is not None: st.error(f"結果シートの作成中にエラー: {report['create_error']}")
+    for created_sheet_name in report['created_sheets']: st.info(f"シート '{created_sheet_name}' を作成しました。")
+    for level, message in report['messages']:
+        if level == 'warning': st.warning(message)
+        elif DEBUG_MODE: st.write(message)
+    # 書き込みの結果は outputs の順に表示する
+    for sheet_name, data_name, result_data, result in report['writes']:
+        if isinstance(result, Exception): st.error(f"{data_name}のシートへの書き込み中にエラー: {result}"); print(f"ERROR: Error writing {data_name}: {result}"); continue
+        worksheet, write_mode = result
+        if worksheet is None: st.error(f"シート '{sheet_name}' が見つかりません。")
+        elif not result_data: st.warning(f"書き込む{data_name}がありません。")
+        else:
+            if DEBUG_MODE: print(f"-> {data_name}書き込み完了 ({write_mode})")
+            if write_mode == 'skipped': st.info(f"シート '{worksheet.title}' の内容が同じため、{data_name}の書き込みを省略しました。")
+            else: st.success(f"{data_name}をシート '{worksheet.title}' に書き込みました。" + (" (変更のあったセルのみ)" if write_mode == 'diff' else ""))
+    if report['unchanged']: st.info(f"シートの内容が同じため、書き込みを省略しました: {', '.join(report['unchanged'])}")
+    if report['pair_history_error'] is not None: st.error(f"ペア履歴の書き込み中にエラー: {report['pair_history_error']}")
+    elif report['pair_history'] is not None and DEBUG_MODE: print(f"-> ペア履歴を書き込みました ({report['pair_history']}, {pair_history.total_pairs} ペア)")
+
+def publish_finished_assignment_job(gspread_client, job, pair_history):
+    """
+    終了した割り振りジョブの結果を表示し、完了していればシートに書き込みます。
+    ジョブを始めたセッションに限らず、結果を受け取った (AssignmentWorkerPool.claim_finished) 管理者のセッションで呼びます。
+    """
+    target_date_done = job['meta']['target_date']
+    if job['state'] == JOB_CANCELLED: st.warning(f"{target_date_done.strftime('%Y-%m-%d')} の割り振りをキャンセルしました。シートは更新していません。")
+    elif job['state'] == JOB_FAILED: st.error(f"割り振り中にエラーが発生しました: {job['error']}"); print(f"ERROR: Assignment job failed: {job['error']}")
+    elif job['state'] == JOB_DONE:
+        with api_action("コート割り振り"), st.spinner("割り振り結果を書き込み中..."):
+            publish_assignment_result(gspread_client, job['result'], target_date_done, job['meta']['reassign_all'], pair_history)
+        st.info(f"{target_date_done.strftime('%Y-%m-%d')} の割り振り処理と名簿出力が完了しました。")
+
+def assignment_job_progress(workers):
+    """
+    実行中の割り振りジョブの進捗とキャンセルボタンを表示します (st.fragment で一定間隔ごとに表示し直します)。
+    ジョブが終了したらアプリ全体を再実行し、結果の書き込みに進みます。
+    """
+    active_jobs = workers.active_jobs()
+    if not active_jobs: st.rerun(scope="app")
+    job = active_jobs[0]
+    progress_text = f"{job['meta']['target_date'].strftime('%Y-%m-%d')} のコート割り振り中... ({job['done_tasks']}/{job['total_tasks']})"
+    st.progress(job['progress'], text=progress_text)
+    st.caption("このタブを閉じても計算は続き、結果は次に管理者画面を開いたときに書き込みます。")
+    if st.button("割り振りをキャンセル", key="assignment_job_cancel_key"):
+        if workers.cancel(job['id']):
+            if workers.can_stop_running_tasks: st.info("キャンセルしました。実行中の計算も停止します。")
+            else: st.info("キャンセルを要求しました。ワーカープロセスを使わない設定のため、実行中の計算は終わり次第停止します。")
+
+# === 6. Streamlit アプリ本体 (一般ログイン済みユーザー向け) ===
 # --- セッション状態の初期化 (アプリデータ用) ---
-if 'member_df' not in st.session_state: st.session_state.member_df = pd.DataFrame()
-if 'name_to_id_map_form' not in st.session_state: st.session_state.name_to_id_map_form = {}
-if 'grade_options' not in st.session_state: st.session_state.grade_options = ["---"]
-if 'department_options' not in st.session_state: st.session_state.department_options = ["---"] # 新規追加
-if 'form_member_options' not in st.session_state: st.session_state.form_member_options = ["---"]
+# 部員リストと選択肢は全セッションで共有し (get_roster_store)、セッションには名簿の版だけを保持する
+if 'roster_version' not in st.session_state: st.session_state.roster_version = None
 if 'show_success_message' not in st.session_state:
     st.session_state.show_success_message = False
 if 'success_message_content' not in st.session_state:
@@ -738,27 +533,6 @@ if 'success_message_content' not in st.session_state:
 # if 'selected_names_form_custom_key' not in st.session_state:
 #     st.session_state.selected_names_form_custom_key = []
 
-# ログイン状態を管理するセッション変数 (共通パスワード方式)
-if 'authentication_status' not in st.session_state:
-    st.session_state.authentication_status = None
-if 'user_name' not in st.session_state:
-    st.session_state.user_name = None
-if 'is_admin' not in st.session_state:
-    st.session_state.is_admin = False
-if 'last_interaction_time' not in st.session_state:
-    st.session_state.last_interaction_time = datetime.datetime.now()
-
-# --- 一般ログイン処理 ---
-def check_general_password():
-    """共通パスワードをチェックし、認証状態を更新します。"""
-    if st.session_state.general_password_input == GENERAL_PASSWORD_SECRET:
-        st.session_state.authentication_status = True
-        st.session_state.user_name = "部員"
-        st.session_state.last_interaction_time = datetime.datetime.now()
-    else:
-        st.error("共通パスワードが間違っています。")
-        st.session_state.authentication_status = False
-
 # --- 管理者ログイン処理 ---
 def check_admin_password():
     """管理者パスワードをチェックし、管理者フラグを更新します。"""
@@ -770,12 +544,6 @@ def check_admin_password():
         st.error("管理者パスワードが間違っています。")
         st.session_state.is_admin = False
 
-# --- ログインフォームの表示 ---
-if st.session_state.authentication_status is not True:
-    st.subheader("アプリ利用のための共通パスワードを入力してください")
-    st.text_input("共通パスワード", type="password", key="general_password_input", on_change=check_general_password)
-    st.stop()
-
 # --- メインコンテンツ (一般ログイン済みユーザー向け) ---
 # 自動ログアウトチェック
 if datetime.datetime.now() - st.session_state.last_interaction_time > datetime.timedelta(minutes=INACTIVITY_TIMEOUT_MINUTES):
@@ -788,11 +556,11 @@ if datetime.datetime.now() - st.session_state.last_interaction_time > datetime.t
                     'form_reason_input_key', 
                     'form_late_time_input_key', 
                     'form_target_date_key', # form_target_date_keyは引き続き利用
-                    'name_to_id_map_form', 'form_member_options',
+                    'roster_version',
                     'show_success_message', 'success_message_content',
                     # 'selected_names_form_custom_key', # 削除されたカスタムキーなのでクリアリストから削除
-                    'lookup_member_options', 'name_to_id_map_lookup', 
                     'lookup_grade_select_key', 'lookup_department_select_key', 'lookup_name_select_key', 
+                    'lookup_active_student', 'lookup_archive_months_loaded', 'lookup_page',
                     'admin_password_input_key' 
                     ] 
     for key in list(st.session_state.keys()):
@@ -811,88 +579,82 @@ gspread_client = authenticate_gspread_service_account()
 if not gspread_client:
     st.error("スプレッドシートサービスへの接続に失敗しました。")
     st.stop()
-
-# 部員データの読み込みと初期設定
-if st.session_state.member_df.empty:
-    required_member_cols_all = [COL_MEMBER_ID, COL_MEMBER_NAME, COL_MEMBER_GRADE, COL_MEMBER_LEVEL, COL_MEMBER_GENDER, COL_MEMBER_DEPARTMENT] # 学科も必須に
-    st.session_state.member_df = load_data_to_dataframe(gspread_client, SPREADSHEET_ID, MEMBER_SHEET_NAME, required_cols=required_member_cols_all)
-    if not st.session_state.member_df.empty:
-        try:
-            unique_grades_raw = st.session_state.member_df[COL_MEMBER_GRADE].astype(str).str.strip().unique()
-            st.session_state.grade_options = ["---"] + sorted([g for g in unique_grades_raw if g])
-            unique_depts_raw = st.session_state.member_df[COL_MEMBER_DEPARTMENT].astype(str).str.strip().unique() # 新規追加
-            st.session_state.department_options = ["---"] + sorted([d for d in unique_depts_raw if d]) # 新規追加
-        except KeyError as e: st.error(f"エラー: 部員リストに必須列がありません: {e}"); st.session_state.grade_options = ["---"]; st.session_state.department_options = ["---"] # フォールバック
+pair_history = get_pair_history(gspread_client) # 割り振りの公開で更新し、以降の割り振りで同じ組み合わせを避けるために使う
+# 再実行ごとの Sheets API 呼び出し台帳 (プロセス全体の台帳にも加算される)
+st.session_state.api_ledger = ApiCallLedger(parent=get_process_api_ledger(), default_budget=API_CALL_BUDGET)
+gspread_client = LedgeredClient(gspread_client, st.session_state.api_ledger)
+
+# 部員データの読み込みと初期設定 (セッションの開始時に1回だけ読み込み、同じ内容の名簿は全セッションで共有する)
+roster = get_roster_store().get(st.session_state.roster_version)
+if roster is None:
+    required_member_cols_all = MEMBER_COLUMNS # 学科も必須に
+    with api_action("部員データ読み込み"):
+        # 連絡送信時の重複チェックで使う連絡ログも並行して読み込み、キャッシュしておく
+        # (フォームの対象練習日に必要なシートだけを、送信時と同じ列・同じキャッシュで読み込む)
+        prefetch_target_dates = [st.session_state.get('form_target_date_key', datetime.date.today())]
+        member_df_loaded, _ = run_sheet_calls_concurrently([
+            functools.partial(load_data_to_dataframe, gspread_client, SPREADSHEET_ID, MEMBER_SHEET_NAME, required_cols=required_member_cols_all, columns=required_member_cols_all),
+            functools.partial(load_attendance_partitions, gspread_client, SPREADSHEET_ID, months_for_target_dates(prefetch_target_dates),
+                              required_cols=ATTENDANCE_CHECK_COLUMNS, columns=ATTENDANCE_CHECK_COLUMNS),
+        ])
+    if not member_df_loaded.empty:
+        try: roster = get_roster_store().intern(member_df_loaded); st.session_state.roster_version = roster.version
+        except KeyError as e: st.error(f"エラー: 部員リストに必須列がありません: {e}")
     else:
-        st.session_state.grade_options = ["---"]
-        st.session_state.department_options = ["---"] # フォールバック
         st.warning("部員データが空か、読み込みに失敗しました。")
+member_df = roster.members if roster is not None else pd.DataFrame() # 共有の部員リスト (変更しない)
 
 # --- 遅刻・欠席連絡フォーム ---
 st.header("１．遅刻・欠席連絡")
-if not st.session_state.member_df.empty:
-    member_df_for_form = st.session_state.member_df
-
-    # 変更: callback関数を引数で呼び出せるようにする (学年と学科でフィルタリング)
-    def update_name_options_for_form_callback_internal(grade, department):
-        name_options = []
-        id_map = {}
-        filtered_df = member_df_for_form.copy()
-
-        if grade != "---":
-            filtered_df = filtered_df[filtered_df[COL_MEMBER_GRADE].astype(str).str.strip() == str(grade).strip()]
-        if department != "---": # 新規追加
-            filtered_df = filtered_df[filtered_df[COL_MEMBER_DEPARTMENT].astype(str).str.strip() == str(department).strip()] # 新規追加
-
-        if not filtered_df.empty:
-            # 変更: 部員リストの順序を保持
-            name_options = filtered_df[COL_MEMBER_NAME].tolist()
-            id_map = pd.Series(filtered_df[COL_MEMBER_ID].values, index=filtered_df[COL_MEMBER_NAME]).to_dict()
-        st.session_state.form_member_options = name_options
-        st.session_state.name_to_id_map_form = id_map
-
+if not member_df.empty:
     # UIのコールバックハンドラー
-    # これらのコールバックは st.form の外側にあるウィジェット用
+    # これらのコールバックは st.form の外側にあるウィジェット用 (名前の選択肢は表示時に共有の名簿から引く)
     def handle_form_grade_change():
-        # 名前リストのオプションを更新
-        update_name_options_for_form_callback_internal(st.session_state.form_grade_select_key, st.session_state.form_department_select_key)
         # 学年変更時に名前の選択を「---」に戻す
         st.session_state.form_name_select_key = "---"
 
     def handle_form_department_change():
-        # 名前リストのオプションを更新
-        update_name_options_for_form_callback_internal(st.session_state.form_grade_select_key, st.session_state.form_department_select_key)
         # 学科変更時に名前の選択を「---」に戻す
         st.session_state.form_name_select_key = "---"
 
     # フォーム外のウィジェット
     target_date_form = st.date_input("対象の練習日:", value=st.session_state.get('form_target_date_key', datetime.date.today()), min_value=datetime.date.today(), key="form_target_date_key")
+    # 毎週の実習など同じ連絡が続く場合は、期間と曜日を指定して複数の練習日をまとめて連絡できる
+    bulk_mode_form = st.checkbox("複数の練習日をまとめて連絡する", key="form_bulk_mode_key")
+    bulk_target_dates_form = []
+    if bulk_mode_form:
+        col_bulk_end, col_bulk_weekdays = st.columns(2)
+        with col_bulk_end:
+            bulk_end_date_form = st.date_input("最終日:", value=target_date_form + datetime.timedelta(days=27), key="form_bulk_end_date_key")
+        with col_bulk_weekdays:
+            bulk_weekday_labels_form = st.multiselect("曜日 (未選択なら毎日):", WEEKDAY_LABELS, default=[WEEKDAY_LABELS[target_date_form.weekday()]], key="form_bulk_weekdays_key")
+        bulk_target_dates_form = practice_dates_in_range(target_date_form, bulk_end_date_form, [WEEKDAY_LABELS.index(w) for w in bulk_weekday_labels_form])
+        if bulk_target_dates_form:
+            st.caption(f"対象の練習日 ({len(bulk_target_dates_form)}日): " + "、".join(d.strftime('%m/%d') + f"({WEEKDAY_LABELS[d.weekday()]})" for d in bulk_target_dates_form))
     col_grade, col_department = st.columns(2)
     with col_grade:
         selected_grade_form = st.selectbox(
             "あなたの学年:",
-            st.session_state.get('grade_options', ["---"]),
+            roster.grade_options,
             key="form_grade_select_key",
             on_change=handle_form_grade_change
         )
     with col_department:
         selected_department_form = st.selectbox(
             "あなたの学科:",
-            st.session_state.get('department_options', ["---"]),
+            roster.department_options,
             key="form_department_select_key",
             on_change=handle_form_department_change
         )
 
-    # フォームレンダリング時に名前のオプションを更新 (初期表示と学年・学科変更時)
-    current_grade_for_names = st.session_state.get('form_grade_select_key', selected_grade_form)
-    current_department_for_names = st.session_state.get('form_department_select_key', selected_department_form)
-    update_name_options_for_form_callback_internal(current_grade_for_names, current_department_for_names)
+    # フォームレンダリング時に名前のオプションを共有の名簿から引く (部員リストの順、学年・学科の組み合わせごとに全セッションで共有)
+    form_member_options, name_to_id_map_form = roster.member_options(selected_grade_form, selected_department_form)
 
     # --- 名前選択をst.selectbox (単一選択)に変更 ---
     selected_name_display_form = st.selectbox(
         f"あなたの名前 ({selected_grade_form if selected_grade_form != '---' else '学年未選択'}"
         f"{' / ' + selected_department_form if selected_department_form != '---' else ''}):", # 学科表示も追加
-        options=["---"] + st.session_state.get('form_member_options', []), # 単一選択なので先頭に「---」を追加
+        options=("---",) + form_member_options, # 単一選択なので先頭に「---」を追加
         key="form_name_select_key" 
     )
 
@@ -957,6 +719,7 @@ if not st.session_state.member_df.empty:
         st.session_state.last_interaction_time = datetime.datetime.now()
         # フォーム外のウィジェットから値を取得
         current_target_date = target_date_form # st.date_inputから変更されたため直接参照
+        current_target_dates = bulk_target_dates_form if bulk_mode_form else [current_target_date]
         current_selected_grade = st.session_state.form_grade_select_key
         current_selected_department = st.session_state.form_department_select_key
         current_selected_name = selected_name_display_form # st.selectboxの選択値 (単一)
@@ -968,6 +731,8 @@ if not st.session_state.member_df.empty:
         
         errors = [];
         if current_target_date is None: errors.append("練習日を選択"); 
+        elif bulk_mode_form and not current_target_dates: errors.append("最終日と曜日を見直し、対象の練習日を1日以上選択")
+        elif len(current_target_dates) > MAX_BULK_TARGET_DATES: errors.append(f"対象の練習日を{MAX_BULK_TARGET_DATES}日以内に")
 
         # 名前が「---」の場合、学年と学科の選択を必須にする
         if current_selected_name == "---":
@@ -976,7 +741,7 @@ if not st.session_state.member_df.empty:
         
         selected_names_to_process = []
         if current_selected_name == "---": # "---"が選択されている場合は、学年と学科でフィルタリングされた全員
-            all_filtered_names_for_submit = st.session_state.get('form_member_options', []) # 現在のフィルタリング結果
+            all_filtered_names_for_submit = list(form_member_options) # 現在のフィルタリング結果
             if all_filtered_names_for_submit: # フィルタリング結果が空でない場合のみ対象とする
                 selected_names_to_process = all_filtered_names_for_submit 
             else: # フィルタリング結果が空の場合
@@ -992,113 +757,87 @@ if not st.session_state.member_df.empty:
 
         if errors: st.warning(f"入力エラー: {', '.join(errors)}してください。") 
         else:
-            # Load all existing attendance logs for the target date
-            # Ensure required_cols are passed here.
-            required_attendance_cols_for_check = [COL_ATTENDANCE_TIMESTAMP, COL_MEMBER_ID, COL_ATTENDANCE_TARGET_DATE, COL_ATTENDANCE_STATUS]
-            attendance_df_all_logs_current_date = load_data_to_dataframe(gspread_client, SPREADSHEET_ID, ATTENDANCE_SHEET_NAME, required_cols=required_attendance_cols_for_check)
-
-            # Determine latest status for each member for the target date
-            existing_records_student_ids = set()
-            if not attendance_df_all_logs_current_date.empty:
-                # Ensure dt_target_date column is processed correctly
-                if 'dt_target_date' not in attendance_df_all_logs_current_date.columns:
-                    attendance_df_all_logs_current_date['dt_target_date'] = pd.to_datetime(attendance_df_all_logs_current_date[COL_ATTENDANCE_TARGET_DATE], errors='coerce').dt.date
-
-                # Filter logs for the specific target_date and get the latest status per member
-                relevant_logs = attendance_df_all_logs_current_date[
-                    attendance_df_all_logs_current_date['dt_target_date'] == current_target_date
-                ].copy()
-
-                if not relevant_logs.empty:
-                    latest_logs_per_member = relevant_logs.sort_values(by='dt_timestamp', ascending=False).drop_duplicates(subset=[COL_MEMBER_ID], keep='first')
-                    # Collect IDs of members who already have a record for this date
-                    existing_records_student_ids = set(latest_logs_per_member[COL_MEMBER_ID].astype(str).tolist())
-            
-            members_to_record_new = []
-            members_skipped_already_recorded_names = []
-
-            for name_to_submit in selected_names_to_process:
-                student_id_to_submit = st.session_state.get('name_to_id_map_form', {}).get(name_to_submit)
-                if not student_id_to_submit:
-                    st.error(f"エラー: {name_to_submit} の学籍番号が見つかりませんでした。スキップします。")
-                    continue
-                
-                # Check if member already has a record for this date
-                if student_id_to_submit in existing_records_student_ids:
-                    members_skipped_already_recorded_names.append(name_to_submit)
-                    if DEBUG_MODE: print(f"DEBUG: {name_to_submit} ({student_id_to_submit}) は既に {current_target_date} の連絡済みの為スキップします。")
-                else:
-                    members_to_record_new.append((name_to_submit, student_id_to_submit))
-                    if DEBUG_MODE: print(f"DEBUG: {name_to_submit} ({student_id_to_submit}) を {current_target_date} の連絡対象に追加します。")
-
-            if not members_to_record_new and not members_skipped_already_recorded_names:
-                st.warning("送信対象となる部員がいません。学年、学科、または名前を選択し直してください。")
-                #return # Stop processing if no valid members to record
-
-            record_count = 0
-            for name_to_submit, student_id_to_submit in members_to_record_new:
-                # Recording part (unchanged from original code)
-                now_jst = datetime.datetime.now() + datetime.timedelta(hours=9)
-                record_timestamp = now_jst.strftime("%Y-%m-%d %H:%M:%S")
-                member_info_rows = member_df_for_form[member_df_for_form[COL_MEMBER_ID] == student_id_to_submit]
-                grade_to_submit = ''
-                department_to_submit = ''
-                if not member_info_rows.empty:
-                    member_info = member_info_rows.iloc[0]
-                    grade_to_submit = member_info.get(COL_MEMBER_GRADE, '')
-                    department_to_submit = member_info.get(COL_MEMBER_DEPARTMENT, '')
-                
-                record_data = {
-                    '記録日時': record_timestamp,
-                    '対象練習日': current_target_date.strftime('%Y/%m/%d'),
-                    '学籍番号': student_id_to_submit, 
-                    '学年': grade_to_submit, 
-                    '名前': name_to_submit, 
-                    '状況': current_status,
-                    '遅刻・欠席理由': current_reason, 
-                    '遅刻開始時刻': current_late_time,
-                    '学科': department_to_submit 
-                }
-                final_record_data = {col: record_data.get(col, "") for col in OUTPUT_COLUMNS_ORDER}
-                attendance_ws = get_worksheet_safe(gspread_client, SPREADSHEET_ID, ATTENDANCE_SHEET_NAME)
-                if record_attendance_streamlit(attendance_ws, final_record_data):
-                    record_count += 1
+            with api_action("連絡送信"):
+                # 対象練習日 (複数の場合は全て) の連絡ログを1回で読み込み、連絡済みの (部員, 日付) をまとめて求める
+                required_attendance_cols_for_check = ATTENDANCE_CHECK_COLUMNS
+                attendance_df_all_logs_current_date = load_attendance_partitions(gspread_client, SPREADSHEET_ID, months_for_target_dates(current_target_dates), required_cols=required_attendance_cols_for_check, columns=required_attendance_cols_for_check)
+                existing_member_dates = recorded_member_dates(attendance_df_all_logs_current_date, current_target_dates)
+
+                members_to_record_new = [] # (名前, 学籍番号, 対象練習日)
+                members_skipped_already_recorded = [] # (名前, 対象練習日)
+
+                for name_to_submit in selected_names_to_process:
+                    student_id_to_submit = name_to_id_map_form.get(name_to_submit)
+                    if not student_id_to_submit:
+                        st.error(f"エラー: {name_to_submit} の学籍番号が見つかりませんでした。スキップします。")
+                        continue
+
+                    for date_to_submit in current_target_dates:
+                        # Check if member already has a record for this date
+                        if (student_id_to_submit, date_to_submit) in existing_member_dates:
+                            members_skipped_already_recorded.append((name_to_submit, date_to_submit))
+                            if DEBUG_MODE: print(f"DEBUG: {name_to_submit} ({student_id_to_submit}) は既に {date_to_submit} の連絡済みの為スキップします。")
+                        else:
+                            members_to_record_new.append((name_to_submit, student_id_to_submit, date_to_submit))
+                            if DEBUG_MODE: print(f"DEBUG: {name_to_submit} ({student_id_to_submit}) を {date_to_submit} の連絡対象に追加します。")
+
+                if not members_to_record_new and not members_skipped_already_recorded:
+                    st.warning("送信対象となる部員がいません。学年、学科、または名前を選択し直してください。")
+                    #return # Stop processing if no valid members to record
+
+                records_to_write = attendance_records(members_to_record_new, current_status, current_reason, current_late_time, roster.member_info_by_id)
+
+                # 全員・全日付の連絡を1回の append_rows で記録する
+                record_count = 0
+                if records_to_write:
+                    attendance_ws = get_worksheet_safe(gspread_client, SPREADSHEET_ID, ATTENDANCE_SHEET_NAME)
+                    if record_attendance_streamlit(attendance_ws, records_to_write):
+                        record_count = len(records_to_write)
+                        get_attendance_rollups().apply(records_to_write) # 管理者向けの集計表にも反映する
+                    else:
+                        st.error(f"{'、'.join(dict.fromkeys(name for name, _, _ in members_to_record_new))} さんの連絡記録に失敗しました。")
+
+                # --- 記録成功メッセージの生成 ---
+                final_message_prefix = ""
+                if current_selected_name == "---":
+                    # 学科まとめて連絡の場合
+                    if current_selected_grade != "---":
+                        final_message_prefix += f"{current_selected_grade}"
+                    if current_selected_department != "---":
+                        final_message_prefix += f"{current_selected_department}"
+                    final_message_prefix += "の未連絡者" # 例: "2年看護学科の未連絡者"
                 else:
-                    st.error(f"{name_to_submit} さんの連絡記録に失敗しました。")
-            
-            # --- 記録成功メッセージの生成 ---
-            final_message_prefix = ""
-            if current_selected_name == "---":
-                # 学科まとめて連絡の場合
-                if current_selected_grade != "---":
-                    final_message_prefix += f"{current_selected_grade}"
-                if current_selected_department != "---":
-                    final_message_prefix += f"{current_selected_department}"
-                final_message_prefix += "の未連絡者" # 例: "2年看護学科の未連絡者"
-            else:
-                # 個人連絡の場合
-                final_message_prefix = f"{current_selected_name}さん"
+                    # 個人連絡の場合
+                    final_message_prefix = f"{current_selected_name}さん"
 
-            new_records_message_part = ""
-            if record_count > 0:
-                new_records_message_part = f"{record_count}名の連絡を受け付けました。"
+                new_records_message_part = ""
+                if record_count > 0:
+                    new_records_message_part = f"{record_count}件の連絡を受け付けました。" if bulk_mode_form else f"{record_count}名の連絡を受け付けました。"
             
-            skipped_message_part = ""
-            if members_skipped_already_recorded_names:
-                skipped_names_str = "、".join(members_skipped_already_recorded_names)
-                skipped_message_part = f"（{skipped_names_str} {len(members_skipped_already_recorded_names)}名は既に連絡済みのためスキップしました。）"
+                skipped_message_part = ""
+                if members_skipped_already_recorded and bulk_mode_form:
+                    skipped_items = [f"{name} ({skipped_date.strftime('%m/%d')})" for name, skipped_date in members_skipped_already_recorded]
+                    skipped_items_str = "、".join(skipped_items[:10]) + (" ほか" if len(skipped_items) > 10 else "")
+                    skipped_message_part = f"（{skipped_items_str} の{len(skipped_items)}件は既に連絡済みのためスキップしました。）"
+                elif members_skipped_already_recorded:
+                    skipped_names_str = "、".join(name for name, _ in members_skipped_already_recorded)
+                    skipped_message_part = f"（{skipped_names_str} {len(members_skipped_already_recorded)}名は既に連絡済みのためスキップしました。）"
             
-            # 最終メッセージの結合
-            full_success_message = f"{current_target_date.strftime('%m月%d日')}の{final_message_prefix}{new_records_message_part}{skipped_message_part}"
-
-            # メッセージ表示
-            if record_count > 0 or members_skipped_already_recorded_names: # 何らかの処理が行われた場合
-                st.session_state.success_message_content = full_success_message
-                st.session_state.show_success_message = True
-                st.rerun() 
-            else: # 誰も対象にならなかった場合 (通常はerrorsで捕捉されるはずだが念のため)
-                st.warning("連絡対象の部員がいませんでした。")
-                st.session_state.show_success_message = False
+                # 最終メッセージの結合
+                if bulk_mode_form:
+                    target_dates_label = f"{current_target_dates[0].strftime('%m月%d日')}〜{current_target_dates[-1].strftime('%m月%d日')}の{len(current_target_dates)}日分"
+                else:
+                    target_dates_label = current_target_date.strftime('%m月%d日')
+                full_success_message = f"{target_dates_label}の{final_message_prefix}{new_records_message_part}{skipped_message_part}"
+
+                # メッセージ表示
+                if record_count > 0 or members_skipped_already_recorded: # 何らかの処理が行われた場合
+                    st.session_state.success_message_content = full_success_message
+                    st.session_state.show_success_message = True
+                    st.rerun() 
+                else: # 誰も対象にならなかった場合 (通常はerrorsで捕捉されるはずだが念のため)
+                    st.warning("連絡対象の部員がいませんでした。")
+                    st.session_state.show_success_message = False
 
 else:
     st.warning("部員データを読み込めないため連絡フォームを表示できません。")
@@ -1112,95 +851,84 @@ if st.session_state.get('show_success_message', False):
 
 # --- 記録参照セクションの追加 ---
 st.header("２．遅刻・欠席連絡の確認")
-if 'lookup_member_options' not in st.session_state: st.session_state.lookup_member_options = ["---"]
-if 'name_to_id_map_lookup' not in st.session_state: st.session_state.name_to_id_map_lookup = {}
-
-# 連絡確認フォームのコールバック (学年と学科でフィルタリング)
-def update_name_options_for_lookup_callback_internal(grade, department):
-    name_options = ["---"]
-    id_map = {}
-    if 'member_df' in st.session_state and not st.session_state.member_df.empty:
-        filtered_df = st.session_state.member_df.copy()
-
-        if grade != "---":
-            filtered_df = filtered_df[filtered_df[COL_MEMBER_GRADE].astype(str).str.strip() == str(grade).strip()]
-        if department != "---":
-            filtered_df = filtered_df[filtered_df[COL_MEMBER_DEPARTMENT].astype(str).str.strip() == str(department).strip()]
-
-        if not filtered_df.empty:
-            name_options = ["---"] + filtered_df[COL_MEMBER_NAME].tolist()
-            id_map = pd.Series(filtered_df[COL_MEMBER_ID].values, index=filtered_df[COL_MEMBER_NAME]).to_dict()
-    st.session_state.lookup_member_options = name_options
-    st.session_state.name_to_id_map_lookup = id_map
-
-# UIのコールバックハンドラー
-def handle_lookup_grade_change():
-    update_name_options_for_lookup_callback_internal(st.session_state.lookup_grade_select_key, st.session_state.lookup_department_select_key)
-
-def handle_lookup_department_change():
-    update_name_options_for_lookup_callback_internal(st.session_state.lookup_grade_select_key, st.session_state.lookup_department_select_key)
-
 if st.session_state.authentication_status is True:
-    if not st.session_state.member_df.empty:
-        # 初期表示またはセッション状態が空の場合にオプションを更新
-        if st.session_state.lookup_member_options == ["---"]:
-            update_name_options_for_lookup_callback_internal(
-                st.session_state.get('lookup_grade_select_key', "---"), 
-                st.session_state.get('lookup_department_select_key', "---")
-            )
+    if not member_df.empty:
         col_grade_lookup, col_department_lookup, col_name_lookup = st.columns(3) # カラム数変更
         with col_grade_lookup:
             selected_grade_lookup = st.selectbox(
                 "あなたの学年:",
-                st.session_state.get('grade_options', ["---"]),
-                key="lookup_grade_select_key",
-                on_change=handle_lookup_grade_change
+                roster.grade_options,
+                key="lookup_grade_select_key"
             )
         with col_department_lookup: # 新規追加
             selected_department_lookup = st.selectbox( # 新規追加
                 "あなたの学科:", # 新規追加
-                st.session_state.get('department_options', ["---"]), # 新規追加
-                key="lookup_department_select_key", # 新規追加
-                on_change=handle_lookup_department_change # 新規追加
+                roster.department_options, # 新規追加
+                key="lookup_department_select_key" # 新規追加
             ) # 新規追加
+        # 名前の選択肢は共有の名簿から引く (学年・学科の組み合わせごとに全セッションで共有)
+        lookup_member_options, name_to_id_map_lookup = roster.member_options(selected_grade_lookup, selected_department_lookup)
         with col_name_lookup: # 3カラム目
             selected_name_lookup = st.selectbox(
                 f"あなたの名前 ({selected_grade_lookup if selected_grade_lookup != '---' else '学年未選択'}"
                 f"{' / ' + selected_department_lookup if selected_department_lookup != '---' else ''}):", # 学科表示も追加
-                options=st.session_state.get('lookup_member_options', ["---"]),
+                options=("---",) + lookup_member_options,
                 key="lookup_name_select_key"
             )
         if st.button("過去の連絡を確認する", key="lookup_submit_button_key"):
             st.session_state.last_interaction_time = datetime.datetime.now()
             grade_to_lookup = st.session_state.lookup_grade_select_key
             name_to_lookup = st.session_state.lookup_name_select_key
-            student_id_to_lookup = st.session_state.get('name_to_id_map_lookup', {}).get(name_to_lookup)
+            student_id_to_lookup = name_to_id_map_lookup.get(name_to_lookup)
 
             if grade_to_lookup == "---" or name_to_lookup == "---" or not student_id_to_lookup:
                 st.warning("学年と名前を選択してください。")
+                st.session_state.lookup_active_student = None
             else:
-                with st.spinner("過去の連絡を読み込み中..."):
-                    attendance_df_all = load_data_to_dataframe(gspread_client, SPREADSHEET_ID, ATTENDANCE_SHEET_NAME, required_cols=None)
-
-                    if attendance_df_all.empty:
-                        st.info("過去の連絡記録はまだありません。")
-                    else:
-                        user_records_df = attendance_df_all[
-                            attendance_df_all[COL_MEMBER_ID].astype(str).str.strip() == str(student_id_to_lookup).strip()
-                        ].copy()
-
-                        if user_records_df.empty:
-                            st.info(f"{name_to_lookup} さん ({student_id_to_lookup}) の過去の連絡記録が見つかりませんでした。")
-                        else:
-                            # 同じ日付で複数の連絡がある場合、最新のもののみを考慮して最終ステータスを表示
-                            user_records_df['dt_timestamp'] = pd.to_datetime(user_records_df[COL_ATTENDANCE_TIMESTAMP], errors='coerce')
-                            user_records_df['dt_target_date'] = pd.to_datetime(user_records_df[COL_ATTENDANCE_TARGET_DATE], errors='coerce').dt.date
-                            user_records_df.dropna(subset=['dt_timestamp', 'dt_target_date'], inplace=True)
-                            # 最新のステータスを優先 (タイムスタンプ降順、対象日降順でソート後、対象日で重複削除)
-                            user_records_df_latest = user_records_df.sort_values(by=['dt_target_date', 'dt_timestamp'], ascending=[False, False]) \
-                                .drop_duplicates(subset=['dt_target_date'], keep='first')
-                            st.subheader(f"{name_to_lookup} さんの過去の連絡記録 (最新情報)")
-                            st.dataframe(user_records_df_latest[LOOKUP_DISPLAY_COLUMNS])
+                # 表示対象を保持し、ページ送りで古い月のアーカイブを追加読み込みする
+                st.session_state.lookup_active_student = (name_to_lookup, student_id_to_lookup)
+                st.session_state.lookup_archive_months_loaded = 1
+                st.session_state.lookup_page = 0
+
+        active_lookup = st.session_state.get('lookup_active_student')
+        if active_lookup and active_lookup[0] == st.session_state.get('lookup_name_select_key'):
+            name_to_lookup, student_id_to_lookup = active_lookup
+            archived_months = list_attendance_archive_months(gspread_client, SPREADSHEET_ID)
+            months_to_load = tuple(archived_months[:st.session_state.get('lookup_archive_months_loaded', 1)])
+            lookup_page = st.session_state.get('lookup_page', 0)
+            with api_action("連絡確認"), st.spinner("過去の連絡を読み込み中..."):
+                history_index = get_member_history_index(gspread_client, SPREADSHEET_ID, months_to_load)
+                user_records_page, user_records_total = history_index.query(student_id_to_lookup, page=lookup_page, page_size=LOOKUP_PAGE_SIZE)
+
+            has_more_archives = len(months_to_load) < len(archived_months)
+            if user_records_total == 0 and not has_more_archives:
+                st.info(f"{name_to_lookup} さん ({student_id_to_lookup}) の過去の連絡記録が見つかりませんでした。")
+            else:
+                # 対象練習日ごとの最新の連絡のみを表示 (索引作成時に重複を除去済み)
+                st.subheader(f"{name_to_lookup} さんの過去の連絡記録 (最新情報)")
+                if user_records_page.empty:
+                    st.info("読み込み済みの期間には記録がありません。「次へ」でさらに古い連絡を読み込めます。")
+                else:
+                    st.dataframe(format_attendance_for_display(user_records_page[LOOKUP_DISPLAY_COLUMNS]))
+                st.caption(f"{user_records_total}件中 {min(lookup_page * LOOKUP_PAGE_SIZE + 1, user_records_total)}〜{min((lookup_page + 1) * LOOKUP_PAGE_SIZE, user_records_total)}件目"
+                           f"{f' ({months_to_load[-1]} 以降の記録)' if has_more_archives and months_to_load else ''}")
+
+            col_prev_page, col_next_page = st.columns(2)
+            with col_prev_page:
+                if lookup_page > 0 and st.button("前へ", key="lookup_prev_page_button_key"):
+                    st.session_state.last_interaction_time = datetime.datetime.now()
+                    st.session_state.lookup_page = lookup_page - 1
+                    st.rerun()
+            with col_next_page:
+                has_next_page = (lookup_page + 1) * LOOKUP_PAGE_SIZE < user_records_total
+                if (has_next_page or has_more_archives) and st.button("次へ", key="lookup_next_page_button_key"):
+                    st.session_state.last_interaction_time = datetime.datetime.now()
+                    if not has_next_page:
+                        # 読み込み済みの記録を使い切ったら、次の月のアーカイブを読み込む
+                        st.session_state.lookup_archive_months_loaded = len(months_to_load) + 1
+                    if user_records_total >= (lookup_page + 1) * LOOKUP_PAGE_SIZE: # 現在のページが埋まっている場合のみ次のページへ
+                        st.session_state.lookup_page = lookup_page + 1
+                    st.rerun()
 
     else:
         st.info("部員データを読み込めないため記録参照フォームを表示できません。")
@@ -1220,7 +948,10 @@ if not st.session_state.is_admin:
 
 if st.session_state.is_admin:
     st.success("管理者としてログイン済みです。")
-    if not st.session_state.member_df.empty:
+    # 事前計算のスケジューラーは管理者が使うときに作成する (認証済みクライアントはキャッシュ済みのものを使い、セッションの台帳は通さない)
+    assignment_scheduler = get_assignment_scheduler(authenticate_gspread_service_account())
+    if PRECOMPUTE_INTERVAL_MINUTES > 0: assignment_scheduler.start()
+    if not member_df.empty:
         target_date_assign_input = st.date_input("割り振り対象日を選択:", value=datetime.date.today(), key="assignment_date_admin_main")
         
         # 8チーム割り振りの1年生（レベル1）に関するラジオボタン
@@ -1231,235 +962,205 @@ if st.session_state.is_admin:
             horizontal=True
         )
 
-        if st.button("コート割り振りを実行して結果シートを更新", key="assign_button_admin_main"):
+        if pair_history.total_pairs: st.caption(f"ペア履歴: {len(pair_history.ids)} 名 / {pair_history.total_pairs} ペアの同じチームになった回数を記録済みです。同じ組み合わせが続かないよう、チームの優先度に含めます (重み {config.PAIR_REPEAT_WEIGHT})。")
+        # 事前計算の状況
+        precomputed_next = assignment_scheduler.latest(next_practice_date(practice_weekdays=PRACTICE_WEEKDAYS))
+        if precomputed_next is not None:
+            st.caption(f"{precomputed_next.target_date.strftime('%Y-%m-%d')} の割り振りは事前計算済みです ({precomputed_next.computed_at.strftime('%H:%M')} 更新)。実行時は以降の連絡の変化だけを反映します。")
+        if assignment_scheduler.last_error: st.caption(f"事前計算でエラーが発生しました: {assignment_scheduler.last_error}")
+        # 乱数シードは対象日から決まるため、同じ日・同じ参加者で何度実行しても同じ割り振りになる (組み合わせを変えるには明示的にシャッフルする)
+        st.caption("同じ対象日・同じ参加者で再実行すると、前回と同じコート割り振りになります。別の組み合わせにしたい場合は下のチェックを入れてください。")
+        reassign_all = st.checkbox("別の組み合わせでシャッフルする (新しい乱数で全員を割り振り直し、事前計算の結果は使わない)", key="assign_full_recompute_checkbox_key")
+        # 使えるコート数が変わった場合など、既定の 8/10/12/3 チーム以外の割り振りも同じ参加者で行う
+        extra_team_counts_text = st.text_input("追加で割り振るチーム数 (任意、カンマ区切り):", placeholder="例: 6, 9 / チームごとの定員: 6/6/6/4 (- は定員なし)", key="extra_team_counts_input_key")
+        try: extra_team_requests = parse_team_requests(extra_team_counts_text)
+        except ValueError as e: st.error(str(e)); extra_team_requests = None
+
+        # ジョブの一覧はプロセスで共有し、実行中は他の管理者も新しい割り振りを始められない
+        assignment_workers = get_assignment_workers()
+        active_assignment_jobs = assignment_workers.active_jobs()
+        if st.button("コート割り振りを実行して結果シートを更新", key="assign_button_admin_main", disabled=extra_team_requests is None or bool(active_assignment_jobs)):
             st.session_state.last_interaction_time = datetime.datetime.now()
-            with st.spinner(f"{target_date_assign_input.strftime('%Y-%m-%d')} のコート割り振り中..."):
-                attendance_df_all_logs = load_data_to_dataframe(gspread_client, SPREADSHEET_ID, ATTENDANCE_SHEET_NAME, required_cols=None)
-                if DEBUG_MODE: st.write(f"割り振り対象日: {target_date_assign_input}")
-
-                member_df_assign = st.session_state.member_df
-                # --- 各部員の最終連絡ステータスを判定するロジック ---
-                # まず、全ての部員IDを取得
-                all_member_ids = set(member_df_assign[COL_MEMBER_ID].astype(str).tolist())
-                # その日の全ての関連する連絡ログを取得
-                latest_status_by_member = pd.DataFrame() 
-                relevant_logs_for_target_date = pd.DataFrame() 
-                if attendance_df_all_logs is not None and not attendance_df_all_logs.empty:
-                    temp_df_logs_for_status = attendance_df_all_logs.copy()
-                    temp_df_logs_for_status['dt_timestamp'] = pd.to_datetime(temp_df_logs_for_status[COL_ATTENDANCE_TIMESTAMP], errors='coerce')
-                    temp_df_logs_for_status['dt_target_date'] = pd.to_datetime(temp_df_logs_for_status[COL_ATTENDANCE_TARGET_DATE], errors='coerce').dt.date
-                    # 割り振り対象日のログに絞り込み
-                    relevant_logs_for_target_date = temp_df_logs_for_status[temp_df_logs_for_status['dt_target_date'] == target_date_assign_input].copy()
-                    if not relevant_logs_for_target_date.empty:
-                        # 各部員IDに対して最新の連絡のみを保持 (最新のタイムスタンプを持つものを優先)
-                        latest_status_by_member = relevant_logs_for_target_date.sort_values(by='dt_timestamp', ascending=False).drop_duplicates(subset=[COL_MEMBER_ID], keep='first')
-                
-                # 最終的なステータスセットを初期化
-                participating_ids_final = set() # 「参加」ステータスの部員
-                late_ids_final = set()          # 「遅刻」ステータスの部員
-                absent_ids_final = set()        # 「欠席」ステータスの部員
-
-                # 全ての部員について最終ステータスを決定
-                for member_id in all_member_ids:
-                    member_latest_log = latest_status_by_member[latest_status_by_member[COL_MEMBER_ID] == member_id]
-                    if not member_latest_log.empty:
-                        status = str(member_latest_log.iloc[0][COL_ATTENDANCE_STATUS]).strip()
-                        if status == '参加':
-                            participating_ids_final.add(member_id)
-                        elif status == '遅刻':
-                            late_ids_final.add(member_id)
-                        elif status == '欠席':
-                            absent_ids_final.add(member_id)
-                    else:
-                        # 連絡が全くない部員は「参加」とみなす (デフォルト)
-                        participating_ids_final.add(member_id)
-
-                # rebalance_teams_by_gender_and_level の引数にもなる late_member_ids は late_ids_final を使用
-                late_member_ids_for_rebalance = late_ids_final 
-
-                # --- 名簿出力用DataFrameの準備 (最新のfinal_idsに基づいて) ---
-                # 参加者名簿用: 最終ステータスが「参加」の部員のみ
-                pool_for_participant_list_output = member_df_assign[
-                    member_df_assign[COL_MEMBER_ID].astype(str).isin(participating_ids_final)
-                ].copy()
-                if DEBUG_MODE: st.write(f"参加者名簿対象 (最終ステータスが「参加」): {len(pool_for_participant_list_output)} 名")
-
-
-                # 欠席者名簿用: 最終ステータスが「欠席」の部員
-                pool_for_absent_list_output = member_df_assign[
-                    member_df_assign[COL_MEMBER_ID].astype(str).isin(absent_ids_final)
-                ].copy()
-                if DEBUG_MODE: st.write(f"欠席者名簿対象 (最終ステータスが「欠席」): {len(pool_for_absent_list_output)} 名")
-
-                # 欠席理由をマージする
-                if not pool_for_absent_list_output.empty and not latest_status_by_member.empty:
-                    pool_for_absent_list_output = pd.merge(
-                        pool_for_absent_list_output,
-                        latest_status_by_member[[COL_MEMBER_ID, COL_ATTENDANCE_REASON]],
-                        on=COL_MEMBER_ID,
-                        how='left'
-                    )
-                else:
-                    pool_for_absent_list_output[COL_ATTENDANCE_REASON] = '' # 理由列がない場合は追加
-
-                # 遅刻者名簿用: 最終ステータスが「遅刻」の部員 (詳細情報をマージ)
-                late_members_df_for_output = member_df_assign[member_df_assign[COL_MEMBER_ID].astype(str).isin(late_ids_final)].copy()
-                if not late_members_df_for_output.empty and not relevant_logs_for_target_date.empty: 
-                    # 遅刻時間と理由をマージ
-                    late_members_df_for_output = pd.merge(late_members_df_for_output, latest_status_by_member[[COL_MEMBER_ID, COL_ATTENDANCE_LATE_TIME, COL_ATTENDANCE_REASON]], 
-                                                          on=COL_MEMBER_ID, how='left')
-                if DEBUG_MODE: st.write(f"遅刻者名簿対象 (最終ステータスが「遅刻」): {len(late_members_df_for_output)} 名")
-
-
-                # --- チーム割り振り用プール ---
-                # 8, 10, 12コート割り振り用: 最終ステータスが「参加」または「遅刻」の部員
-                pool_for_8_10_12_assignment = member_df_assign[
-                    member_df_assign[COL_MEMBER_ID].astype(str).isin(participating_ids_final | late_ids_final)
-                ].copy()
-                if DEBUG_MODE: st.write(f"8,10,12コート割り振り対象総数 (最終「参加」+「遅刻」): {len(pool_for_8_10_12_assignment)} 名")
-
-
-                # 3チーム割り振り用: 最終ステータスが「参加」の部員のみ (遅刻者は除外)
-                pool_for_3_team_assignment = member_df_assign[
-                    member_df_assign[COL_MEMBER_ID].astype(str).isin(participating_ids_final)
-                ].copy()
-                if DEBUG_MODE: st.write(f"3チーム割り振り対象総数 (最終「参加」のみ): {len(pool_for_3_team_assignment)} 名")
-
-
-                # --- 名簿シートの出力 (上記の新しいプール変数を使用) ---
-                participant_ws = get_worksheet_safe(gspread_client, SPREADSHEET_ID, PARTICIPANT_LIST_SHEET_NAME) 
-                if participant_ws: 
-                    if DEBUG_MODE: st.write(f"参加者名簿 ({target_date_assign_input}) を出力...") 
-                    if not pool_for_participant_list_output.empty:
-                        output_cols_p = [COL_MEMBER_ID, COL_MEMBER_NAME, COL_MEMBER_GRADE, COL_MEMBER_LEVEL, COL_MEMBER_GENDER, COL_MEMBER_DEPARTMENT] 
-                        valid_output_cols_p = [col for col in output_cols_p if col in pool_for_participant_list_output.columns] 
-                        participant_list_output = [[f"{target_date_assign_input.strftime('%Y-%m-%d')} 参加者リスト"]] 
-                        participant_list_output.append(valid_output_cols_p); 
-                        participant_list_output.extend(pool_for_participant_list_output[valid_output_cols_p].values.tolist()) 
-                        write_results_to_sheet(participant_ws, participant_list_output, data_name=f"{target_date_assign_input.strftime('%Y-%m-%d')} 参加者名簿") 
-                    else: 
-                        write_results_to_sheet(participant_ws, [[f"{target_date_assign_input.strftime('%Y-%m-%d')} の参加者なし"]], data_name="参加者名簿") 
-                else: st.error(f"シート '{PARTICIPANT_LIST_SHEET_NAME}' が見つかりません。") 
-                
-                absent_ws = get_worksheet_safe(gspread_client, SPREADSHEET_ID, ABSENT_LIST_SHEET_NAME) 
-                if absent_ws: 
-                    if DEBUG_MODE: st.write(f"欠席者名簿 ({target_date_assign_input}) を出力...") 
-                    if not pool_for_absent_list_output.empty: # 欠席者名簿用プールを使用
-                        absent_output_cols = [COL_MEMBER_ID, COL_MEMBER_NAME, COL_MEMBER_GRADE, COL_ATTENDANCE_REASON, COL_MEMBER_DEPARTMENT] # 学科追加
-                        valid_absent_cols = [col for col in absent_output_cols if col in pool_for_absent_list_output.columns] 
-                        absent_list_output = [[f"{target_date_assign_input.strftime('%Y-%m-%d')} 欠席者リスト"]] 
-                        absent_list_output.append(valid_absent_cols)
-                        absent_list_output.extend(pool_for_absent_list_output[valid_absent_cols].fillna('').values.tolist()) 
-                        write_results_to_sheet(absent_ws, absent_list_output, data_name=f"欠席者名簿") 
-                    else: 
-                        absent_list_output = [[f"{target_date_assign_input.strftime('%Y-%m-%d')} の欠席連絡者なし"]] 
-                        write_results_to_sheet(absent_ws, absent_list_output, data_name=f"欠席者名簿") 
-                else: st.error(f"シート '{ABSENT_LIST_SHEET_NAME}' が見つかりません。") 
-
-                late_ws = get_worksheet_safe(gspread_client, SPREADSHEET_ID, LATE_LIST_SHEET_NAME)
-                if late_ws:
-                    if DEBUG_MODE: st.write(f"遅刻者名簿 ({target_date_assign_input}) を出力...")
-                    if not late_members_df_for_output.empty: # 遅刻者名簿用プールはそのまま
-                        late_output_cols = [COL_MEMBER_ID, COL_MEMBER_NAME, COL_MEMBER_GRADE, COL_ATTENDANCE_LATE_TIME, COL_ATTENDANCE_REASON, COL_MEMBER_DEPARTMENT] # 学科追加
-                        valid_late_cols = [col for col in late_output_cols if col in late_members_df_for_output.columns]
-                        late_list_output = [[f"{target_date_assign_input.strftime('%Y-%m-%d')} 遅刻者リスト"]]
-                        late_list_output.append(valid_late_cols); 
-                        late_list_output.extend(late_members_df_for_output[valid_late_cols].fillna('').values.tolist())
-                        write_results_to_sheet(late_ws, late_list_output, data_name=f"遅刻者名簿")
-                    else: 
-                        late_list_output = [[f"{target_date_assign_input.strftime('%Y-%m-%m')} の遅刻連絡者なし"]]
-                        write_results_to_sheet(late_ws, late_list_output, data_name=f"遅刻者名簿")
-                else: st.error(f"シート '{LATE_LIST_SHEET_NAME}' が見つかりません。")
-                # --- 名簿シートの出力ここまで ---
-
-
-                if pool_for_8_10_12_assignment.empty:
-                    st.warning("割り振り対象の参加予定者がいないため、コート割り振りは行いません。")
-                else:
-                    num_teams_8 = TEAMS_COUNT_MAP.get('ノック', 8)
-                    num_teams_10 = TEAMS_COUNT_MAP.get('ハンドノック', 10)
-                    num_teams_12 = TEAMS_COUNT_MAP.get('その他', 12)
-                    num_teams_3 = 3 # 3チーム割り振りの場合
-
-                    # --- 各割り振り用のメンバープールを準備 ---
-                    # 8チーム割り振り用のメンバープール (1年生の扱いをラジオボタンで選択)
-                    pool_for_8_teams = pool_for_8_10_12_assignment.copy() # 初期値は遅刻者含む全員
-                    if include_level1_for_8_teams_selection == "含めない":
-                        # レベル1を除外する選択の場合、プールからレベル1をフィルタリング
-                        pool_for_8_teams = pool_for_8_teams[pool_for_8_teams[COL_MEMBER_LEVEL] != 1].copy()
-                        if DEBUG_MODE: st.write(f"8チーム割り振り対象者 (レベル1除く): {len(pool_for_8_teams)} 名")
-
-                    # 10チーム割り振り用メンバープールは常にレベル1を含む (遅刻者含む)
-                    pool_for_10_teams = pool_for_8_10_12_assignment.copy() 
-
-                    # 12チーム割り振り用メンバープールは常にレベル1を含む (遅刻者含む)
-                    pool_for_12_teams = pool_for_8_10_12_assignment.copy() 
-
-                    # 3チーム割り振り用メンバープール (遅刻者は含めない)
-                    # pool_for_3_team_assignment は既に上で定義されているのでそのまま使う
-
-
-                    # --- 割り振り実行 ---
-                    # 8チーム割り振り
-                    assignment_ws_8 = get_worksheet_safe(gspread_client, SPREADSHEET_ID, ASSIGNMENT_SHEET_NAME_8)
-                    if assignment_ws_8:
-                        if DEBUG_MODE: st.write("--- 8チーム割り振りを実行中 ---")
-                        assignments_8 = assign_teams(
-                            pool_for_8_teams, # フィルタリング済みプールを渡す
-                            late_member_ids_for_rebalance, # 遅刻者IDを渡す (入れ替え対象外判定用)
-                            num_teams_8,
-                            assignment_type="8チーム" # 割り振りタイプを渡す
-                        )
-                        if assignments_8: result_output_8 = format_assignment_results(assignments_8, "8チーム", target_date_assign_input); write_results_to_sheet(assignment_ws_8, result_output_8, f"8チーム結果({target_date_assign_input.strftime('%Y-%m-%d')})")
-                        else: st.warning("8チーム割り振り結果なし。")
-                    else: st.error(f"シート '{ASSIGNMENT_SHEET_NAME_8}' が見つかりません。")
-                    
-                    # 10チーム割り振り
-                    assignment_ws_10 = get_worksheet_safe(gspread_client, SPREADSHEET_ID, ASSIGNMENT_SHEET_NAME_10)
-                    if assignment_ws_10:
-                        if DEBUG_MODE: st.write("--- 10チーム割り振りを実行中 ---")
-                        assignments_10 = assign_teams(
-                            pool_for_10_teams, # レベル1を含むプール (遅刻者含む)
-                            late_member_ids_for_rebalance, # 遅刻者IDを渡す (入れ替え対象外判定用)
-                            num_teams_10,
-                            assignment_type="10チーム" # 振りタイプを渡す
-                        )
-                        if assignments_10: result_output_10 = format_assignment_results(assignments_10, "10チーム", target_date_assign_input); write_results_to_sheet(assignment_ws_10, result_output_10, f"10チーム結果({target_date_assign_input.strftime('%Y-%m-%d')})")
-                        else: st.warning("10チーム割り振り結果なし。")
-                    else: st.error(f"シート '{ASSIGNMENT_SHEET_NAME_10}' が見つかりません。")
-
-                    # 12チーム割り振り
-                    assignment_ws_12 = get_worksheet_safe(gspread_client, SPREADSHEET_ID, ASSIGNMENT_SHEET_NAME_12)
-                    if assignment_ws_12:
-                        if DEBUG_MODE: st.write("--- 12チーム割り振りを実行中 ---")
-                        assignments_12 = assign_teams(
-                            pool_for_12_teams, # 遅刻者を含むプールを渡す
-                            late_member_ids_for_rebalance, # 遅刻者IDを渡す (入れ替え対象外判定用)
-                            num_teams_12,
-                            assignment_type="12チーム" # 割り振りタイプを渡す
-                        )
-                        if assignments_12: result_output_12 = format_assignment_results(assignments_12, "12チーム", target_date_assign_input); write_results_to_sheet(assignment_ws_12, result_output_12, f"12チーム結果({target_date_assign_input.strftime('%Y-%m-%d')})")
-                        else: st.warning("12チーム割り振り結果なし。")
-                    else: st.error(f"シート '{ASSIGNMENT_SHEET_NAME_12}' が見つかりません。")
-                    
-                    # --- 3チーム割り振り (遅刻者は含めないように変更) ---
-                    assignment_ws_3 = get_worksheet_safe(gspread_client, SPREADSHEET_ID, ASSIGNMENT_SHEET_NAME_3)
-                    if assignment_ws_3:
-                        if DEBUG_MODE: st.write("--- 3チーム割り振りを実行中 (素振り指導向け - 遅刻者除外) ---")
-                        assignments_3 = assign_teams(
-                            pool_for_3_team_assignment, # 遅刻者を含まないプールを渡す
-                            late_member_ids_for_rebalance, # 遅刻者IDを渡す (入れ替え対象外判定用)
-                            num_teams_3,
-                            assignment_type="3チーム (素振り指導)" # 割り振りタイプを渡す
-                        )
-                        if assignments_3: result_output_3 = format_assignment_results(assignments_3, "3チーム (素振り指導)", target_date_assign_input); write_results_to_sheet(assignment_ws_3, result_output_3, f"3チーム結果({target_date_assign_input.strftime('%Y-%m-%d')})")
-                        else: st.warning("3チーム割り振り結果なし。")
-                    else: st.error(f"シート '{ASSIGNMENT_SHEET_NAME_3}' が見つかりません。")
-                    # --- 3チーム割り振りここまで ---
-
-            st.info(f"{target_date_assign_input.strftime('%Y-%m-%d')} の割り振り処理と名簿出力が完了しました。")
+            include_level1_assign = (include_level1_for_8_teams_selection == "含める")
+            with api_action("連絡ログの読み込み (コート割り振り)"), st.spinner("連絡ログを読み込み中..."):
+                attendance_df_all_logs = load_attendance_partitions(gspread_client, SPREADSHEET_ID, months_for_target_date(target_date_assign_input), columns=ATTENDANCE_ASSIGNMENT_COLUMNS)
+            if DEBUG_MODE: st.write(f"割り振り対象日: {target_date_assign_input}")
+            member_df_assign, target_date_job = member_df, target_date_assign_input
+            def assignment_job_func(runner):
+                # assign_teams の呼び出しは runner でワーカープロセスに渡す
+                return compute_assignment(assignment_scheduler, member_df_assign, attendance_df_all_logs, target_date_job, include_level1=include_level1_assign,
+                                          force_full=reassign_all, team_requests=extra_team_requests, pair_history=pair_history, runner=runner)
+            assignment_workers.submit(f"コート割り振り ({target_date_job.strftime('%Y-%m-%d')})", assignment_job_func,
+                                      meta={'target_date': target_date_job, 'reassign_all': reassign_all})
+            st.rerun()
+
+        # 終了したジョブの結果は、ジョブを始めたセッション (タブ) が閉じられていても、最初に管理者画面を開いたセッションが1回だけ書き込む
+        for finished_assignment_job in assignment_workers.claim_finished():
+            publish_finished_assignment_job(gspread_client, finished_assignment_job, pair_history)
+        if active_assignment_jobs:
+            st.fragment(assignment_job_progress, run_every=ASSIGNMENT_JOB_POLL_SECONDS)(assignment_workers)
+
+        # --- 週間の割り振り計画 (複数の練習日をまとめて割り振る) ---
+        with st.expander("週間の割り振り計画 (複数の練習日)"):
+            st.caption(f"期間内の練習日の割り振りをまとめて計算し、シート '{WEEKLY_PLAN_SHEET_NAME}' に日付ごとのブロックとして書き込みます。各日の結果シート・名簿は更新しません。")
+            col_plan_start, col_plan_end = st.columns(2)
+            with col_plan_start:
+                plan_start_date = st.date_input("開始日:", value=next_practice_date(practice_weekdays=PRACTICE_WEEKDAYS), key="weekly_plan_start_date_key")
+            with col_plan_end:
+                plan_end_date = st.date_input("最終日:", value=plan_start_date + datetime.timedelta(days=6), key="weekly_plan_end_date_key")
+            plan_weekday_labels = st.multiselect("練習がある曜日 (未選択なら毎日):", WEEKDAY_LABELS, default=[WEEKDAY_LABELS[d] for d in (PRACTICE_WEEKDAYS or [])], key="weekly_plan_weekdays_key")
+            plan_dates = practice_dates_in_range(plan_start_date, plan_end_date, [WEEKDAY_LABELS.index(w) for w in plan_weekday_labels])
+            st.caption(f"対象の練習日 ({len(plan_dates)}日): " + "、".join(d.strftime('%m/%d') + f"({WEEKDAY_LABELS[d.weekday()]})" for d in plan_dates))
+            if st.button("週間の割り振りを計算してシートに書き込む", key="weekly_plan_button_key", disabled=not plan_dates or len(plan_dates) > MAX_BULK_TARGET_DATES):
+                st.session_state.last_interaction_time = datetime.datetime.now()
+                with api_action("週間の割り振り"), st.spinner(f"{len(plan_dates)}日分のコート割り振り中..."):
+                    try:
+                        # 連絡ログは全日付分を1回だけ読み込み、判定もまとめて行う
+                        plan_attendance_df = load_attendance_partitions(gspread_client, SPREADSHEET_ID, months_for_target_dates(plan_dates), columns=ATTENDANCE_ASSIGNMENT_COLUMNS)
+                        weekly_plans = run_weekly_assignment_pipeline(member_df, plan_attendance_df, plan_dates,
+                                                                      include_level1=(include_level1_for_8_teams_selection == "含める"), pair_history=pair_history,
+                                                                      runner=get_assignment_workers().run_tasks)
+                        weekly_grid, weekly_date_rows = weekly_plan_grid(weekly_plans)
+                        weekly_rows, weekly_cols = sheet_size(weekly_grid)
+                        weekly_ws = ensure_worksheet(gspread_client.open_by_key(SPREADSHEET_ID), WEEKLY_PLAN_SHEET_NAME, rows=weekly_rows, cols=weekly_cols)
+                        weekly_write_mode = write_grid(weekly_ws, weekly_grid)
+                        st.dataframe(pd.DataFrame([{
+                            '練習日': target_date.strftime('%Y-%m-%d') + f" ({WEEKDAY_LABELS[target_date.weekday()]})",
+                            '参加': len(plan['statuses']['participating']), '遅刻': len(plan['statuses']['late']), '欠席': len(plan['statuses']['absent']),
+                            '行': f"{weekly_date_rows[target_date][0]}〜{weekly_date_rows[target_date][1]}",
+                        } for target_date, plan in weekly_plans.items()]))
+                        if weekly_write_mode == 'skipped': st.info(f"シートの内容が同じため、'{WEEKLY_PLAN_SHEET_NAME}' への書き込みを省略しました。")
+                        else: st.success(f"{len(plan_dates)}日分の割り振りをシート '{WEEKLY_PLAN_SHEET_NAME}' に書き込みました。" + (" (変更のあったセルのみ)" if weekly_write_mode == 'diff' else ""))
+                    except Exception as e: st.error(f"週間の割り振り中にエラー: {e}"); print(f"ERROR: Error planning weekly assignments: {e}")
+
+        # --- 連絡ログの月別アーカイブ ---
+        with st.expander("過去の連絡を月別シートにアーカイブ"):
+            st.caption(f"対象練習日が今日より前の連絡を '{ATTENDANCE_SHEET_NAME}_YYYY-MM' シートへ移動し、'{ATTENDANCE_SHEET_NAME}' には今後の練習日の連絡だけを残します。")
+            if st.button("アーカイブを実行", key="archive_attendance_button_key"):
+                st.session_state.last_interaction_time = datetime.datetime.now()
+                with api_action("アーカイブ"), st.spinner("過去の連絡をアーカイブ中..."):
+                    try:
+                        # 集計表がある場合は、移動する行を数え漏らさないよう、アーカイブの前にホットシートの末尾を反映しておく
+                        archive_rollups = get_attendance_rollups()
+                        if archive_rollups.loaded_at is not None:
+                            fetch_sheet_dataframe.clear(gspread_client, SPREADSHEET_ID, ATTENDANCE_SHEET_NAME)
+                            catch_up_attendance_rollups(gspread_client, archive_rollups)
+                        archive_summary = archive_past_attendance(gspread_client.open_by_key(SPREADSHEET_ID), ATTENDANCE_SHEET_NAME, datetime.date.today(), debug=DEBUG_MODE)
+                        clear_attendance_cache(gspread_client, archive_summary['months']) # 部員リストのキャッシュは残す
+                        if archive_summary['archived']:
+                            archive_rollups.rescan_hot() # ホットシートの行が移動したため、次の表示で残った行を反映し直す
+                            months_str = "、".join(f"{m} ({n}件)" for m, n in archive_summary['months'].items())
+                            st.success(f"{archive_summary['archived']}件をアーカイブしました: {months_str}。'{ATTENDANCE_SHEET_NAME}' には {archive_summary['kept']}件が残っています。")
+                        else:
+                            st.info("アーカイブ対象の連絡はありません。")
+                    except Exception as e: st.error(f"アーカイブ中にエラー: {e}"); print(f"ERROR: Error archiving attendance: {e}")
+
+        # --- 出欠の傾向 (集計表) ---
+        with st.expander("出欠の傾向 (練習日・学年・学科・部員ごと)"):
+            attendance_rollups = get_attendance_rollups()
+            st.caption("(学籍番号, 対象練習日) ごとの最新の連絡を数えた集計表から表示します。連絡ログ全体の読み込みは最初の集計の1回だけで、以降は送信された連絡を集計表に加えていきます。"
+                       "他の端末・プロセスから追記された連絡は、表示のたびにホットシートの行数を比べて末尾の行を反映します (読み込みのキャッシュのため最大1分遅れます)。")
+            rollup_loaded = attendance_rollups.loaded_at is not None
+            if st.button("連絡ログから集計し直す" if rollup_loaded else "連絡ログを集計", key="load_rollups_button_key"):
+                st.session_state.last_interaction_time = datetime.datetime.now()
+                with api_action("連絡ログの集計"), st.spinner("連絡ログ (全ての月のアーカイブを含む) を読み込み中..."):
+                    try:
+                        # 集計し直す場合は、キャッシュに残っている古い連絡ログを使わないようにする (他のシートのキャッシュは残す)
+                        if rollup_loaded: clear_attendance_cache(gspread_client); attendance_rollups.reset()
+                        load_attendance_rollups(gspread_client, attendance_rollups)
+                    except Exception as e: st.error(f"連絡ログの集計中にエラー: {e}"); print(f"ERROR: Error building attendance rollups: {e}")
+            rollup_caught_up = 0
+            if attendance_rollups.loaded_at is not None:
+                try: rollup_caught_up = catch_up_attendance_rollups(gspread_client, attendance_rollups)
+                except Exception as e: rollup_caught_up = None; print(f"ERROR: Error catching up attendance rollups: {e}")
+            rollup_stats = attendance_rollups.stats()
+            if rollup_stats['loaded_at'] is not None:
+                st.caption(f"{rollup_stats['loaded_at'].strftime('%Y-%m-%d %H:%M')} に集計 / 練習日 {rollup_stats['practice_days']}日・部員 {rollup_stats['members']}名・"
+                           f"(部員, 練習日) {rollup_stats['pairs']}組 / 送信された連絡 {rollup_stats['applied_records']}件・ホットシートの追記 {rollup_stats['caught_up_records']}行を反映済み")
+                # 集計が古い可能性がある場合は知らせる (シート上での編集・削除は反映されない)
+                if rollup_caught_up is None: st.warning("連絡ログを読み込めなかったため、他の端末・プロセスから追記された連絡が反映されていない可能性があります。")
+                if rollup_stats['stale_reason']: st.warning(f"{rollup_stats['stale_reason']} 集計が古い可能性があるため、「連絡ログから集計し直す」で集計し直してください。")
+                st.caption("シート上で連絡を編集・削除した場合は反映されないため、集計し直してください。")
+                rollup_period = st.selectbox("練習日別の表示期間", ["直近30日", "直近90日", "全期間"], key="rollup_period_select_key")
+                rollup_days = {"直近30日": 30, "直近90日": 90}.get(rollup_period)
+                rollup_start = datetime.date.today() - datetime.timedelta(days=rollup_days) if rollup_days else None
+                st.write("練習日ごとの連絡 (状況別の人数)")
+                st.bar_chart(attendance_rollups.by_date(start_date=rollup_start))
+                rollup_grade_col, rollup_department_col = st.columns(2)
+                with rollup_grade_col:
+                    st.write("学年ごと (全期間)"); st.bar_chart(attendance_rollups.by_grade())
+                with rollup_department_col:
+                    st.write("学科ごと (全期間)"); st.bar_chart(attendance_rollups.by_department())
+                st.write("部員ごとの欠席率・遅刻率 (全期間、率はその部員の最初の連絡以降で連絡が1件以上ある練習日の数に対する割合)")
+                member_rates = attendance_rollups.member_rates()
+                if roster is not None:
+                    member_rates = member_rates.join(roster.member_info_by_id[[COL_MEMBER_NAME, COL_MEMBER_GRADE]], on=COL_MEMBER_ID)
+                    member_rates = member_rates[[COL_MEMBER_ID, COL_MEMBER_NAME, COL_MEMBER_GRADE] + [col for col in member_rates.columns if col not in (COL_MEMBER_ID, COL_MEMBER_NAME, COL_MEMBER_GRADE)]]
+                st.dataframe(member_rates, hide_index=True)
+
+        # --- 処理時間の計測 ---
+        with st.expander("処理時間の計測 (p50 / p95)"):
+            span_summary = instrumentation.RECORDER.summary()
+            if span_summary:
+                st.dataframe(pd.DataFrame(span_summary).rename(columns={
+                    'name': '処理', 'count': '回数', 'p50_ms': 'p50 (ms)', 'p95_ms': 'p95 (ms)', 'max_ms': '最大 (ms)',
+                    'avg_api_calls': 'API呼び出し (平均)', 'avg_rows': '処理行数 (平均)', 'errors': 'エラー',
+                }))
+                st.download_button("計測データをダウンロード (JSON Lines)", instrumentation.RECORDER.export_jsonl(),
+                                   file_name="spans.jsonl", mime="application/jsonl", key="download_spans_button_key")
+            else:
+                st.caption("まだ計測データがありません。")
+            if st.button("計測データをクリア", key="clear_spans_button_key"):
+                instrumentation.RECORDER.clear(); st.rerun()
+
+        # --- Sheets API 呼び出し ---
+        with st.expander("Sheets API 呼び出し回数"):
+            st.caption(f"1操作あたりの上限: {API_CALL_BUDGET}回 (secrets の app_config.api_call_budget で変更できます)")
+            if st.session_state.get('api_action_history'):
+                st.write("このセッションの直近の操作")
+                st.dataframe(pd.DataFrame(st.session_state.api_action_history))
+            process_api_rows = get_process_api_ledger().rows()
+            if process_api_rows:
+                st.write("プロセス全体の合計 (メソッド・シート別)")
+                st.dataframe(pd.DataFrame(process_api_rows).rename(columns={
+                    'method': 'メソッド', 'sheet': 'シート', 'calls': '回数', 'bytes_sent': '概算送信(B)', 'bytes_received': '概算受信(B)'}))
+            for warning_message in get_process_api_ledger().warnings[-5:]:
+                st.warning(warning_message)
+            pooled_session = http_session(gspread_client)
+            if pooled_session is not None:
+                connection_stats = pooled_session.connection_stats()
+                st.write("HTTP 接続の使い回し (プロセス全体)")
+                st.dataframe(pd.DataFrame([{
+                    'HTTPリクエスト': connection_stats['requests'], '新規接続': connection_stats['new_connections'],
+                    '接続の再利用': connection_stats['reused_requests'], '再利用率': connection_stats['reuse_ratio'],
+                    'プール上限': connection_stats['pool_maxsize'], 'トークン更新': connection_stats['token_refreshes'],
+                    '(うち事前更新)': connection_stats['background_refreshes'], 'トークン期限 (UTC)': connection_stats['token_expiry'],
+                }]))
+                if connection_stats['last_error']: st.warning(f"トークンの事前更新に失敗しました: {connection_stats['last_error']}")
+
+        # --- シート読み込みキャッシュの状況 ---
+        with st.expander("シート読み込みキャッシュの状況"):
+            st.caption("ミス (読み込み) はスプレッドシートから実際にダウンロードした回数です。各シートは更新 (TTL 60秒) ごとに1回になるはずです。")
+            st.dataframe(sheet_cache_stats_frame())
+
+        # --- キャッシュ済みデータのメモリ使用量 ---
+        with st.expander("キャッシュ済みデータのメモリ使用量"):
+            if st.button("メモリ使用量を集計", key="memory_report_button_key"):
+                attendance_df_for_report = load_data_to_dataframe(gspread_client, SPREADSHEET_ID, ATTENDANCE_SHEET_NAME, required_cols=None)
+                st.dataframe(frame_memory_report({
+                    MEMBER_SHEET_NAME: member_df,
+                    ATTENDANCE_SHEET_NAME: attendance_df_for_report,
+                }))
+                # セッション状態には名簿の版と選択中の値だけを保持し、部員リストと選択肢は全セッションで1つを共有する
+                if roster is not None: st.caption(f"共有の部員名簿 (版 {roster.version}): {round(roster.memory_bytes() / 1024, 1)} KB (全セッションで1つ)")
+                st.write("セッションごとのセッション状態 (直近の操作時点)")
+                st.dataframe(session_footprint_frame())
+                st.write("このセッションのセッション状態 (キーごと)")
+                st.dataframe(pd.DataFrame([{'キー': key, 'メモリ(KB)': round(size / 1024, 2)} for key, size in session_state_footprint().items()], columns=['キー', 'メモリ(KB)']))
     else:
         st.info("コート割り振り実行には部員データが必要です。")
 elif st.session_state.authentication_status is True and not st.session_state.is_admin:
     st.info("コート割り振り機能は管理者専用です。")
-st.caption("システム管理者向けエリア")
\ No newline at end of file
+st.caption("システム管理者向けエリア")
+# このセッションのセッション状態のメモリ使用量を記録する (管理者画面の「キャッシュ済みデータのメモリ使用量」で表示)
+record_session_footprint()
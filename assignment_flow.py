@@ -0,0 +1,126 @@
+# assignment_flow.py (管理者のコート割り振りの手順)
+# -*- coding: utf-8 -*-
+#
+# 管理者のコート割り振り1回分の手順 (事前計算への反映と追加のチーム数の割り振り → 結果シートの書き込み → ペア履歴の記録) です。
+# Streamlit に依存せず、app.py (結果を画面に表示する) と loadtest.py (負荷試験) の両方から同じ手順で呼び出します。
+# 表示するメッセージは返り値 (publish_assignment のレポート) から呼び出し側で作ります。
+
+from gspread.exceptions import WorksheetNotFound
+
+import config
+from instrumentation import traced
+from config import PAIR_HISTORY_SHEET_NAME, PAIR_HISTORY_SHEETS
+from court_assignment import run_team_requests
+from pair_history import PairHistory, PAIR_HISTORY_COLUMNS, RECENT_RECORDS_KEPT, record_key
+from schema import COL_MEMBER_ID
+from sheet_reader import read_columns
+from sheet_writer import is_unchanged, read_grids, write_grid, ensure_worksheet, sheet_size
+from sheets_async import run_concurrently, DEFAULT_MAX_CONCURRENCY
+
+def compute_assignment(scheduler, member_df, attendance_df, target_date, include_level1=True, force_full=False, team_requests=None, pair_history=None, runner=None):
+    """
+    割り振りを計算します (割り振りジョブの本体)。判定・名簿作成・割り振りは court_assignment.py で行い、
+    scheduler (precompute.AssignmentScheduler) に事前計算済みの結果があれば連絡の変化だけを反映します。
+    team_requests があれば、事前計算と同じ判定結果 (プール) とシードで追加のチーム数だけを割り振ります。
+    戻り値: {'precomputed': PrecomputedAssignment, 'extra_result': 追加のチーム数の結果 (なければ None)}
+    """
+    precomputed = scheduler.refresh(member_df, attendance_df, target_date, include_level1=include_level1, force_full=force_full, runner=runner)
+    extra_result = run_team_requests(member_df, precomputed.result['statuses'], target_date, team_requests, include_level1=include_level1,
+                                     seed=precomputed.seed, pair_history=pair_history, runner=runner) if team_requests else None
+    return {'precomputed': precomputed, 'extra_result': extra_result}
+
+def read_pair_history(spreadsheet):
+    """ペア履歴シートを読み込みます。シートがない場合は None を返します。"""
+    try:
+        worksheet = spreadsheet.worksheet(PAIR_HISTORY_SHEET_NAME)
+    except WorksheetNotFound:
+        return None
+    return PairHistory.from_columns(read_columns(worksheet, PAIR_HISTORY_COLUMNS))
+
+def record_pair_history(spreadsheet, pair_history, target_date, assignments):
+    """
+    公開した割り振り ({シート名: チーム}) をペア履歴に記録し、ペア履歴シートに書き戻します。
+    同じ練習日・同じシートの割り振りを公開し直した場合は、前回の分と差し替えます (保持期間を過ぎた日は差し替えられないため、加えたうえで warning で知らせます)。
+    記録の前にシートの履歴を読み込み、他のプロセス (別のレプリカ・CLI) が公開した分で内容が変わっていれば取り込んでから記録します。
+    戻り値: (書き込み方 (write_grid), メッセージのリスト)
+    """
+    stored_history = read_pair_history(spreadsheet)
+    if stored_history is not None and stored_history.fingerprint != pair_history.fingerprint:
+        if config.DEBUG_MODE: print("ペア履歴シートが他から更新されているため、読み込み直してから記録します。")
+        pair_history.replace_with(stored_history)
+    messages = []
+    if pair_history.is_evicted(target_date):
+        messages.append(('warning', f"{target_date.strftime('%Y-%m-%d')} は直近 {RECENT_RECORDS_KEPT} 回の公開より前の練習日のため、ペア履歴の前回の割り振りを差し替えられません。今回の割り振りを加えて記録します。"))
+    for sheet_name, teams in assignments.items():
+        pair_history.record(record_key(target_date, sheet_name), {team_name: [m.get(COL_MEMBER_ID) for m in members] for team_name, members in teams.items()})
+    history_grid = pair_history.to_grid()
+    history_rows, history_cols = sheet_size(history_grid)
+    return write_grid(ensure_worksheet(spreadsheet, PAIR_HISTORY_SHEET_NAME, rows=history_rows, cols=history_cols), history_grid), messages
+
+def _write_output(spreadsheet, sheet_name, values, force_full, current_values):
+    try:
+        worksheet = spreadsheet.worksheet(sheet_name)
+    except WorksheetNotFound:
+        return None, None
+    if not values: return worksheet, None
+    if config.DEBUG_MODE: print(f"書き込み中: '{worksheet.title}' ...")
+    return worksheet, write_grid(worksheet, values, force_full=force_full, current_values=current_values)
+
+@traced("publish_assignment")
+def publish_assignment(spreadsheet, job_result, target_date, force_full=False, pair_history=None, run_calls=None):
+    """
+    compute_assignment の結果を名簿・割り振り結果シートに書き込み、書き込めた割り振りをペア履歴に記録します。
+    - 追加のチーム数の結果シートはなければ作成します。
+    - 各シートの現在の内容を1回でまとめて読み込み、書き込む内容と同じシートは書き込みません (force_full なら常に全体を書き直します)。
+    - シートへの書き込みは run_calls (関数のリストを並行に実行して結果か例外を同じ順で返す関数) で並行して行います。
+    戻り値 (レポート):
+      'messages': 割り振りとペア履歴の記録のメッセージ [(レベル, 文), ...]
+      'created_sheets': 作成したシート名のリスト / 'create_error': シートの作成で起きた例外 (なければ None)
+      'unchanged': 内容が同じため書き込まなかったデータ名のリスト
+      'writes': [(シート名, データ名, 書き込むデータ, (ワークシート, 書き込み方) または例外), ...]
+                (シートが見つからない場合のワークシートは None、書き込むデータがない場合の書き込み方は None)
+      'failed_sheets': 書き込めなかったシート名の集合
+      'pair_history': ペア履歴の書き込み方 (記録しなかった場合は None) / 'pair_history_error': 記録で起きた例外 (なければ None)
+    """
+    if run_calls is None: run_calls = lambda funcs: run_concurrently(funcs, max_concurrency=DEFAULT_MAX_CONCURRENCY, return_exceptions=True)
+    assignment_result, extra_result = job_result['precomputed'].result, job_result['extra_result']
+    outputs, messages = list(assignment_result['outputs']), list(assignment_result['messages'])
+    report = {'messages': messages, 'created_sheets': [], 'create_error': None, 'unchanged': [], 'writes': [], 'failed_sheets': set(),
+              'pair_history': None, 'pair_history_error': None}
+    if extra_result:
+        outputs += extra_result['outputs']; messages += extra_result['messages']
+        try:
+            # 追加のチーム数の結果シートはなければ作成する (シート一覧の取得は1回)
+            existing_titles = {ws.title for ws in spreadsheet.worksheets()}
+            for extra_sheet_name, _, extra_values in extra_result['outputs']:
+                if extra_sheet_name in existing_titles: continue
+                extra_rows, extra_cols = sheet_size(extra_values)
+                spreadsheet.add_worksheet(title=extra_sheet_name, rows=extra_rows, cols=extra_cols)
+                report['created_sheets'].append(extra_sheet_name)
+        except Exception as e: report['create_error'] = e; print(f"ERROR: Error creating result sheets: {e}")
+
+    current_grids = {}
+    if not force_full:
+        try:
+            existing_titles = {ws.title for ws in spreadsheet.worksheets()}
+            current_grids = read_grids(spreadsheet, [name for name, _, _ in outputs if name in existing_titles])
+        except Exception as e: print(f"ERROR: Error reading result sheets: {e}") # 読み込めなかった場合は書き込み時にシートごとに確認する
+    changed_outputs = []
+    for output_sheet_name, data_name, output_values in outputs:
+        if not force_full and is_unchanged(output_values, current_grids.get(output_sheet_name)): report['unchanged'].append(data_name)
+        else: changed_outputs.append((output_sheet_name, data_name, output_values))
+    results = run_calls([lambda s=sheet_name, v=values: _write_output(spreadsheet, s, v, force_full, current_grids.get(s))
+                         for sheet_name, _, values in changed_outputs])
+    for (sheet_name, data_name, values), result in zip(changed_outputs, results):
+        report['writes'].append((sheet_name, data_name, values, result))
+        if isinstance(result, Exception) or result[0] is None: report['failed_sheets'].add(sheet_name)
+
+    # 公開できた割り振りをペア履歴に記録する (次回以降、同じ部員の組み合わせが続かないようにする)
+    published_assignments = {name: teams for name, teams in assignment_result['assignments'].items()
+                             if name in PAIR_HISTORY_SHEETS and teams and name not in report['failed_sheets']}
+    if published_assignments and pair_history is not None:
+        try:
+            report['pair_history'], history_messages = record_pair_history(spreadsheet, pair_history, target_date, published_assignments)
+            messages += history_messages
+        except Exception as e: report['pair_history_error'] = e; print(f"ERROR: Error writing pair history: {e}")
+    return report
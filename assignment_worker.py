@@ -0,0 +1,284 @@
+# assignment_worker.py (コート割り振りの計算を別プロセスで行うワーカー)
+# -*- coding: utf-8 -*-
+#
+# Streamlit は全ユーザーを1つの Python プロセスで処理するため、CPU を使い続ける割り振り (assign_teams と再調整) を
+# 同じプロセスで計算すると、その間は GIL を握ったままになり、他のセッション (遅刻・欠席連絡の送信など) が止まります。
+# ここでは assign_teams の呼び出し1回を1タスクとして常駐のワーカープロセスで実行し、
+# 管理者の操作はジョブ (ID・進捗・キャンセル) として管理します。ジョブの取りまとめはスレッドで行い、結果を待つ間は GIL を手放します。
+# ワーカープロセスはこのモジュールをエントリーポイントとして起動します (python -m assignment_worker)。
+# Streamlit が __main__ として実行している app.py を子プロセスで実行し直さないよう、multiprocessing の spawn は使いません。
+# プロセス数を 0 にすると、タスクはジョブのスレッドで順に実行します (進捗は使えますが、実行中のタスクはキャンセルで止められません)。
+
+import datetime
+import os
+import pickle
+import subprocess
+import sys
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import config
+
+JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED, JOB_CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+JOBS_KEPT = 20 # 保持する終了済み (結果を受け取り済み) のジョブの数
+POLL_SECONDS = 0.2 # タスクの完了とキャンセルを確認する間隔
+WORKER_DIR = os.path.dirname(os.path.abspath(__file__)) # ワーカープロセスの作業ディレクトリ (court_assignment などを読み込めるようにする)
+
+class JobCancelled(Exception):
+    """ジョブがキャンセルされたときに、実行中の runner から送出されます。"""
+
+class WorkerStopped(RuntimeError):
+    """ワーカープロセスが結果を返さずに終了した (キャンセルで停止した・異常終了した) ときに送出されます。"""
+
+def _assign_teams_task(kwargs):
+    # ワーカープロセスで実行する (court_assignment は Streamlit に依存しないため、app.py を読み込まずに済む)
+    from court_assignment import assign_teams
+    return assign_teams(**kwargs)
+
+def serve(task_input, result_output):
+    """
+    ワーカープロセスの本体です。task_input から assign_teams の引数 (辞書) を1つずつ読み込んで実行し、
+    (成功したかどうか, 結果またはエラーの内容) を result_output に書き込みます。task_input が閉じられたら終了します。
+    """
+    import court_assignment # noqa: F401 (pandas などの読み込みを最初のタスクの前に済ませる)
+    while True:
+        try: task = pickle.load(task_input)
+        except EOFError: return
+        try: reply = (True, _assign_teams_task(task))
+        except Exception as e: reply = (False, f"{type(e).__name__}: {e}")
+        pickle.dump(reply, result_output, protocol=pickle.HIGHEST_PROTOCOL)
+        result_output.flush()
+
+class _WorkerProcess:
+    """python -m assignment_worker で起動したワーカープロセス1つ (タスクは1つずつ実行します)。"""
+    def __init__(self):
+        args = [sys.executable, '-m', 'assignment_worker'] + (['--debug'] if config.DEBUG_MODE else [])
+        self.process = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=WORKER_DIR)
+
+    @property
+    def alive(self):
+        return self.process.poll() is None
+
+    def run(self, task):
+        try:
+            pickle.dump(task, self.process.stdin, protocol=pickle.HIGHEST_PROTOCOL)
+            self.process.stdin.flush()
+            succeeded, value = pickle.load(self.process.stdout)
+        except (EOFError, OSError, pickle.UnpicklingError) as e:
+            self.terminate()
+            raise WorkerStopped(f"ワーカープロセスが終了しました (終了コード {self.process.poll()})") from e
+        if not succeeded: raise RuntimeError(value)
+        return value
+
+    def terminate(self):
+        if self.alive: self.process.kill()
+        self.process.wait()
+
+class AssignmentJob:
+    """管理者の操作1回分の割り振りジョブ。進捗はタスク (assign_teams の呼び出し) の完了数で表します。"""
+    def __init__(self, name, meta=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.meta = dict(meta or {}) # 結果を書き込むときに使う情報 (対象日など)
+        self.state = JOB_QUEUED
+        self.done_tasks = 0
+        self.total_tasks = 0
+        self.result = None
+        self.error = None
+        self.created_at = datetime.datetime.now()
+        self.finished_at = None
+        self.claimed = False # 結果をどれかのセッションが受け取ったかどうか
+        self.cancel_event = threading.Event()
+        self._workers = set() # このジョブのタスクを実行中のワーカープロセス
+        self._lock = threading.Lock()
+
+    def add_progress(self, done=0, total=0):
+        with self._lock:
+            self.done_tasks += done; self.total_tasks += total
+
+    def attach(self, worker):
+        # キャンセル済みのジョブのタスクを始めたワーカーはすぐに止める
+        with self._lock:
+            self._workers.add(worker)
+            cancelled = self.cancel_event.is_set()
+        if cancelled: worker.terminate()
+
+    def detach(self, worker):
+        with self._lock:
+            self._workers.discard(worker)
+
+    def cancel(self):
+        """キャンセルを記録し、このジョブのタスクを実行中のワーカープロセスを停止します。"""
+        with self._lock:
+            self.cancel_event.set()
+            workers = list(self._workers)
+        for worker in workers: worker.terminate()
+
+    @property
+    def finished(self):
+        return self.state in (JOB_DONE, JOB_FAILED, JOB_CANCELLED)
+
+    def snapshot(self):
+        """表示用にジョブの状態を辞書で返します (result はジョブが完了した場合だけ含みます)。"""
+        with self._lock:
+            return {
+                'id': self.id, 'name': self.name, 'meta': dict(self.meta), 'state': self.state,
+                'done_tasks': self.done_tasks, 'total_tasks': self.total_tasks,
+                'progress': self.done_tasks / self.total_tasks if self.total_tasks else 0.0,
+                'result': self.result if self.state == JOB_DONE else None, 'error': self.error,
+                'created_at': self.created_at, 'finished_at': self.finished_at,
+            }
+
+class AssignmentWorkerPool:
+    """
+    割り振りのタスクを実行する常駐のワーカープロセスと、ジョブの一覧 (スレッドセーフ)。
+    ワーカープロセスは warm_up か最初のタスクで起動し、以降は使い回します。キャンセルされたジョブのタスクを実行中のプロセスは停止し、次のタスクで起動し直します。
+    終了したジョブの結果は claim_finished で受け取るまで保持するため、ジョブを始めたセッションが閉じられても失われません。
+    """
+    def __init__(self, max_workers=2):
+        self.max_workers = max_workers
+        self._dispatcher = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='assignment-task') if max_workers > 0 else None
+        self._lock = threading.Lock()
+        self._idle_workers = [] # 待機中のワーカープロセス
+        self._jobs = OrderedDict() # ジョブID -> AssignmentJob
+
+    @property
+    def can_stop_running_tasks(self):
+        """キャンセルで実行中のタスクも止められるか (ワーカープロセスを使う場合のみ)。"""
+        return self.max_workers > 0
+
+    def warm_up(self):
+        """
+        ワーカープロセスを起動し、割り振りに必要なモジュールを読み込ませておきます (完了は待ちません)。
+        起動したプロセスは pandas などの読み込みに数秒かかるため、最初のジョブの前に呼んでおきます。
+        """
+        with self._lock:
+            missing = self.max_workers - len(self._idle_workers)
+        for _ in range(missing): self._check_in(_WorkerProcess())
+
+    def _check_out(self):
+        with self._lock:
+            while self._idle_workers:
+                worker = self._idle_workers.pop()
+                if worker.alive: return worker
+        return _WorkerProcess()
+
+    def _check_in(self, worker):
+        with self._lock:
+            if len(self._idle_workers) < self.max_workers:
+                self._idle_workers.append(worker); return
+        worker.terminate()
+
+    def _run_on_worker(self, task, job):
+        if job is not None and job.cancel_event.is_set(): raise JobCancelled()
+        worker = self._check_out()
+        if job is not None: job.attach(worker)
+        try:
+            return worker.run(task)
+        finally:
+            if job is not None: job.detach(worker)
+            # キャンセルで停止した・異常終了したプロセスは使い回さない
+            if worker.alive: self._check_in(worker)
+
+    def run_tasks(self, tasks, job=None):
+        """
+        assign_teams の引数 (辞書) のリストを実行し、結果を同じ順で返します。
+        court_assignment の runner 引数としてそのまま渡せます。job を指定すると進捗を記録し、キャンセルされたら JobCancelled を送出します。
+        """
+        if job is not None: job.add_progress(total=len(tasks))
+        if self._dispatcher is None:
+            results = []
+            for task in tasks:
+                if job is not None and job.cancel_event.is_set(): raise JobCancelled()
+                results.append(_assign_teams_task(task))
+                if job is not None: job.add_progress(done=1)
+            return results
+
+        futures = [self._dispatcher.submit(self._run_on_worker, task, job) for task in tasks]
+        pending = set(futures)
+        try:
+            while pending:
+                done, pending = wait(pending, timeout=POLL_SECONDS, return_when=FIRST_COMPLETED)
+                if job is not None:
+                    job.add_progress(done=len(done))
+                    # 実行中のタスクは cancel でプロセスごと停止済みのため、未開始のタスクを取り消して結果を捨てる
+                    if job.cancel_event.is_set(): raise JobCancelled()
+            return [future.result() for future in futures]
+        finally:
+            for future in pending: future.cancel()
+
+    def submit(self, name, func, meta=None):
+        """
+        func(runner) をジョブとしてバックグラウンドのスレッドで実行し、ジョブIDを返します。
+        runner は進捗とキャンセルを記録する run_tasks で、func の戻り値がジョブの結果になります。meta は結果と一緒に返す情報です。
+        """
+        job = AssignmentJob(name, meta)
+        with self._lock:
+            self._jobs[job.id] = job
+            # 結果をまだ受け取っていないジョブは残す
+            claimed = [job_id for job_id, j in self._jobs.items() if j.finished and j.claimed]
+            for job_id in claimed[:max(0, len(claimed) - JOBS_KEPT)]: del self._jobs[job_id]
+        threading.Thread(target=self._run_job, args=(job, func), name=f"assignment-job-{job.id}", daemon=True).start()
+        return job.id
+
+    def _run_job(self, job, func):
+        job.state = JOB_RUNNING
+        result, error, state = None, None, JOB_DONE
+        try:
+            result = func(lambda tasks: self.run_tasks(tasks, job=job))
+        except JobCancelled:
+            state = JOB_CANCELLED
+        except WorkerStopped as e:
+            if job.cancel_event.is_set(): state = JOB_CANCELLED
+            else: error, state = str(e), JOB_FAILED; print(f"ERROR: Assignment job '{job.name}' ({job.id}) failed: {e}")
+        except Exception as e:
+            error, state = str(e), JOB_FAILED
+            print(f"ERROR: Assignment job '{job.name}' ({job.id}) failed: {e}")
+        with job._lock:
+            job.result, job.error, job.finished_at, job.state = result, error, datetime.datetime.now(), state
+
+    def job(self, job_id):
+        """ジョブの状態 (AssignmentJob.snapshot) を返します。不明なIDなら None。"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return job.snapshot() if job is not None else None
+
+    def active_jobs(self):
+        """実行中 (未終了) のジョブの状態のリストを返します (古い順)。"""
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if not job.finished]
+        return [job.snapshot() for job in jobs]
+
+    def claim_finished(self):
+        """
+        終了したジョブのうち、まだどのセッションも受け取っていないものを受け取り済みにして、その状態のリストを返します (古い順)。
+        同じジョブの結果は1回だけ返すため、複数のセッションから呼んでも結果の書き込みは重複しません。
+        """
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if job.finished and not job.claimed]
+            for job in jobs: job.claimed = True
+        return [job.snapshot() for job in jobs]
+
+    def cancel(self, job_id):
+        """ジョブをキャンセルし、実行中のタスクのワーカープロセスを停止します。キャンセルを受け付けた (ジョブが実行中だった) かどうかを返します。"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None or job.finished: return False
+        job.cancel()
+        return True
+
+    def shutdown(self):
+        for job_id in list(self._jobs): self.cancel(job_id)
+        if self._dispatcher is not None: self._dispatcher.shutdown(wait=False, cancel_futures=True)
+        with self._lock:
+            workers, self._idle_workers = self._idle_workers, []
+        for worker in workers: worker.terminate()
+
+if __name__ == '__main__':
+    # ワーカープロセスのエントリーポイント (標準入出力はタスクと結果の受け渡しに使うため、print の出力は標準エラー出力に回す)
+    config.DEBUG_MODE = '--debug' in sys.argv[1:]
+    task_input, result_output = sys.stdin.buffer, sys.stdout.buffer
+    sys.stdout = sys.stderr
+    serve(task_input, result_output)
@@ -0,0 +1,174 @@
+# attendance_rollup.py (連絡ログの集計表)
+# -*- coding: utf-8 -*-
+#
+# 管理者向けの出欠の傾向 (練習日 x 状況、学年・学科 x 状況の件数と、部員ごとの欠席率・遅刻率) を表示するための集計表です。
+# 集計の単位は (学籍番号, 対象練習日) ごとの最新の連絡 (コート割り振りの判定と同じ) で、連絡が追記されるたびに
+# その組の前回の状況を取り消して新しい状況を加えます。表示は集計表だけから作るため、連絡ログの件数によらず一定の時間で済みます。
+# 全ログの読み込み (load) はプロセスの起動後に1回だけ行い、以降はこのプロセスからの追記を apply で反映します。
+# 集計表はプロセスごとに持つため、他のプロセス (別のレプリカ・CLI) が追記した連絡は、ホットシートの行数を反映済みの行数と比べて
+# 増えた末尾の行を catch_up で反映します。シート上での編集・削除や、反映する前にアーカイブされた連絡は反映されません (stale_reason で知らせます)。
+# load・apply・catch_up は同じ規則 (記録日時が新しい連絡で置き換える) でまとめるため、どの順でも、同じ連絡を重ねて反映しても結果は変わりません。
+
+import bisect
+import datetime
+import threading
+from collections import Counter, defaultdict
+
+import pandas as pd
+
+from schema import (
+    COL_MEMBER_ID, COL_MEMBER_GRADE, COL_MEMBER_DEPARTMENT,
+    COL_ATTENDANCE_TIMESTAMP, COL_ATTENDANCE_TARGET_DATE, COL_ATTENDANCE_STATUS, ROLLUP_COLUMNS, id_text,
+)
+from attendance_store import latest_records
+
+STATUSES = ['参加', '遅刻', '欠席']
+UNKNOWN_GROUP = '(未設定)'
+
+def _timestamp(value):
+    value = pd.to_datetime(value, errors='coerce') if not isinstance(value, pd.Timestamp) else value
+    return None if pd.isna(value) else value
+
+def _text(value):
+    return UNKNOWN_GROUP if value is None or pd.isna(value) or not str(value).strip() else str(value).strip()
+
+class AttendanceRollups:
+    """
+    連絡ログの集計表 (スレッドセーフ)。
+    (学籍番号, 対象練習日) ごとの最新の連絡と、それを数えた練習日別・学年別・学科別・部員別の {状況: 件数} を保持します。
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latest = {} # (学籍番号, 対象練習日) -> (記録日時, 状況, 学年, 学科)
+        self._by_date = defaultdict(Counter)
+        self._by_grade = defaultdict(Counter)
+        self._by_department = defaultdict(Counter)
+        self._by_member = defaultdict(Counter)
+        self._first_date = {} # 学籍番号 -> 最初の連絡の対象練習日
+        self.loaded_at = None # 全ログを読み込んだ日時 (未読み込みなら None)
+        self.applied_records = 0 # apply で反映した連絡の数
+        self.hot_rows = 0 # 反映済みのホットシートの行数 (load・catch_up で更新)
+        self.caught_up_records = 0 # catch_up で反映した (他のプロセスが追記した可能性のある) 行の数
+        self.stale_reason = None # 集計が古い可能性がある理由 (なければ None)
+
+    def _count(self, member_id, target_date, entry, sign):
+        _, status, grade, department = entry
+        for table, key in ((self._by_date, target_date), (self._by_grade, grade), (self._by_department, department), (self._by_member, member_id)):
+            table[key][status] += sign
+            if table[key][status] == 0: del table[key][status]
+            if not table[key]: del table[key]
+
+    def _add(self, member_id, target_date, timestamp, status, grade, department):
+        # 同じ組の連絡は記録日時が新しい (同時刻なら後から反映した) 連絡で置き換える。記録日時が空の連絡は、組に他の連絡がない場合だけ使う
+        if not member_id or target_date is None: return
+        key = (member_id, target_date)
+        previous = self._latest.get(key)
+        if previous is not None:
+            if timestamp is None or (previous[0] is not None and timestamp < previous[0]): return
+            self._count(member_id, target_date, previous, -1)
+        entry = (timestamp, status, grade, department)
+        self._latest[key] = entry
+        self._count(member_id, target_date, entry, 1)
+        if member_id not in self._first_date or target_date < self._first_date[member_id]: self._first_date[member_id] = target_date
+
+    def _add_frame(self, df):
+        rows = zip(*(df[col] if col in df.columns else [None] * len(df) for col in ROLLUP_COLUMNS))
+        for timestamp, target_date, member_id, grade, department, status in rows:
+            if target_date is None or pd.isna(target_date): continue
+            self._add(id_text(member_id), target_date.date(), None if pd.isna(timestamp) else timestamp, _text(status), _text(grade), _text(department))
+
+    def load(self, attendance_df, hot_rows=0):
+        """
+        全ログ (ホットシートと全アーカイブを結合した DataFrame) から集計します。既に反映した連絡とはまとめて数えます。
+        hot_rows は attendance_df に含まれるホットシートの行数で、以降の catch_up はその次の行から反映します。
+        """
+        latest = latest_records(attendance_df, [COL_MEMBER_ID, COL_ATTENDANCE_TARGET_DATE]) if attendance_df is not None else None
+        with self._lock:
+            if latest is not None and not latest.empty: self._add_frame(latest)
+            self.loaded_at = datetime.datetime.now()
+            self.hot_rows, self.stale_reason = hot_rows, None
+
+    def catch_up(self, hot_df):
+        """
+        ホットシートの現在の内容 (hot_df、シートの行の順) のうち、まだ反映していない末尾の行を反映します。反映した行数を返します。
+        行数が反映済みより少ない (アーカイブ・削除された) 場合は全ての行を反映し直し、その間にアーカイブされた連絡を数えていない可能性を stale_reason に記録します。
+        全ログを読み込む前 (load の前) は何もしません。
+        """
+        with self._lock:
+            if self.loaded_at is None or hot_df is None: return 0
+            start = self.hot_rows
+            if len(hot_df) < start:
+                start = 0
+                self.stale_reason = f"ホットシートの行数が集計時より減っています ({self.hot_rows}行 → {len(hot_df)}行、他からのアーカイブや削除)。"
+            tail = hot_df.iloc[start:]
+            self._add_frame(tail)
+            self.hot_rows = len(hot_df); self.caught_up_records += len(tail)
+            return len(tail)
+
+    def rescan_hot(self):
+        """次の catch_up でホットシートの全ての行を反映し直すようにします (このプロセスでアーカイブしてホットシートの行が移動した後に呼びます)。"""
+        with self._lock:
+            self.hot_rows = 0
+
+    def apply(self, records):
+        """追記した連絡 (列名 -> 値の辞書のリスト、シートに書き込んだ文字列のままでよい) を反映します。"""
+        with self._lock:
+            for record in records:
+                target_date = _timestamp(record.get(COL_ATTENDANCE_TARGET_DATE))
+                if target_date is None: continue
+                self._add(id_text(record.get(COL_MEMBER_ID)), target_date.date(), _timestamp(record.get(COL_ATTENDANCE_TIMESTAMP)),
+                          _text(record.get(COL_ATTENDANCE_STATUS)), _text(record.get(COL_MEMBER_GRADE)), _text(record.get(COL_MEMBER_DEPARTMENT)))
+                self.applied_records += 1
+
+    def reset(self):
+        """集計を空に戻します (再集計の前に呼びます)。"""
+        with self._lock:
+            self._latest.clear(); self._first_date.clear()
+            for table in (self._by_date, self._by_grade, self._by_department, self._by_member): table.clear()
+            self.loaded_at, self.applied_records, self.hot_rows, self.caught_up_records, self.stale_reason = None, 0, 0, 0, None
+
+    @staticmethod
+    def _frame(table, index_name):
+        frame = pd.DataFrame.from_dict({key: dict(counts) for key, counts in table.items()}, orient='index')
+        extra = [col for col in frame.columns if col not in STATUSES]
+        frame = frame.reindex(columns=STATUSES + sorted(extra)).fillna(0).astype(int)
+        frame.index.name = index_name
+        return frame.sort_index()
+
+    def by_date(self, start_date=None, end_date=None):
+        """対象練習日 x 状況 の件数 (行: 対象練習日、両端を含む期間で絞り込めます)。"""
+        with self._lock:
+            table = {d: counts for d, counts in self._by_date.items() if (start_date is None or d >= start_date) and (end_date is None or d <= end_date)}
+            return self._frame(table, COL_ATTENDANCE_TARGET_DATE)
+
+    def by_grade(self):
+        """学年 x 状況 の件数 (全期間)。"""
+        with self._lock:
+            return self._frame(self._by_grade, COL_MEMBER_GRADE)
+
+    def by_department(self):
+        """学科 x 状況 の件数 (全期間)。"""
+        with self._lock:
+            return self._frame(self._by_department, COL_MEMBER_DEPARTMENT)
+
+    def member_rates(self):
+        """
+        部員ごとの連絡の件数と欠席率・遅刻率 (全期間)。
+        率の分母は、その部員の最初の連絡の練習日以降で連絡が1件以上ある練習日の数です (入部前の練習日は数えません。
+        連絡のない日は参加とみなすため、その日は参加として数えます)。
+        """
+        with self._lock:
+            practice_dates = sorted(self._by_date)
+            rows = [{COL_MEMBER_ID: member_id, '連絡した練習日': sum(counts.values()), '対象の練習日': len(practice_dates) - bisect.bisect_left(practice_dates, self._first_date[member_id]),
+                     '欠席': counts.get('欠席', 0), '遅刻': counts.get('遅刻', 0)}
+                    for member_id, counts in self._by_member.items()]
+        frame = pd.DataFrame(rows, columns=[COL_MEMBER_ID, '連絡した練習日', '対象の練習日', '欠席', '遅刻'])
+        frame['欠席率'] = (frame['欠席'] / frame['対象の練習日']).round(3)
+        frame['遅刻率'] = (frame['遅刻'] / frame['対象の練習日']).round(3)
+        return frame.sort_values(by=['欠席率', '遅刻率', COL_MEMBER_ID], ascending=[False, False, True]).reset_index(drop=True)
+
+    def stats(self):
+        with self._lock:
+            return {'pairs': len(self._latest), 'practice_days': len(self._by_date), 'members': len(self._by_member),
+                    'loaded_at': self.loaded_at, 'applied_records': self.applied_records, 'hot_rows': self.hot_rows,
+                    'caught_up_records': self.caught_up_records, 'stale_reason': self.stale_reason}
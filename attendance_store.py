@@ -0,0 +1,239 @@
+# attendance_store.py (遅刻欠席連絡ログの月別アーカイブ)
+# -*- coding: utf-8 -*-
+#
+# 遅刻欠席連絡シートは「ホット」シートとして今後の練習日の連絡だけを保持し、
+# 過去の練習日の連絡は対象練習日の月ごとにアーカイブシート (例: 遅刻欠席連絡_2025-04) へ移動します。
+# 読み込み側は、問い合わせに必要な月のアーカイブシートだけを読み込みます。
+# 個人の連絡履歴は MemberHistoryIndex (学籍番号ごとの索引) からページ単位で取り出します。
+# 「部員ごと (や部員・練習日ごと) の最新の連絡」は、連絡確認・コート割り振りのどちらも latest_records で求めます。
+
+import datetime
+import numpy as np
+import pandas as pd
+
+from schema import (
+    COL_MEMBER_ID, COL_MEMBER_NAME, COL_MEMBER_GRADE, COL_MEMBER_DEPARTMENT,
+    COL_ATTENDANCE_TIMESTAMP, COL_ATTENDANCE_TARGET_DATE, COL_ATTENDANCE_STATUS, COL_ATTENDANCE_REASON, COL_ATTENDANCE_LATE_TIME, OUTPUT_COLUMNS_ORDER,
+)
+
+def month_key(date_value):
+    """日付から月キー ('YYYY-MM') を返します。"""
+    return f"{date_value.year:04d}-{date_value.month:02d}"
+
+def archive_sheet_name(hot_sheet_name, month):
+    """月キーに対応するアーカイブシート名を返します。"""
+    return f"{hot_sheet_name}_{month}"
+
+def is_attendance_sheet(sheet_name, hot_sheet_name):
+    """ホットシートまたはそのアーカイブシートかどうかを判定します。"""
+    return sheet_name == hot_sheet_name or sheet_name.startswith(f"{hot_sheet_name}_")
+
+def archive_months_from_titles(titles, hot_sheet_name):
+    """
+    ワークシート名の一覧からアーカイブ済みの月キーを新しい順に返します。
+    """
+    prefix = f"{hot_sheet_name}_"
+    months = []
+    for title in titles:
+        if not title.startswith(prefix): continue
+        month = title[len(prefix):]
+        try:
+            datetime.datetime.strptime(month, '%Y-%m')
+        except ValueError:
+            continue
+        months.append(month)
+    return sorted(months, reverse=True)
+
+def months_for_target_date(target_date, today=None):
+    """
+    対象練習日の連絡を読むために必要なアーカイブ月を返します。
+    アーカイブには今日より前の練習日しか入らないため、今日以降の日付ならホットシートだけで足ります。
+    """
+    today = today or datetime.date.today()
+    if target_date is None or target_date >= today: return []
+    return [month_key(target_date)]
+
+def months_for_target_dates(target_dates, today=None):
+    """複数の対象練習日の連絡を読むために必要なアーカイブ月を (重複なく) 返します。"""
+    return sorted({month for target_date in target_dates for month in months_for_target_date(target_date, today)})
+
+def practice_dates_in_range(start_date, end_date, weekdays=None):
+    """
+    start_date から end_date まで (両端を含む) の日付のうち、weekdays (0=月曜 ... 6=日曜) の曜日に当たる日を返します。
+    weekdays が未指定なら期間内の全日を返します。
+    """
+    if start_date is None or end_date is None or end_date < start_date: return []
+    days = (end_date - start_date).days + 1
+    dates = [start_date + datetime.timedelta(days=offset) for offset in range(days)]
+    return [d for d in dates if not weekdays or d.weekday() in weekdays]
+
+def recorded_member_dates(attendance_df, target_dates):
+    """
+    連絡ログから、target_dates のいずれかに連絡がある (学籍番号, 対象練習日) の組を集合で返します。
+    全ての日付を1回の絞り込みと重複除去で処理します。
+    """
+    if attendance_df is None or attendance_df.empty or not target_dates: return set()
+    logs = attendance_df[attendance_df[COL_ATTENDANCE_TARGET_DATE].isin([pd.Timestamp(d) for d in target_dates])]
+    pairs = logs[[COL_MEMBER_ID, COL_ATTENDANCE_TARGET_DATE]].drop_duplicates()
+    return {(member_id, target.date()) for member_id, target in zip(pairs[COL_MEMBER_ID], pairs[COL_ATTENDANCE_TARGET_DATE])}
+
+def attendance_records(members_to_record, status, reason, late_time, member_info_by_id, recorded_at=None):
+    """
+    連絡する部員と日付 [(名前, 学籍番号, 対象練習日), ...] から、遅刻欠席連絡シートに追記する記録 (OUTPUT_COLUMNS_ORDER の列の辞書) のリストを作ります。
+    学年・学科は member_info_by_id (学籍番号を索引にした部員リスト) から補います。記録日時は recorded_at (未指定なら現在の日本時間) です。
+    """
+    recorded_at = recorded_at or datetime.datetime.now() + datetime.timedelta(hours=9)
+    record_timestamp = recorded_at.strftime("%Y-%m-%d %H:%M:%S")
+    records = []
+    for member_name, member_id, target_date in members_to_record:
+        grade, department = '', ''
+        if member_id in member_info_by_id.index:
+            member_info = member_info_by_id.loc[member_id]
+            grade, department = member_info.get(COL_MEMBER_GRADE, ''), member_info.get(COL_MEMBER_DEPARTMENT, '')
+        record_data = {
+            COL_ATTENDANCE_TIMESTAMP: record_timestamp, COL_ATTENDANCE_TARGET_DATE: target_date.strftime('%Y/%m/%d'),
+            COL_MEMBER_ID: member_id, COL_MEMBER_GRADE: grade, COL_MEMBER_NAME: member_name,
+            COL_ATTENDANCE_STATUS: status, COL_ATTENDANCE_REASON: reason, COL_ATTENDANCE_LATE_TIME: late_time, COL_MEMBER_DEPARTMENT: department,
+        }
+        records.append({col: record_data.get(col, "") for col in OUTPUT_COLUMNS_ORDER})
+    return records
+
+def attendance_rows(records):
+    """記録 (attendance_records) を、シートに追記する行 (OUTPUT_COLUMNS_ORDER の順の値のリスト) に変換します。"""
+    return [[record.get(col_name, "") for col_name in OUTPUT_COLUMNS_ORDER] for record in records]
+
+def latest_records(df, keys, timestamp_col=COL_ATTENDANCE_TIMESTAMP):
+    """
+    keys の列の組ごとに、記録日時が最新の行だけを元の行の順で返します。
+    ログ全体の並べ替えは行わず、組の番号付け (factorize) と組ごとの最大値で求めるため、行数に比例した時間で済みます。
+    同じ記録日時の行が複数あれば後の行 (後から追記された連絡) を使い、記録日時が空の行は組に他の行がない場合だけ使います。
+    """
+    if df is None or df.empty: return df
+    codes = None
+    for key in keys:
+        key_codes, uniques = pd.factorize(df[key], use_na_sentinel=False)
+        # 組の番号を詰め直しておき、キーを重ねても配列の大きさが行数を超えないようにする
+        codes = key_codes.astype(np.int64) if codes is None else pd.factorize(codes * len(uniques) + key_codes)[0]
+    num_groups = int(codes.max()) + 1
+    timestamps = df[timestamp_col]
+    if not pd.api.types.is_datetime64_any_dtype(timestamps): timestamps = pd.to_datetime(timestamps, errors='coerce')
+    stamps = timestamps.to_numpy(dtype='datetime64[ns]').view('i8') # NaT は int64 の最小値になるため、最大値の計算では自然に後回しになる
+    group_latest = np.full(num_groups, np.iinfo(np.int64).min, dtype=np.int64)
+    np.maximum.at(group_latest, codes, stamps)
+    candidates = np.flatnonzero(stamps == group_latest[codes])
+    last_positions = np.full(num_groups, -1, dtype=np.int64)
+    np.maximum.at(last_positions, codes[candidates], candidates)
+    return df.iloc[np.sort(last_positions)]
+
+def _archive_month_per_row(header, rows, cutoff_date):
+    # 行ごとに移動先のアーカイブ月 (アーカイブ対象でなければ None) を返す
+    if COL_ATTENDANCE_TARGET_DATE not in header: raise ValueError(f"ヘッダーに '{COL_ATTENDANCE_TARGET_DATE}' がありません。")
+    date_idx = header.index(COL_ATTENDANCE_TARGET_DATE)
+    target_dates = pd.to_datetime(pd.Series([row[date_idx] if date_idx < len(row) else '' for row in rows], dtype=object), errors='coerce')
+    cutoff = pd.Timestamp(cutoff_date)
+    return [None if pd.isna(target) or target >= cutoff else month_key(target) for target in target_dates]
+
+def split_rows_for_archive(header, rows, cutoff_date):
+    """
+    シートの行 (ヘッダー除く) を、ホットシートに残す行と月ごとのアーカイブ行に分けます。
+    対象練習日が cutoff_date より前の行がアーカイブ対象です。対象練習日を解釈できない行はホットシートに残します。
+    """
+    hot_rows = []
+    archive_rows_by_month = {}
+    for row, month in zip(rows, _archive_month_per_row(header, rows, cutoff_date)):
+        if month is None: hot_rows.append(row)
+        else: archive_rows_by_month.setdefault(month, []).append(row)
+    return hot_rows, archive_rows_by_month
+
+def _delete_row_requests(sheet_id, row_indexes):
+    # 削除する行 (0始まり) を連続した範囲にまとめ、下の範囲から消す deleteDimension リクエストを作る (上の行の位置がずれないように)
+    runs = []
+    for index in sorted(row_indexes):
+        if runs and runs[-1][1] == index: runs[-1][1] = index + 1
+        else: runs.append([index, index + 1])
+    return [{'deleteDimension': {'range': {'sheetId': sheet_id, 'dimension': 'ROWS', 'startIndex': start, 'endIndex': end}}}
+            for start, end in reversed(runs)]
+
+def archive_past_attendance(spreadsheet, hot_sheet_name, cutoff_date, debug=False):
+    """
+    ホットシートのうち対象練習日が cutoff_date より前の行を月別アーカイブシートへ移動します。
+    アーカイブへの追記を先に行い、その後ホットシートからその行だけを削除します (途中で失敗しても行が失われることはなく、重複するだけです)。
+    ホットシートを書き直さないため、アーカイブ中に追記された連絡 (シートの末尾に加わる) はそのまま残ります。
+    値は読み込んだ表示文字列のまま RAW で書き込み、学籍番号や日付をシートに解釈し直させません。
+    戻り値: {'archived': 移動した行数, 'kept': 残した行数, 'months': {月キー: 行数}}
+    """
+    hot_ws = spreadsheet.worksheet(hot_sheet_name)
+    values = hot_ws.get_all_values()
+    if not values: return {'archived': 0, 'kept': 0, 'months': {}}
+    header, rows = values[0], values[1:]
+    months = _archive_month_per_row(header, rows, cutoff_date)
+    archive_rows_by_month = {}
+    for row, month in zip(rows, months):
+        if month is not None: archive_rows_by_month.setdefault(month, []).append(row)
+    if not archive_rows_by_month: return {'archived': 0, 'kept': len(rows), 'months': {}}
+
+    existing_titles = {ws.title for ws in spreadsheet.worksheets()}
+    for month, month_rows in sorted(archive_rows_by_month.items()):
+        title = archive_sheet_name(hot_sheet_name, month)
+        if title in existing_titles:
+            spreadsheet.worksheet(title).append_rows(month_rows, value_input_option='RAW')
+        else:
+            archive_ws = spreadsheet.add_worksheet(title=title, rows=len(month_rows) + 1, cols=len(header))
+            archive_ws.update(range_name='A1', values=[header] + month_rows, value_input_option='RAW')
+        if debug: print(f"-> {len(month_rows)}件を '{title}' にアーカイブしました。")
+
+    # 読み込んだ行より上が書き換えられていれば (別のアーカイブ処理や手作業の編集)、行の位置が変わっているため削除しない
+    # (連絡の送信は末尾への追記だけなので、読み込んだ行の位置は変わらない)
+    if hot_ws.get_all_values()[:len(values)] != values:
+        raise RuntimeError(f"アーカイブ中に '{hot_sheet_name}' の既存の行が変更されたため、移動元の行を削除しませんでした (アーカイブシートには追記済みのため、重複した行を確認してください)。")
+    archived_indexes = [i + 1 for i, month in enumerate(months) if month is not None] # ヘッダーが0行目
+    spreadsheet.batch_update({'requests': _delete_row_requests(hot_ws.id, archived_indexes)})
+    return {
+        'archived': len(archived_indexes),
+        'kept': len(rows) - len(archived_indexes),
+        'months': {m: len(r) for m, r in sorted(archive_rows_by_month.items())},
+    }
+
+class MemberHistoryIndex:
+    """
+    学籍番号ごとの連絡履歴の索引。
+    対象練習日ごとの最新の連絡だけを「学籍番号昇順・対象練習日降順」に並べて保持し、
+    学籍番号 -> (開始行, 終了行) の辞書で各部員の範囲を引けるようにします。
+    索引の作成はログ全体に対して1回だけ行い、問い合わせのコストは1ページ分の行数で決まります。
+    """
+    def __init__(self, records, offsets):
+        self.records = records
+        self.offsets = offsets
+        # 対象練習日 (降順) を符号反転して昇順の整数配列にしておき、期間指定を二分探索で行う
+        self._neg_target_dates = -records[COL_ATTENDANCE_TARGET_DATE].to_numpy(dtype='datetime64[ns]').view('i8') if len(records) else np.array([], dtype='i8')
+
+    @classmethod
+    def build(cls, attendance_df):
+        """連絡ログのDataFrameから索引を作成します。"""
+        if attendance_df is None or attendance_df.empty or COL_MEMBER_ID not in attendance_df.columns:
+            return cls(pd.DataFrame(columns=[COL_MEMBER_ID, COL_ATTENDANCE_TARGET_DATE, COL_ATTENDANCE_TIMESTAMP]), {})
+        df = attendance_df.dropna(subset=[COL_ATTENDANCE_TIMESTAMP, COL_ATTENDANCE_TARGET_DATE])
+        # 先に (学籍番号, 対象練習日) ごとの最新に絞り、残った行だけを並べ替える
+        records = latest_records(df, [COL_MEMBER_ID, COL_ATTENDANCE_TARGET_DATE]) \
+            .sort_values(by=[COL_MEMBER_ID, COL_ATTENDANCE_TARGET_DATE], ascending=[True, False]) \
+            .reset_index(drop=True)
+        ids = records[COL_MEMBER_ID].to_numpy()
+        boundaries = np.flatnonzero(ids[1:] != ids[:-1]) + 1
+        starts = np.concatenate(([0], boundaries)); ends = np.concatenate((boundaries, [len(ids)]))
+        offsets = {ids[start]: (int(start), int(end)) for start, end in zip(starts, ends)} if len(ids) else {}
+        return cls(records, offsets)
+
+    def query(self, student_id, start_date=None, end_date=None, page=0, page_size=20):
+        """
+        部員1名の「対象練習日ごとの最新の連絡」を対象練習日の新しい順に1ページ分返します。
+        start_date / end_date で対象練習日の期間 (両端を含む) を指定できます。
+        戻り値: (ページのDataFrame, 期間内の総件数)
+        """
+        start, end = self.offsets.get(str(student_id).strip(), (0, 0))
+        if end_date is not None:
+            start = start + int(np.searchsorted(self._neg_target_dates[start:end], -pd.Timestamp(end_date).value, side='left'))
+        if start_date is not None:
+            end = start + int(np.searchsorted(self._neg_target_dates[start:end], -pd.Timestamp(start_date).value, side='right'))
+        total = max(end - start, 0)
+        page_start = start + page * page_size
+        return self.records.iloc[page_start:min(page_start + page_size, end)], total
@@ -0,0 +1,65 @@
+# config.py (アプリとコマンドラインで共有する設定値)
+# -*- coding: utf-8 -*-
+#
+# スプレッドシートID・シート名・コート割り振りの設定をまとめます。
+# DEBUG_MODE は app.py (st.secrets) やコマンドライン引数から起動時に上書きされます。
+
+DEBUG_MODE = False
+
+# --- スプレッドシート情報 ---
+SPREADSHEET_ID = '1jCCxSeECR7NZpCEXwZCDmW_NjcoEzBPg8wqM-IGyIS8' # ★あなたのスプレッドシートID
+MEMBER_SHEET_NAME = '部員リスト'
+ATTENDANCE_SHEET_NAME = '遅刻欠席連絡'
+PARTICIPANT_LIST_SHEET_NAME = '参加者名簿'
+ABSENT_LIST_SHEET_NAME = '欠席者名簿'
+LATE_LIST_SHEET_NAME = '遅刻者名簿' # 新規追加: 遅刻者名簿シート名
+ASSIGNMENT_SHEET_NAME_8 = '割り振り結果_8チーム'
+ASSIGNMENT_SHEET_NAME_12 = '割り振り結果_12チーム'
+ASSIGNMENT_SHEET_NAME_10 = '割り振り結果_10チーム' # 10チーム割り振り結果シート名
+ASSIGNMENT_SHEET_NAME_3 = '割り振り結果_3チーム' # 新規追加: 3チーム割り振り結果シート名
+WEEKLY_PLAN_SHEET_NAME = '週間割り振り計画' # 複数の練習日の割り振りをまとめて書き込むシート (なければ作成)
+CUSTOM_ASSIGNMENT_SHEET_PREFIX = '割り振り結果_' # 追加で指定したチーム数の結果シート (例: 割り振り結果_6チーム、なければ作成)
+PAIR_HISTORY_SHEET_NAME = 'ペア履歴' # 部員のペアが同じチームになった回数の履歴 (なければ作成)
+
+# --- コート割り振り設定 ---
+DEFAULT_PRACTICE_TYPE = 'ノック'
+TEAMS_COUNT_MAP = {'ノック': 8, 'ハンドノック': 10, 'その他': 12, '素振り指導': 3}
+WEEKDAY_LABELS = ['月', '火', '水', '木', '金', '土', '日']
+LOOKUP_PAGE_SIZE = 10 # 連絡確認で1ページに表示する件数
+
+# --- レベル区分と割り振りの優先度 ---
+# レベル区分: (区分名, 含まれるレベル)。チームごとのレベルの集計は区分単位で行います。
+LEVEL_BUCKETS = [('lv6', [6]), ('lv5', [5]), ('lv4', [4]), ('lv1', [1]), ('lv23', [2, 3]), ('lv0', [0])]
+# 割り振る順番 (影響の大きいレベルから)
+LEVEL_PROCESSING_ORDER = [6, 5, 4, 1, 3, 2, 0]
+# 部員を入れるチームを選ぶときの優先項目 (前の項目ほど優先し、値が小さいチームを選びます)。
+#   'size': チームの人数 / 'gender': 部員を加えた後の男女比の偏り / 'late': チームの遅刻者数
+#   'own': 部員と同じ区分の人数 / 区分名 ('lv6' など、'lv6+lv5' のように '+' でつなぐと合計)
+# 'regular' は通常参加者、'late' は遅刻者の設定で、レベルがない場合は 'default' を使います。
+PLACEMENT_PRIORITIES = {
+    'regular': {
+        6: ['lv6', 'size', 'gender'], # まずレベル6を各チームに均等に
+        5: ['lv6+lv5', 'lv5', 'size', 'gender'], # レベル6と5の合計が均等になるように
+        4: ['own', 'size', 'gender'], # レベル4同士がバラバラになるように (人数が少ないチームから)
+        1: ['own', 'size', 'gender'], # レベル1も同様に
+        3: ['size', 'gender'], # 最後にレベル2, 3をチームの人数差が1に収まるように
+        2: ['size', 'gender'],
+        0: ['size', 'gender', 'own'],
+        'default': ['size', 'gender'],
+    },
+    'late': {
+        6: ['lv6', 'late', 'size', 'gender'],
+        5: ['lv6+lv5', 'late', 'lv5', 'size', 'gender'],
+        4: ['own', 'late', 'size', 'gender'],
+        1: ['own', 'late', 'size', 'gender'],
+        3: ['late', 'size', 'gender'], # 遅刻者が各チームに均等になるように
+        2: ['late', 'size', 'gender'],
+        0: ['late', 'size', 'gender'],
+        'default': ['late', 'size', 'gender'],
+    },
+}
+# ペア履歴の重み: 部員をチームに入れる優先度の男女比の項 ('gender') に、そのチームの部員と過去に同じチームになった回数 x この値を加える
+# (0 なら優先度が同点のチームの中での選択にだけ使う。0.25 なら同じチームになった回数4回分が男女比の偏り 1.0 と同じ重さ)
+PAIR_REPEAT_WEIGHT = 0.25
+# ペア履歴に記録する割り振り (3チームの素振り指導は記録しない)
+PAIR_HISTORY_SHEETS = [ASSIGNMENT_SHEET_NAME_8, ASSIGNMENT_SHEET_NAME_10, ASSIGNMENT_SHEET_NAME_12]
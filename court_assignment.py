@@ -0,0 +1,1090 @@
+# court_assignment.py (コート割り振りの処理本体とコマンドライン実行)
+# -*- coding: utf-8 -*-
+#
+# 部員の最終ステータス判定・名簿の作成・各チーム数での割り振りを Streamlit に依存せずに行います。
+# app.py の管理者画面から呼び出すほか、コマンドラインから直接実行できます (cron での事前実行やプロファイル用)。
+#
+#   python court_assignment.py --date 2025-05-10 --exclude-level1
+#   python court_assignment.py --date 2025-05-10 --dry-run --profile
+#   python court_assignment.py --offline ./fixtures --output-dir ./out   # CSV を入力にして認証なしで実行
+
+import argparse
+import cProfile
+import csv
+import datetime
+import hashlib
+import os
+import pstats
+import random
+import sys
+import threading
+from collections import OrderedDict, defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import config
+import instrumentation
+from instrumentation import traced, count_rows
+from schema import (
+    COL_MEMBER_ID, COL_MEMBER_NAME, COL_MEMBER_GRADE, COL_MEMBER_LEVEL, COL_MEMBER_GENDER, COL_MEMBER_DEPARTMENT,
+    COL_ATTENDANCE_TARGET_DATE, COL_ATTENDANCE_STATUS, COL_ATTENDANCE_LATE_TIME, COL_ATTENDANCE_REASON,
+    MEMBER_SCHEMA, ATTENDANCE_SCHEMA, MEMBER_COLUMNS, ATTENDANCE_ASSIGNMENT_COLUMNS, concat_frames,
+)
+from attendance_store import archive_sheet_name, archive_months_from_titles, months_for_target_date, latest_records
+from sheet_reader import read_frame
+from sheet_writer import write_grid, ensure_worksheet, sheet_size
+from pair_history import PairHistory, RECENT_RECORDS_KEPT
+
+def calculate_imbalance_score(male_count, female_count):
+    """
+    チームの男女比の偏りを数値で評価します。
+    男性または女性のみのチーム、または人数が少ないチームでも機能するように設計されています。
+    スコアが高いほど偏りが大きいことを示します。
+    """
+    if male_count == 0 and female_count == 0:
+        return 0.0 # 空のチームは偏りなし
+    if male_count == 0: # 女性のみのチーム
+        return float(female_count) # 女性の数で偏りを評価
+    if female_count == 0: # 男性のみのチーム
+        return float(male_count) # 男性の数で偏りを評価
+    # どちらも0でない場合、大きい方を小さい方で割ることで偏りを数値化
+    # 割り算でゼロ除算を避けるためにminが0でないことを確認
+    if min(male_count, female_count) == 0: # 片方が0でもう片方は0でない場合
+        return max(male_count, female_count) * 1000.0 # 非常に高いペナルティ
+    return max(male_count, female_count) / min(male_count, female_count)
+
+@traced("rebalance_teams_by_gender_and_level")
+def rebalance_teams_by_gender_and_level(teams, team_stats, late_member_ids, max_iterations=10, rng=random): # Iterations increased for more attempts
+    """
+    チーム間の男女比、レベル、遅刻者数の偏りを、同レベル・同性別の部員を交換することで再調整します。
+    チームの人数とレベル分布は維持されます。遅刻者は交換の対象外とします。
+    rng は交換候補の選択に使う乱数生成器です (random.Random を渡すと結果を再現できます)。
+    """
+    if config.DEBUG_MODE: print("\n性別・レベル・遅刻者均等化のためのチーム再調整を開始...")
+    count_rows(sum(len(members) for members in teams.values()))
+
+    # For accurate statistics during rebalancing, re-calculate stats from current teams
+    def update_stats_from_teams(current_teams, current_team_stats):
+        capacities = {name: stats.get('capacity') for name, stats in current_team_stats.items()}
+        return _team_stats_from_teams(current_teams, late_member_ids, team_names=current_team_stats, capacities=capacities)
+
+    # Make a copy of team_stats to update it consistently during rebalancing
+    current_team_stats = {k: v.copy() for k, v in team_stats.items()}
+
+    for iteration in range(max_iterations):
+        swapped_in_iteration = False
+        team_names = list(teams.keys())
+        rng.shuffle(team_names)
+
+        # Recalculate stats for current iteration to reflect previous swaps
+        current_team_stats = update_stats_from_teams(teams, current_team_stats)
+        
+        # Determine average latecomers and standard deviation for robust imbalance check
+        late_counts = {name: stats['late_count'] for name, stats in current_team_stats.items()}
+        team_sizes = {name: stats['count'] for name, stats in current_team_stats.items()}
+        
+        if not late_counts: continue # No teams to rebalance
+
+        avg_late = sum(late_counts.values()) / len(late_counts)
+        
+        # --- 1. 遅刻者数の均等化を最優先で試みる ---
+        # Find teams with more latecomers than allowed max_diff (e.g., 1)
+        max_late_count = max(late_counts.values())
+        min_late_count = min(late_counts.values())
+
+        if max_late_count - min_late_count > 1: # Only try to balance if difference is > 1
+            high_late_teams = sorted([name for name, count in late_counts.items() if count == max_late_count], key=lambda k: late_counts[k], reverse=True)
+            low_late_teams = sorted([name for name, count in late_counts.items() if count == min_late_count], key=lambda k: late_counts[k])
+            
+            for team_a_name in high_late_teams:
+                for team_b_name in low_late_teams:
+                    if team_a_name == team_b_name: continue
+                    if team_sizes[team_a_name] < 1 or team_sizes[team_b_name] < 1: continue # Avoid empty teams
+
+                    # team_a から遅刻者を探す
+                    candidate_late_member = None
+                    members_in_team_a = teams[team_a_name].copy() # Copy to iterate and modify original list
+                    rng.shuffle(members_in_team_a) 
+
+                    for m_late in members_in_team_a:
+                        if m_late.get(COL_MEMBER_ID) in late_member_ids: # team A から遅刻者
+                            # team_b から非遅刻者を探す（同レベル・同性別）
+                            candidate_non_late_member = None
+                            members_in_team_b = teams[team_b_name].copy() # Copy
+                            rng.shuffle(members_in_team_b)
+
+                            for m_non_late in members_in_team_b:
+                                if m_non_late.get(COL_MEMBER_ID) not in late_member_ids and \
+                                   pd.notna(m_late.get(COL_MEMBER_LEVEL)) and \
+                                   pd.notna(m_non_late.get(COL_MEMBER_LEVEL)) and \
+                                   int(m_late.get(COL_MEMBER_LEVEL, -1)) == int(m_non_late.get(COL_MEMBER_LEVEL, -1)) and \
+                                   m_late.get(COL_MEMBER_GENDER) == m_non_late.get(COL_MEMBER_GENDER):
+                                    # Ensure this swap improves overall late count balance
+                                    # And doesn't drastically worsen other balances (gender, size)
+                                    temp_teams_after_swap = {k: v[:] for k,v in teams.items()} # Deep copy
+                                    temp_teams_after_swap[team_a_name].remove(m_late)
+                                    temp_teams_after_swap[team_a_name].append(m_non_late)
+                                    temp_teams_after_swap[team_b_name].remove(m_non_late)
+                                    temp_teams_after_swap[team_b_name].append(m_late)
+                                    
+                                    temp_stats_after_swap = update_stats_from_teams(temp_teams_after_swap, {k: v.copy() for k,v in team_stats.items()})
+                                    new_max_late = max(temp_stats_after_swap[n]['late_count'] for n in team_names)
+                                    new_min_late = min(temp_stats_after_swap[n]['late_count'] for n in team_names)
+
+                                    if new_max_late - new_min_late < (max_late_count - min_late_count):
+                                        candidate_late_member = m_late
+                                        candidate_non_late_member = m_non_late
+                                        break
+                            if candidate_late_member: break
+
+                    if candidate_late_member and candidate_non_late_member:
+                        # 実際に交換
+                        teams[team_a_name].remove(candidate_late_member)
+                        teams[team_a_name].append(candidate_non_late_member)
+                        teams[team_b_name].remove(candidate_non_late_member)
+                        teams[team_b_name].append(candidate_late_member)
+
+                        # 統計を更新
+                        current_team_stats = update_stats_from_teams(teams, current_team_stats)
+                        
+                        swapped_in_iteration = True
+                        if config.DEBUG_MODE:
+                            print(f"DEBUG: 遅刻者バランス調整 (Lv:{int(candidate_late_member.get(COL_MEMBER_LEVEL,-1))}, Gender:{candidate_late_member.get(COL_MEMBER_GENDER)}): {candidate_late_member.get(COL_MEMBER_NAME)} from {team_a_name} (late:{late_counts[team_a_name]}) swapped with {candidate_non_late_member.get(COL_MEMBER_NAME)} from {team_b_name} (late:{late_counts[team_b_name]}). New: {team_a_name} (late:{current_team_stats[team_a_name]['late_count']}), {team_b_name} (late:{current_team_stats[team_b_name]['late_count']}).")
+                        break # Go to next iteration to re-evaluate all balances
+                if swapped_in_iteration:
+                    break # Break from outer loop (team_a_name), re-start iteration loop
+        
+        # --- 2. 性別・レベルの均等化を試みる (遅刻者数の差が1以下の場合、または遅刻者調整ができなかった場合) ---
+        if not swapped_in_iteration: # Only proceed if no latecomer swaps were made in this iteration
+            for team_a_name in team_names:
+                team_a_stats = current_team_stats[team_a_name]
+
+                if team_a_stats['count'] < 2:
+                    continue
+
+                current_imbalance_a = calculate_imbalance_score(team_a_stats['male_count'], team_a_stats['female_count'])
+
+                if current_imbalance_a < 1.5: # Only rebalance if gender is significantly imbalanced
+                    continue
+
+                gender_to_swap_out_a = '男性' if team_a_stats['male_count'] > team_a_stats['female_count'] else '女性'
+                gender_to_swap_in_a = '女性' if gender_to_swap_out_a == '男性' else '男性'
+
+                member_a_candidate = None
+                members_of_gender_to_swap_out_a = [m for m in teams[team_a_name] if m.get(COL_MEMBER_GENDER) == gender_to_swap_out_a and m.get(COL_MEMBER_ID) not in late_member_ids]
+                if not members_of_gender_to_swap_out_a:
+                    continue
+                member_a_candidate = rng.choice(members_of_gender_to_swap_out_a)
+                level_a = member_a_candidate.get(COL_MEMBER_LEVEL)
+                if pd.isna(level_a): continue
+                level_a = int(level_a)
+
+                for team_b_name in team_names:
+                    if team_a_name == team_b_name: continue
+                    team_b_stats = current_team_stats[team_b_name]
+
+                    if team_b_stats['count'] < 2:
+                        continue
+
+                    member_b_candidate = None
+                    members_of_gender_to_swap_in_a_from_b = [m for m in teams[team_b_name] if m.get(COL_MEMBER_GENDER) == gender_to_swap_in_a and int(m.get(COL_MEMBER_LEVEL, -1)) == level_a and m.get(COL_MEMBER_ID) not in late_member_ids]
+                    if members_of_gender_to_swap_in_a_from_b:
+                        member_b_candidate = rng.choice(members_of_gender_to_swap_in_a_from_b)
+
+                    if member_b_candidate:
+                        # Simulate swap and check new imbalance scores
+                        new_male_a = team_a_stats['male_count'] - (1 if gender_to_swap_out_a == '男性' else 0) + (1 if gender_to_swap_in_a == '男性' else 0)
+                        new_female_a = team_a_stats['female_count'] - (1 if gender_to_swap_out_a == '女性' else 0) + (1 if gender_to_swap_in_a == '女性' else 0)
+                        new_imbalance_a = calculate_imbalance_score(new_male_a, new_female_a)
+
+                        new_male_b = team_b_stats['male_count'] - (1 if gender_to_swap_in_a == '男性' else 0) + (1 if gender_to_swap_out_a == '男性' else 0)
+                        new_female_b = team_b_stats['female_count'] - (1 if gender_to_swap_in_a == '女性' else 0) + (1 if gender_to_swap_out_a == '女性' else 0)
+                        new_imbalance_b = calculate_imbalance_score(new_male_b, new_female_b)
+                        
+                        # Only swap if it actually improves overall gender balance
+                        if (new_imbalance_a < current_imbalance_a and new_imbalance_b < 1.5 * calculate_imbalance_score(team_b_stats['male_count'], team_b_stats['female_count'])) or \
+                           (new_imbalance_a + new_imbalance_b < calculate_imbalance_score(team_a_stats['male_count'], team_a_stats['female_count']) + calculate_imbalance_score(team_b_stats['male_count'], team_b_stats['female_count'])):
+                            
+                            # Perform swap
+                            teams[team_a_name].remove(member_a_candidate)
+                            teams[team_a_name].append(member_b_candidate)
+                            teams[team_b_name].remove(member_b_candidate)
+                            teams[team_b_name].append(member_a_candidate)
+
+                            # Update stats
+                            current_team_stats = update_stats_from_teams(teams, current_team_stats)
+                            
+                            swapped_in_iteration = True
+                            if config.DEBUG_MODE:
+                                print(f"DEBUG: 性別/レベル調整: {member_a_candidate.get(COL_MEMBER_NAME)} (L{level_a}, {gender_to_swap_out_a}) を {team_a_name} から "
+                                      f"{member_b_candidate.get(COL_MEMBER_NAME)} (L{level_a}, {gender_to_swap_in_a}) を {team_b_name} と交換しました。")
+                                print(f"DEBUG: {team_a_name} の統計: {current_team_stats[team_a_name]['male_count']}M/{current_team_stats[team_a_name]['female_count']}F (新偏り: {new_imbalance_a:.2f})")
+                                print(f"DEBUG: {team_b_name} の統計: {current_team_stats[team_b_name]['male_count']}M/{current_team_stats[team_b_name]['female_count']}F (新偏り: {new_imbalance_b:.2f})")
+                            break # Break from inner loop (team_b_name), re-evaluate team_names in next outer loop
+                if swapped_in_iteration:
+                    break # Break from outer loop (team_a_name), re-start iteration loop
+        
+        if not swapped_in_iteration:
+            # If no swaps were made in this entire iteration (neither latecomer nor gender/level), stop rebalancing
+            if config.DEBUG_MODE: print(f"DEBUG: イテレーション {iteration+1} で交換が行われなかったため、再調整を停止します。")
+            break
+
+    if config.DEBUG_MODE: print("性別・レベル・遅刻者均等化のためのチーム再調整が完了しました。")
+    return teams
+
+# === レベル区分と配置の優先度 ===
+# config.LEVEL_BUCKETS / config.PLACEMENT_PRIORITIES をレベル -> 区分番号の対応表と、優先項目を計算する関数の列に変換しておきます。
+# チームの集計はレベル区分ごとの人数をリスト (stats['levels']) で持ち、区分の追加・変更でコードの分岐は増えません。
+class LevelRules:
+    """レベル区分と配置の優先度の設定を、割り振りで使う形に変換したもの。"""
+    def __init__(self, buckets, priorities, processing_order):
+        self.bucket_names = [name for name, _ in buckets]
+        self.bucket_labels = ['Lv' + '/'.join(str(level) for level in levels) for _, levels in buckets]
+        self.bucket_index = {name: i for i, name in enumerate(self.bucket_names)}
+        self.level_to_bucket = {level: i for i, (_, levels) in enumerate(buckets) for level in levels}
+        self.processing_order = list(processing_order)
+        # 部員を処理する回 (processing_order のレベルの後に、どのレベルにも当たらない部員の回 None を加える)
+        self.processing_passes = self.processing_order + [None]
+        # ベクトル化した集計用の対応表 (レベル -> 区分番号、どの区分にも入らないレベルは -1)
+        max_level = max(self.level_to_bucket, default=0)
+        self.bucket_table = np.full(max_level + 1, -1, dtype=np.int64)
+        for level, i in self.level_to_bucket.items():
+            if level >= 0: self.bucket_table[level] = i
+        self.terms = {kind: {level: tuple(self._compile_term(term) for term in terms) for level, terms in rules.items()}
+                      for kind, rules in priorities.items()}
+
+    def _compile_term(self, term):
+        if term == 'size': return lambda stats, gender_score, own: stats['count'] * stats['size_weight'] # 定員が小さいチームほど重く数える
+        if term == 'gender': return lambda stats, gender_score, own: gender_score
+        if term == 'late': return lambda stats, gender_score, own: stats['late_count']
+        if term == 'own': return lambda stats, gender_score, own: stats['levels'][own] if own is not None else 0
+        try: indexes = tuple(self.bucket_index[name] for name in term.split('+'))
+        except KeyError as e: raise ValueError(f"配置の優先項目 '{term}' のレベル区分 {e} が LEVEL_BUCKETS にありません。")
+        if len(indexes) == 1:
+            i = indexes[0]; return lambda stats, gender_score, own: stats['levels'][i]
+        return lambda stats, gender_score, own: sum(stats['levels'][i] for i in indexes)
+
+    def bucket_of(self, level):
+        """レベルの区分番号を返します (区分に入らないレベルや欠損値は None)。"""
+        return self.level_to_bucket.get(level)
+
+    def bucket_indexes(self, levels):
+        """レベルの配列を区分番号の配列に変換します (区分に入らないレベルや欠損値は -1)。"""
+        levels = pd.to_numeric(pd.Series(levels, dtype=object), errors='coerce').fillna(-1).to_numpy(dtype=np.int64)
+        in_table = (levels >= 0) & (levels < len(self.bucket_table))
+        return np.where(in_table, self.bucket_table[np.where(in_table, levels, 0)], -1)
+
+    def processing_level(self, level):
+        """
+        部員を処理する回 (processing_passes) を返します。
+        processing_order にないレベル (欠損値・-1 を含む) は None で、最後の回に 'default' の優先項目で配置します。
+        """
+        try: level = int(level)
+        except (TypeError, ValueError): return None
+        return level if level in self.processing_order else None
+
+    def placement_terms(self, is_late_member, level):
+        rules = self.terms['late' if is_late_member else 'regular']
+        return rules.get(level, rules['default'])
+
+    def describe(self, stats):
+        """デバッグ表示用に区分ごとの人数を文字列にします。"""
+        return ', '.join(f"{label}:{count}" for label, count in zip(self.bucket_labels, stats['levels']))
+
+LEVEL_RULES = LevelRules(config.LEVEL_BUCKETS, config.PLACEMENT_PRIORITIES, config.LEVEL_PROCESSING_ORDER)
+LEVEL_PROCESSING_ORDER = LEVEL_RULES.processing_order # Order of levels for assignment
+
+def _new_team_stats(capacity=None, size_weight=1):
+    return {'count': 0, 'levels': [0] * len(LEVEL_RULES.bucket_names), 'male_count': 0, 'female_count': 0, 'late_count': 0,
+            'capacity': capacity, 'size_weight': size_weight}
+
+def team_capacity_map(team_capacities, num_teams=None):
+    """
+    チームごとの定員を {チーム名: 定員} にします。
+    team_capacities はチーム 1 から順の定員のリスト (None の要素は定員なし) か、{チーム名: 定員} の辞書です。
+    """
+    if not team_capacities: return {}
+    if isinstance(team_capacities, dict): return dict(team_capacities)
+    capacities = list(team_capacities)[:num_teams] if num_teams is not None else list(team_capacities)
+    return {f"チーム {i+1}": capacity for i, capacity in enumerate(capacities)}
+
+def _size_weights(capacities):
+    """
+    定員から、人数の均等化に使う重み {チーム名: 重み} を計算します。
+    重みは「最大の定員 / チームの定員」で、定員の小さいチームは同じ人数でも埋まっているとみなされます (定員なしのチームは1)。
+    定員が指定されていなければ重みはすべて整数の1で、定員なしの割り振りと同じ結果になります。
+    """
+    limited = [capacity for capacity in capacities.values() if capacity]
+    if not limited: return {name: 1 for name in capacities}
+    largest = max(limited)
+    return {name: (largest / capacity if capacity else 1.0) for name, capacity in capacities.items()}
+
+def _add_member_to_team_stats(stats, member_dict, is_late_member=False, sign=1):
+    """チームの集計に部員1名を加えます (sign=-1 で取り除きます)。"""
+    stats['count'] += sign
+    bucket = LEVEL_RULES.bucket_of(member_dict.get(COL_MEMBER_LEVEL))
+    if bucket is not None: stats['levels'][bucket] += sign
+    stats['male_count' if member_dict.get(COL_MEMBER_GENDER) == '男性' else 'female_count'] += sign
+    if is_late_member: stats['late_count'] += sign
+
+def _team_stats_from_teams(teams, late_member_ids, team_names=None, capacities=None):
+    """
+    チーム構成から各チームの集計を作り直します (team_names を指定するとそのチームだけ、部員がいなくても集計を返します)。
+    全チームの部員をまとめて区分番号に変換し、bincount で人数を数えます。capacities は {チーム名: 定員} です。
+    """
+    team_names = list(teams) if team_names is None else list(team_names)
+    capacities = {name: (capacities or {}).get(name) for name in team_names}
+    size_weights = _size_weights(capacities)
+    members = [(t, m) for t, name in enumerate(team_names) for m in teams.get(name, [])]
+    num_teams, num_buckets = len(team_names), len(LEVEL_RULES.bucket_names)
+    team_index = np.fromiter((t for t, _ in members), dtype=np.int64, count=len(members))
+    buckets = LEVEL_RULES.bucket_indexes([m.get(COL_MEMBER_LEVEL) for _, m in members])
+    is_male = np.fromiter((m.get(COL_MEMBER_GENDER) == '男性' for _, m in members), dtype=bool, count=len(members))
+    is_late = np.fromiter((m.get(COL_MEMBER_ID) in late_member_ids for _, m in members), dtype=bool, count=len(members))
+    has_bucket = buckets >= 0
+    level_counts = np.bincount(team_index[has_bucket] * num_buckets + buckets[has_bucket], minlength=num_teams * num_buckets).reshape(num_teams, num_buckets)
+    counts = np.bincount(team_index, minlength=num_teams)
+    male_counts = np.bincount(team_index[is_male], minlength=num_teams)
+    late_counts = np.bincount(team_index[is_late], minlength=num_teams)
+    return {name: {'count': int(counts[t]), 'levels': level_counts[t].tolist(), 'male_count': int(male_counts[t]),
+                   'female_count': int(counts[t] - male_counts[t]), 'late_count': int(late_counts[t]),
+                   'capacity': capacities[name], 'size_weight': size_weights[name]}
+            for t, name in enumerate(team_names)}
+
+def _placement_score(stats, member_data, level_to_process, is_late_member, pair_repeats=0):
+    """
+    部員を stats のチームに入れる場合の優先度を返します (タプルで、小さいほど優先)。
+    通常参加者と遅刻者で、レベルごとに優先する項目が異なります (config.PLACEMENT_PRIORITIES)。
+    pair_repeats (チームの部員と過去に同じチームになった回数) は config.PAIR_REPEAT_WEIGHT を掛けて男女比の項に加えます。
+    """
+    is_male = (member_data.get(COL_MEMBER_GENDER) == '男性')
+    # Gender balance (deviation from overall target ratio)
+    score_gender_imbalance = calculate_imbalance_score(
+        stats['male_count'] + (1 if is_male else 0),
+        stats['female_count'] + (1 if not is_male else 0)
+    ) + config.PAIR_REPEAT_WEIGHT * pair_repeats
+    own_bucket = LEVEL_RULES.bucket_of(member_data.get(COL_MEMBER_LEVEL))
+    return tuple(term(stats, score_gender_imbalance, own_bucket) for term in LEVEL_RULES.placement_terms(is_late_member, level_to_process))
+
+def _best_team_for_member(team_stats, member_data, level_to_process, is_late_member, pair_penalty=None):
+    """
+    優先度が最も高い (スコアが最小の) チーム名を返します。
+    pair_penalty(チーム名) (過去に同じチームになった回数) は重みを掛けて優先度に含め (_placement_score)、
+    同点の場合も回数が少ないチーム、さらに同点ならチーム名の順で決まります。
+    定員に達したチームは選びません (全チームが定員に達している場合は全チームから選びます)。
+    """
+    candidates = [(team_name, stats) for team_name, stats in team_stats.items() if not stats['capacity'] or stats['count'] < stats['capacity']] or team_stats.items()
+    scored = []
+    for team_name, stats in candidates:
+        repeats = pair_penalty(team_name) if pair_penalty else 0
+        scored.append((_placement_score(stats, member_data, level_to_process, is_late_member, repeats), repeats, team_name))
+    return min(scored)[2]
+
+def _pair_penalty_for(pair_history, teams, member_data):
+    """pair_history から、member_data の部員と各チームの部員が過去に同じチームになった回数を返す関数を作ります。"""
+    if pair_history is None: return None
+    member_id = member_data.get(COL_MEMBER_ID)
+    return lambda team_name: pair_history.repeat_count(member_id, [m.get(COL_MEMBER_ID) for m in teams.get(team_name, [])])
+
+@traced("assign_teams")
+def assign_teams(members_pool_df, late_member_ids, num_teams, assignment_type="general", seed=None, pair_history=None, team_capacities=None):
+    """
+    レベル、遅刻者、性別の均等性を考慮した改善版割り振り関数。
+    割り振り手順：
+    1. 全参加者を「通常参加者」と「遅刻者」に分ける。
+    2. 通常参加者をレベル順に、遅刻者をレベル順に割り振る (割り振りの順番にないレベルや未設定の部員は、それぞれ最後に割り振る)。
+    3. 各部員を割り振る際、チームの現在の状態に基づいて最適なチームをスコアリングで決定する。
+    4. 最終的な性別・レベルの偏りを再調整する（遅刻者は動かさない）。
+    seed を指定すると、同じ入力に対して同じ結果になります。
+    pair_history (pair_history.PairHistory) を指定すると、過去に同じチームになった回数を重み (config.PAIR_REPEAT_WEIGHT) を掛けて優先度に含め、同じ部員の組み合わせを避けます。
+    team_capacities はチームごとの定員 (チーム 1 から順のリストまたは {チーム名: 定員}) で、サイドコートなど人数の少ないチームに使います。
+    人数の均等化は定員に対する割合で行い、定員に達したチームには割り振りません。
+    """
+    rng = random.Random(seed) if seed is not None else random
+    if config.DEBUG_MODE: print(f"\nコート割り振り開始 ({assignment_type} - {num_teams}チーム)... 参加者 {len(members_pool_df)} 名")
+    count_rows(len(members_pool_df))
+    if members_pool_df.empty:
+        if config.DEBUG_MODE: print("参加者がいないため、割り振りできません。")
+        return {}
+
+    required_cols = [COL_MEMBER_ID, COL_MEMBER_NAME, COL_MEMBER_GRADE, COL_MEMBER_LEVEL, COL_MEMBER_GENDER]
+    missing_cols = [col for col in required_cols if col not in members_pool_df.columns]
+    if missing_cols:
+        print(f"ERROR: Missing required columns in member list: {missing_cols}")
+        return {}
+
+    total_members = len(members_pool_df)
+    actual_num_teams = min(num_teams, total_members)
+    if actual_num_teams <= 0:
+        if config.DEBUG_MODE: print("割り当て可能なチーム数が0です。"); return {}
+    if actual_num_teams != num_teams:
+        print(f"参加者数 ({total_members}名) に基づき、チーム数を {actual_num_teams} に調整。")
+        if actual_num_teams == 0: return {} # 調整の結果チーム数が0になった場合
+
+    # 参加者全体の男女比
+    total_male_present = len(members_pool_df[members_pool_df[COL_MEMBER_GENDER] == '男性'])
+    total_present_members = len(members_pool_df)
+    target_male_ratio_total = total_male_present / total_present_members if total_present_members > 0 else 0.5
+    if config.DEBUG_MODE: print(f"参加者全体の男性比率: {target_male_ratio_total:.2f}")
+
+    # NaNを-1として扱うことで、to_numericが失敗してもint()に変換できるようになる
+    members_pool_df[COL_MEMBER_LEVEL] = pd.to_numeric(members_pool_df[COL_MEMBER_LEVEL], errors='coerce').fillna(-1).astype(int)
+    unknown_levels = sum(1 for level in members_pool_df[COL_MEMBER_LEVEL] if LEVEL_RULES.processing_level(level) is None)
+    if unknown_levels: print(f"警告: レベルが未設定または割り振りの順番にない部員 ({unknown_levels}名) は、最後に 'default' の優先項目で割り振ります。")
+    if config.DEBUG_MODE:
+        # 各レベル区分の総数 (区分番号の配列を1回の bincount で数える)
+        buckets = LEVEL_RULES.bucket_indexes(members_pool_df[COL_MEMBER_LEVEL])
+        bucket_totals = np.bincount(buckets[buckets >= 0], minlength=len(LEVEL_RULES.bucket_names))
+        print("レベル区分ごとの参加者数: " + ', '.join(f"{label}:{total}" for label, total in zip(LEVEL_RULES.bucket_labels, bucket_totals)) + f", 遅刻:{len(late_member_ids)}")
+
+    teams = defaultdict(list)
+    # team_statsを初期化
+    team_names = [f"チーム {i+1}" for i in range(actual_num_teams)]
+    capacities = {name: team_capacity_map(team_capacities, actual_num_teams).get(name) for name in team_names}
+    if any(capacities.values()) and all(capacities.values()) and sum(capacities.values()) < total_members:
+        print(f"警告: 定員の合計 ({sum(capacities.values())}名) が参加者数 ({total_members}名) より少ないため、定員を超えて割り振ります。")
+    size_weights = _size_weights(capacities)
+    team_stats = {name: _new_team_stats(capacities[name], size_weights[name]) for name in team_names}
+
+    # Helper function to assign a member and update stats
+    def assign_single_member_to_team(member_dict, target_team_name, is_late_member=False):
+        teams[target_team_name].append(member_dict)
+        _add_member_to_team_stats(team_stats[target_team_name], member_dict, is_late_member)
+
+    all_members_data = members_pool_df.to_dict('records')
+
+    # Separate members by their status (late/regular)
+    late_members_categorized = [m for m in all_members_data if m.get(COL_MEMBER_ID) in late_member_ids]
+    regular_members_categorized = [m for m in all_members_data if m.get(COL_MEMBER_ID) not in late_member_ids]
+
+    # --- 割り振り実行 (レベル順に部員を処理し、最適なチームに割り振る) ---
+    # まず通常参加者を、次に遅刻者をレベル順に割り振る
+    for members_categorized, is_late_member in ((regular_members_categorized, False), (late_members_categorized, True)):
+        for level_to_process in LEVEL_RULES.processing_passes:
+            members_at_this_level = [m for m in members_categorized if LEVEL_RULES.processing_level(m.get(COL_MEMBER_LEVEL)) == level_to_process]
+            rng.shuffle(members_at_this_level) # Shuffle to add randomness and break ties for better distribution
+            for member_data in members_at_this_level:
+                target_team_name = _best_team_for_member(team_stats, member_data, level_to_process, is_late_member, _pair_penalty_for(pair_history, teams, member_data))
+                assign_single_member_to_team(member_data, target_team_name, is_late_member=is_late_member)
+                if config.DEBUG_MODE: print(f"-> {'遅刻' if is_late_member else '通常'}: {member_data.get(COL_MEMBER_NAME, '?')} (L{int(member_data.get(COL_MEMBER_LEVEL, 0)) if pd.notna(member_data.get(COL_MEMBER_LEVEL)) else '?'}, {member_data.get(COL_MEMBER_GENDER, '?')}) を {target_team_name} に割り振り。")
+
+    if config.DEBUG_MODE: print("\n一次割り振りループ完了。")
+
+    # 最終的なバランス調整 (性別・レベルの偏りをさらに調整、遅刻者は動かさない)
+    # Request 8: 最後に男女比調整のために交換を実施する。
+    teams = rebalance_teams_by_gender_and_level(teams, team_stats, late_member_ids, rng=rng)
+
+    if config.DEBUG_MODE:
+        # 正確なデバッグ出力のために、最終的なチーム構成から統計を再計算する
+        print("\n最終的なチーム統計を再計算中...")
+        team_stats = _team_stats_from_teams(teams, late_member_ids, team_names=team_stats)
+
+        print(f"\n--- チーム割り振り最終結果 ({assignment_type} - {num_teams}チーム) ---")
+        total_assigned = 0
+        for team_name in sorted(teams.keys(), key=lambda name: int(name.split()[-1])):
+            members_in_team = teams[team_name]
+            total_assigned += len(members_in_team)
+            member_names = [f"{m.get(COL_MEMBER_NAME, '?')} (L{int(m.get(COL_MEMBER_LEVEL, 0)) if pd.notna(m.get(COL_MEMBER_LEVEL)) else '?'})" for m in members_in_team]
+            stats = team_stats[team_name]
+            print(f" {team_name} ({len(members_in_team)}名, {LEVEL_RULES.describe(stats)}, 男:{stats['male_count']}, 女:{stats['female_count']}, 遅刻:{stats['late_count']}): {', '.join(member_names)}")
+        print("---------------------------------")
+        expected_count_for_debug = len(members_pool_df)
+        print(f"合計割り当て人数: {total_assigned} (期待値: {expected_count_for_debug})")
+        if total_assigned != expected_count_for_debug:
+            print(f"警告: 割り当て人数が期待値と異なります。")
+
+    return dict(teams)
+
+@traced("repair_assignment")
+def repair_assignment(teams, members_to_add, member_ids_to_remove, late_member_ids, pair_history=None, team_capacities=None):
+    """
+    既存の割り振り結果から指定した部員を外し、追加する部員だけを配置します (他の部員は動かしません)。
+    追加する部員は assign_teams と同じ優先度 (team_capacities があれば定員も同じ扱い) で、通常参加者 -> 遅刻者の順にレベル順で配置します。
+    members_to_add: 部員の辞書のリスト / member_ids_to_remove: 外す部員の学籍番号の集合
+    戻り値: (新しい割り振り結果, 変更のあったチーム名の集合)
+    """
+    repaired = {name: [m for m in members if m.get(COL_MEMBER_ID) not in member_ids_to_remove] for name, members in teams.items()}
+    changed_teams = {name for name in teams if len(repaired[name]) != len(teams[name])}
+    team_stats = _team_stats_from_teams(repaired, late_member_ids, capacities=team_capacity_map(team_capacities, len(repaired)))
+    if not team_stats: return repaired, changed_teams
+
+    for is_late_member in (False, True):
+        for level_to_process in LEVEL_RULES.processing_passes:
+            for member_data in members_to_add:
+                if (member_data.get(COL_MEMBER_ID) in late_member_ids) != is_late_member: continue
+                if LEVEL_RULES.processing_level(member_data.get(COL_MEMBER_LEVEL)) != level_to_process: continue
+                target_team_name = _best_team_for_member(team_stats, member_data, level_to_process, is_late_member, _pair_penalty_for(pair_history, repaired, member_data))
+                repaired[target_team_name].append(member_data)
+                _add_member_to_team_stats(team_stats[target_team_name], member_data, is_late_member)
+                changed_teams.add(target_team_name)
+                if config.DEBUG_MODE: print(f"-> 追加: {member_data.get(COL_MEMBER_NAME, '?')} を {target_team_name} に割り振り。")
+    count_rows(len(members_to_add) + len(member_ids_to_remove))
+    return repaired, changed_teams
+
+def _swap_members(teams, team_a_name, member_a, team_b_name, member_b):
+    teams[team_a_name][teams[team_a_name].index(member_a)] = member_b
+    teams[team_b_name][teams[team_b_name].index(member_b)] = member_a
+
+@traced("local_rebalance")
+def local_rebalance(teams, late_member_ids, focus_teams, max_swaps=2):
+    """
+    focus_teams (変更のあったチーム) を含む交換だけで、遅刻者数と男女比の偏りを再調整します。
+    rebalance_teams_by_gender_and_level と同じく同レベル・同性別 (男女比の調整では同レベル・異性) の部員を交換しますが、
+    乱数を使わず、改善幅が最も大きい交換から最大 max_swaps 回だけ行います。
+    戻り値: 交換で移動した部員の学籍番号の集合 (teams はその場で更新されます)
+    """
+    moved_ids = set()
+    for _ in range(max_swaps):
+        team_stats = _team_stats_from_teams(teams, late_member_ids)
+        late_counts = {name: stats['late_count'] for name, stats in team_stats.items()}
+        best = None # (改善幅, チームA, 部員A, チームB, 部員B)
+
+        # --- 1. 遅刻者数の差が1を超える場合、遅刻者と同レベル・同性別の通常参加者を交換する ---
+        if late_counts and max(late_counts.values()) - min(late_counts.values()) > 1:
+            spread = max(late_counts.values()) - min(late_counts.values())
+            for team_a_name in sorted(focus_teams):
+                for team_b_name in sorted(teams):
+                    if team_a_name == team_b_name: continue
+                    high, low = (team_a_name, team_b_name) if late_counts[team_a_name] > late_counts[team_b_name] else (team_b_name, team_a_name)
+                    if late_counts[high] - late_counts[low] < 2: continue
+                    new_counts = dict(late_counts, **{high: late_counts[high] - 1, low: late_counts[low] + 1})
+                    gain = spread - (max(new_counts.values()) - min(new_counts.values()))
+                    if gain <= 0 or (best is not None and gain <= best[0]): continue
+                    for m_late in teams[high]:
+                        if m_late.get(COL_MEMBER_ID) not in late_member_ids or pd.isna(m_late.get(COL_MEMBER_LEVEL)): continue
+                        m_regular = next((m for m in teams[low] if m.get(COL_MEMBER_ID) not in late_member_ids
+                                          and pd.notna(m.get(COL_MEMBER_LEVEL)) and int(m.get(COL_MEMBER_LEVEL)) == int(m_late.get(COL_MEMBER_LEVEL))
+                                          and m.get(COL_MEMBER_GENDER) == m_late.get(COL_MEMBER_GENDER)), None)
+                        if m_regular is not None:
+                            best = (gain, high, m_late, low, m_regular); break
+
+        # --- 2. 男女比の偏りが大きいチームについて、同レベル・異性の通常参加者を交換する ---
+        if best is None:
+            for team_a_name in sorted(focus_teams):
+                stats_a = team_stats[team_a_name]
+                imbalance_a = calculate_imbalance_score(stats_a['male_count'], stats_a['female_count'])
+                if stats_a['count'] < 2 or imbalance_a < 1.5: continue # rebalance_teams_by_gender_and_level と同じ基準
+                gender_out = '男性' if stats_a['male_count'] > stats_a['female_count'] else '女性'
+                for team_b_name in sorted(teams):
+                    stats_b = team_stats[team_b_name]
+                    if team_b_name == team_a_name or stats_b['count'] < 2: continue
+                    delta_male = -1 if gender_out == '男性' else 1
+                    before = imbalance_a + calculate_imbalance_score(stats_b['male_count'], stats_b['female_count'])
+                    after = calculate_imbalance_score(stats_a['male_count'] + delta_male, stats_a['female_count'] - delta_male) + \
+                            calculate_imbalance_score(stats_b['male_count'] - delta_male, stats_b['female_count'] + delta_male)
+                    gain = before - after
+                    if gain <= 0 or (best is not None and gain <= best[0]): continue
+                    for member_a in teams[team_a_name]:
+                        if member_a.get(COL_MEMBER_GENDER) != gender_out or member_a.get(COL_MEMBER_ID) in late_member_ids or pd.isna(member_a.get(COL_MEMBER_LEVEL)): continue
+                        member_b = next((m for m in teams[team_b_name] if m.get(COL_MEMBER_GENDER) != gender_out and m.get(COL_MEMBER_ID) not in late_member_ids
+                                         and pd.notna(m.get(COL_MEMBER_LEVEL)) and int(m.get(COL_MEMBER_LEVEL)) == int(member_a.get(COL_MEMBER_LEVEL))), None)
+                        if member_b is not None:
+                            best = (gain, team_a_name, member_a, team_b_name, member_b); break
+
+        if best is None: break
+        _, team_a_name, member_a, team_b_name, member_b = best
+        _swap_members(teams, team_a_name, member_a, team_b_name, member_b)
+        moved_ids.update((member_a.get(COL_MEMBER_ID), member_b.get(COL_MEMBER_ID)))
+        if config.DEBUG_MODE: print(f"DEBUG: 局所調整: {member_a.get(COL_MEMBER_NAME)} ({team_a_name}) と {member_b.get(COL_MEMBER_NAME)} ({team_b_name}) を交換しました。")
+    return moved_ids
+
+@traced("apply_assignment_delta")
+def apply_assignment_delta(teams, added_members, removed_member_ids, late_member_ids, max_swaps=2, pair_history=None, team_capacities=None):
+    """
+    公開済みの割り振りに部員の追加・削除だけを反映します (assign_teams のように全員を並べ直しません)。
+    追加する部員を assign_teams と同じ優先度で配置したあと、変更のあったチームを含む交換だけで
+    最大 max_swaps 回の局所的な再調整を行います。
+    added_members: 部員の辞書のリストまたはDataFrame / removed_member_ids: 外す部員の学籍番号の集合
+    戻り値: (新しい割り振り結果, 変更のあったチーム名の集合)
+    """
+    if isinstance(added_members, pd.DataFrame): added_members = added_members.to_dict('records')
+    repaired, changed_teams = repair_assignment(teams, added_members, set(removed_member_ids), late_member_ids, pair_history=pair_history, team_capacities=team_capacities)
+    if changed_teams and max_swaps > 0:
+        moved_ids = local_rebalance(repaired, late_member_ids, changed_teams, max_swaps=max_swaps)
+        changed_teams |= {name for name, members in repaired.items() if any(m.get(COL_MEMBER_ID) in moved_ids for m in members)}
+    return repaired, changed_teams
+
+# === 割り振り結果のキャッシュ ===
+ASSIGNMENT_CACHE_SIZE = 32
+_assignment_cache = OrderedDict() # 入力のハッシュ -> 割り振り結果 (古いものから破棄)
+_assignment_cache_lock = threading.Lock()
+ASSIGNMENT_CACHE_STATS = {'hits': 0, 'misses': 0}
+
+def clear_assignment_cache():
+    """保持している割り振り結果を破棄します (計測で毎回計算させる場合など)。"""
+    with _assignment_cache_lock: _assignment_cache.clear()
+
+def default_assignment_seed(target_date):
+    """対象練習日から決まる乱数シード。同じ日・同じ参加者なら何度実行しても同じ割り振りになります。"""
+    return int(target_date.strftime('%Y%m%d'))
+
+def assignment_fingerprint(members_pool_df, late_member_ids, num_teams, include_level1=True, seed=None, pair_history=None, team_capacities=None):
+    """
+    割り振りの入力のハッシュを返します。
+    参加者ごとの学籍番号・名前・レベル・性別・遅刻の有無と、チーム数・定員・レベル1の扱い・シード・ペア履歴の内容から計算し、行の順序には依存しません。
+    """
+    levels = pd.to_numeric(members_pool_df[COL_MEMBER_LEVEL], errors='coerce')
+    participants = sorted(zip(
+        members_pool_df[COL_MEMBER_ID].astype(str), members_pool_df[COL_MEMBER_NAME].astype(str),
+        ['' if pd.isna(level) else str(int(level)) for level in levels],
+        members_pool_df[COL_MEMBER_GENDER].astype(str),
+        [member_id in late_member_ids for member_id in members_pool_df[COL_MEMBER_ID]],
+    ))
+    history_fingerprint = pair_history.fingerprint if pair_history is not None else None
+    capacities = sorted(team_capacity_map(team_capacities, num_teams).items())
+    return hashlib.sha256(repr((participants, num_teams, include_level1, seed, history_fingerprint, capacities)).encode('utf-8')).hexdigest()
+
+def _run_assign_tasks(tasks):
+    return [assign_teams(**task) for task in tasks]
+
+def assign_teams_cached_many(tasks, include_level1=True, runner=None):
+    """
+    assign_teams の引数 (辞書) のリストをまとめて割り振り、結果を同じ順で返します。
+    シードのある割り振りは入力のハッシュ (assignment_fingerprint) ごとの結果を保持し、同じ入力なら計算しません。
+    計算が必要なものだけを runner (引数のリストを受け取り結果のリストを返す関数、assignment_worker.AssignmentWorkerPool.run_tasks など) に渡します。
+    runner が未指定ならこのスレッドで順に計算します。seed が None (毎回異なる結果を求める場合) はキャッシュを使いません。
+    """
+    results, keys, missing = [None] * len(tasks), [None] * len(tasks), []
+    for i, task in enumerate(tasks):
+        if task.get('seed') is None or task['members_pool_df'].empty:
+            missing.append(i); continue
+        keys[i] = assignment_fingerprint(task['members_pool_df'], task['late_member_ids'], task['num_teams'], include_level1, task['seed'],
+                                         task.get('pair_history'), task.get('team_capacities'))
+        with _assignment_cache_lock:
+            cached = _assignment_cache.get(keys[i])
+            if cached is not None:
+                _assignment_cache.move_to_end(keys[i]); ASSIGNMENT_CACHE_STATS['hits'] += 1
+            else:
+                ASSIGNMENT_CACHE_STATS['misses'] += 1
+        if cached is None:
+            if config.DEBUG_MODE: print(f"割り振りキャッシュなし ({task.get('assignment_type', 'general')})。計算します。")
+            missing.append(i)
+        else:
+            # 呼び出し側がチームのリストを変更してもキャッシュに影響しないようにコピーを返す
+            results[i] = {team_name: list(members) for team_name, members in cached.items()}
+    if missing:
+        computed = (runner or _run_assign_tasks)([tasks[i] for i in missing])
+        for i, teams in zip(missing, computed):
+            if keys[i] is not None:
+                with _assignment_cache_lock:
+                    _assignment_cache[keys[i]] = teams
+                    while len(_assignment_cache) > ASSIGNMENT_CACHE_SIZE: _assignment_cache.popitem(last=False)
+                teams = {team_name: list(members) for team_name, members in teams.items()}
+            results[i] = teams
+    return results
+
+def assign_teams_cached(members_pool_df, late_member_ids, num_teams, assignment_type="general", include_level1=True, seed=None, pair_history=None, team_capacities=None, runner=None):
+    """
+    assign_teams の結果を入力のハッシュ (assignment_fingerprint) ごとに保持し、同じ入力なら計算せずに返します。
+    seed が None (毎回異なる結果を求める場合) はキャッシュを使いません。runner は assign_teams_cached_many と同じです。
+    """
+    task = {'members_pool_df': members_pool_df, 'late_member_ids': late_member_ids, 'num_teams': num_teams, 'assignment_type': assignment_type,
+            'seed': seed, 'pair_history': pair_history, 'team_capacities': team_capacities}
+    return assign_teams_cached_many([task], include_level1, runner)[0]
+
+@traced("format_assignment_results")
+def format_assignment_results(assignments, practice_type_or_teams, target_date):
+    """
+    割り振り結果をスプレッドシート書き込み用に整形します。
+    """
+    if config.DEBUG_MODE: print(f"\n割り振り結果 ({practice_type_or_teams} - {target_date.strftime('%Y-%m-%d')}) を整形中...")
+    if not assignments: return [[f"割り振り結果なし ({practice_type_or_teams} - {target_date.strftime('%Y-%m-%d')})"]]
+    
+    output_rows = []
+    output_rows.append([f"コート割り振り結果 ({practice_type_or_teams} - {target_date.strftime('%Y-%m-%d')})"])
+    output_rows.append([]) # 空行
+    
+    # チーム名をソートしてヘッダーに追加
+    team_names = sorted(assignments.keys(), key=lambda name: int(name.split()[-1]))
+    output_rows.append(team_names)
+    
+    # 最大のチーム人数を取得し、行数を決定
+    max_len = max(len(m) for m in assignments.values()) if assignments else 0
+    
+    # 各行に部員名を追加
+    for i in range(max_len):
+        row = []
+        for team_name in team_names:
+            members = assignments.get(team_name, [])
+            cell_value = ""
+            if i < len(members):
+                member = members[i]
+                name = member.get(COL_MEMBER_NAME, '?')
+                level_val = member.get(COL_MEMBER_LEVEL, '?')
+                level_display = int(level_val) if pd.notna(level_val) else '?'
+                gender = member.get(COL_MEMBER_GENDER, '?')
+                cell_value = f"{name} (L{level_display}/{gender})"
+            else:
+                cell_value = "" # そのチームに部員がいなければ空文字列
+            row.append(cell_value)
+        if config.DEBUG_MODE and i < 2 : print(f"DEBUG: Completed Row {i+1} for format: {row}")
+        output_rows.append(row)
+    
+    if config.DEBUG_MODE: print("-> 整形完了")
+    count_rows(len(output_rows))
+    return output_rows
+
+# === 名簿と割り振りのパイプライン ===
+def classify_member_statuses(member_df, attendance_df, target_date):
+    """
+    対象練習日について、各部員の最終ステータス (その日の最新の連絡) を判定します。
+    連絡が全くない部員は「参加」とみなします。
+    戻り値: {'participating': 参加のID集合, 'late': 遅刻のID集合, 'absent': 欠席のID集合, 'latest_logs': 部員ごとの最新連絡のDataFrame}
+    """
+    latest_status_by_member = pd.DataFrame(columns=[COL_MEMBER_ID, COL_ATTENDANCE_STATUS, COL_ATTENDANCE_LATE_TIME, COL_ATTENDANCE_REASON])
+    if attendance_df is not None and not attendance_df.empty:
+        # 割り振り対象日のログに絞り込み (日付列は読み込み時に datetime64 へ変換済み)
+        relevant_logs = attendance_df[attendance_df[COL_ATTENDANCE_TARGET_DATE] == pd.Timestamp(target_date)]
+        if not relevant_logs.empty:
+            # 各部員IDに対して最新の連絡のみを保持 (最新のタイムスタンプを持つものを優先)
+            latest_status_by_member = latest_records(relevant_logs, [COL_MEMBER_ID])
+    return _statuses_from_latest_logs(member_df, latest_status_by_member)
+
+def classify_member_statuses_for_dates(member_df, attendance_df, target_dates):
+    """
+    複数の対象練習日について、classify_member_statuses と同じ判定をまとめて行います。
+    対象日のログ全体から (学籍番号, 対象練習日) ごとの最新を1回で求め (latest_records)、対象練習日ごとに分けます。
+    戻り値: {対象練習日: classify_member_statuses と同じ形式の辞書}
+    """
+    latest_logs_by_date = {}
+    if attendance_df is not None and not attendance_df.empty and target_dates:
+        relevant_logs = attendance_df[attendance_df[COL_ATTENDANCE_TARGET_DATE].isin([pd.Timestamp(d) for d in target_dates])]
+        latest_logs = latest_records(relevant_logs, [COL_MEMBER_ID, COL_ATTENDANCE_TARGET_DATE])
+        latest_logs_by_date = {target.date(): group for target, group in latest_logs.groupby(COL_ATTENDANCE_TARGET_DATE, sort=False, observed=True)}
+    empty_logs = pd.DataFrame(columns=[COL_MEMBER_ID, COL_ATTENDANCE_STATUS, COL_ATTENDANCE_LATE_TIME, COL_ATTENDANCE_REASON])
+    return {d: _statuses_from_latest_logs(member_df, latest_logs_by_date.get(d, empty_logs)) for d in target_dates}
+
+def _statuses_from_latest_logs(member_df, latest_status_by_member):
+    status_by_id = dict(zip(latest_status_by_member[COL_MEMBER_ID], latest_status_by_member[COL_ATTENDANCE_STATUS].astype(str).str.strip()))
+    statuses = {'participating': set(), 'late': set(), 'absent': set(), 'latest_logs': latest_status_by_member}
+    status_keys = {'参加': 'participating', '遅刻': 'late', '欠席': 'absent'}
+    for member_id in member_df[COL_MEMBER_ID]:
+        status = status_by_id.get(member_id, '参加') # 連絡がない部員は「参加」(デフォルト)
+        if status in status_keys: statuses[status_keys[status]].add(member_id)
+    return statuses
+
+def _roster_output(pool_df, columns, title, empty_title, details_df=None):
+    """名簿1枚分の書き込み用データ (タイトル行・ヘッダー行・部員行) を作成します。"""
+    if pool_df.empty: return [[empty_title]]
+    if details_df is not None and not details_df.empty:
+        pool_df = pd.merge(pool_df, details_df, on=COL_MEMBER_ID, how='left')
+    valid_cols = [col for col in columns if col in pool_df.columns]
+    output = [[title], valid_cols]
+    output.extend(pool_df[valid_cols].astype(object).fillna('').values.tolist())
+    return output
+
+def build_roster_outputs(member_df, statuses, target_date):
+    """
+    参加者・欠席者・遅刻者名簿の書き込み用データを作成します。
+    戻り値: [(シート名, データ名, 書き込むデータ), ...]
+    """
+    date_str = target_date.strftime('%Y-%m-%d')
+    latest_logs = statuses['latest_logs']
+    participants = member_df[member_df[COL_MEMBER_ID].isin(statuses['participating'])]
+    absentees = member_df[member_df[COL_MEMBER_ID].isin(statuses['absent'])]
+    late_members = member_df[member_df[COL_MEMBER_ID].isin(statuses['late'])]
+    return [
+        (config.PARTICIPANT_LIST_SHEET_NAME, f"{date_str} 参加者名簿",
+         _roster_output(participants, [COL_MEMBER_ID, COL_MEMBER_NAME, COL_MEMBER_GRADE, COL_MEMBER_LEVEL, COL_MEMBER_GENDER, COL_MEMBER_DEPARTMENT],
+                        f"{date_str} 参加者リスト", f"{date_str} の参加者なし")),
+        (config.ABSENT_LIST_SHEET_NAME, "欠席者名簿",
+         _roster_output(absentees, [COL_MEMBER_ID, COL_MEMBER_NAME, COL_MEMBER_GRADE, COL_ATTENDANCE_REASON, COL_MEMBER_DEPARTMENT],
+                        f"{date_str} 欠席者リスト", f"{date_str} の欠席連絡者なし", latest_logs[[COL_MEMBER_ID, COL_ATTENDANCE_REASON]])),
+        (config.LATE_LIST_SHEET_NAME, "遅刻者名簿",
+         _roster_output(late_members, [COL_MEMBER_ID, COL_MEMBER_NAME, COL_MEMBER_GRADE, COL_ATTENDANCE_LATE_TIME, COL_ATTENDANCE_REASON, COL_MEMBER_DEPARTMENT],
+                        f"{date_str} 遅刻者リスト", f"{date_str} の遅刻連絡者なし", latest_logs[[COL_MEMBER_ID, COL_ATTENDANCE_LATE_TIME, COL_ATTENDANCE_REASON]])),
+    ]
+
+# 割り振りの実行単位。capacities はチームごとの定員 (チーム 1 から順、None なら定員なし)
+AssignmentRun = namedtuple('AssignmentRun', ['sheet_name', 'pool', 'num_teams', 'assignment_type', 'data_prefix', 'capacities'], defaults=[None])
+
+def assignment_runs(member_df, statuses, include_level1=True):
+    """
+    割り振りの実行単位 (出力シートごとの対象プールとチーム数) を返します。
+    8, 10, 12コート: 最終ステータスが「参加」または「遅刻」の部員 / 3チーム: 「参加」のみ (遅刻者は除外)。
+    include_level1 が False の場合、8チーム割り振りからレベル1を除外します。
+    戻り値: [AssignmentRun, ...]
+    """
+    pool_with_late = member_df[member_df[COL_MEMBER_ID].isin(statuses['participating'] | statuses['late'])]
+    pool_participating = member_df[member_df[COL_MEMBER_ID].isin(statuses['participating'])]
+    pool_for_8_teams = pool_with_late if include_level1 else pool_with_late[pool_with_late[COL_MEMBER_LEVEL] != 1]
+    return [
+        AssignmentRun(config.ASSIGNMENT_SHEET_NAME_8, pool_for_8_teams, config.TEAMS_COUNT_MAP.get('ノック', 8), "8チーム", "8チーム"),
+        AssignmentRun(config.ASSIGNMENT_SHEET_NAME_10, pool_with_late, config.TEAMS_COUNT_MAP.get('ハンドノック', 10), "10チーム", "10チーム"),
+        AssignmentRun(config.ASSIGNMENT_SHEET_NAME_12, pool_with_late, config.TEAMS_COUNT_MAP.get('その他', 12), "12チーム", "12チーム"),
+        AssignmentRun(config.ASSIGNMENT_SHEET_NAME_3, pool_participating, config.TEAMS_COUNT_MAP.get('素振り指導', 3), "3チーム (素振り指導)", "3チーム"),
+    ]
+
+def parse_team_requests(text):
+    """
+    追加で割り振るチーム数の指定を解釈します。カンマ区切りで、各項目は次のどちらかです。
+      '6'       : 6チーム (定員なし)
+      '6/6/6/4' : チームごとの定員 (この例は4チームで、チーム 4 だけ定員4)。'-' は定員なし
+    戻り値: [(チーム数, 定員のタプルまたは None), ...]  (重複は除きます)
+    """
+    requests = []
+    for item in str(text or '').replace('、', ',').split(','):
+        item = item.strip()
+        if not item: continue
+        try:
+            if '/' in item:
+                capacities = tuple(None if c.strip() == '-' else int(c) for c in item.split('/'))
+                if any(c is not None and c <= 0 for c in capacities): raise ValueError
+                request = (len(capacities), capacities)
+            else:
+                request = (int(item), None)
+        except ValueError:
+            raise ValueError(f"チーム数の指定 '{item}' を解釈できません (例: 6 または 6/6/6/4)。")
+        if request[0] <= 0: raise ValueError(f"チーム数の指定 '{item}' は1以上にしてください。")
+        if request not in requests: requests.append(request)
+    return requests
+
+def team_request_sheet_name(num_teams, capacities=None):
+    """追加のチーム数の割り振り結果を書き込むシート名を返します。"""
+    suffix = "_定員" + "-".join('x' if c is None else str(c) for c in capacities) if capacities and any(capacities) else ""
+    return f"{config.CUSTOM_ASSIGNMENT_SHEET_PREFIX}{num_teams}チーム{suffix}"
+
+def team_request_runs(member_df, statuses, team_requests):
+    """
+    追加で指定されたチーム数 (parse_team_requests の結果) の実行単位を返します。
+    対象は 8, 10, 12チームと同じ「参加」または「遅刻」の部員です。定員なしで既定の割り振りと同じシートになるものは除きます。
+    """
+    pool_with_late = member_df[member_df[COL_MEMBER_ID].isin(statuses['participating'] | statuses['late'])]
+    standard_sheets = {config.ASSIGNMENT_SHEET_NAME_8, config.ASSIGNMENT_SHEET_NAME_10, config.ASSIGNMENT_SHEET_NAME_12, config.ASSIGNMENT_SHEET_NAME_3}
+    runs = []
+    for num_teams, capacities in team_requests or []:
+        sheet_name = team_request_sheet_name(num_teams, capacities)
+        if sheet_name in standard_sheets: continue
+        label = f"{num_teams}チーム" + (f" (定員 {'/'.join('-' if c is None else str(c) for c in capacities)})" if capacities and any(capacities) else "")
+        runs.append(AssignmentRun(sheet_name, pool_with_late, num_teams, label, label, capacities))
+    return runs
+
+def assignment_outputs(assignments, runs, target_date):
+    """割り振り結果 ({シート名: チーム}) を書き込み用データに整形します。結果のない割り振りは警告メッセージを返します。"""
+    date_str = target_date.strftime('%Y-%m-%d')
+    outputs, messages = [], []
+    for run in runs:
+        if assignments.get(run.sheet_name):
+            outputs.append((run.sheet_name, f"{run.data_prefix}結果({date_str})", format_assignment_results(assignments[run.sheet_name], run.assignment_type, target_date)))
+        else:
+            messages.append(('warning', f"{run.data_prefix}割り振り結果なし。"))
+    return outputs, messages
+
+def assign_runs(runs, late_member_ids, include_level1=True, seed=None, pair_history=None, runner=None):
+    """
+    実行単位ごとに割り振りを行い、{シート名: 割り振り結果} とメッセージを返します。
+    キャッシュにない割り振りはまとめて runner に渡すため、プロセスプールでは各実行単位が並行に計算されます。
+    """
+    messages = [('debug', f"--- {run.assignment_type}割り振りを実行中 ({len(run.pool)} 名) ---") for run in runs]
+    # 遅刻者IDは入れ替え対象外の判定に使う
+    tasks = [{'members_pool_df': run.pool, 'late_member_ids': late_member_ids, 'num_teams': run.num_teams, 'assignment_type': run.assignment_type,
+              'seed': seed, 'pair_history': pair_history, 'team_capacities': run.capacities} for run in runs]
+    results = assign_teams_cached_many(tasks, include_level1, runner)
+    return {run.sheet_name: teams for run, teams in zip(runs, results)}, messages
+
+def pair_history_for_date(pair_history, target_date):
+    """
+    target_date の割り振りに使うペア履歴 (その日自身の公開分を除いた履歴) とメッセージのリストを返します。
+    その日の公開のチーム構成を保持期間を過ぎて破棄している場合は除けないため、全ての履歴を使い、その旨を warning で知らせます。
+    """
+    if pair_history is None: return None, []
+    messages = []
+    if pair_history.is_evicted(target_date):
+        messages.append(('warning', f"{target_date.strftime('%Y-%m-%d')} は直近 {RECENT_RECORDS_KEPT} 回の公開より前の練習日のため、ペア履歴からその日の前回の割り振りを除けません。全ての履歴を使って割り振ります。"))
+    return pair_history.excluding_date(target_date), messages
+
+@traced("run_team_requests")
+def run_team_requests(member_df, statuses, target_date, team_requests, include_level1=True, seed=None, pair_history=None, runner=None):
+    """
+    判定済みのステータス (statuses) のプールを使って、追加で指定されたチーム数の割り振りだけを行います。
+    事前計算済みの結果と同じプールを使うため、連絡ログの読み込みや判定はやり直しません。
+    戻り値: {'assignments': ..., 'outputs': ..., 'messages': ...} (run_assignment_pipeline の該当部分と同じ形式)
+    """
+    runs = team_request_runs(member_df, statuses, team_requests)
+    seed = default_assignment_seed(target_date) if seed is None else seed
+    history, history_messages = pair_history_for_date(pair_history, target_date)
+    assignments, messages = assign_runs(runs, statuses['late'], include_level1, seed, history, runner)
+    outputs, output_messages = assignment_outputs(assignments, runs, target_date)
+    return {'assignments': assignments, 'outputs': outputs, 'messages': history_messages + messages + output_messages}
+
+@traced("run_assignment_pipeline")
+def run_assignment_pipeline(member_df, attendance_df, target_date, include_level1=True, seed=None, pair_history=None, team_requests=None, runner=None):
+    """
+    対象練習日の名簿作成と 8/10/12/3 チームの割り振りを行います。シートへの書き込みは行いません。
+    include_level1 が False の場合、8チーム割り振りからレベル1を除外します。
+    seed が未指定なら対象練習日から決まるシードを使うため、入力が同じなら割り振りはキャッシュから返されます。
+    pair_history を指定すると、対象練習日自身の公開分を除いた履歴で同じ部員の組み合わせが続かないようにします。
+    team_requests (parse_team_requests の結果) を指定すると、そのチーム数・定員の割り振りも行います。
+    runner を指定すると、割り振りの計算をその関数 (assignment_worker のプロセスプールなど) で行います。
+    戻り値: {'statuses': classify_member_statuses の結果,
+             'assignments': {シート名: 割り振り結果 (チーム名 -> 部員のリスト)},
+             'outputs': [(シート名, データ名, 書き込むデータ), ...],
+             'messages': [('debug' または 'warning', メッセージ), ...]}
+    """
+    statuses = classify_member_statuses(member_df, attendance_df, target_date)
+    return _assign_for_statuses(member_df, statuses, target_date, include_level1, seed, pair_history, team_requests, runner)
+
+def _assign_for_statuses(member_df, statuses, target_date, include_level1=True, seed=None, pair_history=None, team_requests=None, runner=None):
+    messages = []
+    messages.append(('debug', f"参加 {len(statuses['participating'])} 名 / 遅刻 {len(statuses['late'])} 名 / 欠席 {len(statuses['absent'])} 名"))
+    outputs = build_roster_outputs(member_df, statuses, target_date)
+
+    runs = assignment_runs(member_df, statuses, include_level1) + team_request_runs(member_df, statuses, team_requests)
+    if all(run.pool.empty for run in runs):
+        messages.append(('warning', "割り振り対象の参加予定者がいないため、コート割り振りは行いません。"))
+        return {'statuses': statuses, 'assignments': {}, 'outputs': outputs, 'messages': messages}
+
+    seed = default_assignment_seed(target_date) if seed is None else seed
+    history, history_messages = pair_history_for_date(pair_history, target_date)
+    assignments, run_messages = assign_runs(runs, statuses['late'], include_level1, seed, history, runner)
+    messages += history_messages + run_messages
+    assignment_result_outputs, assignment_messages = assignment_outputs(assignments, runs, target_date)
+    return {'statuses': statuses, 'assignments': assignments, 'outputs': outputs + assignment_result_outputs, 'messages': messages + assignment_messages}
+
+# === 週間の割り振り計画 ===
+WEEKLY_PLAN_MAX_WORKERS = 4
+
+@traced("run_weekly_assignment_pipeline")
+def run_weekly_assignment_pipeline(member_df, attendance_df, target_dates, include_level1=True, seed=None, max_workers=WEEKLY_PLAN_MAX_WORKERS, pair_history=None, runner=None):
+    """
+    複数の練習日の割り振りをまとめて計算します。シートへの書き込みは行いません。
+    連絡ログの判定は classify_member_statuses_for_dates で全日付まとめて1回だけ行い、各日の割り振りはスレッドで並行に計算します。
+    seed が未指定なら日付ごとに default_assignment_seed を使うため、同じ日を1日ずつ実行した場合と同じ割り振りになります。
+    戻り値: {対象練習日: run_assignment_pipeline と同じ形式の辞書} (target_dates の順)
+    """
+    target_dates = sorted(set(target_dates))
+    statuses_by_date = classify_member_statuses_for_dates(member_df, attendance_df, target_dates)
+    def plan(target_date):
+        return _assign_for_statuses(member_df, statuses_by_date[target_date], target_date, include_level1, seed, pair_history, runner=runner)
+    if len(target_dates) <= 1:
+        return {d: plan(d) for d in target_dates}
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="weekly-plan") as executor:
+        return dict(zip(target_dates, executor.map(plan, target_dates)))
+
+def weekly_plan_grid(plans):
+    """
+    週間計画 (run_weekly_assignment_pipeline の結果) を1枚のシート用に整形します。
+    対象練習日ごとに「見出し行 + 各チーム数の割り振り結果」のブロックを作り、空行を挟んで縦に並べます。
+    戻り値: (書き込み用データ, {対象練習日: (開始行, 終了行)})  行番号は1始まりで終了行を含みます。
+    """
+    grid, date_rows = [], {}
+    for target_date, result in plans.items():
+        statuses = result['statuses']
+        start_row = len(grid) + 1
+        grid.append([f"■ {target_date.strftime('%Y-%m-%d')} ({config.WEEKDAY_LABELS[target_date.weekday()]}) 参加 {len(statuses['participating'])} 名 / 遅刻 {len(statuses['late'])} 名 / 欠席 {len(statuses['absent'])} 名"])
+        assignment_sheets = set(result['assignments'])
+        blocks = [values for sheet_name, _, values in result['outputs'] if sheet_name in assignment_sheets]
+        if not blocks: grid.append(["割り振り対象の参加予定者がいません。"])
+        for values in blocks:
+            grid.extend(list(row) for row in values)
+            grid.append([])
+        while grid and not grid[-1]: grid.pop()
+        date_rows[target_date] = (start_row, len(grid))
+        grid.append([])
+    while grid and not grid[-1]: grid.pop()
+    return grid, date_rows
+
+# === コマンドライン実行 ===
+def load_assignment_inputs(spreadsheet, target_date):
+    """部員リストと、対象練習日の連絡を含む連絡ログ (ホットシート + 必要な月のアーカイブ) を読み込みます。"""
+    member_df = read_frame(spreadsheet.worksheet(config.MEMBER_SHEET_NAME), MEMBER_COLUMNS, MEMBER_SCHEMA)
+    archived_months = set(archive_months_from_titles([ws.title for ws in spreadsheet.worksheets()], config.ATTENDANCE_SHEET_NAME))
+    sheet_names = [config.ATTENDANCE_SHEET_NAME] + [archive_sheet_name(config.ATTENDANCE_SHEET_NAME, m) for m in months_for_target_date(target_date) if m in archived_months]
+    frames = [read_frame(spreadsheet.worksheet(sheet_name), ATTENDANCE_ASSIGNMENT_COLUMNS, ATTENDANCE_SCHEMA) for sheet_name in sheet_names]
+    return member_df, concat_frames(frames, ATTENDANCE_SCHEMA)
+
+def _open_offline_spreadsheet(fixture_dir):
+    """'<シート名>.csv' を集めたディレクトリをオフラインのスプレッドシートとして開きます。"""
+    from offline_sheets import OfflineClient, read_csv_sheets
+    return OfflineClient(read_csv_sheets(fixture_dir)).open_by_key(config.SPREADSHEET_ID)
+
+def _write_outputs_to_dir(outputs, output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    for sheet_name, _, values in outputs:
+        with open(os.path.join(output_dir, f"{sheet_name}.csv"), 'w', newline='', encoding='utf-8-sig') as f:
+            csv.writer(f).writerows(values)
+
+def _team_requests_arg(text):
+    try: return parse_team_requests(text)
+    except ValueError as e: raise argparse.ArgumentTypeError(str(e))
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="コート割り振りを実行し、名簿と割り振り結果をシートに書き込みます。")
+    parser.add_argument('--date', type=datetime.date.fromisoformat, default=datetime.date.today(), help="割り振り対象日 (YYYY-MM-DD、既定は今日)")
+    parser.add_argument('--exclude-level1', action='store_true', help="8チーム割り振りから1年生 (レベル1) を除外する")
+    parser.add_argument('--credentials', help="サービスアカウントの JSON キーファイル (未指定なら gspread の既定の場所)")
+    parser.add_argument('--spreadsheet-id', default=config.SPREADSHEET_ID)
+    parser.add_argument('--offline', metavar='DIR', help="スプレッドシートの代わりに DIR 内の '<シート名>.csv' を読み込む")
+    parser.add_argument('--output-dir', metavar='DIR', help="シートに書き込まず、DIR に '<シート名>.csv' として出力する")
+    parser.add_argument('--dry-run', action='store_true', help="書き込みを行わず、出力の概要だけを表示する")
+    parser.add_argument('--seed', type=int, help="割り振りの乱数シード (既定は対象日から決まる値)")
+    parser.add_argument('--teams', type=_team_requests_arg, default=[], help="追加で割り振るチーム数 (カンマ区切り、'6/6/6/4' のようにチームごとの定員も指定可)")
+    parser.add_argument('--profile', action='store_true', help="cProfile で計測し、累積時間の上位を表示する")
+    parser.add_argument('--trace-export', metavar='PATH', help="計測スパンを JSON Lines で書き出すファイル")
+    parser.add_argument('--debug', action='store_true')
+    return parser.parse_args(argv)
+
+def run(args):
+    """引数に従って読み込み・割り振り・書き込みを行います。戻り値は終了コードです。"""
+    config.DEBUG_MODE = args.debug
+    instrumentation.configure(export_path=args.trace_export)
+
+    if args.offline:
+        spreadsheet = _open_offline_spreadsheet(args.offline)
+    else:
+        from sheets_http import service_account_client
+        client = service_account_client(filename=args.credentials, proactive_refresh=False)
+        spreadsheet = client.open_by_key(args.spreadsheet_id)
+
+    # ペア履歴はアプリと同じシートから読み込み、公開した割り振りを記録する (assignment_flow は court_assignment を読み込むため、ここで読み込む)
+    from assignment_flow import read_pair_history, record_pair_history
+    member_df, attendance_df = load_assignment_inputs(spreadsheet, args.date)
+    if member_df.empty:
+        print(f"ERROR: '{config.MEMBER_SHEET_NAME}' に部員データがありません。"); return 1
+    pair_history = read_pair_history(spreadsheet) or PairHistory()
+    result = run_assignment_pipeline(member_df, attendance_df, args.date, include_level1=not args.exclude_level1, seed=args.seed,
+                                     pair_history=pair_history, team_requests=args.teams)
+    for level, message in result['messages']:
+        if level == 'warning' or config.DEBUG_MODE: print(message)
+
+    if args.dry_run:
+        for sheet_name, data_name, values in result['outputs']: print(f"{sheet_name}: {data_name} ({len(values)}行)")
+    elif args.output_dir:
+        _write_outputs_to_dir(result['outputs'], args.output_dir)
+        print(f"{len(result['outputs'])}件の出力を '{args.output_dir}' に書き出しました。")
+    else:
+        failed_sheets = set()
+        for sheet_name, data_name, values in result['outputs']:
+            try:
+                num_rows, num_cols = sheet_size(values)
+                # 追加のチーム数の結果シートはなければ作成する
+                if write_grid(ensure_worksheet(spreadsheet, sheet_name, rows=num_rows, cols=num_cols), values) == 'skipped': print(f"{data_name}はシートの内容が同じため省略しました。")
+                else: print(f"{data_name}をシート '{sheet_name}' に書き込みました。")
+            except Exception as e:
+                print(f"ERROR: Error writing {data_name} to '{sheet_name}': {e}"); failed_sheets.add(sheet_name)
+        # 書き込めた割り振りをペア履歴に記録する (アプリの公開と同じく、以降の割り振りで同じ部員の組み合わせが続かないようにする)
+        published_assignments = {name: teams for name, teams in result['assignments'].items()
+                                 if name in config.PAIR_HISTORY_SHEETS and teams and name not in failed_sheets}
+        if published_assignments:
+            try:
+                _, history_messages = record_pair_history(spreadsheet, pair_history, args.date, published_assignments)
+                for _, message in history_messages: print(message)
+                print(f"ペア履歴を '{config.PAIR_HISTORY_SHEET_NAME}' に記録しました ({pair_history.total_pairs} ペア)。")
+            except Exception as e:
+                print(f"ERROR: Error writing pair history: {e}"); return 1
+        if failed_sheets: return 1
+    print(f"{args.date.strftime('%Y-%m-%d')} の割り振り処理と名簿出力が完了しました。")
+    return 0
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not args.profile: return run(args)
+    profiler = cProfile.Profile()
+    exit_code = profiler.runcall(run, args)
+    pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(25)
+    return exit_code
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,173 @@
+# instrumentation.py (処理時間の計測スパン)
+# -*- coding: utf-8 -*-
+#
+# 主要な処理を「スパン」で囲み、所要時間・Sheets API 呼び出し回数・処理行数を記録します。
+# 記録はプロセス内のリングバッファに保持し、必要に応じて JSON Lines ファイルへ書き出します。
+# 書き出す形式は OpenTelemetry の Span (ConsoleSpanExporter の JSON) に合わせています。
+
+import collections
+import contextlib
+import contextvars
+import datetime
+import functools
+import json
+import os
+import threading
+import time
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+def _new_id(num_bytes):
+    return os.urandom(num_bytes).hex()
+
+def _iso(ns):
+    return datetime.datetime.fromtimestamp(ns / 1e9, tz=datetime.timezone.utc).isoformat()
+
+class Span:
+    """
+    1回分の計測区間。attributes の 'api_calls' は子スパンの呼び出しも含めた合計です。
+    親スパンは並行に実行するスレッド (sheets_async) の子スパンからも更新されるため、加算は add で行います。
+    """
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent else _new_id(16)
+        self.span_id = _new_id(8)
+        self.start_ns = time.time_ns()
+        self._start_perf = time.perf_counter_ns()
+        self.duration_ns = None
+        self.status = 'OK'
+        self.attributes = {'api_calls': 0, 'rows': 0}
+        if attributes: self.attributes.update(attributes)
+        self._lock = threading.Lock()
+
+    def add(self, key, count):
+        """数値の属性に count を加算します (スレッドセーフ)。"""
+        with self._lock:
+            self.attributes[key] = self.attributes.get(key, 0) + count
+
+    @property
+    def duration_ms(self):
+        return (self.duration_ns or 0) / 1e6
+
+    def finish(self):
+        self.duration_ns = time.perf_counter_ns() - self._start_perf
+
+    def _attributes_snapshot(self):
+        with self._lock:
+            return dict(self.attributes)
+
+    def to_otel_dict(self):
+        return {
+            'name': self.name,
+            'context': {'trace_id': f"0x{self.trace_id}", 'span_id': f"0x{self.span_id}"},
+            'parent_id': f"0x{self.parent.span_id}" if self.parent else None,
+            'start_time': _iso(self.start_ns),
+            'end_time': _iso(self.start_ns + (self.duration_ns or 0)),
+            'status': {'status_code': self.status},
+            'attributes': dict(self._attributes_snapshot(), duration_ms=round(self.duration_ms, 3)),
+        }
+
+class SpanRecorder:
+    """終了したスパンを保持し、JSON Lines への書き出しと集計を行います (スレッドセーフ)。"""
+    def __init__(self, max_spans=2000, export_path=None):
+        self._lock = threading.Lock()
+        self._spans = collections.deque(maxlen=max_spans)
+        self.export_path = export_path
+
+    def record(self, span):
+        with self._lock:
+            self._spans.append(span)
+            if self.export_path:
+                try:
+                    with open(self.export_path, 'a', encoding='utf-8') as f:
+                        f.write(json.dumps(span.to_otel_dict(), ensure_ascii=False) + "\n")
+                except OSError as e:
+                    print(f"ERROR: Failed to export span to {self.export_path}: {e}")
+
+    def spans(self):
+        with self._lock:
+            return list(self._spans)
+
+    def clear(self):
+        with self._lock:
+            self._spans.clear()
+
+    def export_jsonl(self):
+        """保持しているスパンを JSON Lines 文字列として返します。"""
+        return "".join(json.dumps(s.to_otel_dict(), ensure_ascii=False) + "\n" for s in self.spans())
+
+    def summary(self):
+        """スパン名ごとの件数・p50/p95/最大所要時間・平均API呼び出し回数・平均処理行数を返します。"""
+        by_name = collections.defaultdict(list)
+        for s in self.spans():
+            by_name[s.name].append(s)
+        rows = []
+        for name, spans in sorted(by_name.items()):
+            durations = sorted(s.duration_ms for s in spans)
+            rows.append({
+                'name': name,
+                'count': len(spans),
+                'p50_ms': round(percentile(durations, 50), 1),
+                'p95_ms': round(percentile(durations, 95), 1),
+                'max_ms': round(durations[-1], 1),
+                'avg_api_calls': round(sum(s.attributes.get('api_calls', 0) for s in spans) / len(spans), 1),
+                'avg_rows': round(sum(s.attributes.get('rows', 0) for s in spans) / len(spans), 1),
+                'errors': sum(1 for s in spans if s.status != 'OK'),
+            })
+        return rows
+
+def percentile(sorted_values, pct):
+    """ソート済みの値の百分位数 (nearest-rank 法)。"""
+    if not sorted_values: return 0.0
+    rank = max(1, int(-(-pct * len(sorted_values) // 100)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+RECORDER = SpanRecorder()
+
+def configure(export_path=None, max_spans=None):
+    """書き出し先 (JSON Lines ファイル) と保持件数を設定します。"""
+    RECORDER.export_path = export_path or None
+    if max_spans and max_spans != RECORDER._spans.maxlen:
+        with RECORDER._lock:
+            RECORDER._spans = collections.deque(RECORDER._spans, maxlen=max_spans)
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    """処理を計測スパンで囲みます。入れ子にすると親子関係が記録されます。"""
+    parent = _current_span.get()
+    current = Span(name, parent, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException:
+        current.status = 'ERROR'
+        raise
+    finally:
+        current.finish()
+        _current_span.reset(token)
+        RECORDER.record(current)
+
+def traced(name=None):
+    """関数全体をスパンで囲むデコレーター。"""
+    def decorator(func):
+        span_name = name or func.__name__
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def count_api_calls(count=1):
+    """現在のスパンとその親スパンすべてに Sheets API 呼び出し回数を加算します。"""
+    current = _current_span.get()
+    while current is not None:
+        current.add('api_calls', count)
+        current = current.parent
+
+def count_rows(count):
+    """現在のスパンに処理行数を加算します。"""
+    current = _current_span.get()
+    if current is not None:
+        current.add('rows', count)
@@ -0,0 +1,550 @@
+# loadtest.py (練習前の連絡の集中を再現する負荷試験)
+# -*- coding: utf-8 -*-
+#
+# 練習の直前に 50〜150 名が数分のうちに連絡を送る状況を、オフラインのスプレッドシート (offline_sheets.py) に対して再現します。
+# Sheets API の呼び出しごとに遅延と 429 エラーを加え (NetworkConditions)、連絡送信・連絡確認・管理者のコート割り振りを
+# 部員ごとのスレッドから同時に実行して、シナリオごとのスループット・レイテンシ (p50/p95/p99)・API 呼び出し回数を集計します。
+# 各操作は app.py と同じモジュールの関数 (記録の作成は attendance_store、割り振りの計算から書き込みまでは assignment_flow) を呼び出し、
+# app.py の st.cache_data / st.cache_resource (TTL 60秒) による読み込みの共有は SharedReadCache で再現します。
+# Streamlit の AppTest は実行ごとにランタイムとシークレットを差し替えるため同時に動かせず、画面の描画は計測に含みません。
+# app.py の画面側の処理 (読み込むシートの選び方・キャッシュ) を変えた場合は、AppSimulation も合わせて変更してください。
+#
+# 使い方:
+#   python loadtest.py                                           # 120名・遅延 150+0〜100ms・429 なしで全シナリオ
+#   python loadtest.py --members 150 --error-rate 0.02 --scenarios submit,rush
+#   python loadtest.py --offline ./fixtures --ramp-seconds 120 --json report.json
+#   python loadtest.py --import-profile                          # app.py のインポート時間 (ログイン画面まで / ログイン後) を計測
+#   python loadtest.py --latest-benchmark --benchmark-rows 100000 # 最新の連絡の抽出 (latest_records と並べ替え+重複除去) を比較
+#   python loadtest.py --delta-benchmark --delta-changes 5        # 事前計算への差分の反映と全体の計算し直しを比較
+
+import argparse
+import ast
+import copy
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import config
+from schema import (
+    COL_MEMBER_ID, COL_MEMBER_NAME, COL_MEMBER_GRADE, COL_MEMBER_DEPARTMENT, COL_ATTENDANCE_TIMESTAMP, COL_ATTENDANCE_TARGET_DATE,
+    MEMBER_SCHEMA, ATTENDANCE_SCHEMA, MEMBER_COLUMNS, ATTENDANCE_CHECK_COLUMNS, ATTENDANCE_ASSIGNMENT_COLUMNS, LOOKUP_ATTENDANCE_COLUMNS, OUTPUT_COLUMNS_ORDER,
+    ATTENDANCE_READ_COLUMNS, concat_frames, apply_schema,
+)
+from attendance_store import (
+    archive_sheet_name, archive_months_from_titles, months_for_target_date, recorded_member_dates, split_rows_for_archive, latest_records,
+    is_attendance_sheet, attendance_records, attendance_rows, MemberHistoryIndex,
+)
+from attendance_rollup import AttendanceRollups
+from offline_sheets import OfflineClient, NetworkConditions, read_csv_sheets
+from sheet_reader import read_frame, HEADERS
+from sheet_writer import WRITTEN_GRIDS
+from sheets_async import run_concurrently
+from court_assignment import run_assignment_pipeline, load_assignment_inputs, clear_assignment_cache
+from precompute import AssignmentScheduler, next_practice_date, refresh_precomputed_assignment
+from assignment_flow import compute_assignment, publish_assignment, read_pair_history
+from pair_history import PairHistory
+from roster import Roster
+
+SCENARIOS = ['submit', 'lookup', 'assign', 'rush']
+RESULT_SHEET_NAMES = [config.PARTICIPANT_LIST_SHEET_NAME, config.ABSENT_LIST_SHEET_NAME, config.LATE_LIST_SHEET_NAME, config.ASSIGNMENT_SHEET_NAME_8,
+                      config.ASSIGNMENT_SHEET_NAME_10, config.ASSIGNMENT_SHEET_NAME_12, config.ASSIGNMENT_SHEET_NAME_3]
+CACHE_TTL_SECONDS = 60 # app.py の st.cache_data(ttl=60) と同じ
+SHEETS_MAX_CONCURRENCY = 4 # app.py の既定値と同じ
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+HEAVY_MODULES = ['pandas', 'numpy', 'gspread', 'google.oauth2', 'requests'] # ログイン画面では読み込まないモジュール
+IMPORT_PROFILE_TOP = 8 # 段階ごとに表示する、インポートに時間のかかったモジュールの数
+
+class SharedReadCache:
+    """
+    app.py の st.cache_data / st.cache_resource に当たる、全セッションで共有する読み込み結果のキャッシュ (スレッドセーフ)。
+    同じキーを同時に読み込もうとした場合は1回だけ読み込み、他のスレッドはその結果を待ちます。失敗した読み込みは保持しません。
+    """
+    def __init__(self, ttl=CACHE_TTL_SECONDS):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {} # キー -> (読み込んだ時刻, 値)
+        self._key_locks = {}
+        self.misses = 0
+
+    def get(self, key, load):
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl: return entry[1]
+            value = load()
+            with self._lock:
+                self._entries[key] = (time.monotonic(), value); self.misses += 1
+            return value
+
+class AppSimulation:
+    """app.py の各操作と同じ Sheets API の呼び出しを行います (1シナリオで1つ、全スレッドで共有)。"""
+    def __init__(self, client, target_date, runner=None, seed=0):
+        self.client = client
+        self.target_date = target_date
+        self.runner = runner
+        self.cache = SharedReadCache()
+        self.rollups = AttendanceRollups() # app.py の get_attendance_rollups と同じく、送信した連絡を反映する
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self._scheduler = None # app.py の get_assignment_scheduler / get_pair_history と同じく、最初の割り振りで作成する
+        self._scheduler_lock = threading.Lock()
+
+    # --- app.py の読み込み関数に当たる処理 ---
+    def get_worksheet(self, sheet_name):
+        return self.client.open_by_key(config.SPREADSHEET_ID).worksheet(sheet_name)
+
+    def load_sheet(self, sheet_name, columns):
+        # app.py と同じく、シートごとに全ての用途の列を1回だけ読み込み、必要な列を取り出す
+        schema, read_columns = (MEMBER_SCHEMA, MEMBER_COLUMNS) if sheet_name == config.MEMBER_SHEET_NAME else (ATTENDANCE_SCHEMA, ATTENDANCE_READ_COLUMNS)
+        df = self.cache.get(('sheet', sheet_name), lambda: read_frame(self.get_worksheet(sheet_name), read_columns, schema))
+        return df[[col for col in columns if col in df.columns]]
+
+    def roster(self):
+        return self.cache.get(('roster',), lambda: Roster(self.load_sheet(config.MEMBER_SHEET_NAME, MEMBER_COLUMNS)))
+
+    def archive_months(self):
+        return self.cache.get(('archive_months',), lambda: archive_months_from_titles(
+            [ws.title for ws in self.client.open_by_key(config.SPREADSHEET_ID).worksheets()], config.ATTENDANCE_SHEET_NAME))
+
+    def load_attendance_partitions(self, months, columns):
+        load_hot = lambda: self.load_sheet(config.ATTENDANCE_SHEET_NAME, columns)
+        if not months: return concat_frames([load_hot()], ATTENDANCE_SCHEMA)
+        hot_df, archived_months = run_concurrently([load_hot, self.archive_months], max_concurrency=SHEETS_MAX_CONCURRENCY)
+        archive_frames = run_concurrently([lambda month=month: self.load_sheet(archive_sheet_name(config.ATTENDANCE_SHEET_NAME, month), columns)
+                                           for month in months if month in set(archived_months)], max_concurrency=SHEETS_MAX_CONCURRENCY)
+        return concat_frames([hot_df] + archive_frames, ATTENDANCE_SCHEMA)
+
+    def scheduler(self):
+        """ペア履歴を読み込み、事前計算のスケジューラーを作成します (事前計算は開始しません)。"""
+        with self._scheduler_lock:
+            if self._scheduler is None:
+                pair_history = read_pair_history(self.client.open_by_key(config.SPREADSHEET_ID)) or PairHistory()
+                self._scheduler = AssignmentScheduler(None, 0, pair_history=pair_history, runner=self.runner)
+            return self._scheduler
+
+    # --- 操作 ---
+    def start_session(self):
+        """ログイン直後: 部員リストと、連絡送信の重複チェックに使う連絡ログを並行して読み込みます。"""
+        member_df, _ = run_concurrently([lambda: self.load_sheet(config.MEMBER_SHEET_NAME, MEMBER_COLUMNS),
+                                         lambda: self.load_sheet(config.ATTENDANCE_SHEET_NAME, ATTENDANCE_CHECK_COLUMNS)], max_concurrency=SHEETS_MAX_CONCURRENCY)
+        return member_df
+
+    def submit(self, member):
+        """1名分の連絡を送信します (連絡済みならスキップ)。記録した件数を返します。"""
+        target_dates = [self.target_date]
+        attendance_df = self.load_attendance_partitions(months_for_target_date(self.target_date), ATTENDANCE_CHECK_COLUMNS)
+        if (member[COL_MEMBER_ID], self.target_date) in recorded_member_dates(attendance_df, target_dates): return 0
+        with self._rng_lock:
+            status = self._rng.choice(['欠席', '遅刻', '参加'])
+        records = attendance_records([(member[COL_MEMBER_NAME], member[COL_MEMBER_ID], self.target_date)], status, '授業' if status != '参加' else '',
+                                     '17:30' if status == '遅刻' else '', self.roster().member_info_by_id)
+        self.get_worksheet(config.ATTENDANCE_SHEET_NAME).append_rows(attendance_rows(records), value_input_option='USER_ENTERED')
+        self.rollups.apply(records)
+        return len(records)
+
+    def lookup(self, member):
+        """1名分の過去の連絡 (最新の1ページ) を表示します。表示した件数を返します。"""
+        months = tuple(self.archive_months()[:1])
+        history_index = self.cache.get(('history_index', months), lambda: MemberHistoryIndex.build(self.load_attendance_partitions(list(months), LOOKUP_ATTENDANCE_COLUMNS)))
+        page, _ = history_index.query(member[COL_MEMBER_ID], page=0, page_size=config.LOOKUP_PAGE_SIZE)
+        return len(page)
+
+    def assign(self, member_df):
+        """
+        管理者のコート割り振り: 連絡ログを読み込み、app.py の割り振りジョブと同じ手順 (assignment_flow) で計算・結果シートの書き込み・ペア履歴の記録を行います。
+        書き込んだシート数を返します。
+        """
+        attendance_df = self.load_attendance_partitions(months_for_target_date(self.target_date), ATTENDANCE_ASSIGNMENT_COLUMNS)
+        scheduler = self.scheduler()
+        job_result = compute_assignment(scheduler, member_df, attendance_df, self.target_date, pair_history=scheduler.pair_history, runner=self.runner)
+        report = publish_assignment(self.client.open_by_key(config.SPREADSHEET_ID), job_result, self.target_date, pair_history=scheduler.pair_history,
+                                    run_calls=lambda funcs: run_concurrently(funcs, max_concurrency=SHEETS_MAX_CONCURRENCY, return_exceptions=True))
+        failed = [result for _, _, _, result in report['writes'] if isinstance(result, Exception)]
+        if failed: raise failed[0]
+        return len(report['writes'])
+
+def synthetic_sheets(num_members, num_logs, target_date, seed=0, today=None):
+    """
+    部員 num_members 名と連絡 num_logs 件のスプレッドシートの内容 (空の名簿・割り振り結果シートを含む) を作成します。
+    連絡は過去120日〜target_date の範囲に散らし、今日より前の練習日の連絡は月別のアーカイブシートに入れます。
+    """
+    rng = random.Random(seed)
+    today = today or datetime.date.today()
+    members = [MEMBER_COLUMNS]
+    for i in range(num_members):
+        members.append([f"S{10000 + i}", f"部員{i:03d}", rng.choice(['1年', '2年', '3年', '4年', '5年', '6年']), rng.choice([0, 1, 2, 3, 4, 5, 6]),
+                        rng.choice(['男性', '女性']), rng.choice(['医学科', '看護学科', '保健学科'])])
+    rows = []
+    span = max((target_date - today).days, 0) + 120
+    for _ in range(num_logs):
+        member = rng.choice(members[1:])
+        practice_date = today - datetime.timedelta(days=120) + datetime.timedelta(days=rng.randint(0, span))
+        status = rng.choice(['欠席', '遅刻', '参加'])
+        recorded_at = datetime.datetime.combine(practice_date, datetime.time(9)) - datetime.timedelta(hours=rng.randint(1, 200))
+        rows.append([recorded_at.strftime('%Y-%m-%d %H:%M:%S'), practice_date.strftime('%Y/%m/%d'), member[0], member[2], member[1], status,
+                     '授業' if status != '参加' else '', '17:30' if status == '遅刻' else '', member[5]])
+    hot_rows, archive_rows_by_month = split_rows_for_archive(OUTPUT_COLUMNS_ORDER, rows, today)
+    sheets = {config.MEMBER_SHEET_NAME: members, config.ATTENDANCE_SHEET_NAME: [list(OUTPUT_COLUMNS_ORDER)] + hot_rows}
+    for month, month_rows in archive_rows_by_month.items():
+        sheets[archive_sheet_name(config.ATTENDANCE_SHEET_NAME, month)] = [list(OUTPUT_COLUMNS_ORDER)] + month_rows
+    # 名簿・割り振り結果シートは、運用中のスプレッドシートと同じく空のシートを用意しておく (app.py は作成しない)
+    for sheet_name in RESULT_SHEET_NAMES: sheets[sheet_name] = []
+    return sheets
+
+class LoadTestRecorder:
+    """操作ごとの (シナリオ, 操作, 所要時間, 成否) を記録します (スレッドセーフ)。"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.records = []
+
+    def timed(self, scenario, operation, func, *args):
+        started = time.perf_counter()
+        error = None
+        try: return func(*args)
+        except Exception as e:
+            # gspread の APIError は HTTP ステータスでまとめる (429 など)
+            error = f"{type(e).__name__} ({e.code})" if getattr(e, 'code', None) is not None else f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            with self._lock:
+                self.records.append({'scenario': scenario, 'operation': operation, 'seconds': time.perf_counter() - started, 'error': error})
+
+def _member_flow(simulation, recorder, scenario, member, operations, delay):
+    time.sleep(delay)
+    try:
+        recorder.timed(scenario, 'session', simulation.start_session)
+        for operation in operations:
+            if operation == 'submit': recorder.timed(scenario, 'submit', simulation.submit, member)
+            elif operation == 'lookup': recorder.timed(scenario, 'lookup', simulation.lookup, member)
+    except Exception: pass # 失敗は記録済み (失敗した部員はそこで操作をやめる)
+
+def _admin_flow(simulation, recorder, scenario, repeats, delay):
+    time.sleep(delay)
+    try:
+        member_df = recorder.timed(scenario, 'session', simulation.start_session)
+        for _ in range(repeats): recorder.timed(scenario, 'assign', simulation.assign, member_df)
+    except Exception: pass
+
+def run_scenario(name, base_sheets, args, runner=None):
+    """
+    シナリオを1回実行し、(操作の記録, API 呼び出しの集計) を返します。
+    シナリオごとにスプレッドシートの内容とキャッシュ (読み込み・ヘッダー・書き込み済みの内容) を初期化し、起動直後の状態から始めます。
+    """
+    conditions = NetworkConditions(latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000, error_rate=args.error_rate, seed=args.seed)
+    client = OfflineClient(copy.deepcopy(base_sheets), conditions=conditions)
+    HEADERS.forget(); WRITTEN_GRIDS.forget()
+    simulation = AppSimulation(client, args.date, runner=runner, seed=args.seed)
+    member_rows = base_sheets[config.MEMBER_SHEET_NAME]
+    members = [dict(zip(member_rows[0], row)) for row in member_rows[1:]][:args.members]
+    rng = random.Random(args.seed)
+    arrivals = lambda count: sorted(rng.uniform(0, args.ramp_seconds) for _ in range(count)) if args.ramp_seconds > 0 else [0.0] * count
+
+    recorder = LoadTestRecorder()
+    flows = []
+    if name == 'submit': flows = [(_member_flow, (m, ['submit'], d)) for m, d in zip(members, arrivals(len(members)))]
+    elif name == 'lookup': flows = [(_member_flow, (m, ['lookup'], d)) for m, d in zip(members, arrivals(len(members)))]
+    elif name == 'assign': flows = [(_admin_flow, (args.assign_repeats, 0.0))]
+    elif name == 'rush':
+        # 全員が連絡を送り、一部はそのまま過去の連絡も確認する。管理者は集中の途中で割り振りを実行する
+        flows = [(_member_flow, (m, ['submit', 'lookup'] if rng.random() < args.lookup_ratio else ['submit'], d)) for m, d in zip(members, arrivals(len(members)))]
+        flows.append((_admin_flow, (1, args.ramp_seconds / 2)))
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency or len(flows), thread_name_prefix=f"loadtest-{name}") as executor:
+        for flow, flow_args in flows: executor.submit(flow, simulation, recorder, name, *flow_args)
+    elapsed = time.perf_counter() - started
+    total_calls, rate_limited, calls_by_method = conditions.totals()
+    api_totals = {'scenario': name, 'elapsed': elapsed, 'operations': len(recorder.records), 'api_calls': total_calls, 'rate_limited': rate_limited,
+                  'calls_by_method': calls_by_method, 'sheet_loads': simulation.cache.misses}
+    return recorder.records, api_totals
+
+def summarize(records, api_totals):
+    """操作の記録から、シナリオ・操作ごとの件数・失敗数・スループット・レイテンシの表と、シナリオごとの API 呼び出しの表を作成します。"""
+    elapsed_by_scenario = {totals['scenario']: totals['elapsed'] for totals in api_totals}
+    rows = []
+    df = pd.DataFrame(records, columns=['scenario', 'operation', 'seconds', 'error'])
+    for (scenario, operation), group in df.groupby(['scenario', 'operation'], sort=False):
+        ok_seconds = group.loc[group['error'].isna(), 'seconds'].to_numpy()
+        p50, p95, p99 = (np.percentile(ok_seconds, [50, 95, 99]) * 1000).round(1) if len(ok_seconds) else (np.nan,) * 3
+        rows.append({'シナリオ': scenario, '操作': operation, '件数': len(group), '失敗': int(group['error'].notna().sum()),
+                     'スループット(件/秒)': round(len(ok_seconds) / elapsed_by_scenario[scenario], 2) if elapsed_by_scenario[scenario] else np.nan,
+                     'p50(ms)': p50, 'p95(ms)': p95, 'p99(ms)': p99, '最大(ms)': round(ok_seconds.max() * 1000, 1) if len(ok_seconds) else np.nan})
+    operations = pd.DataFrame(rows, columns=['シナリオ', '操作', '件数', '失敗', 'スループット(件/秒)', 'p50(ms)', 'p95(ms)', 'p99(ms)', '最大(ms)'])
+    api = pd.DataFrame([{
+        'シナリオ': totals['scenario'], '所要時間(秒)': round(totals['elapsed'], 2), '操作数': totals['operations'],
+        'API呼び出し': totals['api_calls'], '1操作あたり': round(totals['api_calls'] / totals['operations'], 2) if totals['operations'] else np.nan,
+        'うち429': totals['rate_limited'], 'シート読み込み': totals['sheet_loads'],
+        '内訳': ', '.join(f"{method}:{count}" for method, count in sorted(totals['calls_by_method'].items(), key=lambda kv: -kv[1])),
+    } for totals in api_totals], columns=['シナリオ', '所要時間(秒)', '操作数', 'API呼び出し', '1操作あたり', 'うち429', 'シート読み込み', '内訳'])
+    return operations, api
+
+def app_import_stages(path=APP_PATH):
+    """
+    app.py のモジュール直下のインポート文を、ログインフォームの st.stop() より前 (ログイン画面) と後 (ログイン後) に分けて返します。
+    戻り値は [(段階名, インポート文のソース), ...] です。
+    """
+    with open(path, encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    stages = {'ログイン画面': [], 'ログイン後': []}
+    stage = 'ログイン画面'
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)): stages[stage].append(ast.unparse(node))
+        elif isinstance(node, ast.If) and stage == 'ログイン画面' and any(
+                isinstance(n, ast.Call) and ast.unparse(n.func) == 'st.stop' for n in ast.walk(ast.Module(body=node.body, type_ignores=[]))):
+            stage = 'ログイン後'
+    return [(name, '\n'.join(statements)) for name, statements in stages.items()]
+
+# 新しいプロセスで段階ごとにインポートし、所要時間と読み込まれた重いモジュールを標準エラーに書き出す
+# (-X importtime の出力と順番が入れ替わらないよう、同じ標準エラーに書いて flush する)
+_IMPORT_PROFILE_SCRIPT = """
+import json, sys, time
+for name, code, heavy in json.loads(sys.argv[1]):
+    sys.stderr.write('@@stage ' + name + '\\n'); sys.stderr.flush()
+    started = time.perf_counter()
+    exec(code, {})
+    elapsed = time.perf_counter() - started
+    sys.stderr.write('@@done ' + json.dumps([elapsed, [m for m in heavy if m in sys.modules]]) + '\\n'); sys.stderr.flush()
+"""
+
+def _parse_importtime(stderr):
+    """-X importtime の出力を段階ごとに分け、段階ごとの (所要時間, 読み込まれた重いモジュール, {最上位のモジュール: 累積マイクロ秒}) を返します。"""
+    stages, current = {}, None
+    for line in stderr.splitlines():
+        if line.startswith('@@stage '):
+            current = line[len('@@stage '):]; stages[current] = [None, [], {}]
+        elif line.startswith('@@done ') and current is not None:
+            stages[current][0], stages[current][1] = json.loads(line[len('@@done '):])
+        elif line.startswith('import time:') and current is not None:
+            parts = line[len('import time:'):].split('|')
+            if len(parts) != 3 or not parts[1].strip().isdigit(): continue # 見出し行
+            name = parts[2][1:]
+            if name == name.lstrip(): stages[current][2][name.strip()] = int(parts[1])
+    return stages
+
+def import_profile(repeats=5, path=APP_PATH):
+    """
+    app.py のインポートを新しいプロセスで repeats 回実行し、段階ごとの所要時間 (中央値) と、時間のかかったモジュールを集計します。
+    戻り値は (段階ごとの表, モジュールごとの表) です。
+    """
+    stages = app_import_stages(path)
+    argument = json.dumps([(name, code, HEAVY_MODULES) for name, code in stages])
+    runs = []
+    for _ in range(repeats):
+        completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', _IMPORT_PROFILE_SCRIPT, argument],
+                                   cwd=os.path.dirname(path), capture_output=True, text=True, encoding='utf-8')
+        if completed.returncode != 0:
+            raise RuntimeError(f"インポートに失敗しました: {completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else completed.returncode}")
+        runs.append(_parse_importtime(completed.stderr))
+    stage_rows, module_rows = [], []
+    for name, code in stages:
+        elapsed = [run[name][0] for run in runs]
+        stage_rows.append({'段階': name, 'インポート文': len(code.splitlines()), '所要時間(ms)': round(float(np.median(elapsed)) * 1000, 1),
+                           '最大(ms)': round(max(elapsed) * 1000, 1), '読み込まれた重いモジュール': ', '.join(runs[0][name][1]) or '-'})
+        modules = pd.DataFrame([run[name][2] for run in runs]).median().sort_values(ascending=False)
+        for module, microseconds in modules.head(IMPORT_PROFILE_TOP).items():
+            module_rows.append({'段階': name, 'モジュール': module, '累積(ms)': round(microseconds / 1000, 1)})
+    return pd.DataFrame(stage_rows), pd.DataFrame(module_rows, columns=['段階', 'モジュール', '累積(ms)'])
+
+def run_import_profile(args):
+    """--import-profile: app.py のインポート時間を計測して表示します。戻り値は終了コードです。"""
+    try:
+        stages, modules = import_profile(args.import_repeats)
+    except RuntimeError as e:
+        print(f"ERROR: {e}"); return 1
+    print(f"app.py のインポート時間 (新しいプロセスで {args.import_repeats} 回の中央値、{sys.executable})")
+    with pd.option_context('display.width', 200, 'display.max_columns', None, 'display.max_colwidth', 80):
+        print(stages.to_string(index=False)); print(); print(modules.to_string(index=False))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'stages': stages.to_dict(orient='records'), 'modules': modules.to_dict(orient='records')}, f, ensure_ascii=False, indent=2)
+    return 0
+
+def _sorted_latest(df, keys):
+    # latest_records 導入前の方法 (ログ全体を記録日時の降順に並べ替えてから重複除去)。比較の基準として残す
+    return df.sort_values(by=COL_ATTENDANCE_TIMESTAMP, ascending=False).drop_duplicates(subset=keys, keep='first')
+
+def _median_seconds(func, repeats):
+    seconds = []
+    for _ in range(repeats):
+        started = time.perf_counter(); result = func(); seconds.append(time.perf_counter() - started)
+    return float(np.median(seconds)), result
+
+def latest_records_benchmark(num_rows, num_members=150, repeats=5, seed=0, target_date=None):
+    """
+    合成した num_rows 件の連絡ログで、最新の連絡の抽出を latest_records と並べ替え+重複除去で計測します。
+    コート割り振り (練習日1日分の部員ごと・全練習日の部員x練習日ごと) と連絡確認の索引作成の3通りを比べ、結果が一致するかも確認します
+    (同じ記録日時の連絡がある組は、どちらを最新とするかが異なるため記録日時で比べます)。
+    """
+    target_date = target_date or next_practice_date()
+    sheets = synthetic_sheets(num_members, num_rows, target_date, seed=seed)
+    frames = [pd.DataFrame(values[1:], columns=values[0]) for name, values in sheets.items() if is_attendance_sheet(name, config.ATTENDANCE_SHEET_NAME)]
+    logs = apply_schema(pd.concat(frames, ignore_index=True), ATTENDANCE_SCHEMA)
+    busiest_date = logs[COL_ATTENDANCE_TARGET_DATE].value_counts().idxmax()
+    day_logs = logs[logs[COL_ATTENDANCE_TARGET_DATE] == busiest_date]
+    cases = [
+        ('割り振り (練習日1日分)', day_logs, [COL_MEMBER_ID]),
+        ('割り振り (全練習日)', logs, [COL_MEMBER_ID, COL_ATTENDANCE_TARGET_DATE]),
+    ]
+    rows = []
+    for name, df, keys in cases:
+        sorted_seconds, expected = _median_seconds(lambda: _sorted_latest(df, keys), repeats)
+        latest_seconds, actual = _median_seconds(lambda: latest_records(df, keys), repeats)
+        same = expected.set_index(keys)[COL_ATTENDANCE_TIMESTAMP].sort_index().equals(actual.set_index(keys)[COL_ATTENDANCE_TIMESTAMP].sort_index())
+        rows.append((name, len(df), len(actual), sorted_seconds, latest_seconds, same))
+
+    # 連絡確認の索引は、導入前の MemberHistoryIndex.build と同じく3列で並べ替えてから重複除去したものと比べる
+    sorted_index = lambda: logs.dropna(subset=[COL_ATTENDANCE_TIMESTAMP, COL_ATTENDANCE_TARGET_DATE]) \
+        .sort_values(by=[COL_MEMBER_ID, COL_ATTENDANCE_TARGET_DATE, COL_ATTENDANCE_TIMESTAMP], ascending=[True, False, False]) \
+        .drop_duplicates(subset=[COL_MEMBER_ID, COL_ATTENDANCE_TARGET_DATE], keep='first').reset_index(drop=True)
+    sorted_seconds, expected = _median_seconds(sorted_index, repeats)
+    latest_seconds, index = _median_seconds(lambda: MemberHistoryIndex.build(logs), repeats)
+    same = expected[[COL_MEMBER_ID, COL_ATTENDANCE_TARGET_DATE, COL_ATTENDANCE_TIMESTAMP]].equals(index.records[[COL_MEMBER_ID, COL_ATTENDANCE_TARGET_DATE, COL_ATTENDANCE_TIMESTAMP]])
+    rows.append(('連絡確認の索引作成', len(logs), len(index.records), sorted_seconds, latest_seconds, same))
+    return pd.DataFrame([{
+        'ケース': name, '行数': num_input, '結果の行数': num_output,
+        '並べ替え+重複除去(ms)': round(sorted_seconds * 1000, 2), 'latest_records(ms)': round(latest_seconds * 1000, 2),
+        '倍率': round(sorted_seconds / latest_seconds, 2) if latest_seconds else np.nan, '一致': same,
+    } for name, num_input, num_output, sorted_seconds, latest_seconds, same in rows])
+
+def run_latest_benchmark(args):
+    """--latest-benchmark: 最新の連絡の抽出を計測して表示します。戻り値は終了コードです。"""
+    result = latest_records_benchmark(args.benchmark_rows, num_members=args.members, repeats=args.benchmark_repeats, seed=args.seed, target_date=args.date)
+    print(f"最新の連絡の抽出 (合成した連絡ログ {args.benchmark_rows} 件・部員 {args.members} 名、{args.benchmark_repeats} 回の中央値)")
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print(result.to_string(index=False))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'latest_records': result.to_dict(orient='records')}, f, ensure_ascii=False, indent=2, default=str)
+    return 0 if result['一致'].all() else 1
+
+def _assigned_ids(assignments):
+    return {sheet_name: {m.get(COL_MEMBER_ID) for members in teams.values() for m in members} for sheet_name, teams in assignments.items()}
+
+def delta_refresh_benchmark(num_members, num_logs, num_changes, repeats=5, seed=0, target_date=None):
+    """
+    事前計算した割り振りに num_changes 名の連絡の変化を反映する2通りの方法を計測します。
+    - 差分: refresh_precomputed_assignment に前回の結果を渡す (apply_assignment_delta で変わった部員だけを入れ直す)
+    - 全体: run_assignment_pipeline で同じシードから全員を割り振り直す (事前計算がない場合・部員リストが変わった場合)
+    どちらも連絡ログはメモリ上の DataFrame を使い、Sheets の読み込み・書き込みは含みません。
+    割り振り結果のキャッシュは毎回破棄します (同じ入力の2回目以降が計算されないため)。
+    各シートに割り振られた部員が両者で一致するかも確認します。
+    """
+    target_date = target_date or next_practice_date()
+    rng = random.Random(seed)
+    spreadsheet = OfflineClient(synthetic_sheets(num_members, num_logs, target_date, seed=seed)).open_by_key(config.SPREADSHEET_ID)
+    member_df, attendance_df = load_assignment_inputs(spreadsheet, target_date)
+    previous = refresh_precomputed_assignment(None, member_df, attendance_df, target_date)
+
+    # 事前計算の後に num_changes 名が状況を変えた連絡を追記する
+    status_by_member = {m: status for key, status in (('participating', '参加'), ('late', '遅刻'), ('absent', '欠席')) for m in previous.result['statuses'][key]}
+    recorded_at = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    changes = []
+    for member in rng.sample(member_df.to_dict('records'), min(num_changes, len(member_df))):
+        status = rng.choice([s for s in ('参加', '遅刻', '欠席') if s != status_by_member.get(member[COL_MEMBER_ID], '参加')])
+        changes.append([recorded_at, target_date.strftime('%Y/%m/%d'), member[COL_MEMBER_ID], member[COL_MEMBER_GRADE], member[COL_MEMBER_NAME], status,
+                        '授業' if status != '参加' else '', '17:30' if status == '遅刻' else '', member[COL_MEMBER_DEPARTMENT]])
+    spreadsheet.worksheet(config.ATTENDANCE_SHEET_NAME).append_rows(changes)
+    _, changed_df = load_assignment_inputs(spreadsheet, target_date)
+
+    delta_seconds, delta = _median_seconds(lambda: (clear_assignment_cache(), refresh_precomputed_assignment(previous, member_df, changed_df, target_date))[1], repeats)
+    full_seconds, full = _median_seconds(lambda: (clear_assignment_cache(), run_assignment_pipeline(member_df, changed_df, target_date, seed=previous.seed))[1], repeats)
+    same = _assigned_ids(delta.result['assignments']) == _assigned_ids(full['assignments'])
+    return pd.DataFrame([
+        {'方法': '差分 (apply_assignment_delta)', '反映の種類': delta.refresh_info['mode'], '変化した部員': delta.refresh_info['changed_members'],
+         '時間(ms)': round(delta_seconds * 1000, 2), '割り振った部員が一致': same},
+        {'方法': '全体 (run_assignment_pipeline)', '反映の種類': 'full', '変化した部員': len(changes),
+         '時間(ms)': round(full_seconds * 1000, 2), '割り振った部員が一致': same},
+    ])
+
+def run_delta_benchmark(args):
+    """--delta-benchmark: 事前計算への差分の反映と全体の計算を計測して表示します。戻り値は終了コードです。"""
+    result = delta_refresh_benchmark(args.members, args.logs, args.delta_changes, repeats=args.benchmark_repeats, seed=args.seed, target_date=args.date)
+    print(f"連絡の変化の反映 (部員 {args.members} 名・連絡ログ {args.logs} 件・変化 {args.delta_changes} 名、{args.benchmark_repeats} 回の中央値)")
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print(result.to_string(index=False))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'delta_refresh': result.to_dict(orient='records')}, f, ensure_ascii=False, indent=2, default=str)
+    return 0 if result['割り振った部員が一致'].all() else 1
+
+def _scenarios_arg(text):
+    names = [name.strip() for name in text.split(',') if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown or not names: raise argparse.ArgumentTypeError(f"シナリオは {', '.join(SCENARIOS)} から選んでください: {', '.join(unknown) or text}")
+    return names
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="連絡送信・連絡確認・コート割り振りを同時に実行し、オフラインのスプレッドシートに対する負荷試験を行います。")
+    parser.add_argument('--scenarios', type=_scenarios_arg, default=list(SCENARIOS), help=f"実行するシナリオ (カンマ区切り、{', '.join(SCENARIOS)})")
+    parser.add_argument('--members', type=int, default=120, help="同時に操作する部員の数 (既定 120)")
+    parser.add_argument('--logs', type=int, default=3000, help="合成データの連絡ログの件数 (--offline 指定時は無視)")
+    parser.add_argument('--offline', metavar='DIR', help="合成データの代わりに DIR 内の '<シート名>.csv' を使う")
+    parser.add_argument('--date', type=datetime.date.fromisoformat, default=next_practice_date(), help="連絡・割り振りの対象練習日 (YYYY-MM-DD、既定は今日)")
+    parser.add_argument('--latency-ms', type=float, default=150, help="API 呼び出し1回の遅延 (ミリ秒、既定 150)")
+    parser.add_argument('--jitter-ms', type=float, default=100, help="遅延に加える 0〜N ミリ秒の一様乱数 (既定 100)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="API 呼び出しが 429 で失敗する確率 (0〜1、既定 0)")
+    parser.add_argument('--ramp-seconds', type=float, default=0.0, help="部員の操作開始をこの秒数の間に散らす (既定 0 = 一斉に開始)")
+    parser.add_argument('--concurrency', type=int, help="同時に動かすスレッド数の上限 (既定は部員数 = Streamlit と同じく全セッションが並行)")
+    parser.add_argument('--lookup-ratio', type=float, default=0.3, help="rush で連絡の後に過去の連絡も確認する部員の割合 (既定 0.3)")
+    parser.add_argument('--assign-repeats', type=int, default=3, help="assign で割り振りを繰り返す回数 (既定 3)")
+    parser.add_argument('--worker-processes', type=int, default=0, help="割り振りの計算に使うワーカープロセスの数 (既定 0 = 操作のスレッドで計算)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--import-profile', action='store_true', help="シナリオの代わりに、app.py のインポート時間をログイン画面まで / ログイン後に分けて計測する")
+    parser.add_argument('--import-repeats', type=int, default=5, help="--import-profile で計測を繰り返す回数 (既定 5)")
+    parser.add_argument('--latest-benchmark', action='store_true', help="シナリオの代わりに、最新の連絡の抽出 (latest_records) を並べ替え+重複除去と比較する")
+    parser.add_argument('--benchmark-rows', type=int, default=100000, help="--latest-benchmark で合成する連絡ログの件数 (既定 100000)")
+    parser.add_argument('--benchmark-repeats', type=int, default=5, help="--latest-benchmark / --delta-benchmark で計測を繰り返す回数 (既定 5)")
+    parser.add_argument('--delta-benchmark', action='store_true', help="シナリオの代わりに、事前計算への連絡の変化の反映を全体の計算し直しと比較する")
+    parser.add_argument('--delta-changes', type=int, default=5, help="--delta-benchmark で状況を変える部員の数 (既定 5)")
+    parser.add_argument('--json', metavar='PATH', help="集計結果を JSON で書き出すファイル")
+    return parser.parse_args(argv)
+
+def run(args):
+    """引数に従って各シナリオを実行し、集計を表示します。戻り値は終了コードです。"""
+    base_sheets = read_csv_sheets(args.offline) if args.offline else synthetic_sheets(args.members, args.logs, args.date, seed=args.seed)
+    if config.MEMBER_SHEET_NAME not in base_sheets:
+        print(f"ERROR: '{config.MEMBER_SHEET_NAME}' のシートがありません。"); return 1
+    workers = None
+    if args.worker_processes > 0:
+        from assignment_worker import AssignmentWorkerPool
+        workers = AssignmentWorkerPool(args.worker_processes); workers.warm_up()
+    records, api_totals = [], []
+    try:
+        for name in args.scenarios:
+            scenario_records, totals = run_scenario(name, base_sheets, args, runner=workers.run_tasks if workers else None)
+            records += scenario_records; api_totals.append(totals)
+    finally:
+        if workers is not None: workers.shutdown()
+    operations, api = summarize(records, api_totals)
+    print(f"対象練習日 {args.date} / 部員 {args.members} 名 / 遅延 {args.latency_ms:g}+0〜{args.jitter_ms:g}ms / 429 の確率 {args.error_rate:g} / 開始の分散 {args.ramp_seconds:g}秒")
+    with pd.option_context('display.width', 200, 'display.max_columns', None, 'display.max_colwidth', 80):
+        print(operations.to_string(index=False)); print(); print(api.to_string(index=False))
+    errors = pd.DataFrame(records, columns=['scenario', 'operation', 'seconds', 'error']).dropna(subset=['error'])
+    if not errors.empty:
+        print(); print("失敗の内訳:")
+        print(errors.groupby(['scenario', 'operation', 'error']).size().rename('件数').reset_index().to_string(index=False))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'settings': {k: (str(v) if isinstance(v, datetime.date) else v) for k, v in vars(args).items()},
+                       'operations': operations.to_dict(orient='records'), 'api': api.to_dict(orient='records')}, f, ensure_ascii=False, indent=2, default=str)
+    return 0
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.import_profile: return run_import_profile(args)
+    if args.latest_benchmark: return run_latest_benchmark(args)
+    if args.delta_benchmark: return run_delta_benchmark(args)
+    return run(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
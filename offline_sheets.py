@@ -0,0 +1,290 @@
+# offline_sheets.py (オフライン用のスプレッドシート代替実装)
+# -*- coding: utf-8 -*-
+#
+# gspread のうち本アプリが使う範囲 (open_by_key / worksheet / get_all_records / batch_get / append_rows / update など) を
+# メモリ上のリストで再現します。認証情報なしでの動作確認や、API 呼び出し回数の回帰確認に使います。
+# 値は書き込まれたまま保持し、USER_ENTERED による日付などの解釈は行いません。
+# NetworkConditions を指定すると、API 呼び出しごとに遅延と 429 (レート制限) エラーを加えます (負荷試験 loadtest.py 用)。
+
+import collections
+import copy
+import csv
+import functools
+import itertools
+import json
+import os
+import random
+import threading
+import time
+
+import gspread
+import requests
+from gspread.utils import a1_range_to_grid_range, numericise_all
+
+def rate_limit_error(message="Quota exceeded for quota metric 'Read requests' (offline)"):
+    """Sheets API が返す 429 (RESOURCE_EXHAUSTED) と同じ形の gspread.exceptions.APIError を作成します。"""
+    response = requests.Response()
+    response.status_code = 429
+    response.headers['Content-Type'] = 'application/json'
+    response._content = json.dumps({'error': {'code': 429, 'message': message, 'status': 'RESOURCE_EXHAUSTED'}}).encode('utf-8')
+    return gspread.exceptions.APIError(response)
+
+class NetworkConditions:
+    """
+    API 呼び出しごとの遅延と 429 エラーの発生条件 (スレッドセーフ)。
+    latency 秒に 0〜jitter 秒の一様乱数を加えた時間だけ待ってから、error_rate の確率で 429 を送出します (送出した呼び出しは何も変更しません)。
+    呼び出し回数と送出した 429 の回数をメソッド別に数えます。
+    """
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = collections.Counter() # メソッド -> 呼び出し回数
+        self.errors = collections.Counter() # メソッド -> 429 を送出した回数
+
+    def before_call(self, method):
+        with self._lock:
+            delay = self.latency + (self._rng.uniform(0, self.jitter) if self.jitter > 0 else 0)
+            failed = self.error_rate > 0 and self._rng.random() < self.error_rate
+            self.calls[method] += 1
+            if failed: self.errors[method] += 1
+        if delay > 0: time.sleep(delay)
+        if failed: raise rate_limit_error()
+
+    def totals(self):
+        """(呼び出し回数, 429 の回数, {メソッド: 呼び出し回数}) を返します。"""
+        with self._lock:
+            return sum(self.calls.values()), sum(self.errors.values()), dict(self.calls)
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear(); self.errors.clear()
+
+def _api_call(method):
+    # Sheets API 1回分に当たるメソッド。NetworkConditions があれば遅延と 429 を加える
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        conditions = getattr(self, 'spreadsheet', self).conditions
+        if conditions is not None: conditions.before_call(method.__name__)
+        return method(self, *args, **kwargs)
+    return wrapper
+
+def read_csv_sheets(fixture_dir):
+    """'<シート名>.csv' を集めたディレクトリを読み込み、{シート名: 行のリスト} を返します。"""
+    sheets = {}
+    for filename in sorted(os.listdir(fixture_dir)):
+        if not filename.endswith('.csv'): continue
+        with open(os.path.join(fixture_dir, filename), newline='', encoding='utf-8-sig') as f:
+            sheets[filename[:-4]] = [row for row in csv.reader(f)]
+    return sheets
+
+class OfflineWorksheet:
+    """メモリ上のワークシート。"""
+    def __init__(self, spreadsheet, title):
+        self.spreadsheet = spreadsheet
+        self.title = title
+
+    @property
+    def _rows(self):
+        return self.spreadsheet._data[self.title]
+
+    @property
+    def id(self):
+        return self.spreadsheet._sheet_id(self.title)
+
+    @property
+    def spreadsheet_id(self):
+        return self.spreadsheet.id
+
+    def _data_width(self):
+        return max((len(r) for r in self._rows), default=0)
+
+    @property
+    def row_count(self):
+        # シートの行数 (add_worksheet / resize で指定した大きさ、追記でデータが超えた場合はデータの行数)
+        return max(self.spreadsheet._grid_sizes.get(self.title, (0, 0))[0], len(self._rows))
+
+    @property
+    def col_count(self):
+        return max(self.spreadsheet._grid_sizes.get(self.title, (0, 0))[1], self._data_width())
+
+    def _values(self):
+        with self.spreadsheet._lock:
+            width = self._data_width()
+            return [[str(v) for v in row] + [''] * (width - len(row)) for row in self._rows]
+
+    @_api_call
+    def resize(self, rows=None, cols=None):
+        """シートの行数・列数を変更します。小さくした場合ははみ出した値を削除します (Sheets API と同じ)。"""
+        with self.spreadsheet._lock:
+            rows = self.row_count if rows is None else rows
+            cols = self.col_count if cols is None else cols
+            self.spreadsheet._grid_sizes[self.title] = (rows, cols)
+            del self._rows[rows:]
+            for row in self._rows: del row[cols:]
+        return {}
+
+    @_api_call
+    def get_all_values(self, **kwargs):
+        return self._values()
+
+    @_api_call
+    def get_all_records(self, head=1, **kwargs):
+        values = self._values()
+        if len(values) < head: return []
+        header = values[head - 1]
+        return [dict(zip(header, numericise_all(row, empty2zero=False, default_blank=''))) for row in values[head:]]
+
+    @_api_call
+    def row_values(self, row, **kwargs):
+        values = self._values()
+        return list(values[row - 1]) if row <= len(values) else []
+
+    @_api_call
+    def col_values(self, col, **kwargs):
+        return [row[col - 1] for row in self._values() if col <= len(row)]
+
+    @_api_call
+    def append_row(self, values, value_input_option='RAW', **kwargs):
+        return self._append([values])
+
+    @_api_call
+    def append_rows(self, values, value_input_option='RAW', **kwargs):
+        return self._append(values)
+
+    def _append(self, values):
+        with self.spreadsheet._lock:
+            self._rows.extend(list(row) for row in values)
+        return {'updates': {'updatedRows': len(values)}}
+
+    @_api_call
+    def clear(self):
+        with self.spreadsheet._lock:
+            self._rows.clear()
+        return {}
+
+    def _write_block(self, range_name, values):
+        grid = a1_range_to_grid_range(range_name.split('!')[-1] if range_name else 'A1')
+        top, left = grid.get('startRowIndex', 0), grid.get('startColumnIndex', 0)
+        rows = self._rows
+        for i, row_values in enumerate(values):
+            r = top + i
+            while len(rows) <= r: rows.append([])
+            row = rows[r]
+            if len(row) < left + len(row_values): row.extend([''] * (left + len(row_values) - len(row)))
+            row[left:left + len(row_values)] = list(row_values)
+
+    @_api_call
+    def update(self, values=None, range_name=None, value_input_option='RAW', **kwargs):
+        # gspread 5 系の update(range_name, values) の位置引数順にも対応する
+        if isinstance(values, str) and (range_name is None or isinstance(range_name, list)):
+            values, range_name = range_name, values
+        with self.spreadsheet._lock:
+            self._write_block(range_name or 'A1', values or [])
+        return {'updatedRows': len(values or [])}
+
+    @_api_call
+    def batch_update(self, data, value_input_option='RAW', **kwargs):
+        with self.spreadsheet._lock:
+            for item in data:
+                self._write_block(item['range'], item['values'])
+        return {'totalUpdatedCells': sum(len(r) for item in data for r in item['values'])}
+
+    @_api_call
+    def batch_get(self, ranges, **kwargs):
+        values = self._values()
+        results = []
+        for range_name in ranges:
+            grid = a1_range_to_grid_range(range_name.split('!')[-1])
+            top, bottom = grid.get('startRowIndex', 0), grid.get('endRowIndex', len(values))
+            left, right = grid.get('startColumnIndex', 0), grid.get('endColumnIndex', self._data_width())
+            block = [row[left:right] for row in values[top:bottom]]
+            while block and not any(block[-1]): block.pop() # 末尾の空行は返さない (Sheets API と同じ)
+            if kwargs.get('major_dimension') == 'COLUMNS':
+                block = [list(col) for col in itertools.zip_longest(*block, fillvalue='')]
+                for col in block:
+                    while col and col[-1] == '': col.pop() # 列ごとに末尾の空セルを返さない
+            results.append(block)
+        return results
+
+class OfflineSpreadsheet:
+    """メモリ上のスプレッドシート。sheets は {シート名: 行のリスト (1行目はヘッダー)}。"""
+    def __init__(self, sheets, title='offline', conditions=None):
+        self._data = sheets
+        self._lock = threading.RLock()
+        self.title = title
+        self.id = title
+        self.conditions = conditions
+        self._sheet_ids = {} # シート名 -> sheetId (batch_update のリクエストで使う)
+        self._grid_sizes = {} # シート名 -> (行数, 列数) (add_worksheet / resize で指定した大きさ)
+
+    def _sheet_id(self, title):
+        with self._lock:
+            return self._sheet_ids.setdefault(title, len(self._sheet_ids))
+
+    def _title_for_id(self, sheet_id):
+        with self._lock:
+            for title in self._data: self._sheet_id(title)
+            return next(title for title, known_id in self._sheet_ids.items() if known_id == sheet_id)
+
+    @_api_call
+    def worksheet(self, title):
+        if title not in self._data: raise gspread.exceptions.WorksheetNotFound(title)
+        return OfflineWorksheet(self, title)
+
+    @_api_call
+    def worksheets(self, **kwargs):
+        return [OfflineWorksheet(self, title) for title in list(self._data)]
+
+    @_api_call
+    def add_worksheet(self, title, rows=100, cols=26, index=None):
+        with self._lock:
+            self._data.setdefault(title, [])
+            self._grid_sizes[title] = (rows, cols)
+        return OfflineWorksheet(self, title)
+
+    @_api_call
+    def values_batch_get(self, ranges, params=None):
+        """spreadsheets.values.batchGet のうち、シート全体 ("'シート名'") の読み込みを再現します。"""
+        value_ranges = []
+        for range_name in ranges:
+            title = range_name.strip("'").replace("''", "'")
+            if '!' in range_name or title not in self._data: raise NotImplementedError(f"offline values_batch_get はシート全体の範囲だけに対応しています: {range_name}")
+            values = OfflineWorksheet(self, title)._values()
+            for row in values:
+                while row and row[-1] == '': row.pop() # 行ごとに末尾の空セルを返さない (Sheets API と同じ)
+            while values and not values[-1]: values.pop()
+            value_ranges.append({'range': range_name, 'values': values} if values else {'range': range_name})
+        return {'spreadsheetId': self.id, 'valueRanges': value_ranges}
+
+    @_api_call
+    def batch_update(self, body):
+        """spreadsheets.batchUpdate のうち deleteDimension (行の削除) を再現します。"""
+        with self._lock:
+            for request in body.get('requests', []):
+                if 'deleteDimension' in request:
+                    grid = request['deleteDimension']['range']
+                    if grid.get('dimension') != 'ROWS': raise NotImplementedError("offline batch_update は行の削除だけに対応しています。")
+                    del self._data[self._title_for_id(grid['sheetId'])][grid['startIndex']:grid['endIndex']]
+                else:
+                    raise NotImplementedError(f"offline batch_update は {', '.join(request)} に対応していません。")
+        return {'replies': [{} for _ in body.get('requests', [])]}
+
+class OfflineClient:
+    """
+    gspread.Client の代わりに使うオフラインクライアント。
+    どのスプレッドシートIDで開いても同じデータ (sheets) を返します。conditions で遅延と 429 エラーを加えられます。
+    """
+    def __init__(self, sheets, conditions=None):
+        self.spreadsheet = OfflineSpreadsheet(sheets, conditions=conditions)
+
+    @_api_call
+    def open_by_key(self, key):
+        return self.spreadsheet
+
+    def snapshot(self):
+        """現在の全シートの内容のコピーを返します。"""
+        with self.spreadsheet._lock:
+            return copy.deepcopy(self.spreadsheet._data)
@@ -0,0 +1,214 @@
+# pair_history.py (同じチームになった回数の履歴)
+# -*- coding: utf-8 -*-
+#
+# 公開したコート割り振りで、部員のペアが同じチームになった回数 (共起回数) を保持します。
+# 学籍番号ごとに通し番号を振り、i < j のペアの回数を上三角部分だけの1次元配列 (uint16) に詰めて持ちます。
+# ペア (i, j) の位置は j*(j-1)/2 + i のため、部員が増えても配列の末尾に追加するだけで済みます。
+# 割り振りで参照するのは「部員1名 x チームの部員」の回数だけなので、過去の回数がどれだけ多くても参照のコストは変わりません。
+# 同じ練習日の割り振りを公開し直した場合に二重に数えないよう、直近の公開分はチーム構成も保持して差し替えます。
+# 保持しきれずに破棄した公開は、練習日単位でまとめて破棄し、破棄した最も新しい練習日だけを残します。
+# その日以前で直近の公開にない日は前回の分を差し替え (除き) できないため、全ての履歴をそのまま使い、呼び出し側で知らせます (is_evicted)。
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from schema import SHEETS_EPOCH, id_text
+
+PAIR_HISTORY_COLUMNS = ['学籍番号A', '学籍番号B', '回数', '記録キー', 'チーム', 'メンバー', '差し替えできない練習日 (この日以前)']
+LEGACY_EVICTED_KEYS_COLUMN = '差し替えできない記録キー' # 以前の形式 (破棄した記録キーの一覧)
+RECENT_RECORDS_KEPT = 32 # 差し替えのためにチーム構成を保持する公開の数 (これより古い公開は差し替えできません)
+
+def record_key(target_date, sheet_name):
+    """公開1回分を表すキー ('YYYY-MM-DD/シート名') を返します。"""
+    return f"{target_date.strftime('%Y-%m-%d')}/{sheet_name}"
+
+def _key_date(key):
+    return str(key).split('/', 1)[0]
+
+def _date_text(value):
+    # 練習日は USER_ENTERED で書き込むため日付として解釈され、書式なしで読み込むとシリアル値になる
+    if isinstance(value, (int, float)) and not isinstance(value, bool): return (SHEETS_EPOCH + pd.Timedelta(days=value)).strftime('%Y-%m-%d')
+    return _key_date(str(value).strip())
+
+def _pair_positions(a, b):
+    hi, lo = np.maximum(a, b), np.minimum(a, b)
+    return hi * (hi - 1) // 2 + lo
+
+class PairHistory:
+    """部員のペアごとの共起回数 (スレッドセーフ)。"""
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.ids = [] # 通し番号 -> 学籍番号
+        self.index = {} # 学籍番号 -> 通し番号
+        self.counts = np.zeros(0, dtype=np.uint16)
+        self.recent_records = OrderedDict() # 記録キー -> {チーム名: [学籍番号, ...]}
+        self.evicted_through = None # チーム構成を破棄した公開のうち最も新しい練習日 ('YYYY-MM-DD'、なければ None)
+        self._fingerprint = None
+
+    def __getstate__(self):
+        # 割り振りのワーカープロセスへ渡すため、ロックを除いて pickle する
+        with self._lock:
+            state = dict(self.__dict__)
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    def _indexes(self, member_ids, add=False):
+        indexes = []
+        for member_id in member_ids:
+            member_id = id_text(member_id)
+            i = self.index.get(member_id)
+            if i is None and add:
+                i = self.index[member_id] = len(self.ids); self.ids.append(member_id)
+            if i is not None: indexes.append(i)
+        if add:
+            size = len(self.ids) * (len(self.ids) - 1) // 2
+            if size > len(self.counts): self.counts = np.concatenate([self.counts, np.zeros(size - len(self.counts), dtype=np.uint16)])
+        return np.array(indexes, dtype=np.int64)
+
+    def _add_teams(self, teams, sign):
+        for member_ids in teams.values():
+            indexes = self._indexes(member_ids, add=True)
+            if len(indexes) < 2: continue
+            upper_a, upper_b = np.triu_indices(len(indexes), 1)
+            positions = _pair_positions(indexes[upper_a], indexes[upper_b])
+            if sign > 0: np.add.at(self.counts, positions, 1)
+            else: np.subtract.at(self.counts, positions[self.counts[positions] > 0], 1)
+
+    def record(self, key, teams):
+        """
+        公開した割り振り ({チーム名: 学籍番号のリスト}) を記録します。
+        同じキーの記録がまだ保持されていれば、前回の分を取り消してから加えます。
+        保持期間を過ぎた日 (is_evicted) の公開は前回の分を取り消せないため、そのまま加えます。
+        保持する公開が RECENT_RECORDS_KEPT を超えたら、最も古い公開の練習日の公開をまとめて破棄します。
+        """
+        teams = {name: [id_text(m) for m in member_ids] for name, member_ids in teams.items()}
+        with self._lock:
+            previous = self.recent_records.pop(key, None)
+            if previous is not None: self._add_teams(previous, -1)
+            self._add_teams(teams, 1)
+            self.recent_records[key] = teams
+            while len(self.recent_records) > RECENT_RECORDS_KEPT:
+                # 同じ日の公開の一部だけが残らないよう、練習日単位で破棄する
+                evicted_date = _key_date(next(iter(self.recent_records)))
+                for evicted_key in [k for k in self.recent_records if _key_date(k) == evicted_date]: del self.recent_records[evicted_key]
+                self.evicted_through = max(evicted_date, self.evicted_through or evicted_date)
+            self._fingerprint = None
+
+    def is_evicted(self, target_date):
+        """
+        target_date の公開のチーム構成を保持期間を過ぎて破棄している (前回の分を差し替え・除外できない) かを返します。
+        破棄した最も新しい練習日以前で、直近の公開にない日が該当します (公開したことのない日も含みます)。
+        """
+        day = target_date.strftime('%Y-%m-%d')
+        with self._lock:
+            return self.evicted_through is not None and day <= self.evicted_through and not any(_key_date(k) == day for k in self.recent_records)
+
+    def pair_count(self, member_a, member_b):
+        """2名が同じチームになった回数を返します。"""
+        with self._lock:
+            a, b = self.index.get(id_text(member_a)), self.index.get(id_text(member_b))
+            if a is None or b is None or a == b: return 0
+            return int(self.counts[_pair_positions(np.int64(a), np.int64(b))])
+
+    def repeat_count(self, member_id, team_member_ids):
+        """member_id がチームの部員それぞれと同じチームになった回数の合計を返します。"""
+        with self._lock:
+            i = self.index.get(id_text(member_id))
+            if i is None or not team_member_ids: return 0
+            others = self._indexes(team_member_ids)
+            others = others[others != i]
+            if not len(others): return 0
+            return int(self.counts[_pair_positions(np.full(len(others), i, dtype=np.int64), others)].sum(dtype=np.int64))
+
+    def excluding_date(self, target_date):
+        """
+        target_date の公開分を除いた履歴のコピーを返します。
+        同じ日の割り振りをやり直す場合に、その日の前回の結果自体を避けないようにするために使います。
+        その日の公開のチーム構成を破棄している (is_evicted) 場合は除けないため、全ての履歴のコピーを返します。
+        """
+        prefix = f"{target_date.strftime('%Y-%m-%d')}/"
+        with self._lock:
+            view = PairHistory()
+            view.ids, view.index, view.counts = list(self.ids), dict(self.index), self.counts.copy()
+            view.recent_records = OrderedDict((k, v) for k, v in self.recent_records.items() if not k.startswith(prefix))
+            view.evicted_through = self.evicted_through
+            for key, teams in self.recent_records.items():
+                if key.startswith(prefix): view._add_teams(teams, -1)
+            return view
+
+    def replace_with(self, other):
+        """内容を other (シートから読み込み直した履歴など) で置き換えます。"""
+        with other._lock:
+            state = (list(other.ids), dict(other.index), other.counts.copy(), OrderedDict(other.recent_records), other.evicted_through)
+        with self._lock:
+            self.ids, self.index, self.counts, self.recent_records, self.evicted_through = state
+            self._fingerprint = None
+
+    def _pair_rows(self):
+        # 回数が1以上のペアを [学籍番号A, 学籍番号B, 回数] の行にする (ロックを持って呼ぶ)
+        positions = np.flatnonzero(self.counts)
+        # 位置 p から (i, j) を復元する (j*(j-1)/2 <= p < j*(j+1)/2)
+        high = ((1 + np.sqrt(1 + 8 * positions.astype(np.float64))) // 2).astype(np.int64)
+        high -= (high * (high - 1) // 2 > positions)
+        high += ((high + 1) * high // 2 <= positions)
+        low = positions - high * (high - 1) // 2
+        return [[self.ids[a], self.ids[b], int(c)] for a, b, c in zip(low, high, self.counts[positions])]
+
+    @property
+    def fingerprint(self):
+        """
+        回数と公開の記録キーから計算したハッシュ (割り振りのキャッシュキーや、シートの履歴との比較に使います)。
+        学籍番号の通し番号の振り方によらず、内容が同じなら同じ値になります。
+        """
+        with self._lock:
+            if self._fingerprint is None:
+                pairs = sorted('\t'.join(sorted((a, b)) + [str(c)]) for a, b, c in self._pair_rows())
+                digest = hashlib.sha256('\n'.join(pairs).encode('utf-8'))
+                digest.update('\n'.join(list(self.recent_records) + ['--', self.evicted_through or '']).encode('utf-8'))
+                self._fingerprint = digest.hexdigest()
+            return self._fingerprint
+
+    @property
+    def total_pairs(self):
+        with self._lock:
+            return int(np.count_nonzero(self.counts))
+
+    def to_grid(self):
+        """
+        シート書き込み用のデータを返します。
+        ヘッダー行 + ペアの行・直近の公開のチーム構成の行を横に並べ、最後の列の1行目に差し替えできない最も新しい練習日を書きます。
+        """
+        with self._lock:
+            pair_rows = self._pair_rows()
+            record_rows = [[key, team_name, ' '.join(member_ids)] for key, teams in self.recent_records.items() for team_name, member_ids in teams.items()]
+            evicted_rows = [[self.evicted_through]] if self.evicted_through else []
+        rows = []
+        for n in range(max(len(pair_rows), len(record_rows), len(evicted_rows))):
+            rows.append((pair_rows[n] if n < len(pair_rows) else ['', '', '']) + (record_rows[n] if n < len(record_rows) else ['', '', ''])
+                        + (evicted_rows[n] if n < len(evicted_rows) else ['']))
+        return [list(PAIR_HISTORY_COLUMNS)] + rows
+
+    @classmethod
+    def from_columns(cls, columns):
+        """sheet_reader.read_columns で読み込んだ列 ({列名: 値のリスト}) から履歴を復元します。"""
+        history = cls()
+        pairs = [(id_text(a), id_text(b), c) for a, b, c in zip(columns.get('学籍番号A', []), columns.get('学籍番号B', []), columns.get('回数', []))
+                 if id_text(a) and id_text(b)]
+        history._indexes([member_id for a, b, _ in pairs for member_id in (a, b)], add=True)
+        for a, b, count in pairs:
+            try: history.counts[_pair_positions(np.int64(history.index[a]), np.int64(history.index[b]))] = min(int(float(count)), np.iinfo(np.uint16).max)
+            except (TypeError, ValueError): continue
+        for key, team_name, member_ids in zip(columns.get('記録キー', []), columns.get('チーム', []), columns.get('メンバー', [])):
+            if not str(key).strip(): continue
+            history.recent_records.setdefault(str(key).strip(), {})[str(team_name)] = str(member_ids).split()
+        evicted_dates = [_date_text(key) for key in columns.get(PAIR_HISTORY_COLUMNS[-1], []) + columns.get(LEGACY_EVICTED_KEYS_COLUMN, []) if str(key).strip()]
+        history.evicted_through = max(evicted_dates) if evicted_dates else None
+        return history
@@ -0,0 +1,188 @@
+# precompute.py (練習前のコート割り振りの事前計算)
+# -*- coding: utf-8 -*-
+#
+# 次の練習日のコート割り振りを一定間隔で事前に計算しておき、管理者が「コート割り振り」を押したときは
+# 計算済みの結果に前回からの連絡の変化だけを反映して、すぐに書き込めるようにします。
+# 変化の反映では最終ステータスが変わった部員だけを外す・追加し、局所的な交換を数回行うだけなので、他の部員のチームはほぼ変わりません。
+
+import datetime
+import random
+import threading
+
+import pandas as pd
+
+from court_assignment import (
+    assign_teams_cached, assignment_runs, assignment_outputs, build_roster_outputs, classify_member_statuses,
+    apply_assignment_delta, default_assignment_seed, run_assignment_pipeline, pair_history_for_date,
+)
+from instrumentation import traced
+from schema import COL_MEMBER_ID
+
+def next_practice_date(today=None, practice_weekdays=None):
+    """
+    today 以降で最初の練習日を返します。
+    practice_weekdays は練習がある曜日 (0=月曜 ... 6=日曜) のリストで、未指定なら毎日を練習日とみなします。
+    """
+    today = today or datetime.date.today()
+    if not practice_weekdays: return today
+    for offset in range(7):
+        candidate = today + datetime.timedelta(days=offset)
+        if candidate.weekday() in practice_weekdays: return candidate
+    return today
+
+def member_roster_fingerprint(member_df):
+    """部員リストの内容から指紋 (整数) を計算します。部員の追加やレベルの変更を検出するのに使います。"""
+    if member_df is None or member_df.empty: return 0
+    return int(pd.util.hash_pandas_object(member_df, index=False).sum())
+
+def _status_by_member(statuses):
+    status_by_member = {}
+    for key, status in (('participating', '参加'), ('late', '遅刻'), ('absent', '欠席')):
+        for member_id in statuses[key]: status_by_member[member_id] = status
+    return status_by_member
+
+class PrecomputedAssignment:
+    """
+    事前計算した1日分の割り振り結果。
+    result は run_assignment_pipeline と同じ形式の辞書です。
+    refresh_info: {'mode': 'full' / 'delta' / 'unchanged', 'changed_members': 状態が変わった人数, 'repaired_teams': {シート名: チーム名の集合}}
+    """
+    def __init__(self, target_date, include_level1, roster_fingerprint, result, refresh_info, seed, history_fingerprint=None):
+        self.target_date = target_date
+        self.include_level1 = include_level1
+        self.seed = seed
+        self.roster_fingerprint = roster_fingerprint
+        self.history_fingerprint = history_fingerprint
+        self.result = result
+        self.refresh_info = refresh_info
+        self.computed_at = datetime.datetime.now()
+
+@traced("refresh_precomputed_assignment")
+def refresh_precomputed_assignment(previous, member_df, attendance_df, target_date, include_level1=True, force_full=False, pair_history=None, runner=None):
+    """
+    事前計算の結果を最新の連絡に合わせて更新します。
+    前回の結果が同じ日・同じ条件・同じ部員リスト・同じペア履歴のものであれば、最終ステータスが変わった部員だけを
+    apply_assignment_delta で外す・追加します。それ以外の場合は全体を計算し直します。
+    force_full の場合は新しいシードで全員を割り振り直します (それ以外は対象練習日から決まるシード)。
+    全体の計算は runner (assignment_worker のプロセスプールなど、未指定ならこのスレッド) で行います。
+    """
+    fingerprint = member_roster_fingerprint(member_df)
+    history, history_messages = pair_history_for_date(pair_history, target_date)
+    history_fingerprint = history.fingerprint if history is not None else None
+    reusable = (not force_full and previous is not None and previous.target_date == target_date
+                and previous.include_level1 == include_level1 and previous.roster_fingerprint == fingerprint
+                and previous.history_fingerprint == history_fingerprint)
+    if not reusable:
+        seed = random.randrange(2**31) if force_full else default_assignment_seed(target_date)
+        result = run_assignment_pipeline(member_df, attendance_df, target_date, include_level1=include_level1, seed=seed, pair_history=pair_history, runner=runner)
+        return PrecomputedAssignment(target_date, include_level1, fingerprint, result, {'mode': 'full', 'changed_members': None, 'repaired_teams': {}}, seed, history_fingerprint)
+
+    statuses = classify_member_statuses(member_df, attendance_df, target_date)
+    previous_status, current_status = _status_by_member(previous.result['statuses']), _status_by_member(statuses)
+    changed_ids = {m for m in previous_status.keys() | current_status.keys() if previous_status.get(m) != current_status.get(m)}
+
+    runs = assignment_runs(member_df, statuses, include_level1)
+    assignments, repaired_teams, messages = {}, {}, list(history_messages)
+    for run in runs:
+        sheet_name, pool = run.sheet_name, run.pool
+        previous_teams = previous.result['assignments'].get(sheet_name) or {}
+        if len(previous_teams) != min(run.num_teams, len(pool)):
+            # 参加者がチーム数より少ないなど、チーム数自体が変わる場合は割り振り直す
+            assignments[sheet_name] = assign_teams_cached(pool, statuses['late'], run.num_teams, assignment_type=run.assignment_type, include_level1=include_level1,
+                                                          seed=previous.seed, pair_history=history, team_capacities=run.capacities, runner=runner)
+            repaired_teams[sheet_name] = set(assignments[sheet_name])
+            continue
+        pool_ids = set(pool[COL_MEMBER_ID])
+        assigned_ids = {m.get(COL_MEMBER_ID) for members in previous_teams.values() for m in members}
+        # 遅刻 <-> 参加 のようにプールに残ったまま状態が変わった部員も、配置の優先度が変わるため入れ直す
+        ids_to_remove = (assigned_ids - pool_ids) | (assigned_ids & changed_ids)
+        ids_to_add = (pool_ids - assigned_ids) | (pool_ids & changed_ids)
+        if not ids_to_remove and not ids_to_add:
+            assignments[sheet_name] = previous_teams
+            continue
+        members_to_add = pool[pool[COL_MEMBER_ID].isin(ids_to_add)].to_dict('records')
+        assignments[sheet_name], repaired = apply_assignment_delta(previous_teams, members_to_add, ids_to_remove, statuses['late'], pair_history=history, team_capacities=run.capacities)
+        if repaired: repaired_teams[sheet_name] = repaired
+
+    if all(run.pool.empty for run in runs): messages.append(('warning', "割り振り対象の参加予定者がいないため、コート割り振りは行いません。"))
+    assignment_result_outputs, assignment_messages = assignment_outputs(assignments, runs, target_date)
+    result = {
+        'statuses': statuses, 'assignments': assignments,
+        'outputs': build_roster_outputs(member_df, statuses, target_date) + assignment_result_outputs,
+        'messages': messages + assignment_messages,
+    }
+    mode = 'delta' if repaired_teams else 'unchanged'
+    return PrecomputedAssignment(target_date, include_level1, fingerprint, result, {'mode': mode, 'changed_members': len(changed_ids), 'repaired_teams': repaired_teams}, previous.seed, history_fingerprint)
+
+class AssignmentScheduler:
+    """
+    次の練習日の割り振りを interval_seconds ごとに事前計算するバックグラウンドスレッド。
+    load_inputs(target_date) は (部員のDataFrame, 連絡ログのDataFrame) を返す関数です。
+    8チーム割り振りのレベル1の扱いはどちらが選ばれてもよいように、両方を計算しておきます。
+    pair_history (pair_history.PairHistory) を指定すると、公開で更新される履歴を毎回の計算に使います。
+    runner (assignment_worker.AssignmentWorkerPool.run_tasks など) を指定すると、割り振りの計算を別プロセスで行います。
+    """
+    def __init__(self, load_inputs, interval_seconds, practice_weekdays=None, pair_history=None, runner=None):
+        self.load_inputs = load_inputs
+        self.pair_history = pair_history
+        self.runner = runner
+        self.interval_seconds = interval_seconds
+        self.practice_weekdays = practice_weekdays
+        self.last_run_at = None
+        self.last_error = None
+        self._results = {} # (対象日, include_level1) -> PrecomputedAssignment
+        self._started_at = {} # (対象日, include_level1) -> 保持している結果の計算を始めた日時
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive(): return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="assignment-precompute", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self.run_once()
+            self._stop_event.wait(self.interval_seconds)
+
+    def run_once(self):
+        """次の練習日の割り振りを1回事前計算します。"""
+        target_date = next_practice_date(practice_weekdays=self.practice_weekdays)
+        try:
+            member_df, attendance_df = self.load_inputs(target_date)
+            for include_level1 in (True, False):
+                self.refresh(member_df, attendance_df, target_date, include_level1)
+            self.last_error = None
+        except Exception as e:
+            self.last_error = str(e); print(f"ERROR: Assignment precompute failed: {e}")
+        self.last_run_at = datetime.datetime.now()
+
+    def refresh(self, member_df, attendance_df, target_date, include_level1=True, force_full=False, runner=None):
+        """
+        保持している結果を最新の連絡で更新して返します (保持していなければ全体を計算します)。
+        runner を指定すると、スケジューラーの runner の代わりに使います (ジョブの進捗を記録する場合など)。
+        """
+        key = (target_date, include_level1)
+        # 計算中はロックを持たない (管理者の実行とバックグラウンドの事前計算が互いを待たないようにする)
+        with self._lock:
+            previous = self._results.get(key)
+            started_at = datetime.datetime.now()
+        precomputed = refresh_precomputed_assignment(previous, member_df, attendance_df, target_date, include_level1, force_full=force_full, pair_history=self.pair_history, runner=runner or self.runner)
+        with self._lock:
+            # 同じ日の計算が並行した場合は、後から始めた (より新しい連絡を読み込んだ) 計算の結果を残す
+            if self._started_at.get(key, started_at) <= started_at:
+                self._results[key], self._started_at[key] = precomputed, started_at
+            # 過ぎた練習日の結果は破棄する
+            for old_key in [k for k in self._results if k[0] < min(target_date, datetime.date.today())]:
+                del self._results[old_key]; self._started_at.pop(old_key, None)
+        return precomputed
+
+    def latest(self, target_date, include_level1=True):
+        """保持している結果を返します (なければ None)。"""
+        with self._lock:
+            return self._results.get((target_date, include_level1))
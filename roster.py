@@ -0,0 +1,107 @@
+# roster.py (全セッションで共有する部員名簿)
+# -*- coding: utf-8 -*-
+#
+# 部員リストの DataFrame と、そこから作る学年・学科の選択肢、名前の選択肢と 名前 -> 学籍番号 の対応は、
+# 全員に同じ内容のため、セッションごとに持たずにプロセスで1つの Roster として共有します。
+# Roster の部員リストと選択肢は作成後に変更しない (読み取り専用) ため、複数のセッションから同時に参照できます
+# (学年・学科ごとの名前の選択肢だけは、初回の参照時に作成してロック付きで保持します)。
+# セッションには名簿の版 (内容のハッシュ) だけを保持し、RosterStore から Roster を引きます。
+
+import hashlib
+import sys
+import threading
+import types
+from collections import OrderedDict
+
+import pandas as pd
+
+from schema import COL_MEMBER_ID, COL_MEMBER_NAME, COL_MEMBER_GRADE, COL_MEMBER_DEPARTMENT
+
+UNSELECTED = "---"
+ROSTERS_KEPT = 4 # 保持する名簿の版の数 (名簿の更新直後は古い版を参照するセッションが残るため)
+
+def roster_version(members):
+    """部員リストの内容から名簿の版 (ハッシュの先頭16文字) を計算します。"""
+    digest = hashlib.sha256(','.join(map(str, members.columns)).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(members, index=False).to_numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+def _options(values):
+    return (UNSELECTED,) + tuple(sorted(v for v in values.unique() if v))
+
+class Roster:
+    """
+    部員リストとそこから作る選択肢 (読み取り専用)。
+    members の DataFrame は共有されるため、呼び出し側で変更しないでください (絞り込みなどは新しい DataFrame を作る操作だけを行います)。
+    """
+    def __init__(self, members, version=None):
+        self.members = members
+        self.version = version or roster_version(members)
+        self.grade_options = _options(members[COL_MEMBER_GRADE])
+        self.department_options = _options(members[COL_MEMBER_DEPARTMENT])
+        self.member_info_by_id = members.drop_duplicates(subset=[COL_MEMBER_ID]).set_index(COL_MEMBER_ID)
+        self._lock = threading.Lock()
+        self._member_options = {} # (学年, 学科) -> (名前のタプル, 名前 -> 学籍番号)
+
+    def member_options(self, grade=UNSELECTED, department=UNSELECTED):
+        """
+        学年・学科で絞り込んだ部員の名前 (部員リストの順) と 名前 -> 学籍番号 の対応を返します。
+        組み合わせごとに1回だけ計算して共有します (戻り値は変更できないタプルと MappingProxyType)。
+        """
+        key = (grade, department)
+        with self._lock:
+            options = self._member_options.get(key)
+        if options is not None: return options
+        filtered_df = self.members
+        if grade != UNSELECTED: filtered_df = filtered_df[filtered_df[COL_MEMBER_GRADE] == str(grade).strip()]
+        if department != UNSELECTED: filtered_df = filtered_df[filtered_df[COL_MEMBER_DEPARTMENT] == str(department).strip()]
+        options = (tuple(filtered_df[COL_MEMBER_NAME].tolist()),
+                   types.MappingProxyType(dict(zip(filtered_df[COL_MEMBER_NAME], filtered_df[COL_MEMBER_ID]))))
+        with self._lock:
+            return self._member_options.setdefault(key, options)
+
+    def memory_bytes(self):
+        """共有している部員リストと選択肢のおおよそのメモリ使用量 (バイト) を返します。"""
+        with self._lock:
+            cached = list(self._member_options.values())
+        return int(self.members.memory_usage(deep=True).sum() + self.member_info_by_id.memory_usage(deep=True).sum()
+                   + sum(deep_sizeof(names) + deep_sizeof(dict(id_map)) for names, id_map in cached))
+
+class RosterStore:
+    """名簿の版 -> Roster を保持します (スレッドセーフ)。同じ内容の部員リストは1つの Roster にまとめます。"""
+    def __init__(self, kept=ROSTERS_KEPT):
+        self.kept = kept
+        self._lock = threading.Lock()
+        self._rosters = OrderedDict()
+
+    def get(self, version):
+        with self._lock:
+            roster = self._rosters.get(version)
+            if roster is not None: self._rosters.move_to_end(version)
+            return roster
+
+    def intern(self, members):
+        """部員リストと同じ内容の Roster があればそれを、なければ新しく作成して返します。"""
+        version = roster_version(members)
+        roster = self.get(version)
+        if roster is not None: return roster
+        roster = Roster(members, version)
+        with self._lock:
+            roster = self._rosters.setdefault(version, roster)
+            while len(self._rosters) > self.kept: self._rosters.popitem(last=False)
+        return roster
+
+def deep_sizeof(value, seen=None):
+    """
+    値のおおよそのメモリ使用量 (バイト) を返します。DataFrame は memory_usage(deep=True)、コンテナは要素も含めて数えます。
+    同じオブジェクトは1回だけ数えます。
+    """
+    seen = set() if seen is None else seen
+    if id(value) in seen: return 0
+    seen.add(id(value))
+    if isinstance(value, pd.DataFrame): return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series): return int(value.memory_usage(deep=True))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict): size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)): size += sum(deep_sizeof(v, seen) for v in value)
+    return size
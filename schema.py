@@ -0,0 +1,149 @@
+# schema.py (部員リスト・遅刻欠席連絡シートの列名と型定義)
+# -*- coding: utf-8 -*-
+
+import sys
+import pandas as pd
+
+# --- 列名 (ヘッダー名) ---
+COL_MEMBER_ID = '学籍番号'; COL_MEMBER_NAME = '名前'; COL_MEMBER_GRADE = '学年';
+COL_MEMBER_LEVEL = 'レベル'; COL_MEMBER_GENDER = '性別'; COL_MEMBER_DEPARTMENT = '学科';
+COL_ATTENDANCE_TIMESTAMP = '記録日時';
+COL_ATTENDANCE_TARGET_DATE = '対象練習日';
+COL_ATTENDANCE_STATUS = '状況';
+COL_ATTENDANCE_LATE_TIME = '遅刻開始時刻';
+COL_ATTENDANCE_REASON = '遅刻・欠席理由';
+
+# --- 列ごとの型 ---
+# 'id': 前後の空白を除去し、同じ学籍番号は同一の文字列オブジェクトを共有する (intern)
+# 'text': 前後の空白を除去した文字列
+# 'category': 値の種類が少ない列 (状況・学年・学科・性別) はカテゴリ型で保持する
+# 'level': 数値 (変換できない値は NaN)
+# 'datetime' / 'date': datetime64 (date は時刻を切り捨てる)。数値はスプレッドシートのシリアル値として解釈する
+# 'time': 'HH:MM' の文字列 (シリアル値の時刻も変換する)
+MEMBER_SCHEMA = {
+    COL_MEMBER_ID: 'id',
+    COL_MEMBER_NAME: 'text',
+    COL_MEMBER_GRADE: 'category',
+    COL_MEMBER_LEVEL: 'level',
+    COL_MEMBER_GENDER: 'category',
+    COL_MEMBER_DEPARTMENT: 'category',
+}
+ATTENDANCE_SCHEMA = {
+    COL_ATTENDANCE_TIMESTAMP: 'datetime',
+    COL_ATTENDANCE_TARGET_DATE: 'date',
+    COL_MEMBER_ID: 'id',
+    COL_MEMBER_GRADE: 'category',
+    COL_MEMBER_NAME: 'text',
+    COL_ATTENDANCE_STATUS: 'category',
+    COL_MEMBER_DEPARTMENT: 'category',
+    COL_ATTENDANCE_LATE_TIME: 'time',
+}
+
+# --- 用途ごとに読み込む列 (sheet_reader.read_frame で指定する) ---
+MEMBER_COLUMNS = [COL_MEMBER_ID, COL_MEMBER_NAME, COL_MEMBER_GRADE, COL_MEMBER_LEVEL, COL_MEMBER_GENDER, COL_MEMBER_DEPARTMENT]
+# 連絡送信時の重複チェック
+ATTENDANCE_CHECK_COLUMNS = [COL_ATTENDANCE_TIMESTAMP, COL_MEMBER_ID, COL_ATTENDANCE_TARGET_DATE, COL_ATTENDANCE_STATUS]
+# コート割り振りと名簿出力
+ATTENDANCE_ASSIGNMENT_COLUMNS = [COL_MEMBER_ID, COL_ATTENDANCE_TARGET_DATE, COL_ATTENDANCE_TIMESTAMP, COL_ATTENDANCE_STATUS, COL_ATTENDANCE_REASON, COL_ATTENDANCE_LATE_TIME]
+# 連絡確認フォームの表示用列 (学籍番号と遅刻・欠席理由を除外)
+LOOKUP_DISPLAY_COLUMNS = [COL_ATTENDANCE_TIMESTAMP, COL_ATTENDANCE_TARGET_DATE, COL_MEMBER_GRADE, COL_MEMBER_NAME, COL_ATTENDANCE_STATUS, COL_ATTENDANCE_LATE_TIME]
+# 連絡確認の索引に読み込む列 (学籍番号・対象練習日・記録日時 + 表示用列)
+LOOKUP_ATTENDANCE_COLUMNS = list(dict.fromkeys([COL_MEMBER_ID, COL_ATTENDANCE_TARGET_DATE, COL_ATTENDANCE_TIMESTAMP] + LOOKUP_DISPLAY_COLUMNS))
+# 出欠の集計表 (attendance_rollup.py)
+ROLLUP_COLUMNS = [COL_ATTENDANCE_TIMESTAMP, COL_ATTENDANCE_TARGET_DATE, COL_MEMBER_ID, COL_MEMBER_GRADE, COL_MEMBER_DEPARTMENT, COL_ATTENDANCE_STATUS]
+# 連絡ログのシートから実際に読み込む列 (上の各用途の列の和集合)。シートは1回だけ読み込み、用途ごとの列は読み込んだDataFrameから取り出す
+ATTENDANCE_READ_COLUMNS = list(dict.fromkeys(ATTENDANCE_CHECK_COLUMNS + ATTENDANCE_ASSIGNMENT_COLUMNS + LOOKUP_ATTENDANCE_COLUMNS + ROLLUP_COLUMNS))
+
+# --- 遅刻欠席連絡シートに書き込む列の順 (連絡の記録・アーカイブシートのヘッダー) ---
+OUTPUT_COLUMNS_ORDER = [COL_ATTENDANCE_TIMESTAMP, COL_ATTENDANCE_TARGET_DATE, COL_MEMBER_ID, COL_MEMBER_GRADE, COL_MEMBER_NAME,
+                        COL_ATTENDANCE_STATUS, COL_ATTENDANCE_REASON, COL_ATTENDANCE_LATE_TIME, COL_MEMBER_DEPARTMENT]
+
+SHEETS_EPOCH = pd.Timestamp('1899-12-30') # シリアル値 0 に当たる日時
+
+def intern_ids(values):
+    """
+    学籍番号を文字列に揃えて intern します。
+    部員リストと連絡ログで同じ学籍番号が同一オブジェクトを参照するため、重複した文字列を持ちません。
+    """
+    return pd.Series([sys.intern(id_text(v)) for v in values], index=getattr(values, 'index', None), dtype=object)
+
+def id_text(value):
+    # 書式なしで読み込んだ数値の学籍番号は float になる場合があるため、整数なら小数点以下を付けない
+    if isinstance(value, float) and value.is_integer(): return str(int(value))
+    return str(value).strip()
+
+def _to_datetime(series):
+    """文字列の日時とシリアル値 (1899-12-30 からの日数) が混在する列を datetime64 に変換します。"""
+    if pd.api.types.is_datetime64_any_dtype(series): return series
+    serial = pd.to_numeric(series, errors='coerce')
+    parsed = pd.to_datetime(series.where(serial.isna()), errors='coerce')
+    if serial.isna().all(): return parsed
+    return parsed.fillna((SHEETS_EPOCH + pd.to_timedelta(serial, unit='D')).dt.round('s'))
+
+def _time_text(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and 0 <= value < 1:
+        minutes = round(value * 24 * 60)
+        return f"{minutes // 60:02d}:{minutes % 60:02d}"
+    return '' if value is None else str(value).strip()
+
+def _convert_column(series, kind):
+    if kind == 'id':
+        return intern_ids(series)
+    if kind == 'text':
+        return series.astype(str).str.strip()
+    if kind == 'category':
+        return series.astype(str).str.strip().astype('category')
+    if kind == 'level':
+        # 欠損がなければ int8 まで縮小される (欠損がある場合は float64 のまま)
+        return pd.to_numeric(series, errors='coerce', downcast='integer')
+    if kind == 'datetime':
+        return _to_datetime(series)
+    if kind == 'date':
+        return _to_datetime(series).dt.normalize()
+    if kind == 'time':
+        return series.map(_time_text).astype(object)
+    raise ValueError(f"未知の列型です: {kind}")
+
+def apply_schema(df, schema):
+    """
+    DataFrameの各列を schema に従って型変換します (存在しない列は無視します)。
+    変換は列の置き換えで行い、文字列版と変換後の列を二重に持たないようにします。
+    """
+    for col, kind in schema.items():
+        if col in df.columns:
+            df[col] = _convert_column(df[col], kind)
+    return df
+
+def concat_frames(frames, schema):
+    """
+    同じスキーマのDataFrameを結合します。
+    カテゴリの値の集合が異なると結合結果が object 型に戻るため、カテゴリ列は結合後にカテゴリ型へ戻します。
+    """
+    frames = [df for df in frames if df is not None and not df.empty]
+    if not frames: return pd.DataFrame()
+    if len(frames) == 1: return frames[0]
+    df = pd.concat(frames, ignore_index=True)
+    for col, kind in schema.items():
+        if kind == 'category' and col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+    return df
+
+def frame_memory_report(frames):
+    """
+    名前付きDataFrameのメモリ使用量を集計します。
+    frames: {表示名: DataFrame} の辞書。戻り値は1行1DataFrameの集計表。
+    """
+    rows = []
+    for name, df in frames.items():
+        if df is None: continue
+        usage = df.memory_usage(deep=True)
+        largest_col = usage.drop('Index', errors='ignore').idxmax() if len(df.columns) else ''
+        rows.append({
+            'データ': name,
+            '行数': len(df),
+            '列数': len(df.columns),
+            'メモリ(KB)': round(usage.sum() / 1024, 1),
+            '最大の列': largest_col,
+            'カテゴリ列': ', '.join(str(c) for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)),
+        })
+    return pd.DataFrame(rows, columns=['データ', '行数', '列数', 'メモリ(KB)', '最大の列', 'カテゴリ列'])
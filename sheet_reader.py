@@ -0,0 +1,94 @@
+# sheet_reader.py (列を指定したシートの読み込み)
+# -*- coding: utf-8 -*-
+#
+# get_all_records() はシートの全列を書式付きの文字列で受け取り、1行ごとに辞書を作ってから DataFrame にします。
+# ここでは必要な列だけを batch_get で列単位 (major_dimension=COLUMNS) に取得し、
+# 書式なしの値 (日時はシリアル値) をそのまま列のリストとして DataFrame に渡します。
+# 列の位置を知るためのヘッダー行はシートごとに保持し、同じ batch_get でヘッダー行 (1行目全体) も取得して、保持しているヘッダーと比べます
+# (列の追加・並べ替えでヘッダーが変わった場合や、要求した列が保持しているヘッダーにない場合でも、追加の呼び出しなしで検出できます)。
+# ヘッダーが変わっていた場合だけ、新しいヘッダーで列を取得し直します (通常は1回の API 呼び出しで済みます)。
+
+import threading
+
+import pandas as pd
+from gspread.utils import rowcol_to_a1, Dimension, ValueRenderOption, DateTimeOption
+
+from schema import apply_schema
+
+class HeaderCache:
+    """(スプレッドシートID, シート名) -> ヘッダー行 を保持します (スレッドセーフ)。"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._headers = {}
+
+    def get(self, key):
+        with self._lock:
+            return self._headers.get(key)
+
+    def put(self, key, header):
+        with self._lock:
+            self._headers[key] = list(header)
+
+    def forget(self, key=None):
+        with self._lock:
+            if key is None: self._headers.clear()
+            else: self._headers.pop(key, None)
+
+HEADERS = HeaderCache()
+
+def _header_key(worksheet):
+    return (getattr(worksheet, 'spreadsheet_id', ''), worksheet.title)
+
+def _header_from_row(columns):
+    """batch_get (major_dimension=COLUMNS) で取得した1行目から、末尾の空の列を除いたヘッダー行を作ります。"""
+    header = [str(col[0]).strip() if col else '' for col in columns]
+    while header and not header[-1]: header.pop()
+    return header
+
+def _column_letter(col):
+    return rowcol_to_a1(1, col)[:-1]
+
+def column_runs(positions):
+    """列番号 (1始まり) のリストを、連続する範囲 [(開始列, 終了列), ...] にまとめます。"""
+    runs = []
+    for pos in sorted(set(positions)):
+        if runs and runs[-1][1] == pos - 1: runs[-1][1] = pos
+        else: runs.append([pos, pos])
+    return [tuple(run) for run in runs]
+
+def _fetch_columns(worksheet, header, columns):
+    """
+    header (保持しているヘッダー行) から求めた列の位置で列を取得し、({列名: 値のリスト}, シートの現在のヘッダー行) を返します。
+    ヘッダー行 (1行目全体) も同じ呼び出しで取得します。
+    """
+    names = [c for c in columns if c in header] if columns else [h for h in dict.fromkeys(header) if h]
+    positions = {name: header.index(name) + 1 for name in names}
+    runs = column_runs(positions.values())
+    blocks = worksheet.batch_get(['1:1'] + [f"{_column_letter(start)}1:{_column_letter(end)}" for start, end in runs],
+                                 major_dimension=Dimension.cols, value_render_option=ValueRenderOption.unformatted,
+                                 date_time_render_option=DateTimeOption.serial_number)
+    by_position = {}
+    for (start, end), block in zip(runs, blocks[1:]):
+        for offset in range(end - start + 1):
+            by_position[start + offset] = list(block[offset]) if offset < len(block) else []
+    return {name: by_position[pos][1:] for name, pos in positions.items()}, _header_from_row(blocks[0] if blocks else [])
+
+def read_columns(worksheet, columns=None):
+    """
+    シートから指定した列 (None なら全列) を読み込み、{列名: 値のリスト} を返します。シートにない列は含みません。
+    値は書式なしで、日時はシリアル値 (数値) のまま返します。空のセルは '' になります。
+    """
+    key = _header_key(worksheet)
+    header = HEADERS.get(key) or []
+    data, current_header = _fetch_columns(worksheet, header, columns)
+    if current_header != header:
+        # 初回の読み込み、または列の追加・並べ替えなどでヘッダーが変わっている
+        HEADERS.put(key, current_header)
+        data, _ = _fetch_columns(worksheet, current_header, columns)
+    num_rows = max((len(values) for values in data.values()), default=0)
+    return {name: values + [''] * (num_rows - len(values)) for name, values in data.items()}
+
+def read_frame(worksheet, columns=None, schema=None):
+    """read_columns で読み込んだ列から DataFrame を作成し、schema があれば型変換します。"""
+    df = pd.DataFrame(read_columns(worksheet, columns))
+    return apply_schema(df, schema) if schema else df
@@ -0,0 +1,142 @@
+# sheet_writer.py (名簿・割り振り結果シートへの書き込み)
+# -*- coding: utf-8 -*-
+#
+# 出力シートへの書き込みをまとめます。シートごとに最後に書き込んだ内容を保持し、書き込む前にシートの現在の内容を読み込んで確認します。
+# シートの内容が書き込む内容と同じ場合は書き込みを省略します。
+# シートの内容が前回書き込んだ内容のままで、行数・列数も同じ場合は、変更のあったセル範囲だけを1回の batch_update で送ります。
+# それ以外 (他のプロセスやCLIからの書き込み・手での編集があった場合、前回の内容が分からない場合) は clear() + update() で全体を書き直します。
+# 書き込むたびに、シートの行数・列数を書き込む内容の形にそろえます (大きさが変わらない場合は API を呼びません)。
+# 比較はシートに表示される文字列で行うため、時刻のように表示が書き込んだ文字列と異なるセルを含むシートは毎回全体を書き直します。
+
+import threading
+
+from gspread.exceptions import WorksheetNotFound
+from gspread.utils import rowcol_to_a1, absolute_range_name
+
+from instrumentation import traced, count_rows
+
+class WrittenGridStore:
+    """(スプレッドシートID, シート名) -> 最後に書き込んだ内容 (行のリスト) を保持します (スレッドセーフ)。"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._grids = {}
+
+    def get(self, key):
+        with self._lock:
+            return self._grids.get(key)
+
+    def put(self, key, values):
+        with self._lock:
+            self._grids[key] = [list(row) for row in values]
+
+    def forget(self, key=None):
+        with self._lock:
+            if key is None: self._grids.clear()
+            else: self._grids.pop(key, None)
+
+WRITTEN_GRIDS = WrittenGridStore()
+
+def grid_key(worksheet):
+    """WRITTEN_GRIDS のキー (スプレッドシートID, シート名)。"""
+    return getattr(worksheet, 'spreadsheet_id', None), worksheet.title
+
+def sheet_values(values):
+    """
+    書き込む内容をシートから読み込んだときの形 (文字列、各行と末尾の空のセル・空の行を除く) にそろえます。
+    get_all_values / values_batch_get の結果と比べるために使います。
+    """
+    rows = [[('' if v is None else str(v)) for v in row] for row in values]
+    for row in rows:
+        while row and row[-1] == '': row.pop()
+    while rows and not rows[-1]: rows.pop()
+    return rows
+
+def is_unchanged(values, current_values):
+    """シートの現在の内容 current_values (読み込んだ行のリスト) が values と同じかどうかを返します。"""
+    return current_values is not None and sheet_values(current_values) == sheet_values(values)
+
+def read_grids(spreadsheet, sheet_names):
+    """sheet_names のシートの現在の内容を1回の values_batch_get で読み込みます。戻り値: {シート名: 行のリスト}"""
+    if not sheet_names: return {}
+    response = spreadsheet.values_batch_get([absolute_range_name(name) for name in sheet_names])
+    return {name: value_range.get('values', []) for name, value_range in zip(sheet_names, response.get('valueRanges', []))}
+
+def grid_shape(values):
+    """(行数, 最長の行の列数) を返します。"""
+    return len(values), max((len(row) for row in values), default=0)
+
+def _padded(values, width):
+    return [list(row) + [''] * (width - len(row)) for row in values]
+
+def changed_ranges(old_values, new_values):
+    """
+    同じ形の2つのグリッドを比べ、変更のあったセル範囲を batch_update の形式
+    ([{'range': 'B5:D6', 'values': [[...], ...]}, ...]) で返します。
+    各行で連続して変わったセルを1つの範囲とし、同じ列範囲が縦に続く場合はまとめます。
+    """
+    rows, width = grid_shape(new_values)
+    old_grid, new_grid = _padded(old_values, width), _padded(new_values, width)
+    blocks = [] # [開始行, 終了行 (含まない), 開始列, 終了列 (含まない)] (0始まり)
+    open_blocks = {} # (開始列, 終了列) -> 直前の行まで続いているブロック
+    for r in range(rows):
+        c = 0
+        while c < width:
+            if old_grid[r][c] == new_grid[r][c]: c += 1; continue
+            start = c
+            while c < width and old_grid[r][c] != new_grid[r][c]: c += 1
+            block = open_blocks.get((start, c))
+            if block is not None and block[1] == r: block[1] = r + 1
+            else:
+                block = [r, r + 1, start, c]; blocks.append(block); open_blocks[(start, c)] = block
+    return [{'range': f"{rowcol_to_a1(top + 1, left + 1)}:{rowcol_to_a1(bottom, right)}", 'values': [new_grid[r][left:right] for r in range(top, bottom)]}
+            for top, bottom, left, right in blocks]
+
+def sheet_size(values):
+    """values を書き込むシートの (行数, 列数)。空のデータでも1行1列とします (Sheets API は0行のシートを作れないため)。"""
+    rows, cols = grid_shape(values)
+    return max(rows, 1), max(cols, 1)
+
+def fit_to_grid(worksheet, values):
+    """シートの行数・列数を values の形にそろえます (既に同じ大きさなら API を呼びません)。"""
+    rows, cols = sheet_size(values)
+    if (getattr(worksheet, 'row_count', None), getattr(worksheet, 'col_count', None)) != (rows, cols):
+        worksheet.resize(rows=rows, cols=cols)
+
+def ensure_worksheet(spreadsheet, title, rows=100, cols=26):
+    """シートを返します。存在しなければ rows 行 x cols 列で作成します (書き込む内容の形は sheet_size で求めます)。"""
+    try:
+        return spreadsheet.worksheet(title)
+    except WorksheetNotFound:
+        return spreadsheet.add_worksheet(title=title, rows=rows, cols=cols)
+
+@traced("write_grid")
+def write_grid(worksheet, values, force_full=False, current_values=None):
+    """
+    書き込み用データでシートの内容を置き換えます。
+    current_values はシートの現在の内容 (read_grids などで読み込み済みの場合に渡します)。未指定ならここで読み込みます。
+    戻り値: 'skipped' (シートの内容が同じため省略) / 'diff' (変更セルのみ書き込み) / 'full' (全体を書き直し)
+    force_full を指定すると、シートの内容に関係なく全体を書き直します (シートは読み込みません)。
+    """
+    key = grid_key(worksheet)
+    last_values = WRITTEN_GRIDS.get(key)
+    if not force_full:
+        if current_values is None: current_values = worksheet.get_all_values()
+        if is_unchanged(values, current_values):
+            WRITTEN_GRIDS.put(key, values); return 'skipped'
+        if last_values is not None and not is_unchanged(last_values, current_values):
+            # 前回の書き込みの後に他から書き込まれた (または編集された) シートは、差分ではなく全体を書き直す
+            print(f"WARNING: シート '{worksheet.title}' が前回の書き込みから変更されているため、全体を書き直します。")
+            last_values = None
+    WRITTEN_GRIDS.forget(key) # 途中で失敗した場合に「書き込み済み」と扱わないよう先に破棄する
+    # 前回より大きい内容が収まるように、また前回の内容の残りの行・列が残らないように、シートの大きさを内容に合わせる
+    fit_to_grid(worksheet, values)
+    if not force_full and last_values is not None and grid_shape(last_values) == grid_shape(values):
+        updates = changed_ranges(last_values, values)
+        worksheet.batch_update(updates, value_input_option='USER_ENTERED')
+        count_rows(sum(len(u['values']) for u in updates))
+        mode = 'diff'
+    else:
+        worksheet.clear(); worksheet.update(range_name='A1', values=values, value_input_option='USER_ENTERED'); count_rows(len(values))
+        mode = 'full'
+    WRITTEN_GRIDS.put(key, values)
+    return mode
@@ -0,0 +1,60 @@
+# sheets_async.py (Sheets API 呼び出しの並行実行)
+# -*- coding: utf-8 -*-
+#
+# gspread は同期 (ブロッキング) の API のため、各呼び出しを asyncio.to_thread でスレッドに逃がし、
+# セマフォで同時実行数を制限しながら asyncio.gather でまとめて待ちます。
+# 互いに依存しない読み込み・書き込みを並べると、全体の待ち時間は「最も遅い1回」程度になります。
+# 同期コード (Streamlit のスクリプトや CLI) からは run_concurrently を呼び出します。
+
+import asyncio
+import threading
+
+DEFAULT_MAX_CONCURRENCY = 4
+
+async def _run_limited(semaphore, func):
+    async with semaphore:
+        return await asyncio.to_thread(func)
+
+async def gather_calls(funcs, max_concurrency=DEFAULT_MAX_CONCURRENCY, return_exceptions=False):
+    """引数なしの関数のリストを、最大 max_concurrency 個ずつスレッドで並行に実行し、結果を同じ順序で返します。"""
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+    return await asyncio.gather(*(_run_limited(semaphore, func) for func in funcs), return_exceptions=return_exceptions)
+
+def _call(func, return_exceptions):
+    try:
+        return func()
+    except Exception as e:
+        if not return_exceptions: raise
+        return e
+
+def run_concurrently(funcs, max_concurrency=DEFAULT_MAX_CONCURRENCY, return_exceptions=False, thread_initializer=None):
+    """
+    同期コードから gather_calls を実行し、結果のリストを返します。
+    return_exceptions が True の場合、失敗した呼び出しは例外オブジェクトを結果として返します (False なら最初の例外を送出)。
+    thread_initializer は各スレッドで関数の実行前に呼ばれます (Streamlit のスクリプト文脈の引き継ぎなどに使います)。
+    関数が1つ以下の場合はスレッドを使わずにその場で実行します。
+    """
+    funcs = list(funcs)
+    if len(funcs) <= 1: return [_call(func, return_exceptions) for func in funcs]
+    if thread_initializer is not None:
+        funcs = [_with_initializer(func, thread_initializer) for func in funcs]
+
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(gather_calls(funcs, max_concurrency, return_exceptions))
+    # 既にイベントループが動いているスレッドからは asyncio.run を呼べないため、別スレッドで実行する
+    outcome = {}
+    def runner():
+        try: outcome['result'] = asyncio.run(gather_calls(funcs, max_concurrency, return_exceptions))
+        except BaseException as e: outcome['error'] = e
+    thread = threading.Thread(target=runner, name="sheets-async")
+    thread.start(); thread.join()
+    if 'error' in outcome: raise outcome['error']
+    return outcome['result']
+
+def _with_initializer(func, thread_initializer):
+    def wrapper():
+        thread_initializer()
+        return func()
+    return wrapper
@@ -0,0 +1,147 @@
+# sheets_http.py (Sheets API 用の HTTP セッション)
+# -*- coding: utf-8 -*-
+#
+# gspread が内部で作る AuthorizedSession の代わりに、接続プールの大きさを指定したセッションを使います。
+# 同時に動く Streamlit のセッションや並行呼び出し (sheets_async.py) が同じ keep-alive 接続を使い回せるよう、
+# プールの上限を並行数に合わせて設定し、トークンの取得にも同じプールを使います。
+# アクセストークンは期限切れの少し前にバックグラウンドで更新し、API 呼び出しの途中で更新を待たないようにします。
+# 新しく張った接続と使い回した接続の数は connection_stats で確認できます。
+
+import datetime
+import threading
+
+import gspread
+import requests
+from google.auth.transport.requests import AuthorizedSession, Request
+from google.oauth2.service_account import Credentials
+
+DEFAULT_POOL_MAXSIZE = 16 # 1ホストあたりに保持する keep-alive 接続の最大数
+DEFAULT_POOL_CONNECTIONS = 4 # 接続プールを保持するホスト数 (sheets / drive / oauth2 など)
+DEFAULT_REFRESH_MARGIN_SECONDS = 300 # 期限切れの何秒前にトークンを更新するか
+RETRY_INTERVAL_SECONDS = 30 # トークン更新に失敗した場合の再試行間隔
+
+def _utcnow():
+    # google-auth の expiry はタイムゾーンなしの UTC
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+class PooledAuthorizedSession(AuthorizedSession):
+    """
+    接続プールの大きさとトークンの事前更新を制御する AuthorizedSession。
+    refresh_margin_seconds 以内に期限が切れるトークンは、リクエストの前 (またはバックグラウンド) で1回だけ更新します。
+    """
+    def __init__(self, credentials, pool_maxsize=DEFAULT_POOL_MAXSIZE, refresh_margin_seconds=DEFAULT_REFRESH_MARGIN_SECONDS):
+        self.adapter = requests.adapters.HTTPAdapter(pool_connections=DEFAULT_POOL_CONNECTIONS, pool_maxsize=pool_maxsize, max_retries=3)
+        # トークンの取得も同じプールを使う (AuthorizedSession 自身を渡すと再帰するため別のセッションにする)
+        token_session = requests.Session()
+        token_session.mount("https://", self.adapter)
+        super().__init__(credentials, auth_request=Request(token_session))
+        self.mount("https://", self.adapter)
+        self.pool_maxsize = pool_maxsize
+        self.refresh_margin = datetime.timedelta(seconds=refresh_margin_seconds)
+        self._refresh_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._refresher = None
+        self.stats = {'requests': 0, 'token_refreshes': 0, 'background_refreshes': 0, 'refresh_errors': 0, 'last_refresh_at': None, 'last_error': None}
+
+    def _count(self, key, amount=1):
+        with self._stats_lock:
+            self.stats[key] += amount
+
+    def token_needs_refresh(self):
+        """トークンがない、または refresh_margin 以内に期限が切れる場合に True を返します。"""
+        if not self.credentials.token: return True
+        expiry = self.credentials.expiry
+        return expiry is not None and expiry - _utcnow() <= self.refresh_margin
+
+    def ensure_fresh_token(self, background=False):
+        """
+        必要な場合だけトークンを更新し、更新したかどうかを返します。
+        複数のスレッドが同時に期限切れ間近に気づいても、更新は1回だけ行います。
+        """
+        if not self.token_needs_refresh(): return False
+        with self._refresh_lock:
+            if not self.token_needs_refresh(): return False
+            self.credentials.refresh(self._auth_request)
+        self._count('token_refreshes')
+        if background: self._count('background_refreshes')
+        with self._stats_lock:
+            self.stats['last_refresh_at'] = datetime.datetime.now()
+        return True
+
+    def request(self, method, url, *args, **kwargs):
+        self.ensure_fresh_token()
+        self._count('requests')
+        return super().request(method, url, *args, **kwargs)
+
+    def start_refresher(self):
+        """期限切れの refresh_margin 前にトークンを更新するバックグラウンドスレッドを開始します。"""
+        if self._refresher is not None and self._refresher.is_alive(): return
+        self._stop_event.clear()
+        self._refresher = threading.Thread(target=self._refresh_loop, name="sheets-token-refresh", daemon=True)
+        self._refresher.start()
+
+    def stop_refresher(self):
+        self._stop_event.set()
+
+    def _seconds_until_refresh(self):
+        expiry = self.credentials.expiry
+        if not self.credentials.token or expiry is None: return RETRY_INTERVAL_SECONDS
+        return max(1.0, (expiry - self.refresh_margin - _utcnow()).total_seconds())
+
+    def _refresh_loop(self):
+        while not self._stop_event.is_set():
+            try:
+                self.ensure_fresh_token(background=True)
+                wait_seconds = self._seconds_until_refresh()
+            except Exception as e:
+                self._count('refresh_errors')
+                with self._stats_lock:
+                    self.stats['last_error'] = str(e)
+                print(f"ERROR: Token refresh failed: {e}")
+                wait_seconds = RETRY_INTERVAL_SECONDS
+            self._stop_event.wait(wait_seconds)
+
+    def connection_stats(self):
+        """
+        接続の使い回し状況を辞書で返します。
+        new_connections は新しく張った (TLS ハンドシェイクを行った) 接続の数、reused_requests は既存の接続で送ったリクエストの数です。
+        """
+        new_connections = pooled_requests = 0
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None: continue
+            new_connections += pool.num_connections
+            pooled_requests += pool.num_requests
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats.update({
+            'pool_maxsize': self.pool_maxsize,
+            'new_connections': new_connections,
+            'reused_requests': max(0, pooled_requests - new_connections),
+            'reuse_ratio': round(max(0, pooled_requests - new_connections) / pooled_requests, 3) if pooled_requests else None,
+            'token_expiry': self.credentials.expiry,
+        })
+        return stats
+
+def service_account_client(info=None, filename=None, pool_maxsize=DEFAULT_POOL_MAXSIZE, refresh_margin_seconds=DEFAULT_REFRESH_MARGIN_SECONDS, proactive_refresh=True):
+    """
+    サービスアカウントの認証情報 (辞書 info または JSON ファイル filename) から、
+    PooledAuthorizedSession を使う gspread クライアントを作成します。
+    どちらも未指定の場合は gspread の既定の場所 (~/.config/gspread/service_account.json) を使います。
+    """
+    if info is not None:
+        credentials = Credentials.from_service_account_info(info, scopes=gspread.auth.DEFAULT_SCOPES)
+    else:
+        credentials = Credentials.from_service_account_file(filename or gspread.auth.DEFAULT_SERVICE_ACCOUNT_FILENAME, scopes=gspread.auth.DEFAULT_SCOPES)
+    session = PooledAuthorizedSession(credentials, pool_maxsize=pool_maxsize, refresh_margin_seconds=refresh_margin_seconds)
+    if proactive_refresh: session.start_refresher()
+    client = gspread.authorize(None, session=session)
+    client.http_client.auth = credentials # session を渡すと auth が設定されないため (Client.expiry で参照される)
+    return client
+
+def http_session(client):
+    """gspread クライアント (台帳のプロキシでもよい) が使っている PooledAuthorizedSession を返します (なければ None)。"""
+    session = getattr(getattr(client, 'http_client', None), 'session', None)
+    return session if isinstance(session, PooledAuthorizedSession) else None
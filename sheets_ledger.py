@@ -0,0 +1,155 @@
+# sheets_ledger.py (Sheets API 呼び出しの記録と上限チェック)
+# -*- coding: utf-8 -*-
+#
+# gspread のクライアント・スプレッドシート・ワークシートを薄いプロキシで包み、
+# 呼び出しをメソッド別・シート別に記録します。転送量は引数と戻り値の JSON サイズによる概算です。
+# 操作 (action) ごとに呼び出し回数の上限 (budget) を設定でき、超えた場合は警告を記録します。
+
+import collections
+import contextlib
+import json
+import threading
+
+import instrumentation
+
+def _estimate_bytes(value):
+    if value is None: return 0
+    try:
+        return len(json.dumps(value, ensure_ascii=False, default=str).encode('utf-8'))
+    except (TypeError, ValueError):
+        return 0
+
+class ApiCallLedger:
+    """
+    Sheets API 呼び出しの台帳。parent を指定すると、記録は親の台帳にも加算されます
+    (例: 再実行ごとの台帳 -> プロセス全体の台帳)。
+    """
+    def __init__(self, parent=None, default_budget=None):
+        self._lock = threading.Lock()
+        self.parent = parent
+        self.default_budget = default_budget
+        self.calls = collections.Counter()          # (method, sheet) -> 回数
+        self.bytes_sent = collections.Counter()     # (method, sheet) -> 概算送信バイト数
+        self.bytes_received = collections.Counter() # (method, sheet) -> 概算受信バイト数
+        self.actions = []                           # 終了した操作の記録
+        self.warnings = []                          # 上限超過の警告メッセージ
+        self._action_stack = []
+
+    @property
+    def total_calls(self):
+        with self._lock:
+            return sum(self.calls.values())
+
+    def record(self, method, sheet, bytes_sent=0, bytes_received=0):
+        key = (method, sheet or '')
+        with self._lock:
+            self.calls[key] += 1
+            self.bytes_sent[key] += bytes_sent
+            self.bytes_received[key] += bytes_received
+            for action in self._action_stack:
+                action['calls'] += 1
+                action['by_method'][method] += 1
+                action['bytes'] += bytes_sent + bytes_received
+        if self.parent is not None:
+            self.parent.record(method, sheet, bytes_sent, bytes_received)
+
+    @contextlib.contextmanager
+    def action(self, name, budget=None):
+        """
+        操作単位で呼び出し回数を集計します。budget を超えた場合は warnings に警告を追加します。
+        yield される辞書の 'over_budget' で超過の有無を確認できます。
+        """
+        budget = budget if budget is not None else self.default_budget
+        record = {'name': name, 'calls': 0, 'bytes': 0, 'budget': budget, 'over_budget': False, 'by_method': collections.Counter()}
+        with self._lock:
+            self._action_stack.append(record)
+        try:
+            yield record
+        finally:
+            with self._lock:
+                self._action_stack.remove(record)
+                if budget is not None and record['calls'] > budget:
+                    record['over_budget'] = True
+                    self.warnings.append(f"操作 '{name}' の Sheets API 呼び出しが上限を超えました: {record['calls']}回 (上限 {budget}回)")
+                self.actions.append(record)
+
+    def rows(self):
+        """メソッド・シート別の集計を表形式 (辞書のリスト) で返します。"""
+        with self._lock:
+            return [{'method': method, 'sheet': sheet, 'calls': count,
+                     'bytes_sent': self.bytes_sent[(method, sheet)], 'bytes_received': self.bytes_received[(method, sheet)]}
+                    for (method, sheet), count in sorted(self.calls.items(), key=lambda kv: -kv[1])]
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear(); self.bytes_sent.clear(); self.bytes_received.clear()
+            self.actions.clear(); self.warnings.clear()
+
+class _LedgeredProxy:
+    """呼び出しを台帳に記録するプロキシの共通部分。"""
+
+    def __init__(self, target, ledger, sheet_name=''):
+        object.__setattr__(self, '_target', target)
+        object.__setattr__(self, '_ledger', ledger)
+        object.__setattr__(self, '_sheet_name', sheet_name)
+
+    @property
+    def unwrapped(self):
+        return self._target
+
+    def _wrap_result(self, result):
+        return result
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+        def wrapper(*args, **kwargs):
+            result = None
+            try:
+                result = attr(*args, **kwargs)
+                return self._wrap_result(result)
+            finally:
+                # 失敗した呼び出しも API を消費するため記録する
+                instrumentation.count_api_calls()
+                self._ledger.record(name, self._sheet_for_call(name, args, kwargs),
+                                    bytes_sent=_estimate_bytes([args, kwargs]) if args or kwargs else 0,
+                                    bytes_received=_estimate_bytes(result) if isinstance(result, (list, dict, str)) else 0)
+        return wrapper
+
+    def __setattr__(self, name, value):
+        setattr(self._target, name, value)
+
+    def _sheet_for_call(self, method, args, kwargs):
+        return self._sheet_name
+
+class LedgeredWorksheet(_LedgeredProxy):
+    """ワークシートのプロキシ。title などの属性はそのまま返します。"""
+
+class LedgeredSpreadsheet(_LedgeredProxy):
+    """スプレッドシートのプロキシ。取得したワークシートもプロキシで包みます。"""
+    def _sheet_for_call(self, method, args, kwargs):
+        if method in ('worksheet', 'add_worksheet'):
+            return (args[0] if args else kwargs.get('title')) or ''
+        return ''
+
+    def _wrap_result(self, result):
+        if isinstance(result, list):
+            return [self._wrap_worksheet(ws) for ws in result]
+        return self._wrap_worksheet(result)
+
+    def _wrap_worksheet(self, value):
+        if hasattr(value, 'title') and hasattr(value, 'get_all_values'):
+            return LedgeredWorksheet(value, self._ledger, value.title)
+        return value
+
+class LedgeredClient(_LedgeredProxy):
+    """gspread クライアントのプロキシ。open_by_key などで得たスプレッドシートもプロキシで包みます。"""
+    def _wrap_result(self, result):
+        if hasattr(result, 'worksheet'):
+            return LedgeredSpreadsheet(result, self._ledger)
+        return result
+
+def unwrap(obj):
+    """プロキシで包まれている場合は元のオブジェクトを返します。"""
+    return obj.unwrapped if isinstance(obj, _LedgeredProxy) else obj
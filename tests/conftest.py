@@ -0,0 +1,5 @@
+# tests/conftest.py (テストからリポジトリ直下のモジュールを読み込めるようにする)
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,98 @@
+# tests/test_api_budget.py (主な操作の Sheets API 呼び出し回数の回帰確認)
+#
+# app.py を Streamlit の AppTest でオフラインのスプレッドシート (offline_sheets.OfflineClient) に対して実行し、
+# 操作ごとの呼び出し回数 (api_action の記録) が想定を超えていないことを確認します。
+# 呼び出しを減らした場合は上限も下げ、増やす変更は理由を確認してから上限を上げてください。
+import datetime
+import random
+import time
+
+import pytest
+
+streamlit = pytest.importorskip('streamlit')
+from streamlit.testing.v1 import AppTest
+
+import sheets_http
+from offline_sheets import OfflineClient
+from schema import MEMBER_COLUMNS, OUTPUT_COLUMNS_ORDER
+from config import (PARTICIPANT_LIST_SHEET_NAME, ABSENT_LIST_SHEET_NAME, LATE_LIST_SHEET_NAME,
+                    ASSIGNMENT_SHEET_NAME_8, ASSIGNMENT_SHEET_NAME_10, ASSIGNMENT_SHEET_NAME_12, ASSIGNMENT_SHEET_NAME_3)
+
+APP_PATH = __file__.rsplit('/tests/', 1)[0] + '/app.py'
+# 操作ごとの呼び出し回数の上限 (現在の実装の回数)
+EXPECTED_MAX_CALLS = {
+    '部員データ読み込み': 8,
+    '連絡送信': 3,
+    '連絡確認': 0, # 連絡送信の重複チェックで読み込んだ連絡ログ (シートごとに全ての用途の列を1回で読み込む) のキャッシュを使う
+    '連絡ログの読み込み (コート割り振り)': 0, # それまでの表示で読み込んだ連絡ログのキャッシュを使う
+    'コート割り振り': 37, # 開いたスプレッドシートを各シートの書き込みで使い回す。書き込み前のシートの読み込み (まとめて1回 + ペア履歴)、記録前のペア履歴の読み込み、初回の書き込みでのシートの大きさの変更 (7シート) を含む
+}
+
+def offline_sheets(num_members=40, num_logs=200, seed=1):
+    rng = random.Random(seed)
+    today = datetime.date.today()
+    members = [list(MEMBER_COLUMNS)] + [[f"S{1000 + i}", f"部員{i}", rng.choice(['1年', '2年', '3年']), rng.choice([0, 1, 2, 3, 4, 5, 6]),
+                                          rng.choice(['男性', '女性']), rng.choice(['医学科', '看護学科'])] for i in range(num_members)]
+    logs = [list(OUTPUT_COLUMNS_ORDER)]
+    for _ in range(num_logs):
+        member = rng.choice(members[1:])
+        target = today + datetime.timedelta(days=rng.randint(-60, 10))
+        status = rng.choice(['欠席', '遅刻', '参加'])
+        recorded = datetime.datetime.combine(target, datetime.time(8)) - datetime.timedelta(hours=rng.randint(1, 200))
+        logs.append([recorded.strftime('%Y-%m-%d %H:%M:%S'), target.strftime('%Y/%m/%d'), member[0], member[2], member[1], status,
+                     '授業', '17:30' if status == '遅刻' else '', member[5]])
+    sheets = {'部員リスト': members, '遅刻欠席連絡': logs}
+    # 結果の書き込み先のシート (空のまま用意しておく)
+    for name in (PARTICIPANT_LIST_SHEET_NAME, ABSENT_LIST_SHEET_NAME, LATE_LIST_SHEET_NAME,
+                 ASSIGNMENT_SHEET_NAME_8, ASSIGNMENT_SHEET_NAME_10, ASSIGNMENT_SHEET_NAME_12, ASSIGNMENT_SHEET_NAME_3):
+        sheets[name] = []
+    return sheets
+
+@pytest.fixture
+def app(monkeypatch):
+    client = OfflineClient(offline_sheets())
+    monkeypatch.setattr(sheets_http, 'service_account_client', lambda **kwargs: client)
+    streamlit.cache_data.clear(); streamlit.cache_resource.clear()
+    at = AppTest.from_file(APP_PATH, default_timeout=120)
+    at.secrets['app_passwords'] = {'general_password': 'g', 'admin_password': 'a'}
+    at.secrets['google_credentials'] = {'type': 'service_account'}
+    at.secrets['app_config'] = {'precompute_interval_minutes': 0, 'assignment_worker_processes': 0}
+    at.run()
+    at.text_input(key='general_password_input').input('g').run()
+    yield at
+    streamlit.cache_resource.clear()
+
+def action_calls(at):
+    """操作名 -> 呼び出し回数 (同じ操作が複数回あれば最大)。"""
+    calls = {}
+    for entry in at.session_state['api_action_history']:
+        calls[entry['操作']] = max(calls.get(entry['操作'], 0), entry['呼び出し回数'])
+    return calls
+
+def assert_within_budget(at, names):
+    calls = action_calls(at)
+    for name in names:
+        assert name in calls, f"操作 '{name}' が記録されていません: {calls}"
+        assert calls[name] <= EXPECTED_MAX_CALLS[name], f"操作 '{name}' の呼び出しが増えました: {calls[name]}回 (上限 {EXPECTED_MAX_CALLS[name]}回)"
+
+def test_member_flows_stay_within_call_budget(app):
+    assert not app.exception
+    app.selectbox(key='form_grade_select_key').select('1年').run()
+    app.selectbox(key='form_name_select_key').select(app.selectbox(key='form_name_select_key').options[1]).run()
+    app.text_area(key='form_reason_input_key').input('授業').run()
+    next(b for b in app.button if 'さんの連絡を送信する' in (b.label or '')).click().run()
+    app.selectbox(key='lookup_grade_select_key').select('1年').run()
+    app.selectbox(key='lookup_name_select_key').select(app.selectbox(key='lookup_name_select_key').options[1]).run()
+    app.button(key='lookup_submit_button_key').click().run()
+    assert not app.exception and not app.error
+    assert_within_budget(app, ['部員データ読み込み', '連絡送信', '連絡確認'])
+
+def test_assignment_stays_within_call_budget(app):
+    app.text_input(key='admin_password_input_key').input('a').run()
+    app.button(key='admin_login_button_key').click().run()
+    app.button(key='assign_button_admin_main').click().run()
+    deadline = time.monotonic() + 60
+    while 'コート割り振り' not in action_calls(app) and time.monotonic() < deadline:
+        time.sleep(0.2); app.run()
+    assert not app.exception and not app.error
+    assert_within_budget(app, ['連絡ログの読み込み (コート割り振り)', 'コート割り振り'])
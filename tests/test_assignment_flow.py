@@ -0,0 +1,46 @@
+# tests/test_assignment_flow.py (管理者のコート割り振りの手順)
+import datetime
+
+from assignment_flow import compute_assignment, publish_assignment, read_pair_history
+import court_assignment
+from court_assignment import load_assignment_inputs, parse_args
+from loadtest import synthetic_sheets
+from offline_sheets import OfflineSpreadsheet
+from pair_history import PairHistory
+from precompute import AssignmentScheduler
+from sheet_writer import WRITTEN_GRIDS
+
+TARGET_DATE = datetime.date.today() + datetime.timedelta(days=1)
+
+def test_publish_writes_results_once_and_records_pair_history():
+    WRITTEN_GRIDS.forget()
+    spreadsheet = OfflineSpreadsheet(synthetic_sheets(40, 200, TARGET_DATE, seed=3))
+    member_df, attendance_df = load_assignment_inputs(spreadsheet, TARGET_DATE)
+    history = PairHistory()
+    scheduler = AssignmentScheduler(None, 0, pair_history=history)
+    job_result = compute_assignment(scheduler, member_df, attendance_df, TARGET_DATE, team_requests=[(6, None)], pair_history=history)
+    report = publish_assignment(spreadsheet, job_result, TARGET_DATE, pair_history=history)
+    assert report['created_sheets'] == ['割り振り結果_6チーム'] and not report['failed_sheets']
+    assert report['pair_history'] is not None and read_pair_history(spreadsheet).fingerprint == history.fingerprint
+    # 同じ結果を公開し直しても、内容が同じシートは書き込まず、ペア履歴も同じ日の分を差し替えるだけ
+    again = publish_assignment(spreadsheet, compute_assignment(scheduler, member_df, attendance_df, TARGET_DATE, team_requests=[(6, None)], pair_history=history),
+                               TARGET_DATE, pair_history=history)
+    assert again['writes'] == [] and len(again['unchanged']) == len(report['writes'])
+    assert read_pair_history(spreadsheet).fingerprint == history.fingerprint
+    WRITTEN_GRIDS.forget()
+
+def test_cli_uses_and_records_the_pair_history(monkeypatch):
+    WRITTEN_GRIDS.forget()
+    spreadsheet = OfflineSpreadsheet(synthetic_sheets(40, 200, TARGET_DATE, seed=3))
+    monkeypatch.setattr(court_assignment, '_open_offline_spreadsheet', lambda fixture_dir: spreadsheet)
+    passed_histories = []
+    original_pipeline = court_assignment.run_assignment_pipeline
+    monkeypatch.setattr(court_assignment, 'run_assignment_pipeline', lambda *args, **kwargs: passed_histories.append(kwargs['pair_history'].fingerprint) or original_pipeline(*args, **kwargs))
+    assert court_assignment.run(parse_args(['--offline', 'unused', '--date', TARGET_DATE.isoformat()])) == 0
+    # CLI で公開した割り振りもペア履歴シートに記録され、次の実行 (アプリ・CLI) で読み込まれる
+    history = read_pair_history(spreadsheet)
+    assert history is not None and history.total_pairs > 0
+    assert sorted(history.recent_records) == [f"{TARGET_DATE.isoformat()}/{name}" for name in sorted(['割り振り結果_8チーム', '割り振り結果_10チーム', '割り振り結果_12チーム'])]
+    assert court_assignment.run(parse_args(['--offline', 'unused', '--date', TARGET_DATE.isoformat()])) == 0
+    assert passed_histories[0] == PairHistory().fingerprint and passed_histories[1] == history.fingerprint
+    WRITTEN_GRIDS.forget()
@@ -0,0 +1,61 @@
+# tests/test_assignment_worker.py (割り振りのワーカープロセスとジョブ)
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+from assignment_worker import AssignmentJob, AssignmentWorkerPool, JOB_CANCELLED, JOB_DONE, _WorkerProcess
+from schema import COL_MEMBER_ID, COL_MEMBER_NAME, COL_MEMBER_GRADE, COL_MEMBER_LEVEL, COL_MEMBER_GENDER
+
+def _task(seed):
+    pool = pd.DataFrame([{COL_MEMBER_ID: f"S{i:03d}", COL_MEMBER_NAME: f"部員{i}", COL_MEMBER_GRADE: '2年', COL_MEMBER_LEVEL: i % 6 + 1,
+                          COL_MEMBER_GENDER: '男性' if i % 2 else '女性'} for i in range(24)])
+    return {'members_pool_df': pool, 'late_member_ids': set(), 'num_teams': 4, 'seed': seed}
+
+def _wait_finished(workers, job_id):
+    for _ in range(300):
+        if workers.job(job_id)['finished_at'] is not None: return workers.job(job_id)
+        time.sleep(0.1)
+    pytest.fail("job did not finish")
+
+def test_worker_processes_return_the_same_results_as_in_thread():
+    workers = AssignmentWorkerPool(1)
+    try:
+        tasks = [_task(1), _task(2)]
+        assert workers.run_tasks(tasks) == AssignmentWorkerPool(0).run_tasks(tasks)
+    finally:
+        workers.shutdown()
+
+def test_cancel_stops_the_worker_running_the_job():
+    job, worker = AssignmentJob('test'), _WorkerProcess()
+    try:
+        job.attach(worker)
+        job.cancel()
+        # 実行中のタスクの終了を待たず、プロセスごと停止する
+        assert not worker.alive
+    finally:
+        worker.terminate()
+
+def test_finished_job_is_claimed_by_one_session_only():
+    workers = AssignmentWorkerPool(0)
+    job_id = workers.submit('test', lambda runner: len(runner([_task(1)])), meta={'target_date': 'x'})
+    assert _wait_finished(workers, job_id)['state'] == JOB_DONE
+    # ジョブを始めたセッションが閉じられていても、次に受け取ったセッションが結果を1回だけ受け取る
+    claimed = workers.claim_finished()
+    assert [(job['id'], job['result'], job['meta']) for job in claimed] == [(job_id, 1, {'target_date': 'x'})]
+    assert workers.claim_finished() == []
+    assert workers.active_jobs() == []
+
+def test_cancelled_job_is_reported_as_cancelled():
+    workers = AssignmentWorkerPool(0)
+    started, release = threading.Event(), threading.Event()
+    def job_func(runner):
+        started.set(); release.wait(5)
+        return runner([_task(1)])
+    job_id = workers.submit('test', job_func)
+    assert started.wait(5)
+    assert [job['id'] for job in workers.active_jobs()] == [job_id]
+    assert workers.cancel(job_id)
+    release.set()
+    assert _wait_finished(workers, job_id)['state'] == JOB_CANCELLED
@@ -0,0 +1,73 @@
+# tests/test_attendance_rollup.py (連絡ログの集計表)
+import datetime
+
+import pandas as pd
+
+from attendance_rollup import ROLLUP_COLUMNS, AttendanceRollups
+
+def _record(timestamp, target_date, member_id, status, grade='2年', department='工学部'):
+    return dict(zip(ROLLUP_COLUMNS, [timestamp, target_date, member_id, grade, department, status]))
+
+def _frame(records):
+    df = pd.DataFrame(records, columns=ROLLUP_COLUMNS)
+    for col in ROLLUP_COLUMNS[:2]: df[col] = pd.to_datetime(df[col])
+    return df
+
+LOG = [
+    _record('2026-05-01 10:00:00', '2026-05-07', '0123', '欠席'),
+    _record('2026-05-02 10:00:00', '2026-05-07', '0456', '遅刻'),
+    _record('2026-05-08 10:00:00', '2026-05-14', '0123', '参加'),
+]
+SUBMITTED = [_record('2026-05-03 09:00:00', '2026-05-07', '0123', '参加'), _record('2026-05-09 09:00:00', '2026-05-14', '0456', '欠席')]
+
+def _tables(rollups):
+    return rollups.by_date().to_dict(), rollups.by_grade().to_dict(), rollups.member_rates().to_dict()
+
+def test_apply_before_load_equals_load_then_apply():
+    loaded_first, applied_first = AttendanceRollups(), AttendanceRollups()
+    loaded_first.load(_frame(LOG)); loaded_first.apply(SUBMITTED)
+    # 全ログを読み込む前に送信された連絡も、読み込み後に古い連絡で上書きされない
+    applied_first.apply(SUBMITTED); applied_first.load(_frame(LOG))
+    assert _tables(loaded_first) == _tables(applied_first)
+    assert loaded_first.by_date().loc[datetime.date(2026, 5, 7)].to_dict()['参加'] == 1
+
+def test_reapplying_and_reloading_is_idempotent():
+    rollups = AttendanceRollups()
+    rollups.load(_frame(LOG)); rollups.apply(SUBMITTED)
+    before = _tables(rollups)
+    rollups.apply(SUBMITTED); rollups.load(_frame(LOG + SUBMITTED))
+    assert _tables(rollups) == before and rollups.stats()['pairs'] == 4
+
+def test_reset_clears_everything():
+    rollups = AttendanceRollups()
+    rollups.load(_frame(LOG), hot_rows=3); rollups.apply(SUBMITTED)
+    rollups.reset()
+    assert rollups.stats() == {'pairs': 0, 'practice_days': 0, 'members': 0, 'loaded_at': None, 'applied_records': 0, 'hot_rows': 0,
+                               'caught_up_records': 0, 'stale_reason': None}
+    assert rollups.member_rates().empty
+    # 集計し直しても以前の連絡は残らない
+    rollups.load(_frame(LOG[:1]))
+    assert rollups.stats()['pairs'] == 1
+
+def test_catch_up_applies_only_the_tail_and_flags_a_shrunk_sheet():
+    rollups = AttendanceRollups()
+    assert rollups.catch_up(_frame(LOG)) == 0 # 読み込み前は何もしない
+    rollups.load(_frame(LOG), hot_rows=len(LOG))
+    # 他のプロセスが追記した行だけを反映する
+    assert rollups.catch_up(_frame(LOG + SUBMITTED)) == 2
+    assert rollups.catch_up(_frame(LOG + SUBMITTED)) == 0
+    after_catch_up = _tables(rollups)
+    # 他からのアーカイブで行数が減った場合は、残った行を反映し直し (重ねて数えない)、集計が古い可能性を知らせる
+    assert rollups.catch_up(_frame(SUBMITTED)) == 2
+    assert rollups.stats()['stale_reason'] is not None and _tables(rollups) == after_catch_up
+    # このプロセスでアーカイブした後は知らせない
+    rollups.load(_frame(LOG + SUBMITTED), hot_rows=5); rollups.rescan_hot()
+    assert rollups.catch_up(_frame(SUBMITTED)) == 2 and rollups.stats()['stale_reason'] is None
+
+def test_member_rates_count_practice_days_since_the_first_record():
+    rollups = AttendanceRollups()
+    rollups.load(_frame(LOG + [_record('2026-05-10 10:00:00', '2026-05-14', '0789', '欠席')]))
+    rates = rollups.member_rates().set_index('学籍番号')
+    # 0789 は 5/14 からの部員のため、5/7 は分母に入れない
+    assert rates.loc['0789', '対象の練習日'] == 1 and rates.loc['0789', '欠席率'] == 1.0
+    assert rates.loc['0123', '対象の練習日'] == 2 and rates.loc['0123', '欠席率'] == 0.5
@@ -0,0 +1,157 @@
+# tests/test_attendance_store.py
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from attendance_store import MemberHistoryIndex, archive_past_attendance, archive_sheet_name, latest_records
+from offline_sheets import OfflineSpreadsheet, OfflineWorksheet
+
+HOT = '遅刻欠席連絡'
+HEADER = ['記録日時', '対象練習日', '学籍番号', '状況']
+CUTOFF = datetime.date(2026, 5, 1)
+
+def _rows():
+    return [
+        ['2026-03-30 10:00:00', '2026/04/02', '0123', '欠席'],
+        ['2026-04-30 10:00:00', '2026/05/07', '0456', '遅刻'],
+        ['2026-03-01 10:00:00', '2026/03/05', '0789', '欠席'],
+        ['2026-04-20 10:00:00', '2026/05/01', '0123', '参加'],
+    ]
+
+class _SubmittingSpreadsheet(OfflineSpreadsheet):
+    """アーカイブの途中 (アーカイブシートへの書き込み中と、移動元の行の削除の直前) に連絡が追記されるスプレッドシート。"""
+    submissions = (['2026-04-30 11:00:00', '2026/05/08', '0999', '欠席'], ['2026-04-30 11:01:00', '2026/05/09', '0998', '遅刻'])
+
+    def worksheets(self, **kwargs):
+        self._data[HOT].append(list(self.submissions[0]))
+        return super().worksheets(**kwargs)
+
+    def batch_update(self, body):
+        self._data[HOT].append(list(self.submissions[1]))
+        return super().batch_update(body)
+
+def test_archive_moves_past_rows_and_keeps_order():
+    spreadsheet = OfflineSpreadsheet({HOT: [HEADER] + _rows()})
+    summary = archive_past_attendance(spreadsheet, HOT, CUTOFF)
+    assert summary == {'archived': 2, 'kept': 2, 'months': {'2026-03': 1, '2026-04': 1}}
+    assert spreadsheet._data[HOT] == [HEADER, _rows()[1], _rows()[3]]
+    assert spreadsheet._data[archive_sheet_name(HOT, '2026-04')] == [HEADER, _rows()[0]]
+    assert spreadsheet._data[archive_sheet_name(HOT, '2026-03')] == [HEADER, _rows()[2]]
+
+def test_submission_during_archive_is_not_lost():
+    spreadsheet = _SubmittingSpreadsheet({HOT: [HEADER] + _rows(), archive_sheet_name(HOT, '2026-03'): [HEADER]})
+    archive_past_attendance(spreadsheet, HOT, CUTOFF)
+    assert spreadsheet._data[HOT] == [HEADER, _rows()[1], _rows()[3]] + [list(row) for row in _SubmittingSpreadsheet.submissions]
+    assert spreadsheet._data[archive_sheet_name(HOT, '2026-03')] == [HEADER, _rows()[2]]
+
+def test_archive_writes_values_raw(monkeypatch):
+    options = []
+    original_append, original_update = OfflineWorksheet._append, OfflineWorksheet.update
+    monkeypatch.setattr(OfflineWorksheet, 'append_rows', lambda self, values, value_input_option='RAW', **kw: options.append(value_input_option) or original_append(self, values))
+    monkeypatch.setattr(OfflineWorksheet, 'update', lambda self, values=None, range_name=None, value_input_option='RAW', **kw: options.append(value_input_option) or original_update(self, values=values, range_name=range_name))
+    spreadsheet = OfflineSpreadsheet({HOT: [HEADER] + _rows(), archive_sheet_name(HOT, '2026-03'): [HEADER]})
+    archive_past_attendance(spreadsheet, HOT, CUTOFF)
+    assert options and set(options) == {'RAW'}
+    assert spreadsheet._data[archive_sheet_name(HOT, '2026-04')][1][2] == '0123'
+
+def test_archive_refuses_to_delete_when_existing_rows_changed():
+    class EditingSpreadsheet(OfflineSpreadsheet):
+        def worksheets(self, **kwargs):
+            del self._data[HOT][1] # 別の処理が行を削除した
+            return super().worksheets(**kwargs)
+    spreadsheet = EditingSpreadsheet({HOT: [HEADER] + _rows()})
+    with pytest.raises(RuntimeError):
+        archive_past_attendance(spreadsheet, HOT, CUTOFF)
+    assert len(spreadsheet._data[HOT]) == len(_rows()) # 削除は行わない
+
+def _log(rows):
+    return pd.DataFrame({'記録日時': pd.to_datetime([r[0] for r in rows]), '対象練習日': pd.to_datetime([r[1] for r in rows]),
+                         '学籍番号': [r[2] for r in rows], '状況': [r[3] for r in rows]})
+
+def _history_index():
+    return MemberHistoryIndex.build(_log([
+        ('2026-04-01 10:00', '2026-04-02', '0123', '欠席'),
+        ('2026-04-05 10:00', '2026-04-09', '0123', '遅刻'),
+        ('2026-04-08 10:00', '2026-04-09', '0123', '参加'), # 同じ練習日の後の連絡で置き換わる
+        ('2026-04-10 10:00', '2026-04-16', '0123', '欠席'),
+        ('2026-04-06 10:00', '2026-04-09', '0456', '欠席'),
+    ]))
+
+def test_history_query_returns_the_latest_record_per_date_newest_first():
+    page, total = _history_index().query('0123')
+    assert total == 3
+    assert [(d.strftime('%m-%d'), s) for d, s in zip(page['対象練習日'], page['状況'])] == [('04-16', '欠席'), ('04-09', '参加'), ('04-02', '欠席')]
+    # ページ単位で取り出す
+    page, total = _history_index().query('0123', page=1, page_size=2)
+    assert total == 3 and list(page['状況']) == ['欠席']
+
+def test_history_query_for_a_member_without_records_is_empty():
+    page, total = _history_index().query('0999')
+    assert total == 0 and page.empty
+    page, total = MemberHistoryIndex.build(None).query('0123')
+    assert total == 0 and page.empty
+
+def test_history_query_date_range_includes_both_ends():
+    index = _history_index()
+    page, total = index.query('0123', start_date=datetime.date(2026, 4, 9), end_date=datetime.date(2026, 4, 16))
+    assert total == 2 and list(page['状況']) == ['欠席', '参加']
+    page, total = index.query('0123', start_date=datetime.date(2026, 4, 3), end_date=datetime.date(2026, 4, 8))
+    assert total == 0 and page.empty
+    page, total = index.query('0123', end_date=datetime.date(2026, 4, 2))
+    assert total == 1 and list(page['状況']) == ['欠席']
+    # 他の部員の行は期間内でも含まない
+    page, total = index.query('0456', start_date=datetime.date(2026, 4, 1))
+    assert total == 1 and list(page['学籍番号']) == ['0456']
+
+KEYS = ['学籍番号', '対象練習日']
+
+def _latest_by_sorting(df):
+    # 以前の実装 (記録日時で並べ替えて組ごとに最後の行を残す)。同時刻の行の順を保つため安定な並べ替えにする
+    return df.sort_values('記録日時', kind='stable').drop_duplicates(subset=KEYS, keep='last').sort_index()
+
+def test_latest_records_keeps_the_last_of_tied_timestamps():
+    df = _log([
+        ['2026-05-01 10:00:00', '2026/05/07', '0123', '欠席'],
+        ['2026-05-01 10:00:00', '2026/05/07', '0123', '参加'],
+        ['2026-05-01 09:00:00', '2026/05/07', '0123', '遅刻'],
+    ])
+    assert list(latest_records(df, KEYS)['状況']) == ['参加']
+
+def test_latest_records_uses_missing_timestamps_only_for_otherwise_empty_groups():
+    df = _log([
+        ['2026-05-01 10:00:00', '2026/05/07', '0123', '欠席'],
+        ['', '2026/05/07', '0123', '参加'],
+        ['', '2026/05/07', '0456', '遅刻'],
+        ['', '2026/05/07', '0456', '欠席'],
+    ])
+    latest = latest_records(df, KEYS)
+    # 並べ替える実装では空の記録日時が最後に並ぶため、記録日時のある連絡より空の行が残っていた
+    assert latest.index.tolist() == [0, 3] and list(latest['状況']) == ['欠席', '欠席']
+
+def test_latest_records_groups_by_every_key():
+    df = _log([
+        ['2026-05-01 10:00:00', '2026/05/07', '0123', '欠席'],
+        ['2026-05-02 10:00:00', '2026/05/14', '0123', '遅刻'],
+        ['2026-05-03 10:00:00', '2026/05/07', '0456', '参加'],
+        ['2026-05-04 10:00:00', '2026/05/07', '0123', '参加'],
+        ['2026-05-05 10:00:00', '2026/05/07', '', '欠席'],
+        ['2026-05-06 10:00:00', '2026/05/07', '', '遅刻'],
+    ])
+    latest = latest_records(df, KEYS)
+    # 元の行の順で返す。空の学籍番号も1つの組としてまとめる
+    assert latest.index.tolist() == [1, 2, 3, 5]
+    assert latest_records(df, ['対象練習日']).index.tolist() == [1, 5]
+
+def test_latest_records_matches_sorting_and_dropping_duplicates():
+    rng = np.random.default_rng(7)
+    n = 2000
+    base = pd.Timestamp('2026-04-01')
+    df = pd.DataFrame({
+        '記録日時': base + pd.to_timedelta(rng.integers(0, 500, n), unit='min'), # 同時刻の行が多く含まれる
+        '対象練習日': base + pd.to_timedelta(rng.integers(0, 8, n) * 7, unit='D'),
+        '学籍番号': rng.choice([f"{i:04d}" for i in range(40)], n),
+        '状況': rng.choice(['参加', '遅刻', '欠席'], n),
+    })
+    pd.testing.assert_frame_equal(latest_records(df, KEYS), _latest_by_sorting(df))
@@ -0,0 +1,79 @@
+# tests/test_court_assignment.py
+import numpy as np
+import pandas as pd
+import pytest
+
+import config
+from court_assignment import LEVEL_RULES, LevelRules, assign_teams, assignment_runs, parse_team_requests, repair_assignment, team_request_runs
+from schema import COL_MEMBER_ID, COL_MEMBER_NAME, COL_MEMBER_GRADE, COL_MEMBER_LEVEL, COL_MEMBER_GENDER
+
+def _member(member_id, level, gender='男性'):
+    return {COL_MEMBER_ID: member_id, COL_MEMBER_NAME: member_id, COL_MEMBER_GRADE: '2年', COL_MEMBER_LEVEL: level, COL_MEMBER_GENDER: gender}
+
+def _assigned_ids(teams):
+    return sorted(m[COL_MEMBER_ID] for members in teams.values() for m in members)
+
+def test_level_buckets_at_the_boundaries():
+    bucket = {name: i for i, name in enumerate(LEVEL_RULES.bucket_names)}
+    assert LEVEL_RULES.bucket_of(0) == bucket['lv0'] and LEVEL_RULES.bucket_of(6) == bucket['lv6']
+    assert LEVEL_RULES.bucket_of(2) == LEVEL_RULES.bucket_of(3) == bucket['lv23']
+    assert LEVEL_RULES.bucket_of(7) is None and LEVEL_RULES.bucket_of(-1) is None
+    # シートの値 (文字列・小数・空) もベクトル化した変換で同じ区分になる
+    assert list(LEVEL_RULES.bucket_indexes([0, 6, 7, -1, None, '3', 2.0, ''])) == [bucket['lv0'], bucket['lv6'], -1, -1, -1, bucket['lv23'], bucket['lv23'], -1]
+
+def test_levels_outside_the_processing_order_get_the_last_pass():
+    assert [LEVEL_RULES.processing_level(level) for level in (6, 0, '3', 2.0)] == [6, 0, 3, 2]
+    assert [LEVEL_RULES.processing_level(level) for level in (7, -1, None, np.nan, 'x')] == [None] * 5
+    assert LEVEL_RULES.processing_passes[-1] is None
+    assert LEVEL_RULES.placement_terms(False, None) == LEVEL_RULES.terms['regular']['default']
+
+def test_unknown_bucket_in_priorities_is_a_config_error():
+    with pytest.raises(ValueError):
+        LevelRules(config.LEVEL_BUCKETS, {'regular': {6: ['lv7'], 'default': ['size']}, 'late': {'default': ['size']}}, config.LEVEL_PROCESSING_ORDER)
+
+def test_members_with_unknown_levels_are_still_assigned():
+    members = [_member(f"S{i:02d}", level, '男性' if i % 2 else '女性') for i, level in enumerate([6, 5, 4, 3, 2, 1, 0, 6, 5, 4, 3, 2])]
+    members += [_member('X1', None), _member('X2', 7), _member('X3', -1, '女性'), _member('X4', 'abc')]
+    pool = pd.DataFrame(members)
+    teams = assign_teams(pool, {'X2'}, 4, seed=1)
+    assert _assigned_ids(teams) == sorted(m[COL_MEMBER_ID] for m in members)
+    # 最後の回は 'default' (人数・男女比) で配置するため、チームの人数差は1以内に収まる
+    sizes = [len(team) for team in teams.values()]
+    assert max(sizes) - min(sizes) <= 1
+    # 公開済みの割り振りに追加する場合も同じ
+    repaired, changed = repair_assignment(teams, [_member('X5', None)], set(), set())
+    assert 'X5' in _assigned_ids(repaired) and len(changed) == 1
+
+@pytest.mark.parametrize('text', ['abc', '6/x', '6/0', '6//4', '/', '2.5', '0', '-3', '8,0'])
+def test_malformed_team_requests_are_rejected(text):
+    with pytest.raises(ValueError):
+        parse_team_requests(text)
+
+def test_team_requests_are_parsed_and_deduplicated():
+    assert parse_team_requests(' 6、8,6 ') == [(6, None), (8, None)]
+    assert parse_team_requests('6/-/4') == [(3, (6, None, 4))]
+    assert parse_team_requests('') == [] and parse_team_requests(None) == []
+
+def test_capacities_smaller_than_the_pool_are_exceeded_evenly(capsys):
+    pool = pd.DataFrame([_member(f"S{i:02d}", [6, 5, 4, 3, 2][i % 5], '男性' if i % 2 else '女性') for i in range(12)])
+    teams = assign_teams(pool, set(), 3, seed=1, team_capacities=(2, 2, 2))
+    assert _assigned_ids(teams) == sorted(pool[COL_MEMBER_ID])
+    assert sorted(len(team) for team in teams.values()) == [4, 4, 4]
+    assert '定員の合計 (6名) が参加者数 (12名) より少ない' in capsys.readouterr().out
+    # 定員のないチームがあれば、定員のあるチームは定員で止める
+    teams = assign_teams(pool, set(), 2, seed=1, team_capacities=(2, None))
+    assert len(teams['チーム 1']) == 2 and len(teams['チーム 2']) == 10
+
+def test_three_team_run_uses_the_configured_team_count_and_excludes_late_members(monkeypatch):
+    member_df = pd.DataFrame([_member(f"S{i:02d}", 3) for i in range(10)])
+    statuses = {'participating': {f"S{i:02d}" for i in range(8)}, 'late': {'S08', 'S09'}, 'absent': set()}
+    runs = {run.sheet_name: run for run in assignment_runs(member_df, statuses)}
+    run = runs[config.ASSIGNMENT_SHEET_NAME_3]
+    assert run.num_teams == config.TEAMS_COUNT_MAP['素振り指導']
+    assert set(run.pool[COL_MEMBER_ID]) == statuses['participating']
+    monkeypatch.setitem(config.TEAMS_COUNT_MAP, '素振り指導', 4)
+    assert {r.sheet_name: r for r in assignment_runs(member_df, statuses)}[config.ASSIGNMENT_SHEET_NAME_3].num_teams == 4
+    # 追加のチーム数は遅刻者も含め、既定の割り振りと同じシートになる指定は除く
+    extra = team_request_runs(member_df, statuses, [(8, None), (5, None), (3, (4, 3, 3))])
+    assert [(r.num_teams, r.capacities) for r in extra] == [(5, None), (3, (4, 3, 3))]
+    assert all(len(r.pool) == 10 for r in extra)
@@ -0,0 +1,20 @@
+# tests/test_instrumentation.py
+import sys
+
+import instrumentation
+from sheets_async import run_concurrently
+
+def test_api_calls_from_concurrent_children_are_not_lost():
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6) # スレッドの切り替えを頻繁にして、加算の競合を起こりやすくする
+    try:
+        def worker():
+            with instrumentation.span('child'):
+                for _ in range(2000):
+                    instrumentation.count_api_calls(); instrumentation.count_rows(1)
+        with instrumentation.span('parent') as parent:
+            run_concurrently([worker] * 8, max_concurrency=8)
+    finally:
+        sys.setswitchinterval(switch_interval)
+    assert parent.attributes['api_calls'] == 8 * 2000
+    assert parent.to_otel_dict()['attributes']['api_calls'] == 8 * 2000
@@ -0,0 +1,83 @@
+# tests/test_pair_history.py
+import datetime
+import itertools
+import random
+
+import pandas as pd
+
+from court_assignment import _best_team_for_member, _pair_penalty_for, _team_stats_from_teams, assign_teams
+from pair_history import PAIR_HISTORY_COLUMNS, RECENT_RECORDS_KEPT, PairHistory, record_key
+from schema import COL_MEMBER_ID, COL_MEMBER_NAME, COL_MEMBER_GRADE, COL_MEMBER_LEVEL, COL_MEMBER_GENDER
+
+def _member(member_id, gender, level=3):
+    return {COL_MEMBER_ID: member_id, COL_MEMBER_NAME: member_id, COL_MEMBER_GRADE: '2年', COL_MEMBER_LEVEL: level, COL_MEMBER_GENDER: gender}
+
+def _team_ids(teams):
+    return {name: [m[COL_MEMBER_ID] for m in members] for name, members in teams.items()}
+
+def _repeated_pairs(teams, history):
+    return sum(history.pair_count(a, b) for members in _team_ids(teams).values() for a, b in itertools.combinations(members, 2))
+
+def test_pair_penalty_outweighs_a_small_gender_difference():
+    teams = {'チーム 1': [_member('F1', '女性')], 'チーム 2': [_member('M1', '男性')]}
+    stats = _team_stats_from_teams(teams, set())
+    newcomer = _member('M2', '男性')
+    # 履歴がなければ男女比のよいチーム 1 に入る
+    assert _best_team_for_member(stats, newcomer, 3, False) == 'チーム 1'
+    history = PairHistory()
+    for n in range(10): history.record(f"2026-04-{n + 1:02d}/8", {'チーム 1': ['F1', 'M2']})
+    # F1 と10回同じチームになっているため、男女比が少し偏ってもチーム 2 を選ぶ (同点の比較だけでは選ばれない)
+    assert _best_team_for_member(stats, newcomer, 3, False, _pair_penalty_for(history, teams, newcomer)) == 'チーム 2'
+
+def test_pair_history_reduces_repeated_pairs():
+    rng = random.Random(0)
+    pool = pd.DataFrame([_member(f"S{i:03d}", rng.choice(['男性', '女性']), rng.choice([2, 3, 4, 5, 6])) for i in range(32)])
+    first = assign_teams(pool, set(), 8, seed=1)
+    history = PairHistory()
+    for n in range(4): history.record(f"2026-04-{n + 1:02d}/8", _team_ids(first))
+    again = assign_teams(pool, set(), 8, seed=1, pair_history=history)
+    assert _repeated_pairs(again, history) < _repeated_pairs(first, history)
+
+def test_republishing_an_evicted_date_falls_back_to_the_full_history():
+    history = PairHistory()
+    start = datetime.date(2026, 1, 1)
+    for n in range(RECENT_RECORDS_KEPT + 1):
+        history.record(record_key(start + datetime.timedelta(days=n), '8'), {'チーム 1': ['A', 'B']})
+    assert history.pair_count('A', 'B') == RECENT_RECORDS_KEPT + 1
+    assert history.is_evicted(start) and not history.is_evicted(start + datetime.timedelta(days=1))
+    # 破棄した日は除けないため全ての履歴を使い、公開し直した分は加える (エラーにはしない)
+    assert history.excluding_date(start).pair_count('A', 'B') == RECENT_RECORDS_KEPT + 1
+    history.record(record_key(start, '8'), {'チーム 1': ['A', 'C']})
+    assert history.pair_count('A', 'C') == 1
+    # 保持している日は差し替え・除外できる
+    history.record(record_key(start + datetime.timedelta(days=2), '8'), {'チーム 1': ['A', 'C']})
+    assert history.pair_count('A', 'B') == RECENT_RECORDS_KEPT
+    assert history.excluding_date(start + datetime.timedelta(days=3)).pair_count('A', 'B') == RECENT_RECORDS_KEPT - 1
+
+def test_evicted_dates_are_kept_as_one_watermark():
+    history = PairHistory()
+    start = datetime.date(2026, 1, 1)
+    for n in range(RECENT_RECORDS_KEPT * 3):
+        # 同じ日の公開 (2シート) はまとめて破棄する
+        for sheet_name in ('8', '10'): history.record(record_key(start + datetime.timedelta(days=n), sheet_name), {'チーム 1': ['A', 'B']})
+    assert len(history.recent_records) <= RECENT_RECORDS_KEPT and len(history.recent_records) % 2 == 0
+    oldest_kept = datetime.date.fromisoformat(next(iter(history.recent_records)).split('/')[0])
+    assert history.evicted_through == (oldest_kept - datetime.timedelta(days=1)).strftime('%Y-%m-%d')
+
+def test_evicted_watermark_and_fingerprint_survive_the_sheet_round_trip():
+    history = PairHistory()
+    for n in range(RECENT_RECORDS_KEPT + 2):
+        history.record(f"2026-01-{n + 1:02d}/8" if n < 31 else f"2026-02-{n - 30:02d}/8", {'チーム 1': [f"S{n % 5}", 'S9', f"S{n % 3 + 5}"]})
+    grid = history.to_grid()
+    columns = {name: [row[i] for row in grid[1:]] for i, name in enumerate(grid[0])}
+    loaded = PairHistory.from_columns(columns)
+    assert loaded.evicted_through == history.evicted_through == '2026-01-02'
+    # 通し番号の振り方が違っても、同じ内容なら同じ指紋になる (読み込み直しの要否の判定に使う)
+    assert loaded.fingerprint == history.fingerprint
+    loaded.record('2026-03-01/8', {'チーム 1': ['S1', 'S2']})
+    assert loaded.fingerprint != history.fingerprint
+    history.replace_with(loaded)
+    assert history.fingerprint == loaded.fingerprint and history.pair_count('S1', 'S2') == loaded.pair_count('S1', 'S2')
+    # シートが日付として解釈したシリアル値や、以前の形式 (破棄した記録キーの一覧) からも読み込める
+    assert PairHistory.from_columns({PAIR_HISTORY_COLUMNS[-1]: [46024.0]}).evicted_through == '2026-01-02'
+    assert PairHistory.from_columns({'差し替えできない記録キー': ['2026-01-01/8', '2026-01-02/10']}).evicted_through == '2026-01-02'
@@ -0,0 +1,78 @@
+# tests/test_precompute.py (事前計算のスケジューラー)
+import datetime
+import threading
+
+import random
+
+import pandas as pd
+
+import precompute
+from court_assignment import apply_assignment_delta, assign_teams
+from precompute import AssignmentScheduler
+from schema import COL_MEMBER_ID, COL_MEMBER_NAME, COL_MEMBER_GRADE, COL_MEMBER_LEVEL, COL_MEMBER_GENDER
+
+TARGET_DATE = datetime.date.today() + datetime.timedelta(days=1)
+
+def test_refresh_does_not_hold_lock_while_computing(monkeypatch):
+    started, release = threading.Event(), threading.Event()
+    def slow_refresh(previous, *args, **kwargs):
+        started.set(); release.wait(5)
+        return 'slow'
+    monkeypatch.setattr(precompute, 'refresh_precomputed_assignment', slow_refresh)
+    scheduler = AssignmentScheduler(load_inputs=None, interval_seconds=0)
+    worker = threading.Thread(target=scheduler.refresh, args=(None, None, TARGET_DATE))
+    worker.start()
+    assert started.wait(5)
+    # 計算中でも保持している結果は参照できる
+    latest_done = threading.Event()
+    threading.Thread(target=lambda: (scheduler.latest(TARGET_DATE), latest_done.set())).start()
+    assert latest_done.wait(1)
+    release.set(); worker.join(5)
+    assert scheduler.latest(TARGET_DATE) == 'slow'
+
+def test_later_started_refresh_wins(monkeypatch):
+    first_started, release_first = threading.Event(), threading.Event()
+    def refresh(previous, member_df, *args, **kwargs):
+        if member_df == 'old':
+            first_started.set(); release_first.wait(5)
+        return member_df
+    monkeypatch.setattr(precompute, 'refresh_precomputed_assignment', refresh)
+    scheduler = AssignmentScheduler(load_inputs=None, interval_seconds=0)
+    first = threading.Thread(target=scheduler.refresh, args=('old', None, TARGET_DATE))
+    first.start()
+    assert first_started.wait(5)
+    # 後から始めた計算が先に終わっても、先に始めた計算の結果で上書きしない
+    assert scheduler.refresh('new', None, TARGET_DATE) == 'new'
+    release_first.set(); first.join(5)
+    assert scheduler.latest(TARGET_DATE) == 'new'
+
+def _pool(num_members):
+    rng = random.Random(0)
+    return pd.DataFrame([{COL_MEMBER_ID: f"S{i:03d}", COL_MEMBER_NAME: f"部員{i}", COL_MEMBER_GRADE: '2年', COL_MEMBER_LEVEL: rng.choice([2, 3, 4, 5, 6]),
+                          COL_MEMBER_GENDER: rng.choice(['男性', '女性'])} for i in range(num_members)])
+
+def _team_of(teams):
+    return {m[COL_MEMBER_ID]: name for name, members in teams.items() for m in members}
+
+def test_delta_keeps_unaffected_members_and_places_switched_members():
+    pool = _pool(32)
+    late_ids = {'S001', 'S002', 'S003'}
+    teams = assign_teams(pool, late_ids, 4, seed=1)
+    before = _team_of(teams)
+    absent_ids = {'S010', 'S011'}
+    # S001 は遅刻から参加に、S040 は新たに参加に変わった
+    switched = pool[pool[COL_MEMBER_ID] == 'S001'].to_dict('records')[0]
+    newcomer = {COL_MEMBER_ID: 'S040', COL_MEMBER_NAME: '部員40', COL_MEMBER_GRADE: '1年', COL_MEMBER_LEVEL: 3, COL_MEMBER_GENDER: '女性'}
+    current_late = late_ids - {'S001'}
+    repaired, changed = apply_assignment_delta(teams, [switched, newcomer], absent_ids | {'S001'}, current_late, max_swaps=0)
+    after = _team_of(repaired)
+    # 欠席になった部員は外れ、入れ直した部員は1回だけ配置される
+    assert not absent_ids & after.keys()
+    assert sorted(after) == sorted((before.keys() - absent_ids) | {'S040'})
+    assert after['S001'] in changed and after['S040'] in changed
+    # 交換なしなら、変化のない部員は元のチームのまま
+    assert all(after[m] == before[m] for m in before.keys() - absent_ids - {'S001'})
+    # 交換ありでも、動くのは交換した部員だけ (1回の交換で2名)
+    swapped, _ = apply_assignment_delta(teams, [switched, newcomer], absent_ids | {'S001'}, current_late, max_swaps=2)
+    moved = [m for m in before.keys() - absent_ids - {'S001'} if _team_of(swapped)[m] != before[m]]
+    assert len(moved) <= 4
@@ -0,0 +1,34 @@
+# tests/test_roster.py (全セッションで共有する部員名簿)
+import pandas as pd
+
+from roster import RosterStore, UNSELECTED
+from schema import COL_MEMBER_ID, COL_MEMBER_NAME, COL_MEMBER_GRADE, COL_MEMBER_DEPARTMENT
+
+def _members(rows):
+    return pd.DataFrame(rows, columns=[COL_MEMBER_ID, COL_MEMBER_NAME, COL_MEMBER_GRADE, COL_MEMBER_DEPARTMENT])
+
+ROWS = [['0123', '山田', '2年', '工学部'], ['0456', '佐藤', '1年', '理学部']]
+
+def test_unchanged_member_sheet_reuses_the_roster():
+    store = RosterStore()
+    roster = store.intern(_members(ROWS))
+    # 読み込み直した (別の DataFrame だが同じ内容の) 部員リストは同じ版・同じ Roster になる
+    again = store.intern(_members([list(row) for row in ROWS]))
+    assert again is roster and store.get(roster.version) is roster
+    assert roster.member_options('2年', UNSELECTED)[0] == ('山田',)
+
+def test_changed_member_sheet_yields_a_new_version():
+    store = RosterStore(kept=2)
+    roster = store.intern(_members(ROWS))
+    changed = [store.intern(_members(rows)) for rows in (
+        ROWS[:1] + [['0456', '佐藤', '2年', '理学部']], # 値の変更
+        ROWS + [['0789', '鈴木', '3年', '工学部']],      # 行の追加
+    )]
+    assert len({roster.version} | {r.version for r in changed}) == 3
+    assert changed[0].grade_options == (UNSELECTED, '2年')
+    # 保持する版の数を超えた古い版は破棄する (その版を参照していたセッションは読み込み直す)
+    assert store.get(roster.version) is None and all(store.get(r.version) is r for r in changed)
+    # 列名が変わった場合も別の版になる
+    renamed = _members(ROWS).rename(columns={COL_MEMBER_DEPARTMENT: '学部'})
+    renamed[COL_MEMBER_DEPARTMENT] = renamed['学部']
+    assert store.intern(renamed).version != roster.version
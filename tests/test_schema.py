@@ -0,0 +1,41 @@
+# tests/test_schema.py (列の型変換)
+import pandas as pd
+
+from offline_sheets import OfflineSpreadsheet
+from schema import ATTENDANCE_SCHEMA, MEMBER_SCHEMA, apply_schema, id_text
+from sheet_reader import HEADERS, read_frame
+
+def test_numeric_ids_lose_the_trailing_zero():
+    # 書式なしで読み込んだ数値の学籍番号は float になる
+    assert id_text(1234.0) == '1234'
+    assert id_text(1234.5) == '1234.5'
+    assert id_text(' 0123 ') == '0123'
+    ids = apply_schema(pd.DataFrame({'学籍番号': [1234.0, 1234, '1234']}), MEMBER_SCHEMA)['学籍番号']
+    assert list(ids) == ['1234'] * 3
+    # 同じ学籍番号は同じ文字列オブジェクトを共有する
+    assert ids[0] is ids[2]
+
+def test_blank_cells_become_missing_values():
+    df = apply_schema(pd.DataFrame({'学籍番号': [''], '記録日時': [''], '対象練習日': [''], '遅刻開始時刻': [''], '状況': ['']}), ATTENDANCE_SCHEMA)
+    assert df['学籍番号'][0] == '' and df['遅刻開始時刻'][0] == '' and df['状況'][0] == ''
+    assert pd.isna(df['記録日時'][0]) and pd.isna(df['対象練習日'][0])
+    levels = apply_schema(pd.DataFrame({'レベル': ['3', '']}), MEMBER_SCHEMA)['レベル']
+    assert levels[0] == 3 and pd.isna(levels[1])
+
+def test_serial_dates_are_read_as_datetime64():
+    HEADERS.forget()
+    # シリアル値 (1899-12-30 からの日数) と文字列の日時が混在する列 (オフラインのシートは値を文字列で返す)
+    worksheet = OfflineSpreadsheet({'遅刻欠席連絡': [
+        ['記録日時', '対象練習日', '学籍番号'],
+        [46000.5, 46001, '1234'],
+        ['2026-01-01 10:00:00', '2026/01/08', '0123'],
+    ]}).worksheet('遅刻欠席連絡')
+    df = read_frame(worksheet, None, ATTENDANCE_SCHEMA)
+    HEADERS.forget()
+    assert pd.api.types.is_datetime64_any_dtype(df['記録日時']) and pd.api.types.is_datetime64_any_dtype(df['対象練習日'])
+    assert list(df['記録日時']) == [pd.Timestamp('2025-12-09 12:00:00'), pd.Timestamp('2026-01-01 10:00:00')]
+    assert list(df['対象練習日']) == [pd.Timestamp('2025-12-10'), pd.Timestamp('2026-01-08')]
+    assert list(df['学籍番号']) == ['1234', '0123']
+    # 時刻のシリアル値 (1日に対する割合) は 'HH:MM' にする
+    times = apply_schema(pd.DataFrame({'遅刻開始時刻': [0.75, '17:30']}), ATTENDANCE_SCHEMA)['遅刻開始時刻']
+    assert list(times) == ['18:00', '17:30']
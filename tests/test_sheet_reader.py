@@ -0,0 +1,43 @@
+# tests/test_sheet_reader.py
+import pytest
+
+from offline_sheets import OfflineSpreadsheet
+from sheet_reader import HEADERS, read_columns
+
+SHEET = '部員リスト'
+
+def _worksheet(rows):
+    return OfflineSpreadsheet({SHEET: rows}).worksheet(SHEET)
+
+@pytest.fixture(autouse=True)
+def forget_headers():
+    HEADERS.forget()
+    yield
+    HEADERS.forget()
+
+def test_reordered_header_is_reread():
+    worksheet = _worksheet([['学籍番号', '名前'], ['S1', 'A'], ['S2', 'B']])
+    assert read_columns(worksheet, ['名前']) == {'名前': ['A', 'B']}
+    # 先頭の列はそのままで、後ろの列だけ入れ替わる
+    worksheet.spreadsheet._data[SHEET] = [['学籍番号', '学年', '名前'], ['S1', '1年', 'A'], ['S2', '2年', 'B']]
+    assert read_columns(worksheet, ['名前']) == {'名前': ['A', 'B']}
+
+def test_column_added_after_the_header_was_cached_is_found():
+    worksheet = _worksheet([['学籍番号', '名前'], ['S1', 'A']])
+    assert read_columns(worksheet, ['学籍番号', '学科']) == {'学籍番号': ['S1']}
+    worksheet.spreadsheet._data[SHEET] = [['学籍番号', '名前', '学科'], ['S1', 'A', '医学科']]
+    assert read_columns(worksheet, ['学籍番号', '学科']) == {'学籍番号': ['S1'], '学科': ['医学科']}
+
+def test_unchanged_header_is_read_in_one_call(monkeypatch):
+    worksheet = _worksheet([['学籍番号', '名前'], ['S1', 'A']])
+    read_columns(worksheet, ['名前'])
+    calls = []
+    original = type(worksheet).batch_get
+    monkeypatch.setattr(type(worksheet), 'batch_get', lambda self, *args, **kwargs: calls.append(args) or original(self, *args, **kwargs))
+    assert read_columns(worksheet, ['名前']) == {'名前': ['A']}
+    assert len(calls) == 1
+
+def test_ragged_columns_are_not_truncated():
+    # 行の長さがそろっていないシート (末尾の空セルが省略された行) でも、列単位の取得で値を落とさない
+    worksheet = _worksheet([['学籍番号', '名前', '学科'], ['S1', 'A'], ['S2', 'B', '医学科']])
+    assert read_columns(worksheet, ['学籍番号', '学科']) == {'学籍番号': ['S1', 'S2'], '学科': ['', '医学科']}
@@ -0,0 +1,72 @@
+# tests/test_sheet_writer.py
+import pytest
+
+from offline_sheets import OfflineSpreadsheet
+from sheet_writer import WRITTEN_GRIDS, ensure_worksheet, read_grids, sheet_size, sheet_values, write_grid
+
+SHEET = '参加者名簿'
+FIRST = [['2026-08-04 参加者リスト'], ['学籍番号', '名前'], ['S1000', '部員0'], ['S1001', '部員1']]
+SECOND = [['2026-08-04 参加者リスト'], ['学籍番号', '名前'], ['S1000', '部員0'], ['S1002', '部員2']]
+
+@pytest.fixture
+def worksheet():
+    WRITTEN_GRIDS.forget()
+    yield OfflineSpreadsheet({SHEET: []}).worksheet(SHEET)
+    WRITTEN_GRIDS.forget()
+
+def test_unchanged_sheet_is_skipped_and_changed_cells_are_diffed(worksheet):
+    assert write_grid(worksheet, FIRST) == 'full'
+    assert write_grid(worksheet, FIRST) == 'skipped'
+    assert write_grid(worksheet, SECOND) == 'diff'
+    assert sheet_values(worksheet.get_all_values()) == SECOND
+
+def test_sheet_changed_outside_the_process_is_rewritten_in_full(worksheet):
+    assert write_grid(worksheet, FIRST) == 'full'
+    # 他のプロセス (CLI・別のレプリカ) の書き込みや手での編集
+    worksheet.update(range_name='A3', values=[['S9999', '編集']])
+    worksheet.append_row(['S9998', '追加'])
+    assert write_grid(worksheet, SECOND) == 'full'
+    assert sheet_values(worksheet.get_all_values()) == SECOND
+
+def test_sheet_reverted_outside_the_process_is_not_skipped(worksheet):
+    write_grid(worksheet, FIRST)
+    worksheet.clear()
+    # このプロセスの記録では同じ内容でも、シートが空になっていれば書き直す
+    assert write_grid(worksheet, FIRST) == 'full'
+    assert sheet_values(worksheet.get_all_values()) == FIRST
+
+def test_sheet_already_showing_the_values_is_skipped_without_memory(worksheet):
+    worksheet.update(range_name='A1', values=FIRST)
+    assert write_grid(worksheet, [[cell for cell in row] + [''] for row in FIRST] + [[]]) == 'skipped'
+
+def test_memory_is_kept_per_spreadsheet():
+    WRITTEN_GRIDS.forget()
+    book_a, book_b = OfflineSpreadsheet({SHEET: []}, title='a'), OfflineSpreadsheet({SHEET: []}, title='b')
+    write_grid(book_a.worksheet(SHEET), FIRST)
+    write_grid(book_b.worksheet(SHEET), SECOND)
+    # 同じシート名でも、別のスプレッドシートの書き込みを前回の内容として使わない
+    assert write_grid(book_a.worksheet(SHEET), SECOND) == 'diff'
+    assert sheet_values(book_a.worksheet(SHEET).get_all_values()) == SECOND
+    WRITTEN_GRIDS.forget()
+
+def test_read_grids_reads_several_sheets_at_once():
+    book = OfflineSpreadsheet({SHEET: [list(row) for row in FIRST], '欠席者名簿': []})
+    assert read_grids(book, [SHEET, '欠席者名簿']) == {SHEET: FIRST, '欠席者名簿': []}
+
+def test_sheet_is_resized_to_the_grid_on_every_write(worksheet):
+    write_grid(worksheet, FIRST)
+    assert (worksheet.row_count, worksheet.col_count) == (4, 2)
+    # 行の多い内容 (作成時の大きさを超える内容) に合わせて広げる
+    longer = FIRST + [[f"S{2000 + i}", f"部員{i}", '医学科'] for i in range(30)]
+    write_grid(worksheet, longer)
+    assert (worksheet.row_count, worksheet.col_count) == (34, 3)
+    # 短い内容に合わせて縮め、前回の行・列を残さない
+    write_grid(worksheet, SECOND)
+    assert (worksheet.row_count, worksheet.col_count) == (4, 2)
+    assert sheet_values(worksheet.get_all_values()) == SECOND
+
+def test_existing_sheet_with_the_right_size_is_not_resized(monkeypatch):
+    book = OfflineSpreadsheet({})
+    sheet = ensure_worksheet(book, SHEET, *sheet_size(FIRST))
+    monkeypatch.setattr(type(sheet), 'resize', lambda self, **kwargs: pytest.fail("resize should not be called"))
+    assert write_grid(sheet, FIRST) == 'full'